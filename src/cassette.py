@@ -0,0 +1,695 @@
+"""Recording and replaying the GitHub and S3 traffic of a run.
+
+With `CASSETTE_MODE=record`, every GitHub API request and S3 request the handler makes is
+recorded, with its response and how long it took, and saved to a gzip compressed cassette file
+at the end of the run. Credentials are never recorded: the secret and installation token are
+not part of the cassette, and request and response headers that can carry credentials are
+dropped. Objects written to S3 are recorded by their size and SHA-256 digest only.
+
+With `CASSETTE_MODE=replay`, the handler runs offline against the cassette. No secret or token
+is fetched, GitHub requests are answered by a transport adapter and S3 reads by a client serving
+the recorded responses, and S3 writes are discarded. Requests are matched by endpoint or object
+name, in the order they were recorded. Responses are served at full speed, or after the time
+they originally took with `CASSETTE_TIMING=original`.
+
+A replayed run can save its own interactions to `CASSETTE_REPLAY_OUTPUT`, so two runs can be
+compared request by request with `compare_cassettes`.
+
+The cassette covers the whole invocation, and is saved however the run ends. In fan-out mode the
+coordinator and each worker have their own cassette, with the worker's shard added to its name.
+"""
+
+from __future__ import annotations
+
+import base64
+import hashlib
+import logging
+import os
+import re
+import threading
+import time
+from collections import deque
+from collections.abc import Callable
+from datetime import UTC, datetime
+from io import BytesIO
+from typing import TYPE_CHECKING, Any, Optional, TypeVar
+
+import requests
+from botocore.exceptions import ClientError
+from requests.adapters import BaseAdapter
+from requests.structures import CaseInsensitiveDict
+
+from src.serialisation import decode_json, encode_json
+
+if TYPE_CHECKING:
+    import boto3
+    from requests import PreparedRequest, Response
+
+    from src.http_pool import PooledHTTPAdapter
+
+logger = logging.getLogger()
+
+Result = TypeVar("Result")
+Placeholder = TypeVar("Placeholder")
+
+# "record" saves the run's traffic to CASSETTE_PATH, "replay" serves it back and "off" does
+# neither. They are read once, when the modules are imported
+CASSETTE_MODE = os.getenv("CASSETTE_MODE", "off").lower()
+CASSETTE_PATH = os.getenv("CASSETTE_PATH", "cassette.json.gz")
+
+# "fast" serves replayed responses at once, "original" after the time they took when recorded
+CASSETTE_TIMING = os.getenv("CASSETTE_TIMING", "fast").lower()
+
+# Where a replayed run saves its own interactions, for comparison with the cassette
+CASSETTE_REPLAY_OUTPUT = os.getenv("CASSETTE_REPLAY_OUTPUT", "")
+
+CASSETTE_VERSION = 1
+
+# Stands in for the secret when replaying, and for the token in the form
+# get_installation_token returns it
+SCRUBBED = "scrubbed"
+SCRUBBED_TOKEN = (SCRUBBED,)
+
+# Headers that can carry credentials, which are never recorded
+SENSITIVE_HEADER = re.compile(r"authorization|cookie|token|secret|signature|credential", re.I)
+
+# Request headers that change GitHub's response, recorded for comparison
+RECORDED_REQUEST_HEADERS = ("Accept", "If-None-Match", "If-Modified-Since")
+
+# S3 operations that write an object
+S3_WRITE_OPERATIONS = {"put_object", "upload_fileobj"}
+
+# Fields of an S3 response that are recorded
+RECORDED_S3_FIELDS = ("ContentType", "ContentEncoding", "ContentLength", "Metadata", "ETag")
+
+
+def encode_body(body: bytes) -> dict:
+    """Encodes a response body for the cassette.
+
+    Args:
+        body (bytes): The body.
+
+    Returns:
+        dict: The body as `text` if it is UTF-8, such as JSON, or as `base64` if it is not,
+            such as a compressed S3 object.
+    """
+    try:
+        return {"text": body.decode("utf-8")}
+    except UnicodeDecodeError:
+        return {"base64": base64.b64encode(body).decode("ascii")}
+
+
+def decode_body(encoded: dict) -> bytes:
+    """Decodes a response body encoded by `encode_body`.
+
+    Args:
+        encoded (dict): The encoded body.
+
+    Returns:
+        bytes: The body.
+    """
+    if "base64" in encoded:
+        return base64.b64decode(encoded["base64"])
+    return str(encoded.get("text", "")).encode("utf-8")
+
+
+def get_key(interaction: dict) -> tuple:
+    """Gets the key a recorded interaction is matched by.
+
+    Args:
+        interaction (dict): The interaction.
+
+    Returns:
+        tuple: The kind of interaction, the HTTP method or S3 operation, and the URL or object.
+    """
+    request = interaction["request"]
+    if interaction["kind"] == "github":
+        return ("github", request["method"], request["url"])
+    return ("s3", request["operation"], request["key"])
+
+
+class Cassette:
+    """The GitHub and S3 interactions of a run, being recorded or replayed."""
+
+    def __init__(
+        self, mode: str = "off", recorded: Optional[list] = None, timing: str = "fast"
+    ) -> None:
+        """Creates a Cassette.
+
+        Args:
+            mode (str): One of "off", "record" or "replay".
+            recorded (Optional[list]): The interactions to replay.
+            timing (str): "fast" or "original", how quickly replayed responses are served.
+        """
+        self.mode = mode
+        self.timing = timing
+        self.interactions: list[dict] = []
+        self.no_misses = 0
+        self._started_at = time.perf_counter()
+        self._queues: dict[tuple, deque[dict]] = {}
+        for interaction in recorded or []:
+            self._queues.setdefault(get_key(interaction), deque()).append(interaction)
+        self._lock = threading.Lock()
+
+    @property
+    def replaying(self) -> bool:
+        """Whether the run is served from the cassette."""
+        return self.mode == "replay"
+
+    def add(self, kind: str, request: dict, response: dict, started_at: float) -> None:
+        """Adds an interaction of this run.
+
+        Args:
+            kind (str): "github" or "s3".
+            request (dict): The request.
+            response (dict): The response.
+            started_at (float): When the request was sent, from time.perf_counter.
+        """
+        finished_at = time.perf_counter()
+        interaction = {
+            "kind": kind,
+            "request": request,
+            "response": response,
+            "offset": round(started_at - self._started_at, 6),
+            "elapsed": round(finished_at - started_at, 6),
+        }
+        with self._lock:
+            self.interactions.append(interaction)
+
+    def take(self, kind: str, request: dict) -> Optional[dict]:
+        """Takes the next recorded interaction matching a request, waiting if timing is original.
+
+        Args:
+            kind (str): "github" or "s3".
+            request (dict): The request.
+
+        Returns:
+            Optional[dict]: The recorded interaction, or None if the cassette has no more.
+        """
+        key = get_key({"kind": kind, "request": request})
+        with self._lock:
+            queue = self._queues.get(key)
+            interaction = queue.popleft() if queue else None
+            if interaction is None:
+                self.no_misses += 1
+
+        if interaction is None:
+            logger.warning("Request not in the cassette", extra={"request": list(key)})
+            return None
+
+        if self.timing == "original":
+            time.sleep(interaction.get("elapsed", 0))
+        return interaction
+
+    def call_live(
+        self, func: Callable[..., Result], *args: Any, replayed: Placeholder
+    ) -> Result | Placeholder:
+        """Calls a function for a credential, unless replaying, when a placeholder is used.
+
+        Args:
+            func (Callable[..., Result]): The function, such as get_secret.
+            *args (Any): Passed through to the function.
+            replayed (Placeholder): The placeholder for its result when replaying, such as
+                `SCRUBBED`.
+
+        Returns:
+            Result | Placeholder: The function's result, or the placeholder.
+        """
+        if self.replaying:
+            return replayed
+        return func(*args)
+
+    def wrap_s3(self, s3_client: boto3.client) -> boto3.client | CassetteS3Client:
+        """Records or replays the requests of an S3 client.
+
+        Args:
+            s3_client (boto3.client): The S3 client.
+
+        Returns:
+            boto3.client | CassetteS3Client: A CassetteS3Client, or `s3_client` itself if the
+                cassette is off.
+        """
+        if self.mode == "off":
+            return s3_client
+        return CassetteS3Client(s3_client, self)
+
+    def wrap_adapter(self, adapter: PooledHTTPAdapter) -> PooledHTTPAdapter | CassetteAdapter:
+        """Records or replays the requests sent through a transport adapter.
+
+        Args:
+            adapter (PooledHTTPAdapter): The adapter.
+
+        Returns:
+            PooledHTTPAdapter | CassetteAdapter: A CassetteAdapter, or `adapter` itself if the
+                cassette is off.
+        """
+        if self.mode == "off":
+            return adapter
+        return CassetteAdapter(adapter, self)
+
+    def save(self, suffix: str = "") -> Optional[str]:
+        """Saves the run's interactions, to CASSETTE_PATH if recording.
+
+        When replaying they are saved to CASSETTE_REPLAY_OUTPUT, if it is set.
+
+        Args:
+            suffix (str): Added to the file name, as given to `open_cassette`.
+
+        Returns:
+            Optional[str]: The path saved to, or None if nothing was saved.
+        """
+        path = get_cassette_path(
+            CASSETTE_PATH if self.mode == "record" else CASSETTE_REPLAY_OUTPUT, suffix
+        )
+        if self.mode == "off" or not path:
+            return None
+
+        with self._lock:
+            interactions = sorted(self.interactions, key=lambda interaction: interaction["offset"])
+
+        save_cassette(path, interactions)
+        logger.info(
+            "Cassette saved",
+            extra={
+                "cassette_path": path,
+                "no_cassette_interactions": len(interactions),
+                "no_cassette_misses": self.no_misses,
+            },
+        )
+        return path
+
+
+class CassetteAdapter(BaseAdapter):
+    """A requests transport adapter that records or replays the requests sent through it.
+
+    Recording sends each request through the wrapped adapter. Replaying answers it from the
+    cassette, with a 404 for a request that is not in it. The wrapped adapter's statistics, and
+    any other attribute, are passed through to it.
+    """
+
+    def __init__(self, adapter: PooledHTTPAdapter, cassette: Cassette) -> None:
+        """Creates a CassetteAdapter.
+
+        Args:
+            adapter (PooledHTTPAdapter): The adapter to send requests with when recording.
+            cassette (Cassette): The cassette.
+        """
+        super().__init__()
+        self.adapter = adapter
+        self.cassette = cassette
+
+    def __getattr__(self, name: str) -> Any:
+        """Passes any other attribute through to the wrapped adapter."""
+        if name == "adapter":
+            raise AttributeError(name)
+        return getattr(self.adapter, name)
+
+    def reset_stats(self) -> None:
+        """Starts counting the wrapped adapter's connections and requests again."""
+        self.adapter.reset_stats()
+
+    def stats(self) -> dict:
+        """Gets a summary of the wrapped adapter's connections, for logging.
+
+        Returns:
+            dict: The statistics of the wrapped adapter.
+        """
+        return self.adapter.stats()
+
+    def send(self, request: PreparedRequest, *args: Any, **kwargs: Any) -> Response:
+        """Sends a request, or answers it from the cassette.
+
+        Args:
+            request (PreparedRequest): The request.
+            *args (Any): Passed through to the wrapped adapter's send.
+            **kwargs (Any): Passed through to the wrapped adapter's send.
+
+        Returns:
+            Response: The response.
+        """
+        recorded_request = {
+            "method": request.method,
+            "url": request.url,
+            "headers": {
+                name: request.headers[name]
+                for name in RECORDED_REQUEST_HEADERS
+                if name in request.headers
+            },
+        }
+        started_at = time.perf_counter()
+
+        if self.cassette.replaying:
+            interaction = self.cassette.take("github", recorded_request)
+            recorded = (interaction or {}).get("response") or {
+                "status": 404,
+                "headers": {"Content-Type": "application/json"},
+                "body": {"text": '{"message": "Not in the cassette"}'},
+            }
+            if "error" in recorded:
+                self.cassette.add("github", recorded_request, recorded, started_at)
+                error = getattr(requests.exceptions, recorded["error"]["type"], None)
+                if not isinstance(error, type) or not issubclass(
+                    error, requests.exceptions.RequestException
+                ):
+                    error = requests.exceptions.ConnectionError
+                raise error(recorded["error"]["message"], request=request)
+
+            response = self.build_response(request, recorded)
+        else:
+            try:
+                response = self.adapter.send(request, *args, **kwargs)
+            except requests.exceptions.RequestException as error:
+                recorded = {"error": {"type": type(error).__name__, "message": str(error)}}
+                self.cassette.add("github", recorded_request, recorded, started_at)
+                raise
+
+            recorded = {
+                "status": response.status_code,
+                "headers": {
+                    name: value
+                    for name, value in response.headers.items()
+                    if not SENSITIVE_HEADER.search(name)
+                },
+                "body": encode_body(response.content or b""),
+            }
+
+        self.cassette.add("github", recorded_request, recorded, started_at)
+        return response
+
+    def build_response(self, request: PreparedRequest, recorded: dict) -> Response:
+        """Builds a response from a recorded one.
+
+        Args:
+            request (PreparedRequest): The request being answered.
+            recorded (dict): The recorded response.
+
+        Returns:
+            Response: The response.
+        """
+        response = requests.Response()
+        response.status_code = recorded["status"]
+        response.headers = CaseInsensitiveDict(recorded.get("headers", {}))
+        # requests keeps the body of a response in _content once it has been read
+        body = decode_body(recorded.get("body", {}))
+        response._content = body  # pylint: disable=protected-access
+        response.encoding = "utf-8"
+        response.url = request.url or ""
+        response.request = request
+        # As on a recorded response, which the wrapped adapter built
+        response.connection = self.adapter
+        return response
+
+    def close(self) -> None:
+        """Closes the wrapped adapter."""
+        self.adapter.close()
+
+
+class CassetteS3Client:
+    """An S3 client that records or replays the requests sent through it.
+
+    Recording sends each request through the wrapped client. Replaying answers reads from the
+    cassette, raising NoSuchKey for a read that is not in it, and discards writes. Any other
+    attribute is passed through to the wrapped client.
+    """
+
+    def __init__(self, s3_client: boto3.client, cassette: Cassette) -> None:
+        """Creates a CassetteS3Client.
+
+        Args:
+            s3_client (boto3.client): The S3 client to send requests with when recording.
+            cassette (Cassette): The cassette.
+        """
+        self.s3_client = s3_client
+        self.cassette = cassette
+
+    def __getattr__(self, name: str) -> Any:
+        """Passes any attribute other than the recorded operations through."""
+        if name == "s3_client":
+            raise AttributeError(name)
+        return getattr(self.s3_client, name)
+
+    def get_object(self, **kwargs: Any) -> dict:
+        """Gets an object, recording or replaying the request.
+
+        Args:
+            **kwargs (Any): Passed through to the S3 client's get_object.
+
+        Returns:
+            dict: The get_object response.
+        """
+        response: dict = self.call("get_object", **kwargs)
+        return response
+
+    def head_object(self, **kwargs: Any) -> dict:
+        """Gets an object's metadata, recording or replaying the request.
+
+        Args:
+            **kwargs (Any): Passed through to the S3 client's head_object.
+
+        Returns:
+            dict: The head_object response.
+        """
+        response: dict = self.call("head_object", **kwargs)
+        return response
+
+    def put_object(self, **kwargs: Any) -> dict:
+        """Writes an object, recording the request or discarding the write when replaying.
+
+        Args:
+            **kwargs (Any): Passed through to the S3 client's put_object.
+
+        Returns:
+            dict: The put_object response.
+        """
+        response: dict = self.call("put_object", **kwargs)
+        return response
+
+    def upload_fileobj(self, **kwargs: Any) -> None:
+        """Uploads an object in parts, recording the request or discarding it when replaying.
+
+        Args:
+            **kwargs (Any): Passed through to the S3 client's upload_fileobj.
+        """
+        self.call("upload_fileobj", **kwargs)
+
+    def call(self, operation: str, **kwargs: Any) -> Any:
+        """Sends a request to S3, or answers it from the cassette.
+
+        Args:
+            operation (str): The name of the client method.
+            **kwargs (Any): Passed through to the client method.
+
+        Returns:
+            Any: The value returned by the client method.
+        """
+        request: dict = {"operation": operation, "key": kwargs.get("Key")}
+        if operation in S3_WRITE_OPERATIONS:
+            body = read_upload_body(operation, kwargs)
+            request.update({"size": len(body), "sha256": hashlib.sha256(body).hexdigest()})
+
+        started_at = time.perf_counter()
+        if self.cassette.replaying:
+            return self.replay(operation, request, started_at)
+
+        try:
+            response = getattr(self.s3_client, operation)(**kwargs)
+        except ClientError as error:
+            self.cassette.add("s3", request, {"error": error.response.get("Error", {})}, started_at)
+            raise
+
+        recorded = {name: response[name] for name in RECORDED_S3_FIELDS if name in (response or {})}
+        if operation == "get_object":
+            body = response["Body"].read()
+            response["Body"] = BytesIO(body)
+            recorded["body"] = encode_body(body)
+
+        self.cassette.add("s3", request, recorded, started_at)
+        return response
+
+    def replay(self, operation: str, request: dict, started_at: float) -> Any:
+        """Answers an S3 request from the cassette.
+
+        Args:
+            operation (str): The name of the client method.
+            request (dict): The recorded form of the request.
+            started_at (float): When the request was made, from time.perf_counter.
+
+        Returns:
+            Any: The response.
+
+        Raises:
+            ClientError: If the recorded request failed, or a read is not in the cassette.
+        """
+        interaction = self.cassette.take("s3", request)
+
+        if operation in S3_WRITE_OPERATIONS:
+            # The write is discarded, and succeeds whatever happened when it was recorded
+            response = (interaction or {}).get("response") or {}
+            if "error" in response or not response:
+                response = {"ETag": f'"{request["sha256"][:32]}"'}
+            self.cassette.add("s3", request, response, started_at)
+            return None if operation == "upload_fileobj" else response
+
+        recorded = (interaction or {}).get("response") or {
+            "error": {"Code": "NoSuchKey", "Message": "Not in the cassette"}
+        }
+        self.cassette.add("s3", request, recorded, started_at)
+
+        if "error" in recorded:
+            raise ClientError(
+                error_response={"Error": recorded["error"]},
+                operation_name="".join(part.title() for part in operation.split("_")),
+            )
+
+        response = {name: value for name, value in recorded.items() if name != "body"}
+        if "body" in recorded:
+            response["Body"] = BytesIO(decode_body(recorded["body"]))
+        return response
+
+
+def read_upload_body(operation: str, kwargs: dict) -> bytes:
+    """Reads the body of an S3 write, leaving the request able to send it.
+
+    Args:
+        operation (str): "put_object" or "upload_fileobj".
+        kwargs (dict): The arguments of the request. A file being uploaded is replaced by a
+            copy of its content.
+
+    Returns:
+        bytes: The body.
+    """
+    if operation == "upload_fileobj":
+        body: bytes = kwargs["Fileobj"].read()
+        kwargs["Fileobj"] = BytesIO(body)
+        return body
+
+    body = kwargs.get("Body", b"")
+    return body.encode("utf-8") if isinstance(body, str) else bytes(body)
+
+
+def get_cassette_path(path: str, suffix: str = "") -> str:
+    """Gets the file of a cassette, with a suffix added to its name if one is given.
+
+    Each fan-out worker records to and replays from its own cassette, such as
+    `cassette-shard-1-of-4.json.gz` for the first of four shards.
+
+    Args:
+        path (str): The configured file, or an empty string if none is.
+        suffix (str): Added to the file name, before its extensions.
+
+    Returns:
+        str: The file.
+    """
+    if not path or not suffix:
+        return path
+    directory, name = os.path.split(path)
+    stem, dot, extensions = name.partition(".")
+    return os.path.join(directory, f"{stem}-{suffix}{dot}{extensions}")
+
+
+def save_cassette(path: str, interactions: list) -> None:
+    """Writes interactions to a gzip compressed cassette file.
+
+    Args:
+        path (str): The file to write.
+        interactions (list): The interactions.
+    """
+    cassette = {
+        "version": CASSETTE_VERSION,
+        "created": datetime.now(UTC).isoformat(),
+        "interactions": interactions,
+    }
+    body, _ = encode_json(cassette, "compact", "gzip")
+    with open(path, "wb") as file:
+        file.write(body)
+
+
+def load_cassette(path: str) -> list:
+    """Reads the interactions of a cassette file.
+
+    Args:
+        path (str): The file to read.
+
+    Returns:
+        list: The interactions.
+
+    Raises:
+        ValueError: If the file was written by an incompatible version.
+    """
+    with open(path, "rb") as file:
+        cassette = decode_json(file.read())
+
+    if cassette.get("version") != CASSETTE_VERSION:
+        raise ValueError(f"Unsupported cassette version: {cassette.get('version')}")
+    interactions: list = cassette["interactions"]
+    return interactions
+
+
+def open_cassette(suffix: str = "") -> Cassette:
+    """Opens the cassette for a run, as configured by CASSETTE_MODE.
+
+    Args:
+        suffix (str): Added to the file name, so each fan-out worker has its own cassette.
+
+    Returns:
+        Cassette: The cassette to record to or replay from. With the cassette off, its wrappers
+            return what they are given.
+    """
+    if CASSETTE_MODE == "record":
+        return Cassette("record")
+    if CASSETTE_MODE == "replay":
+        return Cassette(
+            "replay", load_cassette(get_cassette_path(CASSETTE_PATH, suffix)), CASSETTE_TIMING
+        )
+    return Cassette()
+
+
+def compare_cassettes(before: list, after: list) -> list[str]:
+    """Compares the interactions of two runs, request by request.
+
+    Requests are paired by endpoint or object name, in the order they were made. Timings and
+    GitHub response headers are not compared.
+
+    Args:
+        before (list): The interactions of the first run.
+        after (list): The interactions of the second run.
+
+    Returns:
+        list[str]: A line for each request made by only one of the runs, and for each request
+            sent or answered differently.
+    """
+
+    def pair(interactions: list) -> dict:
+        counts: dict = {}
+        paired = {}
+        for interaction in interactions:
+            key = get_key(interaction)
+            counts[key] = counts.get(key, 0) + 1
+            paired[(*key, counts[key])] = interaction
+        return paired
+
+    def describe(key: tuple) -> str:
+        kind, method, target, number = key
+        return f"{kind} {method} {target}" + (f" (#{number})" if number > 1 else "")
+
+    def comparable(interaction: dict) -> tuple:
+        response = {
+            name: value for name, value in interaction["response"].items() if name != "headers"
+        }
+        return interaction["request"], response
+
+    paired_before, paired_after = pair(before), pair(after)
+    differences = []
+    for key in sorted(paired_before.keys() | paired_after.keys(), key=str):
+        if key not in paired_after:
+            differences.append(f"{describe(key)}: only before")
+        elif key not in paired_before:
+            differences.append(f"{describe(key)}: only after")
+        else:
+            request_before, response_before = comparable(paired_before[key])
+            request_after, response_after = comparable(paired_after[key])
+            if request_before != request_after:
+                differences.append(f"{describe(key)}: request changed")
+            elif response_before != response_after:
+                differences.append(f"{describe(key)}: response changed")
+    return differences
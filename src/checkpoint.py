@@ -0,0 +1,208 @@
+"""Time budget and checkpoints for the team history.
+
+A large organisation can have more teams than the Lambda can refresh before it times out, and
+a run that is stopped by the timeout stores nothing. The handler gives the team history phase a
+TimeBudget, built from the time left in the invocation. Once only the reserve is left, teams that
+would need a GitHub API request are deferred rather than refreshed, so the history of the teams
+already refreshed is stored and the run exits cleanly.
+
+The deferred teams are stored in a checkpoint object, which is the cursor for the next run. That
+run refreshes them first, followed by the other teams from the most out of date.
+
+Team discovery is bounded by the same budget. Once it runs out while the teams are being probed,
+the page being probed, the teams already probed on it and the teams found with Copilot data are
+stored in the checkpoint, and the next run carries on discovery from there.
+"""
+
+from __future__ import annotations
+
+import logging
+import os
+from datetime import UTC, datetime
+from typing import TYPE_CHECKING, Any, Optional
+
+from src.s3_objects import BUCKET_NAME, get_s3_object, update_s3_object
+
+if TYPE_CHECKING:
+    import boto3
+
+logger = logging.getLogger()
+
+# Teams not refreshed before the time budget ran out, refreshed first by the next run
+CHECKPOINT_OBJECT = "teams_history_checkpoint.json"
+
+# Time kept back to store the team history and checkpoint before the Lambda times out
+CHECKPOINT_RESERVE_SECONDS = float(os.getenv("CHECKPOINT_RESERVE_SECONDS", "60"))
+
+
+class TimeBudget:
+    """Tracks the time left in an invocation, and the teams deferred once it runs out."""
+
+    def __init__(
+        self,
+        context: Any,
+        resume: Optional[list] = None,
+        discovery: Optional[dict] = None,
+        reserve_seconds: Optional[float] = None,
+    ) -> None:
+        """Creates a TimeBudget.
+
+        Args:
+            context (Any): The Lambda context. Without `get_remaining_time_in_millis`, such as
+                when run locally, the budget never runs out.
+            resume (Optional[list]): The names of the teams deferred by the previous run.
+            discovery (Optional[dict]): Where the previous run's team discovery stopped, with the
+                `page` it stopped on, the names of the teams already `probed` on that page and
+                the `copilot_teams` found before it.
+            reserve_seconds (Optional[float]): The time to keep back for storing the results.
+                Defaults to `CHECKPOINT_RESERVE_SECONDS`.
+        """
+        self.context = context
+        self.resume = list(resume or [])
+        self.reserve_seconds = (
+            CHECKPOINT_RESERVE_SECONDS if reserve_seconds is None else reserve_seconds
+        )
+        self.deferred: list[str] = []
+        self.resume_discovery = discovery
+        self.discovery: Optional[dict] = None
+
+    def remaining_seconds(self) -> Optional[float]:
+        """Gets the time left before the Lambda times out.
+
+        Returns:
+            Optional[float]: The time left in seconds, or None if the context does not say.
+        """
+        get_remaining_time = getattr(self.context, "get_remaining_time_in_millis", None)
+        if get_remaining_time is None:
+            return None
+        return float(get_remaining_time()) / 1000
+
+    def is_spent(self) -> bool:
+        """Checks whether only the reserve is left.
+
+        Returns:
+            bool: True if no more teams should be refreshed in this invocation.
+        """
+        remaining = self.remaining_seconds()
+        return remaining is not None and remaining <= self.reserve_seconds
+
+    def defer(self, team_name: str) -> None:
+        """Records a team that was not refreshed, so the next run refreshes it first.
+
+        Args:
+            team_name (str): The name of the team.
+        """
+        if not self.deferred:
+            logger.warning(
+                "Time budget used up, so the remaining teams are deferred to the next run",
+                extra={"remaining_seconds": self.remaining_seconds()},
+            )
+        self.deferred.append(team_name)
+
+    def defer_discovery(self, page: int, probed: list, copilot_teams: list) -> None:
+        """Records where team discovery stopped, so the next run carries on from there.
+
+        Args:
+            page (int): The page of teams being probed when the budget ran out.
+            probed (list): The names of the teams on that page already probed.
+            copilot_teams (list): The teams found with Copilot data so far.
+        """
+        logger.warning(
+            "Time budget used up, so team discovery is deferred to the next run",
+            extra={"page": page, "remaining_seconds": self.remaining_seconds()},
+        )
+        self.discovery = {"page": page, "probed": probed, "copilot_teams": copilot_teams}
+
+    def order(self, teams: list, watermarks: dict) -> list:
+        """Orders teams by staleness, so the most out of date are refreshed first.
+
+        Teams deferred by the previous run come first, in the order they were deferred. The
+        rest follow from the oldest latest date, with teams that have no stored history first.
+
+        Args:
+            teams (list): The teams, each with a `name`.
+            watermarks (dict): Each team's watermark, keyed by team name, with its `latest` date.
+
+        Returns:
+            list: The teams, most out of date first.
+        """
+        resume = {team_name: position for position, team_name in enumerate(self.resume)}
+
+        def staleness(team: dict) -> tuple:
+            team_name = team.get("name", "")
+            return (
+                resume.get(team_name, len(resume)),
+                watermarks.get(team_name, {}).get("latest") or "",
+            )
+
+        return sorted(teams, key=staleness)
+
+    def stats(self) -> dict:
+        """Gets a summary of the teams resumed and deferred, for logging.
+
+        Returns:
+            dict: The number of teams resumed from the previous run and deferred to the next.
+        """
+        return {
+            "no_teams_resumed": len(self.resume),
+            "no_teams_deferred": len(self.deferred),
+            "discovery_resumed": self.resume_discovery is not None,
+            "discovery_deferred": self.discovery is not None,
+        }
+
+
+def load_checkpoint(s3: boto3.client) -> tuple[list, Optional[dict]]:
+    """Gets the teams deferred by the previous run, and where its team discovery stopped.
+
+    Args:
+        s3 (boto3.client): An S3 client.
+
+    Returns:
+        tuple[list, Optional[dict]]: The names of the deferred teams, or an empty list if there
+            are none, and the discovery cursor, or None if discovery finished.
+    """
+    checkpoint = get_s3_object(s3, BUCKET_NAME, CHECKPOINT_OBJECT, {})
+    if not isinstance(checkpoint, dict):
+        return [], None
+
+    discovery = checkpoint.get("discovery")
+    if not isinstance(discovery, dict) or not isinstance(discovery.get("page"), int):
+        discovery = None
+
+    return [team_name for team_name in checkpoint.get("deferred", []) if team_name], discovery
+
+
+def save_checkpoint(s3: boto3.client, budget: TimeBudget) -> bool:
+    """Stores the teams and discovery deferred by this run, or clears the previous checkpoint.
+
+    Args:
+        s3 (boto3.client): An S3 client.
+        budget (TimeBudget): The time budget of this run.
+
+    Returns:
+        bool: True if the checkpoint is up to date in S3.
+    """
+    deferred = bool(budget.deferred or budget.discovery)
+    if not deferred and not budget.resume and budget.resume_discovery is None:
+        # Neither run ran out of time, so there is nothing to store or clear
+        return True
+
+    if deferred:
+        logger.info(
+            "Checkpoint stored, so the next run resumes the deferred teams",
+            extra={
+                "no_teams_deferred": len(budget.deferred),
+                "discovery_deferred": budget.discovery is not None,
+            },
+        )
+
+    return update_s3_object(
+        s3,
+        BUCKET_NAME,
+        CHECKPOINT_OBJECT,
+        {
+            "created": datetime.now(UTC).isoformat(),
+            "deferred": budget.deferred,
+            "discovery": budget.discovery,
+        },
+    )
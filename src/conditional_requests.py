@@ -0,0 +1,197 @@
+"""Conditional requests for the GitHub Copilot metrics endpoints.
+
+Most team metrics do not change between runs. This module remembers the `ETag` and
+`Last-Modified` validators of each metrics response so that the next run can send
+`If-None-Match` and `If-Modified-Since`. GitHub then answers with an empty 304 Not Modified
+response for unchanged data, which does not count against the primary rate limit and does not
+need decoding or merging.
+
+The validators are stored as a small JSON object in S3 between runs. Response bodies are not
+stored, only whether the last full response contained any data.
+"""
+
+from __future__ import annotations
+
+import threading
+import time
+from http import HTTPStatus
+from typing import TYPE_CHECKING, Any, Optional
+
+from requests import HTTPError, Response
+
+from src.instrumentation import observe_request
+
+if TYPE_CHECKING:
+    import github_api_toolkit
+
+API_URL = "https://api.github.com"
+
+# Only the Copilot metrics endpoints are requested conditionally
+CACHEABLE_SUFFIX = "/copilot/metrics"
+
+
+def cache_key(url: str, params: Optional[dict] = None) -> str:
+    """Gets the cache key for a request.
+
+    Args:
+        url (str): The API endpoint.
+        params (Optional[dict]): The query parameters of the request.
+
+    Returns:
+        str: The endpoint followed by its query parameters, sorted by name.
+    """
+    if not params:
+        return url
+    query = "&".join(f"{name}={value}" for name, value in sorted(params.items()))
+    return f"{url}?{query}"
+
+
+def is_not_modified(response: Any) -> bool:
+    """Checks whether a response is a 304 Not Modified.
+
+    Args:
+        response (Any): The value returned by a github_interface request.
+
+    Returns:
+        bool: True if the data is unchanged since the cached response.
+    """
+    return (
+        isinstance(response, Response)
+        and getattr(response, "status_code", None) == HTTPStatus.NOT_MODIFIED
+    )
+
+
+def forget_validators(gh: Any, url: str) -> None:
+    """Drops an endpoint's validators, if the github_interface sends conditional requests.
+
+    Used for a team whose new days were not stored, so the next run requests them in full
+    rather than being told they are unchanged.
+
+    Args:
+        gh (Any): The github_interface, which may wrap a ConditionalRequestCache.
+        url (str): The API endpoint.
+    """
+    forget = getattr(gh, "forget", None)
+    if callable(forget):
+        forget(url)
+
+
+class ConditionalRequestCache:
+    """Sends conditional requests for the Copilot metrics endpoints through a github_interface.
+
+    Requests to any other endpoint are passed straight through to the wrapped
+    github_interface, as is any attribute other than `get` and `has_data`.
+    """
+
+    def __init__(
+        self, gh: github_api_toolkit.github_interface, entries: Optional[dict] = None
+    ) -> None:
+        """Creates a ConditionalRequestCache.
+
+        Args:
+            gh (github_api_toolkit.github_interface): The github_interface to send requests with.
+            entries (Optional[dict]): The validators stored by a previous run, keyed by
+                `cache_key`.
+        """
+        self.gh = gh
+        self.entries = entries if isinstance(entries, dict) else {}
+        self.not_modified = 0
+        self.modified = 0
+        self._lock = threading.Lock()
+
+    def __getattr__(self, name: str) -> Any:
+        """Passes any other attribute through to the wrapped github_interface."""
+        if name == "gh":
+            raise AttributeError(name)
+        return getattr(self.gh, name)
+
+    def get(self, url: str, params: Optional[dict] = None, **kwargs: Any) -> Response | Exception:
+        """Sends a GET request, conditionally if the endpoint's validators are known.
+
+        Args:
+            url (str): The API endpoint to request.
+            params (Optional[dict]): The query parameters of the request.
+            **kwargs (Any): Passed through to github_interface.get for other endpoints.
+
+        Returns:
+            Response | Exception: The response, which has a 304 status code if the data is
+                unchanged, or the HTTP error raised by the request.
+        """
+        session = getattr(self.gh, "session", None)
+        if not url.endswith(CACHEABLE_SUFFIX) or session is None:
+            passed_through: Response | Exception = self.gh.get(url, params=params, **kwargs)
+            return passed_through
+
+        key = cache_key(url, params)
+        entry = self.entries.get(key, {})
+
+        headers = {}
+        if entry.get("etag"):
+            headers["If-None-Match"] = entry["etag"]
+        if entry.get("last_modified"):
+            headers["If-Modified-Since"] = entry["last_modified"]
+
+        # The session bypasses the instrumented github_interface, so the request is recorded here
+        started_at = time.perf_counter()
+        response: Optional[Response] = None
+        try:
+            response = session.get(API_URL + url, params=params, headers=headers)
+        finally:
+            observe_request(url, time.perf_counter() - started_at, response)
+
+        try:
+            response.raise_for_status()
+        except HTTPError as error:
+            if response.status_code == HTTPStatus.UNAUTHORIZED:
+                # Sent through the wrapped github_interface, which may refresh its token
+                retried: Response | Exception = self.gh.get(url, params=params, **kwargs)
+                return retried
+            # Match github_interface, which returns HTTP errors rather than raising them
+            return error
+
+        with self._lock:
+            if response.status_code == HTTPStatus.NOT_MODIFIED:
+                self.not_modified += 1
+            else:
+                self.modified += 1
+                self.entries[key] = {
+                    "etag": response.headers.get("ETag"),
+                    "last_modified": response.headers.get("Last-Modified"),
+                    # Checked on the raw body, so the caller's .json() is the only decode
+                    "has_data": response.content.strip() not in (b"", b"[]"),
+                }
+
+        return response
+
+    def has_data(self, url: str, params: Optional[dict] = None) -> bool:
+        """Checks whether the last full response for a request contained any data.
+
+        Args:
+            url (str): The API endpoint.
+            params (Optional[dict]): The query parameters of the request.
+
+        Returns:
+            bool: True if the cached response contained data.
+        """
+        return bool(self.entries.get(cache_key(url, params), {}).get("has_data"))
+
+    def forget(self, url: str) -> None:
+        """Drops the validators of an endpoint, whatever the query parameters of its requests.
+
+        Args:
+            url (str): The API endpoint.
+        """
+        with self._lock:
+            for key in [key for key in self.entries if key == url or key.startswith(f"{url}?")]:
+                del self.entries[key]
+
+    def stats(self) -> dict:
+        """Gets a summary of the conditional requests made, for logging.
+
+        Returns:
+            dict: The number of unchanged and changed responses.
+        """
+        return {
+            "no_not_modified_responses": self.not_modified,
+            "no_modified_responses": self.modified,
+        }
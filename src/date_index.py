@@ -0,0 +1,77 @@
+"""Date index for lists of daily Copilot metrics records.
+
+The historic usage data and each team's history are lists of records with a `date` field.
+Checking a new day against the whole list is linear in its length, so merging a run's data
+into several years of history is quadratic. DateIndex maps each date to its position in the
+list once, so each new day can be looked up and upserted in constant time.
+
+filter_team_history trims a team's full metrics payload to the days a `since` request would
+have returned, so a payload downloaded once can be merged from any date.
+"""
+
+from typing import Optional
+
+
+class DateIndex:
+    """An index of a list of daily records by their `date` field.
+
+    The indexed list is updated in place, so it can be written back out as it is. The most
+    recent date in the list is kept up to date as records are added.
+    """
+
+    def __init__(self, records: list[dict]) -> None:
+        """Creates a DateIndex.
+
+        Args:
+            records (list[dict]): The records to index. Later records replace earlier records
+                with the same date in the index.
+        """
+        self.records = records
+        self.positions = {record["date"]: position for position, record in enumerate(records)}
+        self.latest: Optional[str] = max(self.positions, default=None)
+
+    def __contains__(self, day: str) -> bool:
+        """Checks whether a record exists for a date."""
+        return day in self.positions
+
+    def __len__(self) -> int:
+        """Gets the number of dates in the index."""
+        return len(self.positions)
+
+    def upsert(self, record: dict) -> bool:
+        """Adds a record, or replaces the existing record for the same date.
+
+        Args:
+            record (dict): The record to add.
+
+        Returns:
+            bool: True if the date was not already in the index.
+        """
+        day = record["date"]
+
+        if day in self.positions:
+            self.records[self.positions[day]] = record
+            return False
+
+        self.positions[day] = len(self.records)
+        self.records.append(record)
+
+        if self.latest is None or day > self.latest:
+            self.latest = day
+
+        return True
+
+
+def filter_team_history(team_usage: list[dict], since: Optional[str] = None) -> list[dict]:
+    """Filters a team's metrics payload to the days a `since` request would have returned.
+
+    Args:
+        team_usage (list[dict]): A team's GitHub Copilot metrics, as returned without `since`.
+        since (Optional[str]): The earliest date to keep (inclusive). Keeps all days if None.
+
+    Returns:
+        list[dict]: The metrics for each day on or after `since`.
+    """
+    if not since:
+        return list(team_usage)
+    return [day for day in team_usage if day["date"] >= since]
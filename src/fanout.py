@@ -0,0 +1,503 @@
+"""Coordinator and worker mode, which splits the teams across several invocations.
+
+A single invocation probes every team of the organisation itself, which can take longer than a
+Lambda may run for a large organisation. In fan-out mode the handler is invoked as a coordinator
+instead. The coordinator lists the teams and partitions them into shards by a hash of each
+team's slug, so a team is always in the same shard. Each shard is sent to a worker, which
+probes its teams, works out their new days of history and writes them to a partial object in
+S3. Once every worker has finished, the coordinator merges the partials into the team history,
+`copilot_teams.json` and the cache of teams without Copilot data.
+
+Workers are invoked asynchronously as Lambda functions, and the coordinator polls S3 for their
+partials, or they run in a local process pool so the mode can be run without deploying it. The
+organisation's usage is gathered by the coordinator while the workers run.
+"""
+
+from __future__ import annotations
+
+import json
+import logging
+import multiprocessing
+import os
+import time
+import uuid
+import zlib
+from concurrent.futures import ProcessPoolExecutor
+from datetime import UTC, datetime
+from http import HTTPStatus
+from typing import TYPE_CHECKING, Any
+
+from src import main
+from src.cassette import SCRUBBED, SCRUBBED_TOKEN, Cassette, open_cassette
+from src.checkpoint import TimeBudget
+from src.instrumentation import emit, instrument, start
+from src.negative_cache import NEGATIVE_CACHE_OBJECT, NEGATIVE_CACHE_TTL_DAYS, remove_expired
+from src.phases import PhaseGraph
+from src.rate_limit import RateLimitScheduler
+from src.resilience import CircuitBreaker, RetryingInterface, RunAbortedError
+from src.s3_objects import (
+    BUCKET_NAME,
+    ResilientS3Client,
+    get_s3_object,
+    get_s3_objects,
+    update_s3_object,
+)
+from src.warm_start import (
+    TokenRefreshingInterface,
+    get_client,
+    get_github_adapter,
+    get_installation_token,
+    get_secret,
+)
+
+if TYPE_CHECKING:
+    import boto3
+    import github_api_toolkit
+
+logger = logging.getLogger()
+
+# Number of workers the teams are split across
+FANOUT_SHARDS = int(os.getenv("FANOUT_SHARDS", "4"))
+
+# Lambda function invoked for each worker. Defaults to the coordinator's own function
+FANOUT_FUNCTION_NAME = os.getenv("FANOUT_FUNCTION_NAME")
+
+# Workers write their partial results here, one object per shard
+FANOUT_PREFIX = "fanout/"
+
+# Seconds between the coordinator's checks for the partials of Lambda workers
+FANOUT_POLL_SECONDS = float(os.getenv("FANOUT_POLL_SECONDS", "5"))
+
+# The team fields workers need, which keeps the worker events small
+TEAM_FIELDS = ("name", "slug", "description", "html_url")
+
+
+def get_shard(team: dict, shards: int) -> int:
+    """Gets the shard of a team, which is the same on every run and in every process.
+
+    Args:
+        team (dict): The team, with a `slug` and `name`.
+        shards (int): The number of shards.
+
+    Returns:
+        int: The shard, from 0 to `shards - 1`.
+    """
+    key = team.get("slug") or team["name"]
+    return zlib.crc32(key.encode("utf-8")) % shards
+
+
+def partition_teams(teams: list, shards: int) -> list[list]:
+    """Splits teams into shards by a hash of their slug, keeping their order within each shard.
+
+    Args:
+        teams (list): The teams, as returned by the teams endpoint.
+        shards (int): The number of shards.
+
+    Returns:
+        list[list]: The teams of each shard, with only the fields the workers need.
+    """
+    partitions: list[list] = [[] for _ in range(shards)]
+    for team in teams:
+        partitions[get_shard(team, shards)].append(
+            {field: team.get(field) for field in TEAM_FIELDS}
+        )
+    return partitions
+
+
+def get_partial_name(shard: int, shards: int) -> str:
+    """Gets the S3 object name of a shard's partial result.
+
+    Args:
+        shard (int): The shard.
+        shards (int): The number of shards.
+
+    Returns:
+        str: The S3 object name.
+    """
+    return f"{FANOUT_PREFIX}shard-{shard}-of-{shards}.json"
+
+
+def connect(cassette: Cassette) -> tuple[boto3.client, github_api_toolkit.github_interface]:
+    """Creates the S3 client and GitHub interface used by the coordinator and workers.
+
+    Args:
+        cassette (Cassette): The cassette their traffic is recorded to or replayed from.
+
+    Returns:
+        tuple: The S3 client and the GitHub interface.
+
+    Raises:
+        RunAbortedError: If an installation token could not be minted.
+    """
+    s3 = ResilientS3Client(cassette.wrap_s3(get_client("s3")), CircuitBreaker("S3"))
+
+    secret = cassette.call_live(get_secret, main.secret_name, main.secret_region, replayed=SCRUBBED)
+    access_token = cassette.call_live(
+        get_installation_token, main.org, secret, main.client_id, replayed=SCRUBBED_TOKEN
+    )
+    if isinstance(access_token, str):
+        raise RunAbortedError(f"Error getting access token: {access_token}")
+
+    adapter = cassette.wrap_adapter(
+        get_github_adapter(
+            main.GITHUB_POOL_SIZE, (main.GITHUB_CONNECT_TIMEOUT, main.GITHUB_READ_TIMEOUT)
+        )
+    )
+    token_interface = TokenRefreshingInterface(
+        main.org, secret, main.client_id, access_token[0], adapter
+    )
+    gh = RateLimitScheduler(
+        RetryingInterface(instrument(token_interface)),
+        max_concurrency=main.MAX_WORKERS,
+        low_remaining=main.RATE_LIMIT_LOW_REMAINING,
+    )
+    return s3, gh
+
+
+def list_teams(gh: github_api_toolkit.github_interface) -> list:
+    """Lists every team in the organisation, without probing them.
+
+    Args:
+        gh (github_api_toolkit.github_interface): An instance of the github_interface class.
+
+    Returns:
+        list: The teams, in the order the API lists them.
+    """
+    response = gh.get(f"/orgs/{main.org}/teams", params={"per_page": 100})
+    return [team for _, teams in main.iter_team_pages(gh, response) for team in teams]
+
+
+def get_watermarks(s3: boto3.client) -> dict:
+    """Gets each team's stored watermark, for the configured team history layout.
+
+    Args:
+        s3 (boto3.client): An S3 client.
+
+    Returns:
+        dict: Each team's watermark, keyed by team name, or an empty dict if none are stored.
+    """
+    object_name = main.TEAMS_HISTORY_MANIFEST
+    if main.TEAMS_HISTORY_LAYOUT == "sharded":
+        object_name = main.TEAMS_HISTORY_INDEX
+
+    watermarks = get_s3_object(s3, BUCKET_NAME, object_name, {})
+    return watermarks if isinstance(watermarks, dict) else {}
+
+
+def run_worker(event: dict) -> str:
+    """Probes a shard's teams and writes their new days of history to the shard's partial.
+
+    Args:
+        event (dict): The worker event, with the `run_id`, `shard`, `shards` and `teams`.
+
+    Returns:
+        str: Completion message.
+    """
+    # Each worker records to and replays from the cassette of its shard
+    suffix = f"shard-{event['shard'] + 1}-of-{event['shards']}"
+    cassette = open_cassette(suffix)
+    try:
+        return probe_shard(event, cassette)
+    finally:
+        cassette.save(suffix)
+
+
+def probe_shard(event: dict, cassette: Cassette) -> str:
+    """Probes a shard's teams and writes the shard's partial, as `run_worker` does.
+
+    Args:
+        event (dict): The worker event, with the `run_id`, `shard`, `shards` and `teams`.
+        cassette (Cassette): The cassette the worker's traffic is recorded to or replayed from.
+
+    Returns:
+        str: Completion message.
+    """
+    s3, gh = connect(cassette)
+    teams = event["teams"]
+
+    negative_cache = None
+    if NEGATIVE_CACHE_TTL_DAYS > 0:
+        negative_cache = get_s3_object(s3, BUCKET_NAME, NEGATIVE_CACHE_OBJECT, {})
+
+    # Teams whose metrics cannot be fetched keep their entry from the last run
+    previous_teams = {
+        team.get("name"): team
+        for team in get_s3_object(s3, BUCKET_NAME, "copilot_teams.json", [])
+        if isinstance(team, dict)
+    }
+
+    team_metrics: dict = {}
+    copilot_teams = main.get_copilot_team_date(
+        gh,
+        0,
+        team_metrics=team_metrics,
+        teams=teams,
+        negative_cache=negative_cache,
+        previous_teams=previous_teams,
+    )
+    new_history = main.plan_team_history(gh, copilot_teams, get_watermarks(s3), team_metrics)
+
+    team_names = {team["name"] for team in teams}
+    partial = {
+        "run_id": event["run_id"],
+        "copilot_teams": copilot_teams,
+        "new_history": new_history,
+        "negative_cache": {
+            name: entry for name, entry in (negative_cache or {}).items() if name in team_names
+        },
+    }
+
+    object_name = get_partial_name(event["shard"], event["shards"])
+    if not update_s3_object(s3, BUCKET_NAME, object_name, partial):
+        raise RunAbortedError(f"Could not write {object_name}")
+
+    logger.info(
+        "Shard %s of %s written",
+        event["shard"] + 1,
+        event["shards"],
+        extra={"no_teams": len(teams), "no_copilot_teams": len(copilot_teams)},
+    )
+
+    return f"Shard {event['shard'] + 1} of {event['shards']} written to {object_name}"
+
+
+def invoke_workers(s3: boto3.client, events: list[dict], context: Any, local: bool) -> list[str]:
+    """Runs a worker for each event, and waits for them all to finish.
+
+    Lambda workers are invoked asynchronously, so no request is held open while they run. The
+    coordinator then polls S3 until every shard's partial has been written, or only the time
+    kept back to merge them is left.
+
+    Args:
+        s3 (boto3.client): An S3 client.
+        events (list[dict]): The worker events.
+        context (Any): The coordinator's Lambda context.
+        local (bool): Run the workers in a local process pool rather than as Lambda functions.
+
+    Returns:
+        list[str]: The result of each worker, or why it did not finish.
+    """
+    if local:
+        # Workers are spawned, as forking would copy the locks held by the coordinator's threads
+        with ProcessPoolExecutor(
+            max_workers=len(events), mp_context=multiprocessing.get_context("spawn")
+        ) as executor:
+            futures = [executor.submit(run_worker, event) for event in events]
+            return [
+                str(future.exception()) if future.exception() else future.result()
+                for future in futures
+            ]
+
+    # S3 stores the time a partial was last modified to the second
+    invoked = datetime.now(UTC).replace(microsecond=0)
+    function_name = FANOUT_FUNCTION_NAME or context.function_name
+    lambda_client = get_client("lambda")
+
+    results = {}
+    for event in events:
+        response = lambda_client.invoke(
+            FunctionName=function_name,
+            InvocationType="Event",
+            Payload=json.dumps({"mode": "worker", **event}),
+        )
+        if response.get("StatusCode") != HTTPStatus.ACCEPTED:
+            results[event["shard"]] = f"Shard {event['shard'] + 1} failed to start: {response}"
+
+    started = [event for event in events if event["shard"] not in results]
+    results.update(wait_for_partials(s3, started, invoked, TimeBudget(context)))
+
+    return [
+        results.get(event["shard"], f"Shard {event['shard'] + 1} did not finish in time")
+        for event in events
+    ]
+
+
+def wait_for_partials(
+    s3: boto3.client, events: list[dict], invoked: datetime, budget: TimeBudget
+) -> dict[int, str]:
+    """Polls S3 until each worker has written its shard's partial, or the budget is spent.
+
+    Args:
+        s3 (boto3.client): An S3 client.
+        events (list[dict]): The events of the workers that were invoked.
+        invoked (datetime): When the workers were invoked. A partial last modified before then
+            was written by an earlier run.
+        budget (TimeBudget): The coordinator's time budget, whose reserve is kept for merging.
+
+    Returns:
+        dict[int, str]: The result of each shard whose partial was written, keyed by shard.
+    """
+    pending = {get_partial_name(event["shard"], event["shards"]): event for event in events}
+    finished = {}
+
+    while True:
+        response = s3.list_objects_v2(Bucket=BUCKET_NAME, Prefix=FANOUT_PREFIX)
+        for item in response.get("Contents", []):
+            if item["Key"] in pending and item["LastModified"] >= invoked:
+                event = pending.pop(item["Key"])
+                finished[event["shard"]] = (
+                    f"Shard {event['shard'] + 1} of {event['shards']} written to {item['Key']}"
+                )
+
+        if not pending or budget.is_spent():
+            return finished
+        time.sleep(FANOUT_POLL_SECONDS)
+
+
+def merge_partials(
+    s3: boto3.client,
+    gh: github_api_toolkit.github_interface,
+    teams: list,
+    shards: int,
+    run_id: str,
+) -> list:
+    """Merges the workers' partials into the team history and the team lists.
+
+    The history of every shard that finished is merged. `copilot_teams.json` and the cache of
+    teams without Copilot data are only written if every shard finished, as they would
+    otherwise be missing the teams of the shards that did not.
+
+    Args:
+        s3 (boto3.client): An S3 client.
+        gh (github_api_toolkit.github_interface): An instance of the github_interface class.
+        teams (list): The teams listed by the coordinator.
+        shards (int): The number of shards.
+        run_id (str): The ID of this run, which each partial must have.
+
+    Returns:
+        list: A list of GitHub Teams with Copilot Data.
+
+    Raises:
+        RunAbortedError: If the team history could not be written, or a shard did not finish.
+    """
+    partials = get_s3_objects(
+        s3, BUCKET_NAME, [get_partial_name(shard, shards) for shard in range(shards)]
+    )
+
+    copilot_teams: list = []
+    new_history: dict = {}
+    negative_cache: dict = {}
+    unfinished = []
+    for object_name, partial in partials.items():
+        # A partial left by an earlier run means this run's worker did not finish
+        if not isinstance(partial, dict) or partial.get("run_id") != run_id:
+            unfinished.append(object_name)
+            continue
+        copilot_teams.extend(partial["copilot_teams"])
+        new_history.update(partial["new_history"])
+        negative_cache.update(partial["negative_cache"])
+
+    # The teams are stored in the order the API lists them, as a single invocation stores them
+    position = {team["name"]: i for i, team in enumerate(teams)}
+    copilot_teams.sort(key=lambda team: position.get(team["name"], len(position)))
+
+    # The new days are merged as if they had been downloaded while discovering the teams
+    teams_with_history = [team for team in copilot_teams if team["name"] in new_history]
+    if main.TEAMS_HISTORY_LAYOUT == "sharded":
+        history_updated = main.update_sharded_team_history(s3, gh, teams_with_history, new_history)
+    else:
+        history_updated = main.update_team_history(s3, gh, teams_with_history, new_history)
+
+    if not history_updated:
+        # The team lists would describe history that was not stored
+        raise RunAbortedError("Could not write the team history")
+
+    if unfinished:
+        raise RunAbortedError(f"{len(unfinished)} of {shards} shards did not finish")
+
+    update_s3_object(s3, BUCKET_NAME, "copilot_teams.json", copilot_teams)
+
+    if NEGATIVE_CACHE_TTL_DAYS > 0:
+        negative_cache = remove_expired(negative_cache, datetime.now(UTC))
+        update_s3_object(s3, BUCKET_NAME, NEGATIVE_CACHE_OBJECT, negative_cache)
+
+    logger.info(
+        "Shards merged",
+        extra={"no_shards": shards, "no_copilot_teams": len(copilot_teams)},
+    )
+
+    return copilot_teams
+
+
+def coordinate(event: dict, context: Any) -> str:
+    """Splits the teams across workers, and merges their results once they have all finished.
+
+    Args:
+        event (dict): The coordinator event, optionally with the number of `shards` and whether
+            to run the workers in a `local` process pool.
+        context (Any): AWS Lambda context object.
+
+    Returns:
+        str: Completion message.
+    """
+    shards = max(1, int(event.get("shards") or FANOUT_SHARDS))
+    run_id = uuid.uuid4().hex
+
+    # The coordinator has its own cassette. A replayed run is offline, so its workers replay
+    # their cassettes in the local process pool rather than being invoked
+    cassette = open_cassette()
+    local = event.get("local", context is None) or cassette.replaying
+
+    try:
+        s3, gh = connect(cassette)
+
+        def run_workers(teams: list) -> list[str]:
+            events = [
+                {"run_id": run_id, "shard": shard, "shards": shards, "teams": shard_teams}
+                for shard, shard_teams in enumerate(partition_teams(teams, shards))
+            ]
+            return invoke_workers(s3, events, context, local)
+
+        # The organisation's usage is gathered while the workers run
+        phases = PhaseGraph()
+        phases.add("historic_usage", lambda: main.get_and_update_historic_usage(s3, gh))
+        phases.add("teams", lambda: list_teams(gh))
+        phases.add("workers", run_workers, ["teams"])
+        phases.add(
+            "merge",
+            lambda teams, _: merge_partials(s3, gh, teams, shards, run_id),
+            ["teams", "workers"],
+        )
+
+        results = phases.run(max_workers=main.MAX_CONCURRENT_PHASES)
+    except RunAbortedError as error:
+        logger.error("Run aborted: %s", error, extra={"run_id": run_id, "no_shards": shards})
+        return f"Run aborted: {error}"
+    finally:
+        cassette.save()
+
+    _, dates_added, *_ = results["historic_usage"]
+
+    logger.info(
+        "Process complete",
+        extra={
+            "bucket": BUCKET_NAME,
+            "run_id": run_id,
+            "no_shards": shards,
+            "worker_results": results["workers"],
+            "no_days_added": len(dates_added),
+            "no_copilot_teams": len(results["merge"]),
+            "phase_seconds": phases.timings,
+        },
+    )
+
+    return "Github Data logging is now complete."
+
+
+def handler(event: dict, context: Any) -> str:
+    """Runs the coordinator or a worker, as the event asks.
+
+    Args:
+        event (dict): AWS Lambda event payload, with a `mode` of "coordinator" or "worker".
+        context (Any): AWS Lambda context object.
+
+    Returns:
+        str: Completion message.
+    """
+    start()
+    try:
+        if event.get("mode") == "worker":
+            return run_worker(event)
+        return coordinate(event, context)
+    finally:
+        emit()
@@ -0,0 +1,251 @@
+"""Monthly partitions of the historic usage data.
+
+With `HISTORIC_USAGE_LAYOUT=monthly`, the organisation's usage is stored as one object per
+month under `historic_usage/`, plus a manifest of each month's number of days and latest date.
+A run only reads and writes the months its new days fall in, so its cost does not grow with
+the length of the history.
+"""
+
+from __future__ import annotations
+
+import logging
+from typing import TYPE_CHECKING
+
+from botocore.exceptions import ClientError
+
+from src.date_index import DateIndex
+from src.resilience import RunAbortedError
+from src.s3_objects import (
+    BUCKET_NAME,
+    get_s3_object,
+    get_s3_objects,
+    is_not_found,
+    update_s3_object,
+    update_s3_objects,
+)
+from src.serialisation import decode_s3_response
+
+if TYPE_CHECKING:
+    import boto3
+
+logger = logging.getLogger()
+
+OBJECT_NAME = "historic_usage_data.json"
+HISTORIC_USAGE_PREFIX = "historic_usage/"
+HISTORIC_USAGE_MANIFEST = f"{HISTORIC_USAGE_PREFIX}manifest.json"
+
+
+def get_partition_object_name(partition: str) -> str:
+    """Gets the S3 object name of a month of historic usage data.
+
+    Args:
+        partition (str): The month, in the format YYYY-MM.
+
+    Returns:
+        str: The S3 object name.
+    """
+    return f"{HISTORIC_USAGE_PREFIX}{partition}.json"
+
+
+def group_by_partition(usage_data: list[dict]) -> dict[str, list[dict]]:
+    """Groups daily usage records by month.
+
+    Args:
+        usage_data (list[dict]): Daily usage records.
+
+    Returns:
+        dict[str, list[dict]]: The records of each month, keyed by YYYY-MM.
+    """
+    partitions: dict[str, list[dict]] = {}
+    for day in usage_data:
+        partitions.setdefault(day["date"][:7], []).append(day)
+    return partitions
+
+
+def migrate_historic_usage(s3: boto3.client) -> dict:
+    """Splits the single historic usage object into monthly partitions and a manifest.
+
+    The migration only adds days that are missing from a partition, and includes partitions
+    already in the bucket, so it is safe to run again.
+
+    Args:
+        s3 (boto3.client): An S3 client.
+
+    Returns:
+        dict: The manifest of the partitions.
+
+    Raises:
+        RunAbortedError: If the single historic usage object exists but could not be read. Its
+            days would otherwise be left out of the partitions, which replace it. Also raised
+            if a partition could not be written, in which case the manifest is not written.
+    """
+    logger.info("Migrating %s to monthly partitions", OBJECT_NAME)
+
+    try:
+        legacy_usage = decode_s3_response(s3.get_object(Bucket=BUCKET_NAME, Key=OBJECT_NAME))
+    except ClientError as e:
+        if not is_not_found(e):
+            raise RunAbortedError(f"Could not read {OBJECT_NAME}: {e}") from e
+        legacy_usage = []
+    except (ValueError, OSError) as e:
+        raise RunAbortedError(f"Could not decode {OBJECT_NAME}: {e}") from e
+
+    if not isinstance(legacy_usage, list):
+        raise RunAbortedError(f"Could not migrate {OBJECT_NAME}, as it is not a list of days")
+
+    legacy_partitions = group_by_partition(legacy_usage)
+
+    # Partitions written by an earlier, interrupted migration are kept
+    existing_partitions = {
+        item["Key"][len(HISTORIC_USAGE_PREFIX) : -len(".json")]
+        for item in s3.list_objects_v2(Bucket=BUCKET_NAME, Prefix=HISTORIC_USAGE_PREFIX).get(
+            "Contents", []
+        )
+        if item["Key"] != HISTORIC_USAGE_MANIFEST
+    }
+
+    manifest: dict = {"partitions": {}}
+
+    # Partitions are read and written concurrently, and the manifest written once they are done
+    stored = get_s3_objects(
+        s3,
+        BUCKET_NAME,
+        [get_partition_object_name(partition) for partition in sorted(existing_partitions)],
+        [],
+    )
+    writes = {}
+
+    for partition in sorted(existing_partitions | set(legacy_partitions)):
+        object_name = get_partition_object_name(partition)
+
+        records = stored.get(object_name, [])
+
+        index = DateIndex(records)
+        missing = [day for day in legacy_partitions.get(partition, []) if day["date"] not in index]
+        for day in missing:
+            index.upsert(day)
+
+        if missing:
+            writes[object_name] = records
+
+        manifest["partitions"][partition] = {"no_days": len(index), "latest": index.latest}
+
+    failed = [name for name, ok in update_s3_objects(s3, BUCKET_NAME, writes).items() if not ok]
+    if failed:
+        # The manifest would list partitions that were not stored, so they would never be
+        # migrated again
+        raise RunAbortedError(f"Could not write {', '.join(sorted(failed))}")
+
+    update_s3_object(s3, BUCKET_NAME, HISTORIC_USAGE_MANIFEST, manifest)
+
+    logger.info(
+        "Migrated %s to monthly partitions",
+        OBJECT_NAME,
+        extra={"no_partitions": len(manifest["partitions"])},
+    )
+
+    return manifest
+
+
+def update_partitioned_historic_usage(s3: boto3.client, usage_data: list[dict]) -> tuple:
+    """Upserts new usage data into the monthly partitions of the historic usage data.
+
+    Only the partitions that the new data falls into are read and written, along with the
+    manifest. The single historic usage object is migrated on the first run.
+
+    Args:
+        s3 (boto3.client): An S3 client.
+        usage_data (list[dict]): The usage data returned by the GitHub API.
+
+    Returns:
+        tuple: A tuple containing the usage data of the partitions touched by this run, a list
+            of dates added, whether every touched partition and the manifest were written, and
+            the number of days in every partition, from the manifest.
+    """
+    manifest = get_s3_object(s3, BUCKET_NAME, HISTORIC_USAGE_MANIFEST)
+    if not isinstance(manifest, dict):
+        manifest = migrate_historic_usage(s3)
+
+    historic_usage = []
+    dates_added: list[str] = []
+
+    # The touched partitions are read and written concurrently
+    new_partitions = sorted(group_by_partition(usage_data).items())
+    stored = get_s3_objects(
+        s3,
+        BUCKET_NAME,
+        [
+            get_partition_object_name(partition)
+            for partition, _ in new_partitions
+            if partition in manifest["partitions"]
+        ],
+    )
+    writes = {}
+    written = True
+
+    for partition, days in new_partitions:
+        object_name = get_partition_object_name(partition)
+
+        records = stored.get(object_name, [])
+
+        if records is None:
+            # Writing only the new days would overwrite the rest of the month
+            logger.error("Skipping partition %s as it could not be read", partition)
+            written = False
+            continue
+
+        index = DateIndex(records)
+        dates_added.extend(day["date"] for day in days if index.upsert(day))
+
+        writes[object_name] = records
+
+        manifest["partitions"][partition] = {"no_days": len(index), "latest": index.latest}
+        historic_usage.extend(records)
+
+    written = all(update_s3_objects(s3, BUCKET_NAME, writes).values()) and written
+
+    # The touched partitions are only part of the history, so the total comes from the manifest
+    no_days = sum(item["no_days"] for item in manifest["partitions"].values())
+
+    logger.info(
+        "New usage data added to %s",
+        HISTORIC_USAGE_PREFIX,
+        extra={
+            "no_days_added": len(dates_added),
+            "dates_added": dates_added,
+            "no_days_total": no_days,
+        },
+    )
+
+    written = update_s3_object(s3, BUCKET_NAME, HISTORIC_USAGE_MANIFEST, manifest) and written
+
+    return historic_usage, dates_added, written, no_days
+
+
+def read_historic_usage(s3: boto3.client) -> list[dict]:
+    """Reads the full historic usage data, in whichever layout it is stored.
+
+    This reassembles the monthly partitions into the same list as the single historic usage
+    object, for readers such as the dashboard that need every day.
+
+    Args:
+        s3 (boto3.client): An S3 client.
+
+    Returns:
+        list[dict]: Every day of historic usage data, in date order for partitioned data.
+    """
+    manifest = get_s3_object(s3, BUCKET_NAME, HISTORIC_USAGE_MANIFEST)
+    if not isinstance(manifest, dict):
+        historic_usage = get_s3_object(s3, BUCKET_NAME, OBJECT_NAME, [])
+        return historic_usage if isinstance(historic_usage, list) else []
+
+    historic_usage = []
+    object_names = [
+        get_partition_object_name(partition) for partition in sorted(manifest["partitions"])
+    ]
+    partitions = get_s3_objects(s3, BUCKET_NAME, object_names, [])
+
+    for object_name in object_names:
+        historic_usage.extend(sorted(partitions[object_name], key=lambda day: day["date"]))
+
+    return historic_usage
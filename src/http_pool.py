@@ -0,0 +1,153 @@
+"""Connection pooling for GitHub API requests.
+
+Every GitHub API request is sent over HTTPS, so a request that cannot reuse an open connection
+pays for a new TCP connection and TLS handshake. `requests` keeps at most 10 connections per
+host by default, and discards any others when concurrent requests return them, so a run with
+more requests in flight than that keeps opening new connections.
+
+PooledHTTPAdapter keeps a pool large enough for every request in flight, waits for a free
+connection rather than opening a throwaway one, enables TCP keep-alive on its sockets and gives
+every request a default timeout. It is mounted on the session of each github_interface the
+handler creates, so the pool outlives token refreshes and warm invocations.
+"""
+
+from __future__ import annotations
+
+import logging
+import socket
+from typing import TYPE_CHECKING, Any
+
+from requests.adapters import HTTPAdapter
+from urllib3.connection import HTTPConnection
+
+if TYPE_CHECKING:
+    from requests import PreparedRequest, Response
+    from requests.adapters import BaseAdapter
+
+logger = logging.getLogger()
+
+
+class PooledHTTPAdapter(HTTPAdapter):
+    """A requests transport adapter with a fixed size pool of keep-alive connections.
+
+    The number of connections opened and the number of requests sent are read from the pools,
+    so `stats` reports how often a request reused an open connection.
+    """
+
+    def __init__(
+        self,
+        pool_size: int,
+        timeout: float | tuple[float, float],
+        keep_alive: bool = True,
+    ) -> None:
+        """Creates a PooledHTTPAdapter.
+
+        Args:
+            pool_size (int): The maximum number of connections kept open to each host. Requests
+                wait for a free connection once this many are in use.
+            timeout (float | tuple[float, float]): The timeout of requests sent
+                without one, in seconds. A tuple is the connect and read timeouts.
+            keep_alive (bool): Enable TCP keep-alive on the connections.
+        """
+        self.timeout = timeout
+        self.keep_alive = keep_alive
+        self._baseline = (0, 0)
+        super().__init__(pool_maxsize=pool_size, pool_block=True)
+
+    def init_poolmanager(self, *args: Any, **pool_kwargs: Any) -> None:
+        """Creates the pool manager, with TCP keep-alive enabled on its sockets."""
+        if self.keep_alive:
+            pool_kwargs.setdefault(
+                "socket_options",
+                [
+                    *HTTPConnection.default_socket_options,
+                    (socket.SOL_SOCKET, socket.SO_KEEPALIVE, 1),
+                ],
+            )
+        super().init_poolmanager(*args, **pool_kwargs)
+
+    # The parameters are those of HTTPAdapter.send
+    # pylint: disable-next=too-many-arguments,too-many-positional-arguments
+    def send(  # noqa: PLR0913, PLR0917
+        self,
+        request: PreparedRequest,
+        stream: bool = False,
+        timeout: float | tuple[float | None, float | None] | None = None,
+        verify: bool | str = True,
+        cert: str | tuple[str, str] | None = None,
+        proxies: dict[str, str] | None = None,
+    ) -> Response:
+        """Sends a request, with the default timeout if it does not have one.
+
+        Args:
+            request (PreparedRequest): The request.
+            stream (bool): Stream the response body rather than downloading it at once.
+            timeout (float | tuple[float | None, float | None] | None): The timeout of the
+                request, in seconds. Defaults to the adapter's timeout.
+            verify (bool | str): Verify the server's TLS certificate, or the path of a CA bundle
+                to verify it with.
+            cert (str | tuple[str, str] | None): A client certificate to send.
+            proxies (dict[str, str] | None): The proxies to send the request through.
+
+        Returns:
+            Response: The response.
+        """
+        if timeout is None:
+            timeout = self.timeout
+        return super().send(
+            request, stream=stream, timeout=timeout, verify=verify, cert=cert, proxies=proxies
+        )
+
+    def totals(self) -> tuple[int, int]:
+        """Counts the connections opened and requests sent by every pool.
+
+        Returns:
+            tuple[int, int]: The number of connections opened and the number of requests sent.
+        """
+        pools = self.poolmanager.pools
+        # The pools cannot be iterated over directly, as it is not thread safe
+        keys = pools.keys()
+        connections = requests_sent = 0
+        for key in keys:
+            pool = pools.get(key)
+            if pool is not None:
+                connections += pool.num_connections
+                requests_sent += pool.num_requests
+        return connections, requests_sent
+
+    def reset_stats(self) -> None:
+        """Starts counting connections and requests again, keeping the open connections."""
+        self._baseline = self.totals()
+
+    def stats(self) -> dict:
+        """Gets a summary of the connections used since the last reset, for logging.
+
+        Returns:
+            dict: The number of requests sent, connections opened and connections reused.
+        """
+        connections, requests_sent = (
+            total - baseline for total, baseline in zip(self.totals(), self._baseline, strict=True)
+        )
+        return {
+            "no_github_http_requests": requests_sent,
+            "no_github_connections_opened": connections,
+            "no_github_connections_reused": max(requests_sent - connections, 0),
+        }
+
+
+def mount_adapter(gh: Any, adapter: BaseAdapter) -> bool:
+    """Sends a github_interface's HTTPS requests through an adapter.
+
+    Args:
+        gh (Any): The github_interface.
+        adapter (BaseAdapter): The adapter.
+
+    Returns:
+        bool: True if the adapter was mounted, False if the github_interface has no session.
+    """
+    session = getattr(gh, "session", None)
+    if session is None:
+        logger.warning("github_interface has no session to mount the connection pool on")
+        return False
+    session.mount("https://", adapter)
+    return True
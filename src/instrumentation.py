@@ -0,0 +1,330 @@
+"""Timings and counters of a run, for finding where its time goes.
+
+Each invocation records how long every phase, every function in `src.main`, every GitHub API
+request and every JSON encode and decode took. Requests are grouped by endpoint, with the team
+names replaced, so each endpoint gets one latency histogram. The number of requests made and
+the bytes downloaded from GitHub are counted alongside.
+
+At the end of the run the histograms are summarised as a count, p50, p95 and max, and emitted
+as a structured log or in CloudWatch Embedded Metric Format (EMF), which CloudWatch turns into
+metrics without any API calls.
+
+With `INSTRUMENTATION=off`, functions are not wrapped and GitHub requests are not intercepted,
+so the instrumentation costs nothing.
+"""
+
+from __future__ import annotations
+
+import functools
+import inspect
+import json
+import logging
+import math
+import os
+import threading
+import time
+from collections.abc import Callable
+from typing import TYPE_CHECKING, Any, Optional
+
+from src.rate_limit import get_response
+from src.resilience import get_endpoint
+
+if TYPE_CHECKING:
+    import github_api_toolkit
+    from requests import Response
+
+logger = logging.getLogger()
+
+# "logs" adds the summary to a structured log, "emf" also prints it in Embedded Metric Format
+# and "off" disables the instrumentation. It is read once, when the modules are imported
+INSTRUMENTATION = os.getenv("INSTRUMENTATION", "logs").lower()
+ENABLED = INSTRUMENTATION != "off"
+
+# CloudWatch namespace of the metrics emitted in Embedded Metric Format
+EMF_NAMESPACE = os.getenv("INSTRUMENTATION_NAMESPACE", "CopilotUsageLambda")
+
+# The Recorder of the run in progress, under "recorder"
+_current: dict[str, Recorder] = {}
+
+
+def percentile(values: list[float], fraction: float) -> float:
+    """Gets a percentile of some values, using the nearest rank.
+
+    Args:
+        values (list[float]): The values, which must not be empty.
+        fraction (float): The percentile, from 0 to 1.
+
+    Returns:
+        float: The smallest value that at least `fraction` of the values are less than or
+            equal to.
+    """
+    ordered = sorted(values)
+    rank = max(1, math.ceil(len(ordered) * fraction))
+    return ordered[rank - 1]
+
+
+class Recorder:
+    """Collects the timings and counters of one run. Recording is thread safe."""
+
+    def __init__(self) -> None:
+        """Creates an empty Recorder."""
+        self.timings: dict[str, list[float]] = {}
+        self.counters: dict[str, int] = {}
+        self._lock = threading.Lock()
+
+    def observe(self, name: str, seconds: float) -> None:
+        """Records a timing.
+
+        Args:
+            name (str): The name of the histogram, such as `github:/orgs/{org}/teams`.
+            seconds (float): The time taken.
+        """
+        with self._lock:
+            self.timings.setdefault(name, []).append(seconds)
+
+    def add(self, name: str, amount: int = 1) -> None:
+        """Adds to a counter.
+
+        Args:
+            name (str): The name of the counter.
+            amount (int): The amount to add.
+        """
+        with self._lock:
+            self.counters[name] = self.counters.get(name, 0) + amount
+
+    def request(self, url: str, seconds: float, result: Any) -> None:
+        """Records a GitHub API request, with its endpoint's timing and the bytes downloaded.
+
+        Args:
+            url (str): The API endpoint requested.
+            seconds (float): The time the request took.
+            result (Any): The response or error returned by the request.
+        """
+        self.observe(f"github:{get_endpoint(url)}", seconds)
+        self.add("github_requests")
+
+        response = get_response(result)
+        if response is not None:
+            self.add("github_downloaded_bytes", len(response.content or b""))
+
+    def summary(self) -> dict:
+        """Summarises the histograms and counters.
+
+        Returns:
+            dict: The count, p50, p95 and max in milliseconds of each histogram, keyed by name,
+                and the counters.
+        """
+        with self._lock:
+            timings = {name: list(values) for name, values in self.timings.items()}
+            counters = dict(self.counters)
+
+        return {
+            "timings_ms": {
+                name: {
+                    "count": len(values),
+                    "p50": round(percentile(values, 0.5) * 1000, 1),
+                    "p95": round(percentile(values, 0.95) * 1000, 1),
+                    "max": round(max(values) * 1000, 1),
+                }
+                for name, values in sorted(timings.items())
+            },
+            "counters": counters,
+        }
+
+    def to_emf(self, summary: dict) -> dict:
+        """Formats a summary in CloudWatch Embedded Metric Format.
+
+        Each histogram becomes the metrics `<name>.p50`, `<name>.p95` and `<name>.max`, in
+        milliseconds, and each counter a metric of the same name.
+
+        Args:
+            summary (dict): The summary, as returned by `summary`.
+
+        Returns:
+            dict: The EMF document, to be printed as one line of JSON.
+        """
+        metrics = {}
+        units = {}
+        for name, stats in summary["timings_ms"].items():
+            for stat in ("p50", "p95", "max"):
+                metrics[f"{name}.{stat}"] = stats[stat]
+                units[f"{name}.{stat}"] = "Milliseconds"
+        for name, value in summary["counters"].items():
+            metrics[name] = value
+            units[name] = "Bytes" if name.endswith("bytes") else "Count"
+
+        return {
+            "_aws": {
+                "Timestamp": int(time.time() * 1000),
+                "CloudWatchMetrics": [
+                    {
+                        "Namespace": EMF_NAMESPACE,
+                        "Dimensions": [[]],
+                        "Metrics": [{"Name": name, "Unit": units[name]} for name in metrics],
+                    }
+                ],
+            },
+            **metrics,
+        }
+
+
+def start() -> Optional[Recorder]:
+    """Starts recording a new run, discarding anything recorded by the last one.
+
+    Returns:
+        Optional[Recorder]: The run's Recorder, or None if instrumentation is off.
+    """
+    _current.pop("recorder", None)
+    if ENABLED:
+        _current["recorder"] = Recorder()
+    return _current.get("recorder")
+
+
+def observe(name: str, seconds: float) -> None:
+    """Records a timing in the current run, if one is being recorded.
+
+    Args:
+        name (str): The name of the histogram.
+        seconds (float): The time taken.
+    """
+    recorder = _current.get("recorder")
+    if recorder is not None:
+        recorder.observe(name, seconds)
+
+
+def observe_request(url: str, seconds: float, result: Any) -> None:
+    """Records a GitHub API request in the current run, if one is being recorded.
+
+    Used for requests sent around the github_interface, such as conditional requests.
+
+    Args:
+        url (str): The API endpoint requested.
+        seconds (float): The time the request took.
+        result (Any): The response or error returned by the request.
+    """
+    recorder = _current.get("recorder")
+    if recorder is not None:
+        recorder.request(url, seconds, result)
+
+
+def emit() -> dict:
+    """Emits the summary of the current run, as a log and optionally in EMF.
+
+    Returns:
+        dict: The summary, or an empty dict if nothing is being recorded.
+    """
+    recorder = _current.get("recorder")
+    if recorder is None:
+        return {}
+
+    summary = recorder.summary()
+    logger.info("Instrumentation summary", extra={"instrumentation": summary})
+    if INSTRUMENTATION == "emf":
+        # Lambda sends standard output to CloudWatch Logs, which extracts the metrics from it
+        print(json.dumps(recorder.to_emf(summary)), flush=True)
+    return summary
+
+
+def traced(func: Optional[Callable] = None, name: Optional[str] = None) -> Callable:
+    """Times each call of a function. Used as `@traced` or `@traced(name="...")`.
+
+    With instrumentation off, the function is returned unwrapped.
+
+    Args:
+        func (Optional[Callable]): The function.
+        name (Optional[str]): The name of the histogram. Defaults to `function:<name>`.
+
+    Returns:
+        Callable: The timed function.
+    """
+    if func is None:
+        return functools.partial(traced, name=name)
+    if not ENABLED:
+        return func
+
+    histogram = name or f"function:{func.__name__}"
+
+    @functools.wraps(func)
+    def wrapper(*args: Any, **kwargs: Any) -> Any:
+        started_at = time.perf_counter()
+        try:
+            return func(*args, **kwargs)
+        finally:
+            observe(histogram, time.perf_counter() - started_at)
+
+    return wrapper
+
+
+def trace_functions(namespace: dict, module_name: str) -> None:
+    """Times every function defined in a module, by replacing them in its namespace.
+
+    Calls between the module's functions look them up in the namespace, so they are timed too.
+
+    Args:
+        namespace (dict): The module's globals.
+        module_name (str): The module's name, so imported functions are left alone.
+    """
+    if not ENABLED:
+        return
+    for name, value in list(namespace.items()):
+        if inspect.isfunction(value) and value.__module__ == module_name:
+            namespace[name] = traced(value)
+
+
+class InstrumentedInterface:
+    """Times the requests sent through a github_interface, and counts the bytes downloaded.
+
+    The interface is a drop-in replacement for github_interface: any attribute other than `get`
+    is passed through to the wrapped instance.
+    """
+
+    def __init__(self, gh: github_api_toolkit.github_interface, recorder: Recorder) -> None:
+        """Creates an InstrumentedInterface.
+
+        Args:
+            gh (github_api_toolkit.github_interface): The github_interface to send requests with.
+            recorder (Recorder): Records the timings and counters.
+        """
+        self.gh = gh
+        self.recorder = recorder
+
+    def __getattr__(self, name: str) -> Any:
+        """Passes any other attribute through to the wrapped github_interface."""
+        if name == "gh":
+            raise AttributeError(name)
+        return getattr(self.gh, name)
+
+    def get(self, url: str, *args: Any, **kwargs: Any) -> Response | Exception:
+        """Sends a GET request, recording how long it took and the size of its body.
+
+        Args:
+            url (str): The API endpoint to request.
+            *args (Any): Passed through to github_interface.get.
+            **kwargs (Any): Passed through to github_interface.get.
+
+        Returns:
+            Response | Exception: The value returned by github_interface.get.
+        """
+        started_at = time.perf_counter()
+        result: Any = None
+        try:
+            result = self.gh.get(url, *args, **kwargs)
+        finally:
+            self.recorder.request(url, time.perf_counter() - started_at, result)
+        response: Response | Exception = result
+        return response
+
+
+def instrument(gh: github_api_toolkit.github_interface) -> Any:
+    """Wraps a github_interface in an InstrumentedInterface, if the current run is recorded.
+
+    Args:
+        gh (github_api_toolkit.github_interface): The github_interface.
+
+    Returns:
+        Any: The InstrumentedInterface, or `gh` itself if nothing is being recorded.
+    """
+    recorder = _current.get("recorder")
+    if recorder is None:
+        return gh
+    return InstrumentedInterface(gh, recorder)
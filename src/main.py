@@ -5,16 +5,72 @@ gathering, storing, and updating GitHub Copilot usage metrics and team history
 for an organization. Data is retrieved from the GitHub API and stored in S3.
 """
 
-import json
+from __future__ import annotations
+
+import importlib
 import logging
 import os
-from typing import Optional
+from collections.abc import Iterator
+from concurrent.futures import ThreadPoolExecutor
+from datetime import UTC, datetime
+from typing import TYPE_CHECKING, Any, Optional
+from urllib.parse import parse_qs, urlparse
 
-import boto3
-import github_api_toolkit
 from botocore.exceptions import ClientError
 from requests import Response
 
+from src.cassette import SCRUBBED, SCRUBBED_TOKEN, Cassette, open_cassette
+from src.checkpoint import CHECKPOINT_OBJECT, TimeBudget, load_checkpoint, save_checkpoint
+from src.conditional_requests import ConditionalRequestCache, forget_validators, is_not_modified
+from src.date_index import DateIndex, filter_team_history
+from src.historic_usage import (
+    HISTORIC_USAGE_MANIFEST,
+    OBJECT_NAME,
+    update_partitioned_historic_usage,
+)
+from src.instrumentation import emit, instrument, start, trace_functions
+from src.negative_cache import (
+    NEGATIVE_CACHE_OBJECT,
+    NEGATIVE_CACHE_TTL_DAYS,
+    is_without_copilot_data,
+    mark_without_copilot_data,
+    remove_expired,
+)
+from src.phases import PhaseGraph
+from src.rate_limit import RateLimitScheduler
+from src.records import get_object_pairs_hook
+from src.resilience import CircuitBreaker, RetryingInterface, RunAbortedError, is_retryable
+from src.s3_objects import (
+    BUCKET_NAME,
+    PrefetchingS3Client,
+    ResilientS3Client,
+    get_s3_object,
+    get_s3_objects,
+    is_not_found,
+    update_s3_object,
+)
+from src.serialisation import decode_s3_response
+from src.team_history import (
+    TEAMS_HISTORY_INDEX,
+    TEAMS_HISTORY_MANIFEST,
+    TEAMS_HISTORY_OBJECT,
+    get_team_watermark,
+    stream_team_history,
+    write_team_shards,
+)
+from src.warm_start import (
+    TokenRefreshingInterface,
+    get_client,
+    get_github_adapter,
+    get_installation_token,
+    get_secret,
+    is_warm,
+)
+
+if TYPE_CHECKING:
+    import boto3
+    import github_api_toolkit
+
 # GitHub Organisation
 org = os.getenv("GITHUB_ORG")
 
@@ -25,11 +81,35 @@ client_id = os.getenv("GITHUB_APP_CLIENT_ID")
 secret_name = os.getenv("AWS_SECRET_NAME")
 secret_region = os.getenv("AWS_DEFAULT_REGION")
 
-account = os.getenv("AWS_ACCOUNT_NAME")
+# Layout of the historic usage data in S3
+# "single" keeps every day in OBJECT_NAME, "monthly" keeps one object per month plus a manifest
+HISTORIC_USAGE_LAYOUT = os.getenv("HISTORIC_USAGE_LAYOUT", "single")
+
+# Layout of the team history in S3
+# "single" keeps every team in teams_history.json, "sharded" keeps one object per team plus an index
+TEAMS_HISTORY_LAYOUT = os.getenv("TEAMS_HISTORY_LAYOUT", "single")
+
+# Maximum number of GitHub API requests to have in flight at once when probing teams
+MAX_WORKERS = int(os.getenv("GITHUB_MAX_WORKERS", "10"))
+
+# Connections kept open to the GitHub API, which requests wait for rather than opening more
+# It should be at least GITHUB_MAX_WORKERS, so every request in flight can reuse a connection
+GITHUB_POOL_SIZE = int(os.getenv("GITHUB_POOL_SIZE", str(MAX_WORKERS)))
+
+# Timeouts of GitHub API requests, in seconds
+GITHUB_CONNECT_TIMEOUT = float(os.getenv("GITHUB_CONNECT_TIMEOUT", "5"))
+GITHUB_READ_TIMEOUT = float(os.getenv("GITHUB_READ_TIMEOUT", "30"))
 
-# AWS Bucket Path
-BUCKET_NAME = f"{account}-copilot-usage-dashboard"
-OBJECT_NAME = "historic_usage_data.json"
+# Concurrency is scaled down while fewer than this many GitHub API requests remain
+RATE_LIMIT_LOW_REMAINING = int(os.getenv("GITHUB_RATE_LIMIT_LOW_REMAINING", "100"))
+
+# Send If-None-Match/If-Modified-Since on the Copilot metrics endpoints, using the validators
+# stored in S3 by the previous run
+CONDITIONAL_REQUESTS = os.getenv("GITHUB_CONDITIONAL_REQUESTS", "true").lower() == "true"
+ETAG_CACHE_OBJECT = "github_etag_cache.json"
+
+# Maximum number of the handler's phases to run at once. Set to 1 to run them one at a time
+MAX_CONCURRENT_PHASES = int(os.getenv("MAX_CONCURRENT_PHASES", "4"))
 
 logger = logging.getLogger()
 
@@ -55,59 +135,193 @@ logger = logging.getLogger()
 # }
 
 
-def get_copilot_team_date(gh: github_api_toolkit.github_interface, page: int) -> list:
+def probe_team_metrics(
+    gh: github_api_toolkit.github_interface, teams: list, max_workers: Optional[int] = None
+) -> list:
+    """Requests the Copilot metrics endpoint for each team, with a bounded number in flight.
+
+    Args:
+        gh (github_api_toolkit.github_interface): An instance of the github_interface class.
+        teams (list): A list of GitHub Teams, as returned by the teams endpoint.
+        max_workers (Optional[int]): The maximum number of requests in flight at once.
+            Defaults to `MAX_WORKERS`.
+
+    Returns:
+        list: The response for each team, in the same order as `teams`.
+    """
+    if max_workers is None:
+        max_workers = MAX_WORKERS
+
+    def probe(team: dict) -> Response | Exception:
+        result: Response | Exception = gh.get(f"/orgs/{org}/team/{team['name']}/copilot/metrics")
+        return result
+
+    if max_workers <= 1 or len(teams) <= 1:
+        return [probe(team) for team in teams]
+
+    # executor.map yields results in submission order, keeping the output deterministic
+    with ThreadPoolExecutor(max_workers=min(max_workers, len(teams))) as executor:
+        return list(executor.map(probe, teams))
+
+
+def get_last_page(response: Response) -> int:
+    """Gets the last page number from the `Link` header of a paginated API response.
+
+    Args:
+        response (Response): The response of the first page request.
+
+    Returns:
+        int: The last page number, or 1 if the response is not paginated.
+    """
+    try:
+        last_url = response.links["last"]["url"]
+    except (AttributeError, KeyError):
+        return 1
+
+    page = parse_qs(urlparse(last_url).query).get("page")
+    if not page:
+        return 1
+    return int(page[0])
+
+
+def iter_team_pages(
+    gh: github_api_toolkit.github_interface,
+    first_response: Response,
+    max_workers: Optional[int] = None,
+    first_page: int = 1,
+) -> Iterator[tuple[int, list]]:
+    """Yields each page of the organisation's teams, reusing the response of the first page.
+
+    The remaining pages are requested concurrently as soon as the last page number is known.
+    Pages are yielded in order, each as soon as it (and every page before it) has arrived,
+    so downstream work can start before the whole listing has been downloaded.
+
+    Args:
+        gh (github_api_toolkit.github_interface): An instance of the github_interface class.
+        first_response (Response): The response for the first page of teams.
+        max_workers (Optional[int]): The maximum number of page requests in flight at once.
+            Defaults to `MAX_WORKERS`.
+        first_page (int): The first page to yield, such as where a previous run's discovery
+            stopped. Earlier pages are not requested.
+
+    Yields:
+        tuple[int, list]: The page number and the teams on that page.
+    """
+    if max_workers is None:
+        max_workers = MAX_WORKERS
+
+    last_page = get_last_page(first_response)
+
+    if first_page <= 1:
+        yield 1, first_response.json()
+
+    if last_page <= 1:
+        return
+
+    def fetch(page: int) -> list:
+        teams: list = gh.get(f"/orgs/{org}/teams", params={"per_page": 100, "page": page}).json()
+        return teams
+
+    pages = range(max(2, first_page), last_page + 1)
+    if not pages:
+        return
+
+    with ThreadPoolExecutor(max_workers=max(1, min(max_workers, len(pages)))) as executor:
+        # executor.map submits every page up front and yields them in page order
+        yield from zip(pages, executor.map(fetch, pages), strict=True)
+
+
+def get_copilot_team_date(  # noqa: PLR0913 # pylint: disable=too-many-arguments
+    gh: github_api_toolkit.github_interface,
+    page: int,
+    team_metrics: Optional[dict] = None,
+    teams: Optional[list] = None,
+    negative_cache: Optional[dict] = None,
+    *,
+    previous_teams: Optional[dict] = None,
+) -> list:
     """Gets a list of GitHub Teams with Copilot Data for a given API page.
 
+    The Copilot metrics endpoint is probed for each team on the page concurrently, bounded by
+    `MAX_WORKERS`. Teams are returned in the same order as the API lists them.
+
     Args:
         gh (github_api_toolkit.github_interface): An instance of the github_interface class.
         page (int): The page number of the API request.
+        team_metrics (Optional[dict]): If given, the metrics payload of each team with Copilot
+            Data is stored here, keyed by team name, so it can be reused by `create_dictionary`.
+            Teams whose metrics are unchanged since the last run are stored as None.
+        teams (Optional[list]): The teams on the page, if already fetched. When None, the page
+            is requested from the API.
+        negative_cache (Optional[dict]): If given, teams recently found without Copilot Data
+            are not probed, and the result for each probed team is recorded here.
+        previous_teams (Optional[dict]): If given, the teams with Copilot Data found by the last
+            run, keyed by team name. A team whose metrics could not be fetched keeps its entry.
 
     Returns:
         list: A list of GitHub Teams with Copilot Data.
     """
     copilot_teams = []
 
-    response = gh.get(f"/orgs/{org}/teams", params={"per_page": 100, "page": page})
-    teams = response.json()
-    for team in teams:
-        usage_data = gh.get(f"/orgs/{org}/team/{team['name']}/copilot/metrics")
+    if teams is None:
+        teams = gh.get(f"/orgs/{org}/teams", params={"per_page": 100, "page": page}).json()
+
+    now = datetime.now(UTC)
+    teams = [
+        team for team in teams if not is_without_copilot_data(negative_cache, team["name"], now)
+    ]
+
+    for team, usage_data in zip(teams, probe_team_metrics(gh, teams), strict=True):
+        if is_retryable(usage_data) or not isinstance(usage_data, Response):
+            # The request failed, or was refused even after a token refresh or the rate limit
+            # retries, so whether the team has data is unknown. It is probed again on the next
+            # run rather than recorded as without data, and keeps its entry from the last run
+            logger.warning("Skipping team %s as its metrics could not be fetched", team["name"])
+            previous = (previous_teams or {}).get(team["name"])
+            copilot_teams += [previous] if previous else []
+            continue
 
-        if not isinstance(usage_data, Response):
+        # If the metrics are unchanged since the last run, the team has data if it had then
+        # This skips decoding the payload, which was already merged into the team history
+        if is_not_modified(usage_data):
+            has_data = gh.has_data(f"/orgs/{org}/team/{team['name']}/copilot/metrics")
+            team_usage = None
+        # If the response has data, append the team to the list
+        # If there is no data, .json() will return an empty list
+        else:
+            team_usage = usage_data.json(object_pairs_hook=get_object_pairs_hook())
+            has_data = bool(team_usage)
 
-            # If the response is not a Response object, no copilot data is available for this team
-            # We can then skip this team
+        if not has_data:
+            # GitHub answers with no metrics for a team with fewer than five licensed members
+            if negative_cache is not None:
+                mark_without_copilot_data(negative_cache, team["name"], now)
+            continue
 
-            # We don't log this as an error, as it is expected and it'd be too noisy within logs
+        entry = {
+            "name": team.get("name", ""),
+            "slug": team.get("slug", ""),
+            "description": team.get("description", ""),
+            "url": team.get("html_url", ""),
+        }
+
+        logger.info(
+            "Team %s has Copilot data",
+            extra={
+                "team_name": entry["name"],
+                "team_slug": entry["slug"],
+                "team_description": entry["description"],
+                "team_html_url": entry["url"],
+            },
+        )
 
-            continue
+        copilot_teams.append(entry)
 
-        # If the response has data, append the team to the list
-        # If there is no data, .json() will return an empty list
-        if usage_data.json():
-
-            team_name = team.get("name", "")
-            team_slug = team.get("slug", "")
-            team_description = team.get("description", "")
-            team_html_url = team.get("html_url", "")
-
-            logger.info(
-                "Team %s has Copilot data",
-                extra={
-                    "team_name": team_name,
-                    "team_slug": team_slug,
-                    "team_description": team_description,
-                    "team_html_url": team_html_url,
-                },
-            )
+        if team_metrics is not None:
+            team_metrics[entry["name"]] = team_usage
 
-            copilot_teams.append(
-                {
-                    "name": team_name,
-                    "slug": team_slug,
-                    "description": team_description,
-                    "url": team_html_url,
-                }
-            )
+        if negative_cache is not None:
+            negative_cache.pop(team["name"], None)
 
     return copilot_teams
 
@@ -122,29 +336,44 @@ def get_and_update_historic_usage(
         gh (github_api_toolkit.github_interface): An instance of the github_interface class.
 
     Returns:
-        tuple: A tuple containing the updated historic usage data and a list of dates added.
+        tuple: A tuple containing the updated historic usage data, a list of dates added,
+            whether the historic usage data was written to S3 and the number of days stored.
+            With the monthly layout, the data only covers the months touched by this run.
     """
     # Get the usage data
     usage_data = gh.get(f"/orgs/{org}/copilot/metrics")
-    usage_data = usage_data.json()
 
-    logger.info("Usage data retrieved")
+    if is_not_modified(usage_data):
+        # Every day in the response was added by a previous run
+        logger.info("Usage data unchanged since the last run")
+        usage_data = []
+    else:
+        usage_data = usage_data.json()
+
+        logger.info("Usage data retrieved")
+
+    if HISTORIC_USAGE_LAYOUT == "monthly":
+        return update_partitioned_historic_usage(s3, usage_data)
 
     try:
         response = s3.get_object(Bucket=BUCKET_NAME, Key=OBJECT_NAME)
-        historic_usage = json.loads(response["Body"].read().decode("utf-8"))
+        historic_usage = decode_s3_response(response)
     except ClientError as e:
+        if not is_not_found(e):
+            # Starting from an empty list would overwrite the stored history
+            raise RunAbortedError(f"Could not read {OBJECT_NAME}: {e}") from e
+
         logger.error("Error getting %s: %s. Using empty list.", OBJECT_NAME, e)
 
         historic_usage = []
 
     dates_added = []
 
-    # Append the new usage data to the historic_usage_data.json
+    # Upsert the new usage data into the historic_usage_data.json
+    # The index makes each date lookup constant time, however long the history grows
+    historic_index = DateIndex(historic_usage)
     for date in usage_data:
-        if not any(d["date"] == date["date"] for d in historic_usage):
-            historic_usage.append(date)
-
+        if historic_index.upsert(date):
             dates_added.append(date["date"])
 
     logger.info(
@@ -154,50 +383,150 @@ def get_and_update_historic_usage(
     )
 
     # Write the updated historic_usage to historic_usage_data.json
-    update_s3_object(s3, BUCKET_NAME, OBJECT_NAME, historic_usage)
+    written = update_s3_object(s3, BUCKET_NAME, OBJECT_NAME, historic_usage)
 
-    return historic_usage, dates_added
+    return historic_usage, dates_added, written, len(historic_usage)
 
 
-def get_and_update_copilot_teams(s3: boto3.client, gh: github_api_toolkit.github_interface) -> list:
+def get_and_update_copilot_teams(
+    s3: boto3.client,
+    gh: github_api_toolkit.github_interface,
+    team_metrics: Optional[dict] = None,
+    budget: Optional[TimeBudget] = None,
+) -> list:
     """Get and update GitHub Teams with Copilot Data.
 
     Args:
         s3 (boto3.client): An S3 client.
         gh (github_api_toolkit.github_interface): An instance of the github_interface class.
+        team_metrics (Optional[dict]): If given, filled with the metrics payload of each team
+            with Copilot Data, keyed by team name.
+        budget (Optional[TimeBudget]): If given, discovery carries on from where the previous
+            run's discovery stopped, and stops once the budget is used up. The list of teams is then
+            left unchanged in S3, and where discovery stopped is kept for the checkpoint.
 
     Returns:
-        list: A list of GitHub Teams with Copilot Data.
+        list: A list of GitHub Teams with Copilot Data, which is incomplete if discovery stopped.
     """
     logger.info("Getting GitHub Teams with Copilot Data")
 
-    copilot_teams = []
+    # Discovery carries on from the page the previous run stopped on, with the teams it found
+    cursor = (budget.resume_discovery if budget is not None else None) or {"page": 1}
+    copilot_teams = list(cursor.get("copilot_teams", []))
+    probed = set(cursor.get("probed", []))
 
-    response = gh.get(f"/orgs/{org}/teams", params={"per_page": 100})
+    # Teams whose metrics cannot be fetched keep their entry from the last run
+    previous_teams = {
+        team.get("name"): team
+        for team in get_s3_object(s3, BUCKET_NAME, "copilot_teams.json", [])
+        if isinstance(team, dict)
+    }
 
-    # Get the last page of teams
-    try:
-        last_page = int(response.links["last"]["url"].split("=")[-1])
-    except KeyError:
-        last_page = 1
+    # Teams recently found without Copilot data are skipped until their entry expires
+    negative_cache = None
+    if NEGATIVE_CACHE_TTL_DAYS > 0:
+        negative_cache = get_s3_object(s3, BUCKET_NAME, NEGATIVE_CACHE_OBJECT, {})
+        if not isinstance(negative_cache, dict):
+            negative_cache = {}
+
+    response = gh.get(f"/orgs/{org}/teams", params={"per_page": 100})
 
-    for page in range(1, last_page + 1):
-        page_teams = get_copilot_team_date(gh, page)
+    # The first page is reused, and the remaining pages are fetched concurrently
+    for page, teams in iter_team_pages(gh, response, first_page=cursor["page"]):
+        unprobed = [team for team in teams if team["name"] not in probed]
+
+        # With a budget, the page is probed a batch at a time until the budget is used up
+        while unprobed and not (budget is not None and budget.is_spent()):
+            batch_size = len(unprobed) if budget is None else max(1, MAX_WORKERS)
+            batch, unprobed = unprobed[:batch_size], unprobed[batch_size:]
+
+            copilot_teams = copilot_teams + get_copilot_team_date(
+                gh,
+                page,
+                team_metrics=team_metrics,
+                teams=batch,
+                negative_cache=negative_cache,
+                previous_teams=previous_teams,
+            )
 
-        copilot_teams = copilot_teams + page_teams
+        if budget is not None and unprobed:
+            budget.defer_discovery(
+                page, [team["name"] for team in teams if team not in unprobed], copilot_teams
+            )
+            break
 
     logger.info(
         "Fetched GitHub Teams with Copilot Data",
         extra={"no_teams": len(copilot_teams)},
     )
 
-    update_s3_object(s3, BUCKET_NAME, "copilot_teams.json", copilot_teams)
+    if budget is not None and budget.discovery is not None:
+        # The teams found so far would drop the rest from the dashboard, so the list is kept
+        logger.info("Team discovery incomplete, so copilot_teams.json is left unchanged")
+    else:
+        update_s3_object(s3, BUCKET_NAME, "copilot_teams.json", copilot_teams)
+
+    if negative_cache is not None:
+        negative_cache = remove_expired(negative_cache, datetime.now(UTC))
+
+        logger.info(
+            "Teams without Copilot Data cached",
+            extra={"no_teams_without_copilot": len(negative_cache)},
+        )
+
+        update_s3_object(s3, BUCKET_NAME, NEGATIVE_CACHE_OBJECT, negative_cache)
 
     return copilot_teams
 
 
+def get_new_team_history(
+    gh: github_api_toolkit.github_interface,
+    team_name: str,
+    last_known_date: Optional[str],
+    team_metrics: Optional[dict] = None,
+    budget: Optional[TimeBudget] = None,
+) -> Optional[list[dict]]:
+    """Gets a team's metrics from its last known date, reusing the discovery payload if possible.
+
+    Args:
+        gh (github_api_toolkit.github_interface): An instance of the github_interface class.
+        team_name (str): Team name.
+        last_known_date (Optional[str]): The most recent date in the team's stored history.
+        team_metrics (Optional[dict]): Metrics payloads already downloaded during team
+            discovery, keyed by team name.
+        budget (Optional[TimeBudget]): If given, the team is deferred rather than requested
+            once the time budget is used up.
+
+    Returns:
+        Optional[list[dict]]: The team's metrics on or after `last_known_date`, or None if an
+            error occurs or the team was deferred.
+    """
+    # Assign the last known date to the `since` query parameter
+    query_params = {}
+    if last_known_date:
+        query_params["since"] = last_known_date
+
+    if team_metrics is not None and team_metrics.get(team_name) is not None:
+        return filter_team_history(team_metrics[team_name], last_known_date)
+
+    if team_metrics is not None and team_name in team_metrics and last_known_date:
+        # Unchanged since the last run, so there is nothing new to add
+        return []
+
+    if budget is not None and budget.is_spent():
+        budget.defer(team_name)
+        forget_validators(gh, f"/orgs/{org}/team/{team_name}/copilot/metrics")
+        return None
+
+    return get_team_history(gh, team_name, query_params)
+
+
 def create_dictionary(
-    gh: github_api_toolkit.github_interface, copilot_teams: list, existing_team_history: list
+    gh: github_api_toolkit.github_interface,
+    copilot_teams: list,
+    existing_team_history: list,
+    team_metrics: Optional[dict] = None,
+    budget: Optional[TimeBudget] = None,
 ) -> list:
     """Create a dictionary for quick lookup of existing team data using the `name` field.
 
@@ -205,6 +534,11 @@ def create_dictionary(
         gh (github_api_toolkit.github_interface): An instance of the github_interface class.
         copilot_teams (list): List of teams with Copilot data.
         existing_team_history (list): List of existing team history data.
+        team_metrics (Optional[dict]): Metrics payloads already downloaded during team
+            discovery, keyed by team name. Teams found here are not requested again. A payload
+            of None means the team's metrics are unchanged since the last run.
+        budget (Optional[TimeBudget]): If given, teams that need a request once the time budget
+            is used up are deferred, and keep their existing history.
 
     Returns:
         list: A list of dictionaries containing team data and their history.
@@ -213,6 +547,10 @@ def create_dictionary(
         single_team["team"]["name"]: single_team for single_team in existing_team_history
     }
 
+    # Each team's history is indexed by date the first time it is needed
+    # The index keeps the team's most recent date, so it is never rescanned
+    date_indexes: dict[str, DateIndex] = {}
+
     # Iterate through identified teams
     for team in copilot_teams:
         team_name = team.get("name", "")
@@ -223,60 +561,215 @@ def create_dictionary(
         # Determine the last known date for the team
         last_known_date = None
         if team_name in existing_team_data_map:
-            existing_dates = [entry["date"] for entry in existing_team_data_map[team_name]["data"]]
-            if existing_dates:
-                last_known_date = max(existing_dates)  # Get the most recent date
+            if team_name not in date_indexes:
+                date_indexes[team_name] = DateIndex(existing_team_data_map[team_name]["data"])
+            last_known_date = date_indexes[team_name].latest
 
-        # Assign the last known date to the `since` query parameter
-        query_params = {}
-        if last_known_date:
-            query_params["since"] = last_known_date
-
-        single_team_history = get_team_history(gh, team_name, query_params)
+        single_team_history = get_new_team_history(
+            gh, team_name, last_known_date, team_metrics, budget
+        )
         if not single_team_history:
             logger.info("No new history found for team %s", team_name)
             continue
 
-        # Append new data to the existing team history
-        new_team_data = single_team_history
-        if team_name in existing_team_data_map:
-            existing_team_data_map[team_name]["data"].extend(new_team_data)
+        # Upsert new data into the existing team history
+        # The `since` date is inclusive, so the last known day is returned again and replaced
+        if team_name in date_indexes:
+            for day in single_team_history:
+                date_indexes[team_name].upsert(day)
         else:
-            existing_team_data_map[team_name] = {"team": team, "data": new_team_data}
+            existing_team_data_map[team_name] = {"team": team, "data": single_team_history}
 
     return list(existing_team_data_map.values())
 
 
-def update_s3_object(
-    s3_client: boto3.client, bucket_name: str, object_name: str, data: dict
+def plan_team_history(
+    gh: github_api_toolkit.github_interface,
+    copilot_teams: list,
+    watermarks: dict,
+    team_metrics: Optional[dict] = None,
+    budget: Optional[TimeBudget] = None,
+) -> dict:
+    """Gets the new days of each team from its latest stored date, without reading its history.
+
+    Args:
+        gh (github_api_toolkit.github_interface): An instance of the github_interface class.
+        copilot_teams (list): List of teams with Copilot data.
+        watermarks (dict): Each team's watermark, keyed by team name, with its `latest` date.
+        team_metrics (Optional[dict]): Metrics payloads already downloaded during team
+            discovery, keyed by team name.
+        budget (Optional[TimeBudget]): If given, teams are planned from the most out of date,
+            and teams that need a request once the time budget is used up are deferred.
+
+    Returns:
+        dict: The metrics on or after each team's latest date, keyed by team name. Only teams
+            with metrics to merge are included.
+    """
+    new_history = {}
+
+    if budget is not None:
+        copilot_teams = budget.order(copilot_teams, watermarks)
+
+    for team in copilot_teams:
+        team_name = team.get("name", "")
+        if not team_name:
+            continue
+
+        last_known_date = watermarks.get(team_name, {}).get("latest")
+        team_history = get_new_team_history(gh, team_name, last_known_date, team_metrics, budget)
+        if team_history:
+            new_history[team_name] = team_history
+
+    return new_history
+
+
+def update_team_history(
+    s3: boto3.client,
+    gh: github_api_toolkit.github_interface,
+    copilot_teams: list,
+    team_metrics: Optional[dict] = None,
+    budget: Optional[TimeBudget] = None,
 ) -> bool:
-    """Update an S3 object with new data.
+    """Updates the team history stored in `teams_history.json`, planned from its manifest.
+
+    Each team's requests are planned from its latest date in the manifest, so
+    `teams_history.json` is only read and written when a team has new days, and is then merged
+    one team at a time as it is read. Without a manifest, the whole history is read to plan the
+    requests, and the manifest is built from it.
 
     Args:
-        s3_client (boto3.client): The S3 client.
-        bucket_name (str): The name of the S3 bucket.
-        object_name (str): The name of the S3 object.
-        data (dict): The data to be written to the S3 object.
+        s3 (boto3.client): An S3 client.
+        gh (github_api_toolkit.github_interface): An instance of the github_interface class.
+        copilot_teams (list): List of teams with Copilot data.
+        team_metrics (Optional[dict]): Metrics payloads already downloaded during team
+            discovery, keyed by team name.
+        budget (Optional[TimeBudget]): If given, teams that need a request once the time budget
+            is used up are deferred, and keep their stored history.
 
     Returns:
-        bool: True if the update was successful, False otherwise.
+        bool: True if the team history and manifest are up to date in S3.
     """
+    manifest = get_s3_object(s3, BUCKET_NAME, TEAMS_HISTORY_MANIFEST)
+
+    if isinstance(manifest, dict):
+        team_metrics = plan_team_history(gh, copilot_teams, manifest, team_metrics, budget)
+        if not team_metrics:
+            logger.info("No new team history, so %s is unchanged", TEAMS_HISTORY_OBJECT)
+            return True
+        copilot_teams = [team for team in copilot_teams if team.get("name") in team_metrics]
+        return stream_team_history(s3, copilot_teams, team_metrics, manifest)
+
+    # Retrieve existing team history from S3
     try:
-        s3_client.put_object(
-            Bucket=bucket_name,
-            Key=object_name,
-            Body=json.dumps(data, indent=4).encode("utf-8"),
-        )
-        logger.info("Successfully updated %s in bucket %s", object_name, bucket_name)
-        return True
+        response = s3.get_object(Bucket=BUCKET_NAME, Key=TEAMS_HISTORY_OBJECT)
+        existing_team_history = decode_s3_response(response, get_object_pairs_hook())
     except ClientError as e:
-        logger.error("Failed to update %s in bucket %s: %s", object_name, bucket_name, e)
+        if manifest or not is_not_found(e):
+            # Writing only the new days would overwrite the stored history
+            logger.error("Error retrieving existing team history: %s", e)
+            return False
+        logger.warning("Error retrieving existing team history: %s", e)
+        existing_team_history = []
+
+    logger.info("Existing team history has %d entries", len(existing_team_history))
+
+    # Convert to dictionary for quick lookup
+    updated_team_history = create_dictionary(
+        gh, copilot_teams, existing_team_history, team_metrics, budget
+    )
+
+    # Write updated team history to S3
+    if not update_s3_object(s3, BUCKET_NAME, TEAMS_HISTORY_OBJECT, updated_team_history):
         return False
 
+    # The manifest is written last, so it never describes history that was not stored
+    manifest = {entry["team"]["name"]: get_team_watermark(entry) for entry in updated_team_history}
+    return update_s3_object(s3, BUCKET_NAME, TEAMS_HISTORY_MANIFEST, manifest)
+
+
+def update_sharded_team_history(  # pylint: disable=too-many-locals
+    s3: boto3.client,
+    gh: github_api_toolkit.github_interface,
+    copilot_teams: list,
+    team_metrics: Optional[dict] = None,
+    budget: Optional[TimeBudget] = None,
+) -> bool:
+    """Updates the team history stored as one object per team, writing only changed teams.
+
+    The index maps each team name to its shard, the number of days stored, its latest date and
+    a hash of its content. Each team's requests are planned from its latest date in the index,
+    so only the shards of teams with new days are read, and a shard is only written when its
+    hash changes. On the first run, `teams_history.json` is split into
+    shards.
+
+    Args:
+        s3 (boto3.client): An S3 client.
+        gh (github_api_toolkit.github_interface): An instance of the github_interface class.
+        copilot_teams (list): List of teams with Copilot data.
+        team_metrics (Optional[dict]): Metrics payloads already downloaded during team
+            discovery, keyed by team name.
+        budget (Optional[TimeBudget]): If given, teams that need a request once the time budget
+            is used up are deferred, and keep their stored history.
+
+    Returns:
+        bool: True if every changed shard and the index were written successfully.
+    """
+    index = get_s3_object(s3, BUCKET_NAME, TEAMS_HISTORY_INDEX)
+
+    # Teams to write, keyed by name
+    pending: dict = {}
+    if not isinstance(index, dict):
+        # Migrate the single team history object, which writes a shard for every team in it
+        logger.info("Splitting %s into one object per team", TEAMS_HISTORY_OBJECT)
+        index = {}
+        pending = {
+            entry["team"]["name"]: entry
+            for entry in get_s3_object(s3, BUCKET_NAME, TEAMS_HISTORY_OBJECT, [])
+        }
+
+    # Shards are only read for indexed teams with new days, and are read concurrently
+    indexed_teams = [team for team in copilot_teams if team.get("name") in index]
+    new_history = plan_team_history(gh, indexed_teams, index, team_metrics, budget)
+    shards = get_s3_objects(
+        s3, BUCKET_NAME, [index[team_name]["object"] for team_name in new_history]
+    )
+
+    for team in copilot_teams:
+        team_name = team.get("name", "")
+
+        existing = pending.get(team_name)
+        metrics = team_metrics
+        if team_name in index:
+            if team_name not in new_history:
+                continue
+
+            existing = shards[index[team_name]["object"]]
+            if existing is None:
+                # Writing only the new days would overwrite the rest of the team's history
+                logger.error("Skipping team %s as its history could not be read", team_name)
+                forget_validators(gh, f"/orgs/{org}/team/{team_name}/copilot/metrics")
+                continue
+            metrics = new_history
+
+        for entry in create_dictionary(gh, [team], [existing] if existing else [], metrics, budget):
+            pending[entry["team"]["name"]] = entry
+
+    success, no_shards_written = write_team_shards(s3, pending, index)
+
+    logger.info(
+        "Team history shards updated",
+        extra={"no_shards_written": no_shards_written, "no_teams": len(index)},
+    )
+
+    if no_shards_written:
+        success = update_s3_object(s3, BUCKET_NAME, TEAMS_HISTORY_INDEX, index) and success
+
+    return success
+
 
 def get_team_history(
     gh: github_api_toolkit.github_interface, team: str, query_params: Optional[dict] = None
-) -> list[dict]:
+) -> Optional[list[dict]]:
     """Gets the team metrics Copilot data through the API.
     Note - This endpoint will only return results for a given day if the team had
     five or more members with active Copilot licenses on that day,
@@ -288,17 +781,43 @@ def get_team_history(
         query_params (dict): Additional query parameters for the API request.
 
     Returns:
-        list[dict]: A team's GitHub Copilot metrics or None if an error occurs.
+        Optional[list[dict]]: A team's GitHub Copilot metrics or None if an error occurs.
     """
     response = gh.get(f"/orgs/{org}/team/{team}/copilot/metrics", params=query_params)
 
     if not isinstance(response, Response):
         logger.error("Unexpected response type: %s", type(response))
         return None
-    return response.json()
+    if is_not_modified(response):
+        return []
+    metrics: list[dict] = response.json(object_pairs_hook=get_object_pairs_hook())
+    return metrics
+
+
+def get_prefetch_object_names() -> list[str]:
+    """Gets the S3 objects every run reads, for the configured layouts and caches.
+
+    Returns:
+        list[str]: The names of the S3 objects to prefetch.
+    """
+    object_names = [HISTORIC_USAGE_MANIFEST if HISTORIC_USAGE_LAYOUT == "monthly" else OBJECT_NAME]
+
+    if TEAMS_HISTORY_LAYOUT == "sharded":
+        object_names.append(TEAMS_HISTORY_INDEX)
+    else:
+        # The history itself is streamed when it is merged, rather than held in memory
+        object_names.append(TEAMS_HISTORY_MANIFEST)
 
+    if CONDITIONAL_REQUESTS:
+        object_names.append(ETAG_CACHE_OBJECT)
+    if NEGATIVE_CACHE_TTL_DAYS > 0:
+        object_names.append(NEGATIVE_CACHE_OBJECT)
+    object_names += ["copilot_teams.json", CHECKPOINT_OBJECT]
 
-def handler(event: dict, context) -> str:  # pylint: disable=unused-argument
+    return object_names
+
+
+def handler(event: dict, context: Any) -> str:
     """AWS Lambda handler function for GitHub Copilot usage data aggregation.
 
     This function:
@@ -309,77 +828,168 @@ def handler(event: dict, context) -> str:  # pylint: disable=unused-argument
     - Logs progress and errors.
 
     Args:
-        event (dict): AWS Lambda event payload.
+        event (dict): AWS Lambda event payload. A `mode` of "coordinator" or "worker" runs the
+            fan-out mode in `src.fanout` instead.
         context (LambdaContext): AWS Lambda context object.
 
     Returns:
         str: Completion message.
     """
+    # Large organisations can be split across worker invocations, coordinated by one of them
+    if isinstance(event, dict) and event.get("mode") in ("coordinator", "worker"):
+        result: str = importlib.import_module("src.fanout").handler(event, context)
+        return result
+
+    # With CASSETTE_MODE, the run's GitHub and S3 traffic is recorded, or replayed offline.
+    # The cassette is saved however the run ends
+    cassette = open_cassette()
+    try:
+        return run_handler(context, cassette)
+    finally:
+        cassette.save()
+
+
+def run_handler(context: Any, cassette: Cassette) -> str:  # pylint: disable=too-many-locals
+    """Gathers the organisation's usage and the team history, as the handler does.
+
+    Args:
+        context (Any): AWS Lambda context object.
+        cassette (Cassette): The cassette the run's GitHub and S3 traffic is recorded to or
+            replayed from.
+
+    Returns:
+        str: Completion message.
+    """
+    # Each phase, function and GitHub request of the run is timed, unless INSTRUMENTATION is off
+    start()
+
     # Create an S3 client
-    session = boto3.Session()
-    s3 = session.client("s3")
+    # Clients, the secret and the token are kept between invocations of a warm container
+    warm_start = is_warm()
+
+    # botocore retries S3 requests, and the run is aborted if they keep failing
+    resilient_s3 = ResilientS3Client(cassette.wrap_s3(get_client("s3")), CircuitBreaker("S3"))
+
+    # The objects the run reads are fetched in the background, while the token is acquired
+    # and the organisation's usage is requested
+    s3 = PrefetchingS3Client(resilient_s3, BUCKET_NAME, get_prefetch_object_names())
 
     logger.info("S3 client created")
 
     # Get the .pem file from AWS Secrets Manager
-    secret_manager = session.client("secretsmanager", region_name=secret_region)
-
-    logger.info("Secret Manager client created")
+    secret = cassette.call_live(get_secret, secret_name, secret_region, replayed=SCRUBBED)
 
-    secret = secret_manager.get_secret_value(SecretId=secret_name)["SecretString"]
+    logger.info("Secret retrieved from Secret Manager")
 
     # Get updated copilot usage data from GitHub API
-    access_token = github_api_toolkit.get_token_as_installation(org, secret, client_id)
+    access_token = cassette.call_live(
+        get_installation_token, org, secret, client_id, replayed=SCRUBBED_TOKEN
+    )
 
     if isinstance(access_token, str):
         logger.error("Error getting access token: %s", access_token)
         return f"Error getting access token: {access_token}"
     logger.info("Access token retrieved using AWS Secret")
 
+    # Requests share a pool of keep-alive connections, kept between warm invocations
+    adapter = cassette.wrap_adapter(
+        get_github_adapter(GITHUB_POOL_SIZE, (GITHUB_CONNECT_TIMEOUT, GITHUB_READ_TIMEOUT))
+    )
+    adapter.reset_stats()
+
     # Create an instance of the api_controller class
-    gh = github_api_toolkit.github_interface(access_token[0])
+    # If GitHub rejects the token, a new one is minted and the request retried
+    token_refresher = TokenRefreshingInterface(org, secret, client_id, access_token[0], adapter)
+    gh = instrument(token_refresher)
+
+    # Metrics requests are sent conditionally, using the validators from the last run
+    etag_cache = None
+    if CONDITIONAL_REQUESTS:
+        etag_entries = get_s3_object(s3, BUCKET_NAME, ETAG_CACHE_OBJECT, {})
+        etag_cache = ConditionalRequestCache(gh, etag_entries)
+        gh = etag_cache
+
+    # Transient failures are retried, and the run is aborted if GitHub keeps failing
+    gh = retrying = RetryingInterface(gh)
+
+    # Requests are scheduled around the GitHub rate limit, as teams are fetched concurrently
+    gh = RateLimitScheduler(gh, max_concurrency=MAX_WORKERS, low_remaining=RATE_LIMIT_LOW_REMAINING)
 
     logger.info("API Controller created")
 
-    # Copilot Usage Data (Historic)
-    historic_usage, dates_added = get_and_update_historic_usage(s3, gh)
+    # The metrics downloaded while discovering teams are kept to build the team history
+    team_metrics: dict = {}
 
-    # GitHub Teams with Copilot Data
-    copilot_teams = get_and_update_copilot_teams(s3, gh)
+    # Teams are deferred once the invocation is nearly out of time, and the teams deferred by
+    # the previous run are refreshed first
+    budget = TimeBudget(context, *load_checkpoint(s3))
 
-    logger.info("Getting history of each team identified previously")
+    def update_copilot_team_history(copilot_teams: list) -> bool:
+        logger.info("Getting history of each team identified previously")
 
-    # Retrieve existing team history from S3
-    try:
-        response = s3.get_object(Bucket=BUCKET_NAME, Key="teams_history.json")
-        existing_team_history = json.loads(response["Body"].read().decode("utf-8"))
-    except ClientError as e:
-        logger.warning("Error retrieving existing team history: %s", e)
-        existing_team_history = []
+        if TEAMS_HISTORY_LAYOUT == "sharded":
+            # Only the shards of teams with new days are read, and only changed ones written
+            return update_sharded_team_history(s3, gh, copilot_teams, team_metrics, budget)
 
-    logger.info("Existing team history has %d entries", len(existing_team_history))
+        # Requests are planned from the manifest, and the history only read if a team has new days
+        return update_team_history(s3, gh, copilot_teams, team_metrics, budget)
 
-    # Convert to dictionary for quick lookup
-    updated_team_history = create_dictionary(gh, copilot_teams, existing_team_history)
+    def update_etag_cache(historic_usage: tuple, history_updated: bool) -> bool:
+        # The validators are only kept once the data they describe has been stored, as the next
+        # run would otherwise be told the data it is missing is unchanged
+        if etag_cache is None or not historic_usage[2] or not history_updated:
+            return False
+        return update_s3_object(s3, BUCKET_NAME, ETAG_CACHE_OBJECT, etag_cache.entries)
 
-    # Write updated team history to S3
-    update_s3_object(s3, BUCKET_NAME, "teams_history.json", updated_team_history)
+    # The organisation's usage and the teams are independent, so they are gathered at once
+    phases = PhaseGraph()
+    phases.add("historic_usage", lambda: get_and_update_historic_usage(s3, gh))
+    phases.add("copilot_teams", lambda: get_and_update_copilot_teams(s3, gh, team_metrics, budget))
+    phases.add("team_history", update_copilot_team_history, ["copilot_teams"])
+    phases.add("etag_cache", update_etag_cache, ["historic_usage", "team_history"])
+    phases.add("checkpoint", lambda _: save_checkpoint(s3, budget), ["team_history"])
+
+    try:
+        results = phases.run(max_workers=MAX_CONCURRENT_PHASES)
+    except RunAbortedError as error:
+        # The phases still to run are skipped, so nothing is written from incomplete data
+        logger.error("Run aborted: %s", error, extra={**retrying.stats(), **resilient_s3.stats()})
+        return f"Run aborted: {error}"
+
+    _, dates_added, _, no_days = results["historic_usage"]
+    copilot_teams = results["copilot_teams"]
 
     logger.info(
         "Process complete",
         extra={
             "bucket": BUCKET_NAME,
+            "warm_start": warm_start,
             "no_days_added": len(dates_added),
             "dates_added": dates_added,
-            "no_dates_before": len(historic_usage) - len(dates_added),
-            "no_dates_after": len(historic_usage),
+            "no_dates_before": no_days - len(dates_added),
+            "no_dates_after": no_days,
             "no_copilot_teams": len(copilot_teams),
+            **gh.stats(),
+            **adapter.stats(),
+            **retrying.stats(),
+            **s3.stats(),
+            **resilient_s3.stats(),
+            "github_token_refreshes": token_refresher.no_token_refreshes,
+            **budget.stats(),
+            **(etag_cache.stats() if etag_cache is not None else {}),
+            "phase_seconds": phases.timings,
         },
     )
 
+    emit()
+
     return "Github Data logging is now complete."
 
 
+# Every function above is timed when instrumentation is enabled
+trace_functions(globals(), __name__)
+
+
 # # Dev Only
 # # Uncomment the following line to run the script locally
 # if __name__ == "__main__":
@@ -0,0 +1,69 @@
+"""Teams recently found without Copilot data.
+
+Most teams in an organisation have no Copilot metrics, and probing each of them costs a request
+on every run. Teams found without data are recorded with an expiry date, and are not probed
+again until it passes. The record is stored in S3 between runs.
+"""
+
+import os
+import zlib
+from datetime import datetime, timedelta
+from typing import Optional
+
+# Teams found without Copilot data are not probed again for up to this many days
+# Set to 0 to probe every team on every run
+NEGATIVE_CACHE_TTL_DAYS = int(os.getenv("NEGATIVE_CACHE_TTL_DAYS", "21"))
+NEGATIVE_CACHE_OBJECT = "teams_without_copilot.json"
+
+
+def mark_without_copilot_data(negative_cache: dict, team_name: str, now: datetime) -> None:
+    """Records that a team has no Copilot data, so it is not probed again until it expires.
+
+    Expiry dates are staggered across the second half of the TTL by a hash of the team name,
+    so that teams first seen on the same run are not all probed again on the same run.
+
+    Args:
+        negative_cache (dict): Teams without Copilot data, keyed by team name.
+        team_name (str): The name of the team.
+        now (datetime): The time the team was probed.
+    """
+    stagger = zlib.crc32(team_name.encode("utf-8")) % max(1, NEGATIVE_CACHE_TTL_DAYS // 2)
+    expires = now.date() + timedelta(days=NEGATIVE_CACHE_TTL_DAYS - stagger)
+
+    negative_cache[team_name] = {
+        "checked": now.date().isoformat(),
+        "expires": expires.isoformat(),
+    }
+
+
+def is_without_copilot_data(negative_cache: Optional[dict], team_name: str, now: datetime) -> bool:
+    """Checks whether a team was recently found without Copilot data.
+
+    Args:
+        negative_cache (Optional[dict]): Teams without Copilot data, keyed by team name.
+        team_name (str): The name of the team.
+        now (datetime): The current time.
+
+    Returns:
+        bool: True if the team has an unexpired entry, so does not need probing on this run.
+    """
+    if not negative_cache or team_name not in negative_cache:
+        return False
+    expires: str = negative_cache[team_name].get("expires", "")
+    return expires > now.date().isoformat()
+
+
+def remove_expired(negative_cache: dict, now: datetime) -> dict:
+    """Drops expired entries, which also clears out teams that have been deleted.
+
+    Args:
+        negative_cache (dict): Teams without Copilot data, keyed by team name.
+        now (datetime): The current time.
+
+    Returns:
+        dict: The unexpired entries.
+    """
+    today = now.date().isoformat()
+    return {
+        name: entry for name, entry in negative_cache.items() if entry.get("expires", "") > today
+    }
@@ -0,0 +1,125 @@
+"""Dependency graph execution of the handler's phases.
+
+The handler's phases form a small graph. The organisation's usage and team discovery do not
+depend on each other, the team history needs the discovered teams, and the conditional request
+validators can only be stored once everything they describe has been. PhaseGraph starts each
+phase as soon as the phases it depends on have finished, so a run takes about as long as its
+longest chain of phases rather than the sum of them all.
+"""
+
+import logging
+import threading
+import time
+from collections.abc import Callable, Iterable
+from concurrent.futures import FIRST_COMPLETED, Future, ThreadPoolExecutor, wait
+from typing import Any, Optional
+
+from src.instrumentation import observe
+
+logger = logging.getLogger()
+
+
+class PhaseGraph:
+    """A set of named phases, each run with the results of the phases it depends on.
+
+    Phases must be added after the phases they depend on, so the graph cannot contain a cycle.
+    The time each phase takes is recorded in `timings`.
+    """
+
+    def __init__(self) -> None:
+        """Creates an empty PhaseGraph."""
+        self.phases: dict[str, tuple[Callable[..., Any], tuple[str, ...]]] = {}
+        self.timings: dict[str, float] = {}
+        self._lock = threading.Lock()
+
+    def add(self, name: str, func: Callable[..., Any], dependencies: Iterable[str] = ()) -> None:
+        """Adds a phase to the graph.
+
+        Args:
+            name (str): The name of the phase.
+            func (Callable[..., Any]): The phase. It is called with the result of each of its
+                dependencies, in order.
+            dependencies (Iterable[str]): The names of the phases that must finish first.
+
+        Raises:
+            ValueError: If the name is already used, or a dependency has not been added.
+        """
+        dependencies = tuple(dependencies)
+
+        if name in self.phases:
+            raise ValueError(f"Phase {name} has already been added")
+
+        unknown = [dependency for dependency in dependencies if dependency not in self.phases]
+        if unknown:
+            raise ValueError(f"Phase {name} depends on unknown phases: {', '.join(unknown)}")
+
+        self.phases[name] = (func, dependencies)
+
+    def run(self, max_workers: Optional[int] = None) -> dict:
+        """Runs every phase, each as soon as its dependencies have finished.
+
+        If a phase raises an exception, no further phases are started. The phases already
+        running are allowed to finish, then the first exception is raised.
+
+        Args:
+            max_workers (Optional[int]): The maximum number of phases running at once. With 1,
+                the phases run one at a time in the order they were added. Defaults to the
+                number of phases.
+
+        Returns:
+            dict: The result of each phase, keyed by name.
+        """
+        results: dict = {}
+        pending = dict(self.phases)
+        running: dict[Future, str] = {}
+        error: Optional[BaseException] = None
+
+        with ThreadPoolExecutor(max_workers=max(1, max_workers or len(self.phases))) as executor:
+            while pending or running:
+                # Phases are submitted in the order they were added, once their inputs exist
+                for name, (func, dependencies) in list(pending.items()):
+                    if error is None and all(dependency in results for dependency in dependencies):
+                        del pending[name]
+                        args = [results[dependency] for dependency in dependencies]
+                        running[executor.submit(self._run_phase, name, func, args)] = name
+
+                if error is not None:
+                    pending.clear()
+
+                if not running:
+                    break
+
+                done, _ = wait(running, return_when=FIRST_COMPLETED)
+                for future in done:
+                    name = running.pop(future)
+                    if future.exception() is not None:
+                        error = error or future.exception()
+                    else:
+                        results[name] = future.result()
+
+        if error is not None:
+            raise error
+
+        return results
+
+    def _run_phase(self, name: str, func: Callable[..., Any], args: list) -> Any:
+        """Runs a phase, recording how long it takes.
+
+        Args:
+            name (str): The name of the phase.
+            func (Callable[..., Any]): The phase.
+            args (list): The results of the phase's dependencies.
+
+        Returns:
+            Any: The result of the phase.
+        """
+        started_at = time.monotonic()
+        try:
+            return func(*args)
+        finally:
+            elapsed = time.monotonic() - started_at
+            observe(f"phase:{name}", elapsed)
+            seconds = round(elapsed, 3)
+            with self._lock:
+                self.timings[name] = seconds
+            logger.info("Phase %s finished", name, extra={"phase": name, "seconds": seconds})
@@ -0,0 +1,268 @@
+"""Rate limit aware scheduling of GitHub API requests.
+
+This module wraps a github_api_toolkit.github_interface so that every thread making requests
+shares a single view of the GitHub rate limit. The `X-RateLimit-Remaining`,
+`X-RateLimit-Reset` and `Retry-After` headers of each response are used to scale the number of
+requests in flight up or down, and to pause all requests until the limit resets rather than
+letting them fail.
+"""
+
+from __future__ import annotations
+
+import logging
+import threading
+import time
+from typing import TYPE_CHECKING, Any, Optional
+
+from requests import Response
+
+if TYPE_CHECKING:
+    import github_api_toolkit
+
+logger = logging.getLogger()
+
+# Status codes GitHub uses when a primary or secondary rate limit has been exceeded
+RATE_LIMIT_STATUS_CODES = (403, 429)
+
+# Seconds added to X-RateLimit-Reset, as the header is rounded down to the whole second
+RESET_MARGIN = 1.0
+
+
+def get_response(result: Any) -> Optional[Response]:
+    """Gets the HTTP response from the result of a github_interface request.
+
+    github_interface returns the Response on success and the raised exception on failure.
+    HTTP errors carry the response that caused them.
+
+    Args:
+        result (Any): The value returned by github_interface.get.
+
+    Returns:
+        Optional[Response]: The response, or None if no response was received.
+    """
+    if isinstance(result, Response):
+        return result
+    response = getattr(result, "response", None)
+    if isinstance(response, Response):
+        return response
+    return None
+
+
+def get_int_header(response: Response, header: str) -> Optional[int]:
+    """Gets a header as an integer.
+
+    Args:
+        response (Response): The response to read.
+        header (str): The name of the header.
+
+    Returns:
+        Optional[int]: The header value, or None if it is missing or not an integer.
+    """
+    value = response.headers.get(header)
+    if value is None:
+        return None
+    try:
+        return int(value)
+    except (TypeError, ValueError):
+        return None
+
+
+class RateLimitScheduler:  # pylint: disable=too-many-instance-attributes
+    """Schedules requests through a github_interface based on the GitHub rate limit headers.
+
+    Concurrency follows an additive-increase, multiplicative-decrease scheme. Each healthy
+    response allows one more request in flight, up to `max_concurrency`. Running low on the
+    remaining budget or hitting a rate limit halves it, down to one. When the
+    budget is exhausted or GitHub asks for a back off, every request is paused until the reset
+    time and rate limited requests are retried.
+
+    The scheduler is a drop-in replacement for github_interface: any attribute other than `get`
+    is passed through to the wrapped instance.
+    """
+
+    def __init__(
+        self,
+        gh: github_api_toolkit.github_interface,
+        max_concurrency: int = 10,
+        low_remaining: int = 100,
+        max_retries: int = 3,
+    ) -> None:
+        """Creates a RateLimitScheduler.
+
+        Args:
+            gh (github_api_toolkit.github_interface): The github_interface to send requests with.
+            max_concurrency (int): The maximum number of requests in flight at once.
+            low_remaining (int): Concurrency is reduced while the remaining budget is below this.
+            max_retries (int): How many times a rate limited request is retried.
+        """
+        self.gh = gh
+        self.max_concurrency = max(1, max_concurrency)
+        self.concurrency = self.max_concurrency
+        self.low_remaining = low_remaining
+        self.max_retries = max_retries
+
+        self.remaining: Optional[int] = None
+        self.reset_at: Optional[float] = None
+
+        self.requests_made = 0
+        self.rate_limited_responses = 0
+        self.throttled_seconds = 0.0
+
+        self._condition = threading.Condition()
+        self._in_flight = 0
+        self._paused_until = 0.0
+        self._started_at: Optional[float] = None
+
+    def __getattr__(self, name: str) -> Any:
+        """Passes any other attribute through to the wrapped github_interface."""
+        if name == "gh":
+            raise AttributeError(name)
+        return getattr(self.gh, name)
+
+    def get(self, url: str, *args: Any, **kwargs: Any) -> Response | Exception:
+        """Sends a GET request once the rate limit allows, retrying if it is rate limited.
+
+        Args:
+            url (str): The API endpoint to request.
+            *args (Any): Passed through to github_interface.get.
+            **kwargs (Any): Passed through to github_interface.get.
+
+        Returns:
+            Response | Exception: The value returned by github_interface.get.
+        """
+        attempt = 0
+        while True:
+            self._acquire()
+
+            result: Any = None
+            try:
+                result = self.gh.get(url, *args, **kwargs)
+            finally:
+                rate_limited = self._release(result)
+
+            if not rate_limited or attempt >= self.max_retries:
+                response: Response | Exception = result
+                return response
+
+            attempt += 1
+            logger.warning(
+                "Rate limited requesting %s, retrying",
+                url,
+                extra={"attempt": attempt, "paused_until": self._paused_until},
+            )
+
+    def _acquire(self) -> None:
+        """Blocks until a request may be sent, then reserves a slot for it."""
+        while True:
+            with self._condition:
+                while self._in_flight >= self.concurrency:
+                    self._condition.wait()
+
+                wait = self._paused_until - time.time()
+                if wait <= 0:
+                    if self._started_at is None:
+                        self._started_at = time.time()
+                    self._in_flight += 1
+                    self.requests_made += 1
+                    return
+
+            time.sleep(wait)
+
+    def _release(self, result: Any) -> bool:
+        """Frees a request's slot and updates the rate limit state from its response.
+
+        Args:
+            result (Any): The value returned by github_interface.get.
+
+        Returns:
+            bool: True if the request was rate limited and should be retried.
+        """
+        with self._condition:
+            self._in_flight -= 1
+            try:
+                return self._update(get_response(result))
+            finally:
+                self._condition.notify_all()
+
+    def _update(self, response: Optional[Response]) -> bool:
+        """Updates the rate limit state from a response. Must be called holding the lock.
+
+        Args:
+            response (Optional[Response]): The response of a request.
+
+        Returns:
+            bool: True if the request was rate limited and should be retried.
+        """
+        if response is None:
+            return False
+
+        remaining = get_int_header(response, "X-RateLimit-Remaining")
+        reset_at = get_int_header(response, "X-RateLimit-Reset")
+        retry_after = get_int_header(response, "Retry-After")
+
+        if remaining is not None:
+            self.remaining = remaining
+        if reset_at is not None:
+            self.reset_at = float(reset_at)
+
+        rate_limited = response.status_code in RATE_LIMIT_STATUS_CODES and (
+            retry_after is not None or remaining == 0
+        )
+
+        if rate_limited:
+            self.rate_limited_responses += 1
+            self._decrease()
+
+            if retry_after is not None:
+                self._pause_until(time.time() + retry_after)
+            elif reset_at is not None:
+                self._pause_until(reset_at + RESET_MARGIN)
+
+            return True
+
+        if remaining == 0 and reset_at is not None:
+            # The budget is spent, so hold every request until it resets rather than fail
+            self._pause_until(reset_at + RESET_MARGIN)
+            self._decrease()
+        elif remaining is not None and remaining < self.low_remaining:
+            self._decrease()
+        else:
+            self.concurrency = min(self.max_concurrency, self.concurrency + 1)
+
+        return False
+
+    def _decrease(self) -> None:
+        """Halves the number of requests allowed in flight."""
+        self.concurrency = max(1, self.concurrency // 2)
+
+    def _pause_until(self, until: float) -> None:
+        """Pauses all requests until the given time, counting only new time towards throttling.
+
+        Args:
+            until (float): The epoch time in seconds to pause until.
+        """
+        start = max(time.time(), self._paused_until)
+        if until > start:
+            self.throttled_seconds += until - start
+            self._paused_until = until
+
+    def stats(self) -> dict:
+        """Gets a summary of the requests made, for logging.
+
+        Returns:
+            dict: The request count, effective request rate and time spent throttled.
+        """
+        with self._condition:
+            elapsed = 0.0
+            if self._started_at is not None:
+                elapsed = time.time() - self._started_at
+
+            request_rate = self.requests_made / elapsed if elapsed > 0 else 0.0
+
+            return {
+                "no_github_requests": self.requests_made,
+                "github_request_rate": round(request_rate, 2),
+                "github_throttled_seconds": round(self.throttled_seconds, 2),
+                "github_rate_limited_responses": self.rate_limited_responses,
+                "github_rate_limit_remaining": self.remaining,
+            }
@@ -0,0 +1,121 @@
+"""Compact in-memory representation of Copilot metrics records.
+
+Each day of a team's metrics nests editors, models and languages, and every one of them is a
+dict repeating the same keys and many of the same values, such as editor, model and language
+names. Tens of thousands of team-days are held at once while the teams are probed and merged.
+
+Record stores an object as a tuple of its values, with a mapping from each key to its position
+that is shared by every object with the same keys. String values are interned, so each distinct
+name is stored once however many records use it. A Record reads like the dict it was decoded
+from, and `encode_record` writes it back out as exactly the same JSON.
+"""
+
+import os
+import sys
+from collections.abc import Callable, Iterator, Mapping
+from typing import Any, Optional
+
+# Decode Copilot metrics into Records rather than dicts. Set to false to use plain dicts
+COMPACT_RECORDS = os.getenv("COMPACT_RECORDS", "true").lower() == "true"
+
+# The position of each key, shared by every Record with the same keys in the same order
+_shapes: dict[tuple[str, ...], dict[str, int]] = {}
+
+
+class Record(Mapping):
+    """A read-only JSON object, stored as a tuple of its values.
+
+    Records compare equal to dicts with the same items. Lists inside a record are kept as lists,
+    so a team's list of days can still be updated in place.
+    """
+
+    __slots__ = ("_positions", "_values")
+
+    def __init__(self, positions: dict[str, int], values: tuple) -> None:
+        """Creates a Record.
+
+        Args:
+            positions (dict[str, int]): The position of each key's value, shared between records.
+            values (tuple): The values.
+        """
+        self._positions = positions
+        self._values = values
+
+    def __getitem__(self, key: str) -> Any:
+        """Gets the value of a key."""
+        return self._values[self._positions[key]]
+
+    def __iter__(self) -> Iterator[str]:
+        """Iterates over the keys, in the order they were decoded."""
+        return iter(self._positions)
+
+    def __len__(self) -> int:
+        """Gets the number of keys."""
+        return len(self._positions)
+
+    def __repr__(self) -> str:
+        """Shows the record as the dict it was decoded from."""
+        return f"Record({self.to_dict()!r})"
+
+    def to_dict(self) -> dict:
+        """Converts the record to a dict, without converting any records nested in it.
+
+        Returns:
+            dict: The record's items, in their original order.
+        """
+        return {key: self._values[position] for key, position in self._positions.items()}
+
+
+def compact_pairs(pairs: list[tuple[str, Any]]) -> Record:
+    """Creates a Record from the key and value pairs of a decoded JSON object.
+
+    Used as the `object_pairs_hook` of `json.loads`, so objects are decoded straight into Records.
+
+    Args:
+        pairs (list[tuple[str, Any]]): The object's keys and values, in order.
+
+    Returns:
+        Record: The object as a Record.
+    """
+    keys, values = zip(*pairs, strict=True) if pairs else ((), ())
+
+    positions = _shapes.get(keys)
+    if positions is None:
+        # A repeated key keeps its first position and its last value, as json.loads does
+        positions = _shapes.setdefault(
+            keys, {sys.intern(key): position for position, key in enumerate(keys)}
+        )
+
+    return Record(
+        positions, tuple(sys.intern(value) if isinstance(value, str) else value for value in values)
+    )
+
+
+def encode_record(value: Any) -> dict:
+    """Converts a Record to a dict while it is encoded.
+
+    Used as the `default` of `json.dumps`, so Records are written as the JSON they were decoded
+    from.
+
+    Args:
+        value (Any): A value json.dumps cannot encode itself.
+
+    Returns:
+        dict: The record's items.
+
+    Raises:
+        TypeError: If the value is not a Record.
+    """
+    if isinstance(value, Record):
+        return value.to_dict()
+    raise TypeError(f"Object of type {type(value).__name__} is not JSON serializable")
+
+
+def get_object_pairs_hook() -> Optional[Callable[[list], Any]]:
+    """Gets the `object_pairs_hook` to decode Copilot metrics with.
+
+    Returns:
+        Optional[Callable[[list], Any]]: `compact_pairs`, or None to decode plain dicts if
+            `COMPACT_RECORDS` is disabled.
+    """
+    return compact_pairs if COMPACT_RECORDS else None
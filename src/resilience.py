@@ -0,0 +1,287 @@
+"""Retries and circuit breaking for GitHub API requests.
+
+A transient failure, such as a 502 from GitHub or a dropped connection, is retried with
+exponential backoff and full jitter, so one bad response does not lose a team's data for the
+day. Each endpoint has a budget of retries for the run, so a failing endpoint cannot stall the
+run with retries.
+
+A failure that survives its retries is recorded by a CircuitBreaker. Once a dependency has
+failed too many times in a row, every further request raises CircuitOpenError, which aborts
+the run before it stores data that is missing whatever could not be fetched. The breaker
+stays open for the rest of the invocation, as the next scheduled run starts with a new one.
+"""
+
+from __future__ import annotations
+
+import logging
+import os
+import re
+import secrets
+import threading
+import time
+from http import HTTPStatus
+from typing import TYPE_CHECKING, Any, Optional
+
+from requests import ConnectionError as RequestsConnectionError
+from requests import Response, Timeout
+
+from src.rate_limit import get_response
+
+if TYPE_CHECKING:
+    import github_api_toolkit
+
+logger = logging.getLogger()
+
+# Each request gets up to this many attempts, waiting longer before each retry
+RETRY_MAX_ATTEMPTS = int(os.getenv("RETRY_MAX_ATTEMPTS", "3"))
+RETRY_BASE_DELAY = float(os.getenv("RETRY_BASE_DELAY", "0.5"))
+RETRY_MAX_DELAY = float(os.getenv("RETRY_MAX_DELAY", "10"))
+
+# Maximum number of retries of each endpoint in a run
+RETRY_BUDGET_PER_ENDPOINT = int(os.getenv("RETRY_BUDGET_PER_ENDPOINT", "20"))
+
+# The run is aborted once a dependency fails this many times in a row
+CIRCUIT_BREAKER_THRESHOLD = int(os.getenv("CIRCUIT_BREAKER_THRESHOLD", "5"))
+
+# Server errors that are usually gone by the time the request is repeated
+RETRYABLE_STATUS_CODES = {
+    HTTPStatus.INTERNAL_SERVER_ERROR,
+    HTTPStatus.BAD_GATEWAY,
+    HTTPStatus.SERVICE_UNAVAILABLE,
+    HTTPStatus.GATEWAY_TIMEOUT,
+}
+
+# Errors raised when a request could not be completed, which are retried like server errors
+RETRYABLE_EXCEPTIONS = (RequestsConnectionError, Timeout)
+
+_random = secrets.SystemRandom()
+
+
+class RunAbortedError(Exception):
+    """Raised to stop a run rather than store incomplete data."""
+
+
+class CircuitOpenError(RunAbortedError):
+    """Raised once a dependency has failed too many times in a row."""
+
+
+def is_retryable(result: Any) -> bool:
+    """Checks whether a request failed in a way that is worth retrying.
+
+    Args:
+        result (Any): The value returned or raised by a github_interface request.
+
+    Returns:
+        bool: True for a server error response or a connection failure.
+    """
+    if isinstance(result, RETRYABLE_EXCEPTIONS):
+        return True
+    response = get_response(result)
+    return getattr(response, "status_code", None) in RETRYABLE_STATUS_CODES
+
+
+def get_backoff_delay(attempt: int, base_delay: float, max_delay: float) -> float:
+    """Gets a random delay before a retry, using exponential backoff with full jitter.
+
+    Args:
+        attempt (int): The number of the retry, starting at 1.
+        base_delay (float): The maximum delay before the first retry, in seconds.
+        max_delay (float): The maximum delay before any retry, in seconds.
+
+    Returns:
+        float: The delay in seconds, between 0 and the backoff for this attempt.
+    """
+    return _random.uniform(0, min(max_delay, base_delay * 2 ** (attempt - 1)))
+
+
+def get_endpoint(url: str) -> str:
+    """Gets the endpoint of a request, so that requests for different teams share a budget.
+
+    Args:
+        url (str): The API endpoint requested.
+
+    Returns:
+        str: The path without its query, with team names replaced by `{team}`.
+    """
+    path = url.split("?", 1)[0]
+    return re.sub(r"/(team|teams)/[^/]+", r"/\1/{team}", path)
+
+
+class CircuitBreaker:
+    """Counts consecutive failures of a dependency, and opens once there are too many.
+
+    A success resets the count. Once open, the breaker stays open.
+    """
+
+    def __init__(self, name: str, threshold: Optional[int] = None) -> None:
+        """Creates a closed CircuitBreaker.
+
+        Args:
+            name (str): The name of the dependency, used in logs and errors.
+            threshold (Optional[int]): The number of consecutive failures that opens the
+                breaker. Defaults to `CIRCUIT_BREAKER_THRESHOLD`.
+        """
+        self.name = name
+        self.threshold = max(1, threshold or CIRCUIT_BREAKER_THRESHOLD)
+        self.consecutive_failures = 0
+        self.no_failures = 0
+        self.is_open = False
+        self._lock = threading.Lock()
+
+    def check(self) -> None:
+        """Raises CircuitOpenError if the breaker is open.
+
+        Raises:
+            CircuitOpenError: If the dependency has failed too many times in a row.
+        """
+        if self.is_open:
+            raise CircuitOpenError(
+                f"{self.name} failed {self.threshold} times in a row, so the run was stopped"
+            )
+
+    def record_success(self) -> None:
+        """Resets the count of consecutive failures."""
+        with self._lock:
+            self.consecutive_failures = 0
+
+    def record_failure(self, description: str) -> None:
+        """Counts a failure, opening the breaker if there have been too many in a row.
+
+        Args:
+            description (str): What failed, for the log.
+        """
+        with self._lock:
+            self.no_failures += 1
+            self.consecutive_failures += 1
+            if self.is_open or self.consecutive_failures < self.threshold:
+                return
+            self.is_open = True
+
+        logger.error(
+            "Circuit breaker for %s opened after %s failed",
+            self.name,
+            description,
+            extra={"dependency": self.name, "consecutive_failures": self.threshold},
+        )
+
+
+class RetryingInterface:
+    """Retries transient failures of requests sent through a github_interface.
+
+    Server errors and connection failures are retried with exponential backoff and full
+    jitter, up to `RETRY_MAX_ATTEMPTS` attempts and within each endpoint's budget of
+    `RETRY_BUDGET_PER_ENDPOINT` retries. Any other
+    result is returned at once, including rate limited responses, which are left to the
+    RateLimitScheduler. The interface is a drop-in replacement for github_interface: any
+    attribute other than `get` is passed through to the wrapped instance.
+    """
+
+    def __init__(
+        self, gh: github_api_toolkit.github_interface, breaker: Optional[CircuitBreaker] = None
+    ) -> None:
+        """Creates a RetryingInterface.
+
+        Args:
+            gh (github_api_toolkit.github_interface): The github_interface to send requests with.
+            breaker (Optional[CircuitBreaker]): Records the requests that still fail after
+                retrying. Defaults to a new breaker for GitHub.
+        """
+        self.gh = gh
+        self.breaker = breaker or CircuitBreaker("GitHub")
+        self.retries: dict[str, int] = {}
+        self._lock = threading.Lock()
+
+    def __getattr__(self, name: str) -> Any:
+        """Passes any other attribute through to the wrapped github_interface."""
+        if name == "gh":
+            raise AttributeError(name)
+        return getattr(self.gh, name)
+
+    def get(self, url: str, *args: Any, **kwargs: Any) -> Response | Exception:
+        """Sends a GET request, retrying it while it fails transiently.
+
+        Args:
+            url (str): The API endpoint to request.
+            *args (Any): Passed through to github_interface.get.
+            **kwargs (Any): Passed through to github_interface.get.
+
+        Returns:
+            Response | Exception: The value returned by github_interface.get.
+
+        Raises:
+            CircuitOpenError: If GitHub has failed too many times in a row.
+        """
+        endpoint = get_endpoint(url)
+        attempt = 1
+        result: Response | Exception
+
+        while True:
+            self.breaker.check()
+
+            raised: Optional[Exception] = None
+            try:
+                result = self.gh.get(url, *args, **kwargs)
+            except RETRYABLE_EXCEPTIONS as error:
+                result = raised = error
+
+            if not is_retryable(result):
+                self.breaker.record_success()
+                return result
+
+            if attempt >= RETRY_MAX_ATTEMPTS or not self._take_retry(endpoint):
+                self.breaker.record_failure(f"GET {endpoint}")
+                self.breaker.check()
+                if raised is not None:
+                    raise raised
+                return result
+
+            delay = get_backoff_delay(attempt, RETRY_BASE_DELAY, RETRY_MAX_DELAY)
+            response = get_response(result)
+            logger.warning(
+                "Retrying %s after a transient failure",
+                url,
+                extra={
+                    "endpoint": endpoint,
+                    "attempt": attempt,
+                    "delay_seconds": round(delay, 3),
+                    "status_code": response.status_code if response is not None else None,
+                    "error": type(result).__name__,
+                },
+            )
+            time.sleep(delay)
+            attempt += 1
+
+    def _take_retry(self, endpoint: str) -> bool:
+        """Uses one retry from an endpoint's budget.
+
+        Args:
+            endpoint (str): The endpoint, as returned by get_endpoint.
+
+        Returns:
+            bool: True if the budget allowed another retry.
+        """
+        with self._lock:
+            used = self.retries.get(endpoint, 0)
+            if used >= RETRY_BUDGET_PER_ENDPOINT:
+                return False
+            self.retries[endpoint] = used + 1
+
+        if used + 1 == RETRY_BUDGET_PER_ENDPOINT:
+            logger.warning("Retry budget for %s used up", endpoint, extra={"endpoint": endpoint})
+        return True
+
+    def stats(self) -> dict:
+        """Gets a summary of the retries made, for logging.
+
+        Returns:
+            dict: The number of retries, the retries of each endpoint, the requests that still
+                failed and whether the circuit breaker opened.
+        """
+        with self._lock:
+            retries = dict(self.retries)
+        return {
+            "no_github_retries": sum(retries.values()),
+            "github_retries_by_endpoint": retries,
+            "no_github_failures": self.breaker.no_failures,
+            "github_circuit_open": self.breaker.is_open,
+        }
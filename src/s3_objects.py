@@ -0,0 +1,584 @@
+"""Reading and writing the JSON objects stored in S3."""
+
+from __future__ import annotations
+
+import copy
+import hashlib
+import importlib
+import io
+import logging
+import os
+import threading
+from collections.abc import Iterable
+from concurrent.futures import ThreadPoolExecutor
+from typing import IO, TYPE_CHECKING, Any, Optional
+
+from botocore.exceptions import ClientError
+
+from src.resilience import CircuitBreaker, RunAbortedError
+from src.serialisation import JsonListWriter, decode_s3_response, encode_json
+
+if TYPE_CHECKING:
+    import boto3
+
+logger = logging.getLogger()
+
+account = os.getenv("AWS_ACCOUNT_NAME")
+
+# AWS Bucket Path
+BUCKET_NAME = f"{account}-copilot-usage-dashboard"
+
+# Format of the JSON objects written to S3, which are read back in any format
+# Style is "indent", "compact" or "ndjson", and compression is "none", "gzip" or "zstd"
+S3_JSON_STYLE = os.getenv("S3_JSON_STYLE", "indent")
+S3_COMPRESSION = os.getenv("S3_COMPRESSION", "none")
+
+# Skip writing objects whose content is unchanged, compared by digest with the stored object
+SKIP_UNCHANGED_WRITES = os.getenv("S3_SKIP_UNCHANGED_WRITES", "true").lower() == "true"
+
+# User metadata holding the SHA-256 digest of an object's body
+DIGEST_METADATA_KEY = "content-sha256"
+
+# Maximum number of S3 requests in flight at once when reading or writing several objects
+S3_MAX_WORKERS = int(os.getenv("S3_MAX_WORKERS", "8"))
+
+# Bodies of at least this size are uploaded in parts, several at once
+MULTIPART_THRESHOLD = int(os.getenv("S3_MULTIPART_THRESHOLD_MB", "8")) * 1024 * 1024
+
+# Error codes S3 uses for an object that does not exist
+NOT_FOUND_ERROR_CODES = {"NoSuchKey", "NotFound", "404"}
+
+# Client methods that send a request to S3, and count towards the circuit breaker
+S3_OPERATIONS = {"get_object", "head_object", "put_object", "upload_fileobj", "list_objects_v2"}
+
+
+def is_not_found(error: ClientError) -> bool:
+    """Checks whether an S3 error means the object does not exist.
+
+    Args:
+        error (ClientError): The error raised by the S3 client.
+
+    Returns:
+        bool: True if the object does not exist.
+    """
+    return error.response.get("Error", {}).get("Code") in NOT_FOUND_ERROR_CODES
+
+
+class ResilientS3Client:
+    """Counts S3 retries and failures, and stops sending requests once S3 keeps failing.
+
+    botocore already retries throttling, server errors and connection failures with
+    exponential backoff and jitter. This client logs and counts the retries each request
+    needed, and records requests that still failed with a CircuitBreaker. Once the breaker is
+    open, every request raises CircuitOpenError. An object that does not exist is not a failure.
+
+    The client is a drop-in replacement for the boto3 S3 client: any other attribute is passed
+    through to the wrapped instance.
+    """
+
+    def __init__(self, s3_client: boto3.client, breaker: CircuitBreaker) -> None:
+        """Creates a ResilientS3Client.
+
+        Args:
+            s3_client (boto3.client): The S3 client to send requests with.
+            breaker (CircuitBreaker): Records the requests that failed.
+        """
+        self.s3_client = s3_client
+        self.breaker = breaker
+        self.no_retries = 0
+        self._lock = threading.Lock()
+
+    def __getattr__(self, name: str) -> Any:
+        """Wraps the S3 operations, and passes any other attribute through to the client."""
+        if name == "s3_client":
+            raise AttributeError(name)
+
+        attribute = getattr(self.s3_client, name)
+        if name not in S3_OPERATIONS:
+            return attribute
+
+        def operation(**kwargs: Any) -> Any:
+            return self.call(name, attribute, **kwargs)
+
+        return operation
+
+    def call(self, name: str, operation: Any, **kwargs: Any) -> Any:
+        """Sends a request to S3, counting its retries and recording whether it failed.
+
+        Args:
+            name (str): The name of the operation, for the log.
+            operation (Any): The client method.
+            **kwargs (Any): Passed through to the client method.
+
+        Returns:
+            Any: The value returned by the client method.
+
+        Raises:
+            CircuitOpenError: If S3 has failed too many times in a row.
+        """
+        self.breaker.check()
+
+        try:
+            response = operation(**kwargs)
+        except ClientError as error:
+            self.count_retries(name, error.response)
+            if is_not_found(error):
+                self.breaker.record_success()
+            else:
+                self.breaker.record_failure(f"{name} {kwargs.get('Key', '')}".strip())
+            raise
+        except Exception:
+            self.breaker.record_failure(f"{name} {kwargs.get('Key', '')}".strip())
+            raise
+
+        self.count_retries(name, response)
+        self.breaker.record_success()
+        return response
+
+    def count_retries(self, name: str, response: Any) -> None:
+        """Counts and logs the retries botocore made for a request.
+
+        Args:
+            name (str): The name of the operation.
+            response (Any): The response, or the error response, with its `ResponseMetadata`.
+        """
+        if not isinstance(response, dict):
+            return
+        retries = response.get("ResponseMetadata", {}).get("RetryAttempts", 0)
+        if not isinstance(retries, int) or retries <= 0:
+            return
+
+        with self._lock:
+            self.no_retries += retries
+
+        logger.warning("S3 %s was retried", name, extra={"operation": name, "retries": retries})
+
+    def stats(self) -> dict:
+        """Gets a summary of the retries and failures, for logging.
+
+        Returns:
+            dict: The number of retries and failures, and whether the circuit breaker opened.
+        """
+        return {
+            "no_s3_retries": self.no_retries,
+            "no_s3_failures": self.breaker.no_failures,
+            "s3_circuit_open": self.breaker.is_open,
+        }
+
+
+class PrefetchingS3Client:
+    """Reads S3 objects in the background, before they are needed.
+
+    A get_object request for a prefetched object is answered from its prefetched response, or
+    raises the error the prefetch did. Each prefetched response is used once. Writing an object
+    discards its prefetched response, so a later read is never stale.
+
+    The client is a drop-in replacement for the boto3 S3 client: any other attribute is passed
+    through to the wrapped instance.
+    """
+
+    def __init__(
+        self,
+        s3_client: boto3.client,
+        bucket_name: str,
+        object_names: list[str],
+        max_workers: Optional[int] = None,
+    ) -> None:
+        """Creates a PrefetchingS3Client, and starts reading the objects.
+
+        Args:
+            s3_client (boto3.client): The S3 client to send requests with.
+            bucket_name (str): The name of the S3 bucket.
+            object_names (list[str]): The objects to read in the background.
+            max_workers (Optional[int]): The maximum number of reads in flight at once.
+                Defaults to `S3_MAX_WORKERS`.
+        """
+        self.s3_client = s3_client
+        self.bucket_name = bucket_name
+        self.no_prefetched = len(object_names)
+        self.no_prefetch_hits = 0
+        self._lock = threading.Lock()
+
+        if max_workers is None:
+            max_workers = S3_MAX_WORKERS
+
+        executor = ThreadPoolExecutor(max_workers=max(1, min(max_workers, len(object_names))))
+        self._prefetched = {name: executor.submit(self._fetch, name) for name in object_names}
+        # The reads carry on in the background, and the threads exit once they are done
+        executor.shutdown(wait=False)
+
+    def __getattr__(self, name: str) -> Any:
+        """Passes any other attribute through to the wrapped S3 client."""
+        if name == "s3_client":
+            raise AttributeError(name)
+        return getattr(self.s3_client, name)
+
+    def _fetch(self, object_name: str) -> dict:
+        """Reads an object, including its body, so the response can be used from any thread.
+
+        Args:
+            object_name (str): The name of the S3 object.
+
+        Returns:
+            dict: The get_object response, with its body read into memory.
+        """
+        response = self.s3_client.get_object(Bucket=self.bucket_name, Key=object_name)
+        return {**response, "Body": io.BytesIO(response["Body"].read())}
+
+    def _discard(self, bucket_name: Optional[str], object_name: Optional[str]) -> Any:
+        """Removes an object's prefetched response.
+
+        Args:
+            bucket_name (Optional[str]): The name of the S3 bucket.
+            object_name (Optional[str]): The name of the S3 object.
+
+        Returns:
+            Any: The future of the object's prefetched response, or None if there is none.
+        """
+        if bucket_name != self.bucket_name or object_name is None:
+            return None
+        with self._lock:
+            return self._prefetched.pop(object_name, None)
+
+    def get_object(self, **kwargs: Any) -> dict:
+        """Gets an object, using its prefetched response if there is one.
+
+        Args:
+            **kwargs (Any): Passed through to the S3 client's get_object.
+
+        Returns:
+            dict: The get_object response.
+        """
+        future = None
+        if set(kwargs) == {"Bucket", "Key"}:
+            future = self._discard(kwargs["Bucket"], kwargs["Key"])
+
+        if future is None:
+            response: dict = self.s3_client.get_object(**kwargs)
+            return response
+
+        with self._lock:
+            self.no_prefetch_hits += 1
+        prefetched: dict = future.result()
+        return prefetched
+
+    def put_object(self, **kwargs: Any) -> dict:
+        """Writes an object, discarding its prefetched response.
+
+        Args:
+            **kwargs (Any): Passed through to the S3 client's put_object.
+
+        Returns:
+            dict: The put_object response.
+        """
+        self._discard(kwargs.get("Bucket"), kwargs.get("Key"))
+        response: dict = self.s3_client.put_object(**kwargs)
+        return response
+
+    def upload_fileobj(self, **kwargs: Any) -> None:
+        """Uploads an object in parts, discarding its prefetched response.
+
+        Args:
+            **kwargs (Any): Passed through to the S3 client's upload_fileobj.
+        """
+        self._discard(kwargs.get("Bucket"), kwargs.get("Key"))
+        self.s3_client.upload_fileobj(**kwargs)
+
+    def stats(self) -> dict:
+        """Gets a summary of the prefetched objects, for logging.
+
+        Returns:
+            dict: The number of objects prefetched, and how many of them were used.
+        """
+        return {
+            "no_s3_prefetched": self.no_prefetched,
+            "no_s3_prefetch_hits": self.no_prefetch_hits,
+        }
+
+
+def get_s3_object(
+    s3_client: boto3.client, bucket_name: str, object_name: str, default: Any = None
+) -> Any:
+    """Get the JSON content of an S3 object.
+
+    Args:
+        s3_client (boto3.client): The S3 client.
+        bucket_name (str): The name of the S3 bucket.
+        object_name (str): The name of the S3 object.
+        default (Any): Returned if the object does not exist or cannot be decoded.
+
+    Returns:
+        Any: The decoded content of the object, or `default`.
+
+    Raises:
+        RunAbortedError: If the object exists but could not be read. The default could
+            otherwise be written back over it.
+    """
+    try:
+        response = s3_client.get_object(Bucket=bucket_name, Key=object_name)
+        return decode_s3_response(response)
+    except ClientError as e:
+        if not is_not_found(e):
+            logger.error("Error getting %s: %s", object_name, e)
+            raise RunAbortedError(f"Could not read {object_name}: {e}") from e
+        logger.warning("Error getting %s: %s. Using default.", object_name, e)
+        return default
+    except (ValueError, OSError) as e:
+        logger.warning("Error getting %s: %s. Using default.", object_name, e)
+        return default
+
+
+def get_s3_objects(
+    s3_client: boto3.client, bucket_name: str, object_names: list[str], default: Any = None
+) -> dict:
+    """Gets the JSON content of several S3 objects, with a bounded number of reads in flight.
+
+    Args:
+        s3_client (boto3.client): The S3 client.
+        bucket_name (str): The name of the S3 bucket.
+        object_names (list[str]): The names of the S3 objects.
+        default (Any): Returned for each object that does not exist or cannot be decoded. Each
+            object gets its own copy, so it can be changed in place.
+
+    Returns:
+        dict: The decoded content of each object, keyed by object name.
+
+    Raises:
+        RunAbortedError: If an object exists but could not be read.
+    """
+
+    def get(object_name: str) -> Any:
+        return get_s3_object(s3_client, bucket_name, object_name, copy.copy(default))
+
+    if S3_MAX_WORKERS <= 1 or len(object_names) <= 1:
+        return {object_name: get(object_name) for object_name in object_names}
+
+    with ThreadPoolExecutor(max_workers=min(S3_MAX_WORKERS, len(object_names))) as executor:
+        return dict(zip(object_names, executor.map(get, object_names), strict=True))
+
+
+def update_s3_objects(s3_client: boto3.client, bucket_name: str, objects: dict) -> dict:
+    """Updates several S3 objects, with a bounded number of writes in flight.
+
+    Args:
+        s3_client (boto3.client): The S3 client.
+        bucket_name (str): The name of the S3 bucket.
+        objects (dict): The data to write to each object, keyed by object name.
+
+    Returns:
+        dict: Whether each update was successful, keyed by object name.
+    """
+
+    def update(object_name: str) -> bool:
+        return update_s3_object(s3_client, bucket_name, object_name, objects[object_name])
+
+    if S3_MAX_WORKERS <= 1 or len(objects) <= 1:
+        return {object_name: update(object_name) for object_name in objects}
+
+    with ThreadPoolExecutor(max_workers=min(S3_MAX_WORKERS, len(objects))) as executor:
+        return dict(zip(objects, executor.map(update, objects), strict=True))
+
+
+def is_unchanged(s3_client: boto3.client, bucket_name: str, object_name: str, body: bytes) -> bool:
+    """Checks whether an S3 object already has the given body, without downloading it.
+
+    Args:
+        s3_client (boto3.client): The S3 client.
+        bucket_name (str): The name of the S3 bucket.
+        object_name (str): The name of the S3 object.
+        body (bytes): The encoded body to be written.
+
+    Returns:
+        bool: True if the stored object's digest matches the body. False if it differs, or the
+            object does not exist or cannot be checked.
+    """
+    digests = (
+        hashlib.sha256(body).hexdigest(),
+        hashlib.md5(body, usedforsecurity=False).hexdigest(),
+    )
+    return has_digests(s3_client, bucket_name, object_name, digests)
+
+
+def has_digests(
+    s3_client: boto3.client, bucket_name: str, object_name: str, digests: tuple[str, str]
+) -> bool:
+    """Checks whether an S3 object already has a body with the given digests.
+
+    Args:
+        s3_client (boto3.client): The S3 client.
+        bucket_name (str): The name of the S3 bucket.
+        object_name (str): The name of the S3 object.
+        digests (tuple[str, str]): The SHA-256 and MD5 hex digests of the body to be written.
+
+    Returns:
+        bool: True if the stored object's digest matches. False if it differs, or the object
+            does not exist or cannot be checked.
+    """
+    try:
+        response = s3_client.head_object(Bucket=bucket_name, Key=object_name)
+    except ClientError:
+        return False
+
+    sha256, md5 = digests
+
+    stored_digest: Optional[str] = response.get("Metadata", {}).get(DIGEST_METADATA_KEY)
+    if stored_digest:
+        return stored_digest == sha256
+
+    # Objects written before the digest was stored are compared by their ETag, which is the MD5
+    # of the body for single part uploads
+    etag = str(response.get("ETag", "")).strip('"')
+    return etag == md5
+
+
+def update_s3_object(
+    s3_client: boto3.client, bucket_name: str, object_name: str, data: dict | list
+) -> bool:
+    """Update an S3 object with new data.
+
+    The data is encoded according to `S3_JSON_STYLE` and `S3_COMPRESSION`, with the matching
+    `Content-Type` and `Content-Encoding` set on the object. The SHA-256 digest of the body is
+    stored in the object's metadata, and unless `SKIP_UNCHANGED_WRITES` is disabled, the write
+    is skipped if the stored object already has the same digest. Bodies of at least
+    `MULTIPART_THRESHOLD` bytes are uploaded in parts.
+
+    Args:
+        s3_client (boto3.client): The S3 client.
+        bucket_name (str): The name of the S3 bucket.
+        object_name (str): The name of the S3 object.
+        data (dict | list): The data to be written to the S3 object.
+
+    Returns:
+        bool: True if the update was successful or the object is unchanged, False otherwise.
+    """
+    body, metadata = encode_json(data, S3_JSON_STYLE, S3_COMPRESSION)
+
+    if SKIP_UNCHANGED_WRITES and is_unchanged(s3_client, bucket_name, object_name, body):
+        log_unchanged(bucket_name, object_name, len(body))
+        return True
+
+    extra_args = {"Metadata": {DIGEST_METADATA_KEY: hashlib.sha256(body).hexdigest()}, **metadata}
+    return write_s3_body(s3_client, bucket_name, object_name, io.BytesIO(body), extra_args)
+
+
+def update_s3_list(
+    s3_client: boto3.client, bucket_name: str, object_name: str, items: Iterable
+) -> bool:
+    """Update an S3 object with a list, encoded one item at a time.
+
+    The object is written as `update_s3_object` would write the list, but neither the list nor
+    its encoded body is held in memory as a whole. Items can be generated as they are merged,
+    and the body is kept in a temporary file once it reaches `MULTIPART_THRESHOLD` bytes.
+
+    Args:
+        s3_client (boto3.client): The S3 client.
+        bucket_name (str): The name of the S3 bucket.
+        object_name (str): The name of the S3 object.
+        items (Iterable): The items of the list to be written to the S3 object.
+
+    Returns:
+        bool: True if the update was successful or the object is unchanged, False otherwise.
+    """
+    with JsonListWriter(S3_JSON_STYLE, S3_COMPRESSION, MULTIPART_THRESHOLD) as writer:
+        for item in items:
+            writer.write(item)
+        body = writer.close()
+
+        digests = writer.digests()
+        if SKIP_UNCHANGED_WRITES and has_digests(s3_client, bucket_name, object_name, digests):
+            log_unchanged(bucket_name, object_name, writer.size)
+            return True
+
+        extra_args = {"Metadata": {DIGEST_METADATA_KEY: digests[0]}, **writer.metadata}
+        return write_s3_body(s3_client, bucket_name, object_name, body, extra_args)
+
+
+def log_unchanged(bucket_name: str, object_name: str, size: int) -> None:
+    """Logs that writing an object was skipped, as its content is unchanged.
+
+    Args:
+        bucket_name (str): The name of the S3 bucket.
+        object_name (str): The name of the S3 object.
+        size (int): The size of the body that was not written.
+    """
+    logger.info(
+        "Skipped updating %s in bucket %s as it is unchanged",
+        object_name,
+        bucket_name,
+        extra={"object": object_name, "bytes_written": 0, "bytes_skipped": size},
+    )
+
+
+def write_s3_body(
+    s3_client: boto3.client, bucket_name: str, object_name: str, body: IO[bytes], extra_args: dict
+) -> bool:
+    """Write an encoded body to S3, in parts if it is at least `MULTIPART_THRESHOLD` bytes.
+
+    Args:
+        s3_client (boto3.client): The S3 client.
+        bucket_name (str): The name of the S3 bucket.
+        object_name (str): The name of the S3 object.
+        body (IO[bytes]): The encoded body, positioned at its start.
+        extra_args (dict): The object's metadata, content type and content encoding.
+
+    Returns:
+        bool: True if the write was successful, False otherwise.
+    """
+    size = body.seek(0, io.SEEK_END)
+    body.seek(0)
+
+    if size >= MULTIPART_THRESHOLD:
+        if not upload_in_parts(s3_client, bucket_name, object_name, body, extra_args):
+            return False
+    else:
+        try:
+            s3_client.put_object(
+                Bucket=bucket_name, Key=object_name, Body=body.read(), **extra_args
+            )
+        except ClientError as e:
+            logger.error("Failed to update %s in bucket %s: %s", object_name, bucket_name, e)
+            return False
+
+    logger.info(
+        "Successfully updated %s in bucket %s",
+        object_name,
+        bucket_name,
+        extra={"object": object_name, "bytes_written": size, "bytes_skipped": 0},
+    )
+    return True
+
+
+def upload_in_parts(
+    s3_client: boto3.client, bucket_name: str, object_name: str, body: IO[bytes], extra_args: dict
+) -> bool:
+    """Upload a large body to S3 in parts, several at once.
+
+    boto3's transfer manager is imported the first time a body is large enough to need it.
+
+    Args:
+        s3_client (boto3.client): The S3 client.
+        bucket_name (str): The name of the S3 bucket.
+        object_name (str): The name of the S3 object.
+        body (IO[bytes]): The encoded body, positioned at its start.
+        extra_args (dict): The object's metadata, content type and content encoding.
+
+    Returns:
+        bool: True if the upload was successful, False otherwise.
+    """
+    transfer = importlib.import_module("boto3.s3.transfer")
+    exceptions = importlib.import_module("boto3.exceptions")
+
+    try:
+        s3_client.upload_fileobj(
+            Fileobj=body,
+            Bucket=bucket_name,
+            Key=object_name,
+            ExtraArgs=extra_args,
+            Config=transfer.TransferConfig(
+                multipart_threshold=MULTIPART_THRESHOLD, max_concurrency=S3_MAX_WORKERS
+            ),
+        )
+    except (ClientError, exceptions.S3UploadFailedError) as e:
+        logger.error("Failed to update %s in bucket %s: %s", object_name, bucket_name, e)
+        return False
+    return True
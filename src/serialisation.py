@@ -0,0 +1,516 @@
+"""Serialisation of the JSON objects stored in S3.
+
+Objects can be written as indented JSON (the original format), compact JSON or NDJSON, and
+optionally compressed with gzip or zstd. Readers detect the format from the object's
+`Content-Type` and from the compression magic bytes, so objects written in any format,
+including those written before these options existed, can be read back without configuration.
+
+Lists too large to hold in memory at once are read with `iter_json_list`, which decompresses
+and parses the body a chunk at a time and yields one item at a time, and written with
+`JsonListWriter`, which encodes one item at a time into a file that spills to disk.
+
+zstd compression needs the optional `zstandard` package, installed with the `zstd` extra. If it
+is not installed, gzip is used instead and a warning is logged.
+"""
+
+import codecs
+import gzip
+import hashlib
+import json
+import logging
+import tempfile
+import zlib
+from collections.abc import Callable, Iterable, Iterator
+from typing import IO, Any, BinaryIO, Optional
+
+from src.instrumentation import traced
+from src.records import encode_record
+
+try:
+    import zstandard
+except ImportError:
+    zstandard = None
+
+logger = logging.getLogger()
+
+JSON_STYLES = ("indent", "compact", "ndjson")
+COMPRESSIONS = ("none", "gzip", "zstd")
+
+JSON_CONTENT_TYPE = "application/json"
+NDJSON_CONTENT_TYPE = "application/x-ndjson"
+
+GZIP_MAGIC = b"\x1f\x8b"
+ZSTD_MAGIC = b"\x28\xb5\x2f\xfd"
+
+# Size of each read from a streamed body, in bytes
+STREAM_CHUNK_SIZE = 1024 * 1024
+
+JSON_WHITESPACE = " \t\n\r"
+
+
+@traced(name="json:encode")
+def encode_json(data: Any, style: str = "indent", compression: str = "none") -> tuple[bytes, dict]:
+    """Encodes data for storage in S3.
+
+    Args:
+        data (Any): The JSON serialisable data to encode.
+        style (str): One of "indent", "compact" or "ndjson". NDJSON writes one list item per
+            line, so data that is not a list is written as compact JSON instead.
+        compression (str): One of "none", "gzip" or "zstd".
+
+    Returns:
+        tuple[bytes, dict]: The encoded body, and the `ContentType` and `ContentEncoding`
+            arguments to pass to put_object.
+    """
+    content_type = JSON_CONTENT_TYPE
+
+    if style == "ndjson" and isinstance(data, list):
+        body = "".join(
+            json.dumps(item, separators=(",", ":"), default=encode_record) + "\n" for item in data
+        )
+        content_type = NDJSON_CONTENT_TYPE
+    elif style in ("compact", "ndjson"):
+        body = json.dumps(data, separators=(",", ":"), default=encode_record)
+    else:
+        body = json.dumps(data, indent=4, default=encode_record)
+
+    encoded = body.encode("utf-8")
+    metadata = {"ContentType": content_type}
+
+    if compression == "zstd":
+        zstd_compressor = get_zstd_compressor()
+        if zstd_compressor is not None:
+            metadata["ContentEncoding"] = "zstd"
+            return zstd_compressor.compress(encoded), metadata
+
+        logger.warning("zstandard is not installed. Using gzip instead. Install the zstd extra")
+        compression = "gzip"
+
+    if compression == "gzip":
+        metadata["ContentEncoding"] = "gzip"
+        return gzip.compress(encoded, mtime=0), metadata
+
+    return encoded, metadata
+
+
+@traced(name="json:decode")
+def decode_json(
+    body: bytes,
+    content_type: Optional[str] = None,
+    object_pairs_hook: Optional[Callable[[list], Any]] = None,
+) -> Any:
+    """Decodes an object stored in S3, in any of the formats written by `encode_json`.
+
+    Args:
+        body (bytes): The raw body of the object.
+        content_type (Optional[str]): The object's `ContentType`, if known.
+        object_pairs_hook (Optional[Callable[[list], Any]]): Passed to json.loads, to decode
+            each JSON object into something other than a dict.
+
+    Returns:
+        Any: The decoded data.
+    """
+    if body.startswith(GZIP_MAGIC):
+        body = gzip.decompress(body)
+    elif body.startswith(ZSTD_MAGIC):
+        zstd_decompressor = get_zstd_decompressor()
+        if zstd_decompressor is None:
+            raise ValueError("Object is zstd compressed, but zstandard is not installed")
+        body = zstd_decompressor.decompressobj().decompress(body)
+
+    text = body.decode("utf-8")
+
+    if content_type == NDJSON_CONTENT_TYPE:
+        return [
+            json.loads(line, object_pairs_hook=object_pairs_hook)
+            for line in text.splitlines()
+            if line.strip()
+        ]
+
+    return json.loads(text, object_pairs_hook=object_pairs_hook)
+
+
+def decode_s3_response(
+    response: dict, object_pairs_hook: Optional[Callable[[list], Any]] = None
+) -> Any:
+    """Decodes the body of an S3 get_object response.
+
+    Args:
+        response (dict): The response of get_object.
+        object_pairs_hook (Optional[Callable[[list], Any]]): Passed to json.loads, to decode
+            each JSON object into something other than a dict.
+
+    Returns:
+        Any: The decoded data.
+    """
+    return decode_json(response["Body"].read(), response.get("ContentType"), object_pairs_hook)
+
+
+def iter_decompressed(stream: BinaryIO, chunk_size: int = STREAM_CHUNK_SIZE) -> Iterator[bytes]:
+    """Reads a body a chunk at a time, decompressing it if it is gzip or zstd compressed.
+
+    Args:
+        stream (BinaryIO): The raw body, such as the `Body` of a get_object response.
+        chunk_size (int): The number of bytes to read at a time.
+
+    Yields:
+        bytes: The next chunk of the decompressed body.
+    """
+    head = b""
+    while len(head) < len(ZSTD_MAGIC):
+        chunk = stream.read(chunk_size)
+        if not chunk:
+            break
+        head += chunk
+
+    decompressor = None
+    if head.startswith(GZIP_MAGIC):
+        decompressor = zlib.decompressobj(wbits=zlib.MAX_WBITS | 16)
+    elif head.startswith(ZSTD_MAGIC):
+        zstd_decompressor = get_zstd_decompressor()
+        if zstd_decompressor is None:
+            raise ValueError("Object is zstd compressed, but zstandard is not installed")
+        decompressor = zstd_decompressor.decompressobj()
+
+    chunk = head
+    while chunk:
+        yield chunk if decompressor is None else decompressor.decompress(chunk)
+        chunk = stream.read(chunk_size)
+
+    if decompressor is not None:
+        yield decompressor.flush()
+
+
+def iter_json_list(
+    stream: BinaryIO, content_type: Optional[str] = None, chunk_size: int = STREAM_CHUNK_SIZE
+) -> Iterator[Any]:
+    """Decodes a list stored in S3 one item at a time, in any of the formats of `encode_json`.
+
+    Only the item being parsed is held in memory, besides a chunk of the body, so the list can
+    be merged and written back out without ever holding all of it.
+
+    Args:
+        stream (BinaryIO): The raw body, such as the `Body` of a get_object response.
+        content_type (Optional[str]): The object's `ContentType`, if known.
+        chunk_size (int): The number of bytes to read at a time.
+
+    Yields:
+        Any: The next item of the list.
+
+    Raises:
+        ValueError: If the body is not a JSON list, or is truncated.
+    """
+    text_decoder = codecs.getincrementaldecoder("utf-8")()
+    texts = (text_decoder.decode(chunk) for chunk in iter_decompressed(stream, chunk_size))
+
+    if content_type == NDJSON_CONTENT_TYPE:
+        yield from iter_json_lines(texts)
+    else:
+        yield from JsonListReader(texts)
+
+    # Raises if the body ends part way through a character
+    text_decoder.decode(b"", final=True)
+
+
+def iter_json_lines(texts: Iterable[str]) -> Iterator[Any]:
+    """Decodes NDJSON one line at a time.
+
+    Args:
+        texts (Iterable[str]): The text, in chunks of any size.
+
+    Yields:
+        Any: The value on the next non-blank line.
+    """
+    parts: list[str] = []
+    for text in texts:
+        *lines, rest = text.split("\n")
+        if lines:
+            lines[0] = "".join(parts) + lines[0]
+            parts = []
+        parts.append(rest)
+
+        for line in lines:
+            if line.strip():
+                yield json.loads(line)
+
+    line = "".join(parts)
+    if line.strip():
+        yield json.loads(line)
+
+
+class JsonListReader:  # pylint: disable=too-few-public-methods
+    """Parses the items of a JSON list one at a time, from its text in chunks of any size.
+
+    Each item is decoded with `json.JSONDecoder.raw_decode` once enough of the text has been
+    read. An item that does not fit in the text read so far is retried after at least doubling
+    it, so large items are not parsed over and over.
+    """
+
+    def __init__(self, texts: Iterable[str]) -> None:
+        """Creates a JsonListReader.
+
+        Args:
+            texts (Iterable[str]): The text of the list, in chunks of any size.
+        """
+        self.texts = iter(texts)
+        self.buffer = ""
+        self.position = 0
+        self._decoder = json.JSONDecoder()
+
+    def __iter__(self) -> Iterator[Any]:
+        """Parses the list.
+
+        Yields:
+            Any: The next item of the list.
+
+        Raises:
+            ValueError: If the text is not a JSON list, or is truncated.
+        """
+        if self._next_char() != "[":
+            raise ValueError("Expected a JSON list")
+        self.position += 1
+
+        if self._next_char() == "]":
+            self.position += 1
+        else:
+            while True:
+                yield self._decode_item()
+
+                char = self._next_char()
+                self.position += 1
+                if char == "]":
+                    break
+                if char != ",":
+                    raise ValueError(f"Expected ',' or ']' in JSON list, found {char!r}")
+
+        if self._next_char() is not None:
+            raise ValueError("Extra data after JSON list")
+
+    def _read(self, min_chars: int = 1) -> bool:
+        """Reads more of the text, dropping what has already been parsed.
+
+        Args:
+            min_chars (int): The number of characters to read at least, unless the text ends.
+
+        Returns:
+            bool: True if any text was read, False if the text has ended.
+        """
+        parts = [self.buffer[self.position :]]
+        self.position = 0
+        no_read = 0
+
+        while no_read < min_chars:
+            text = next(self.texts, None)
+            if text is None:
+                break
+            parts.append(text)
+            no_read += len(text)
+
+        self.buffer = "".join(parts)
+        return no_read > 0
+
+    def _next_char(self) -> Optional[str]:
+        """Skips whitespace, and gets the next character without consuming it.
+
+        Returns:
+            Optional[str]: The next character, or None if the text has ended.
+        """
+        while True:
+            while (
+                self.position < len(self.buffer) and self.buffer[self.position] in JSON_WHITESPACE
+            ):
+                self.position += 1
+
+            if self.position < len(self.buffer):
+                return self.buffer[self.position]
+            if not self._read():
+                return None
+
+    def _decode_item(self) -> Any:
+        """Decodes the next item.
+
+        Returns:
+            Any: The item.
+
+        Raises:
+            json.JSONDecodeError: If the item is not valid JSON, or the text ends part way
+                through it.
+        """
+        self._next_char()
+
+        while True:
+            remaining = len(self.buffer) - self.position
+            try:
+                item, end = self._decoder.raw_decode(self.buffer, self.position)
+            except json.JSONDecodeError:
+                if self._read(remaining):
+                    continue
+                raise
+
+            # A number that ends with the text read so far may continue in the next chunk
+            is_scalar = self.buffer[self.position] not in '{["'
+            if end == len(self.buffer) and is_scalar and self._read(remaining):
+                continue
+
+            self.position = end
+            return item
+
+
+class JsonListWriter:
+    """Encodes a list one item at a time, in the format and with the body `encode_json` would.
+
+    The body is written to a temporary file, which is kept in memory until it grows past
+    `max_memory` bytes and then moves to disk. Its size and digests are kept as it is written,
+    so it can be compared with the stored object without reading it back.
+
+    zstd is compressed as a stream, which omits the content size from the frame header, so the
+    body differs from the one `encode_json` writes for the same data.
+    """
+
+    def __init__(
+        self, style: str = "indent", compression: str = "none", max_memory: int = 8 * 1024 * 1024
+    ) -> None:
+        """Creates a JsonListWriter.
+
+        Args:
+            style (str): One of "indent", "compact" or "ndjson".
+            compression (str): One of "none", "gzip" or "zstd".
+            max_memory (int): The size the body can reach before it is moved to disk.
+        """
+        self.style = style
+        # The body is closed by __exit__
+        # pylint: disable-next=consider-using-with
+        self.body = tempfile.SpooledTemporaryFile(max_size=max_memory)  # noqa: SIM115
+        self.size = 0
+        self.hashes = (hashlib.sha256(), hashlib.md5(usedforsecurity=False))
+        self.no_items = 0
+
+        content_type = NDJSON_CONTENT_TYPE if style == "ndjson" else JSON_CONTENT_TYPE
+        self.metadata = {"ContentType": content_type}
+
+        if compression == "zstd":
+            zstd_compressor = get_zstd_compressor()
+            if zstd_compressor is not None:
+                self.metadata["ContentEncoding"] = "zstd"
+                self._compressor = zstd_compressor.compressobj()
+                return
+
+            logger.warning("zstandard is not installed. Using gzip instead. Install the zstd extra")
+            compression = "gzip"
+
+        self._compressor = None
+        if compression == "gzip":
+            self.metadata["ContentEncoding"] = "gzip"
+            # The same settings as gzip.compress with mtime=0
+            self._compressor = zlib.compressobj(9, zlib.DEFLATED, zlib.MAX_WBITS | 16)
+
+    def __enter__(self) -> "JsonListWriter":
+        """Returns the writer, whose body is closed on exit."""
+        return self
+
+    def __exit__(self, *exc_info: Any) -> None:
+        """Closes the body, deleting it if it was moved to disk."""
+        self.body.close()
+
+    def write(self, item: Any) -> None:
+        """Encodes the next item of the list.
+
+        Args:
+            item (Any): The JSON serialisable item.
+        """
+        if self.style == "ndjson":
+            text = json.dumps(item, separators=(",", ":"), default=encode_record) + "\n"
+        elif self.style == "compact":
+            text = ("," if self.no_items else "[") + json.dumps(
+                item, separators=(",", ":"), default=encode_record
+            )
+        else:
+            # Nested one level inside the list, as json.dumps(data, indent=4) would indent it
+            text = (",\n    " if self.no_items else "[\n    ") + json.dumps(
+                item, indent=4, default=encode_record
+            ).replace("\n", "\n    ")
+
+        self.no_items += 1
+        self._write(text.encode("utf-8"))
+
+    def close(self) -> IO[bytes]:
+        """Ends the list.
+
+        Returns:
+            IO[bytes]: The encoded body, positioned at its start.
+        """
+        if self.style == "compact":
+            self._write(b"]" if self.no_items else b"[]")
+        elif self.style != "ndjson":
+            self._write(b"\n]" if self.no_items else b"[]")
+
+        if self._compressor is not None:
+            self._write_body(self._compressor.flush())
+
+        self.body.seek(0)
+        return self.body
+
+    def digests(self) -> tuple[str, str]:
+        """Gets the digests of the body written so far.
+
+        Returns:
+            tuple[str, str]: The SHA-256 and MD5 hex digests of the body.
+        """
+        sha256, md5 = self.hashes
+        return sha256.hexdigest(), md5.hexdigest()
+
+    def _write(self, data: bytes) -> None:
+        """Writes encoded text, compressing it if needed.
+
+        Args:
+            data (bytes): The encoded text.
+        """
+        if self._compressor is not None:
+            data = self._compressor.compress(data)
+        self._write_body(data)
+
+    def _write_body(self, data: bytes) -> None:
+        """Writes to the body, updating its size and digests.
+
+        Args:
+            data (bytes): The next bytes of the body.
+        """
+        self.body.write(data)
+        self.size += len(data)
+        for digest in self.hashes:
+            digest.update(data)
+
+
+def get_content_hash(data: Any) -> str:
+    """Gets a hash of JSON serialisable data, independent of key order and formatting.
+
+    Args:
+        data (Any): The data to hash.
+
+    Returns:
+        str: The SHA-256 hex digest of the canonical JSON encoding of the data.
+    """
+    canonical = json.dumps(data, sort_keys=True, separators=(",", ":"), default=encode_record)
+    return hashlib.sha256(canonical.encode("utf-8")).hexdigest()
+
+
+def get_zstd_compressor() -> Any:
+    """Gets a zstd compressor, if the optional zstandard package is installed.
+
+    Returns:
+        Any: A zstandard.ZstdCompressor, or None.
+    """
+    if zstandard is None:
+        return None
+    return zstandard.ZstdCompressor()
+
+
+def get_zstd_decompressor() -> Any:
+    """Gets a zstd decompressor, if the optional zstandard package is installed.
+
+    Returns:
+        Any: A zstandard.ZstdDecompressor, or None.
+    """
+    if zstandard is None:
+        return None
+    return zstandard.ZstdDecompressor()
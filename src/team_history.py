@@ -0,0 +1,174 @@
+"""Storage of the team history, in `teams_history.json` or one shard per team.
+
+The team history holds every day of every team's metrics, so it is by far the largest object
+the lambda reads. Once the manifest has planned which teams have new days, the stored history
+is read, merged and written back one team at a time: each entry is parsed from the S3 body as
+it arrives, has its new days upserted, and is encoded into the new body before the next entry
+is read. The memory a run needs then depends on the largest team, not on the whole history.
+
+With the sharded layout, each team's history is stored in its own object under
+`teams_history/`, with an index of every shard's watermark.
+"""
+
+from __future__ import annotations
+
+import logging
+from collections.abc import Iterable, Iterator
+from typing import TYPE_CHECKING
+
+from botocore.exceptions import ClientError
+
+from src.date_index import DateIndex, filter_team_history
+from src.s3_objects import BUCKET_NAME, update_s3_list, update_s3_object, update_s3_objects
+from src.serialisation import get_content_hash, iter_json_list
+
+if TYPE_CHECKING:
+    import boto3
+
+logger = logging.getLogger()
+
+TEAMS_HISTORY_OBJECT = "teams_history.json"
+
+# Each team's latest date, number of days and content hash in teams_history.json
+# Runs plan their requests from this, and only read teams_history.json if a team has new days
+TEAMS_HISTORY_MANIFEST = "teams_history_manifest.json"
+
+# One object per team with the sharded layout, and an index of each shard's watermark
+TEAMS_HISTORY_PREFIX = "teams_history/"
+TEAMS_HISTORY_INDEX = f"{TEAMS_HISTORY_PREFIX}index.json"
+
+
+def get_team_watermark(entry: dict) -> dict:
+    """Gets the summary of a team's history stored in the manifest and the shard index.
+
+    Args:
+        entry (dict): The team's history, with its `team` and `data`.
+
+    Returns:
+        dict: The number of days stored, the latest date and a hash of the team's history.
+    """
+    return {
+        "no_days": len(entry["data"]),
+        "latest": max((day["date"] for day in entry["data"]), default=None),
+        "hash": get_content_hash(entry),
+    }
+
+
+def merge_team_history(
+    entries: Iterable[dict], copilot_teams: list, new_history: dict
+) -> Iterator[dict]:
+    """Merges new days into a team history, one team at a time.
+
+    Args:
+        entries (Iterable[dict]): The stored history of each team, with its `team` and `data`.
+        copilot_teams (list): List of teams with Copilot data, in the order new teams are added.
+        new_history (dict): Each team's new days, keyed by team name.
+
+    Yields:
+        dict: Each stored team's history, with its new days upserted, followed by the history
+            of each team in `new_history` that was not stored.
+    """
+    remaining = dict(new_history)
+
+    for entry in entries:
+        new_days = remaining.pop(entry["team"]["name"], None)
+        if new_days:
+            # The last known day is returned again and replaced
+            date_index = DateIndex(entry["data"])
+            for day in filter_team_history(new_days, date_index.latest):
+                date_index.upsert(day)
+        yield entry
+
+    for team in copilot_teams:
+        new_days = remaining.pop(team.get("name", ""), None)
+        if new_days:
+            yield {"team": team, "data": list(new_days)}
+
+
+def stream_team_history(
+    s3: boto3.client, copilot_teams: list, new_history: dict, manifest: dict
+) -> bool:
+    """Merges new days into `teams_history.json` as it is read, and updates the manifest.
+
+    Args:
+        s3 (boto3.client): An S3 client.
+        copilot_teams (list): List of teams with Copilot data.
+        new_history (dict): Each team's new days, keyed by team name, as planned from the
+            manifest.
+        manifest (dict): Each team's watermark, keyed by team name, which is updated in place
+            once the team history is written.
+
+    Returns:
+        bool: True if the team history and manifest are up to date in S3.
+    """
+    try:
+        response = s3.get_object(Bucket=BUCKET_NAME, Key=TEAMS_HISTORY_OBJECT)
+    except ClientError as e:
+        # Writing only the new days would overwrite the stored history
+        logger.error("Error retrieving existing team history: %s", e)
+        return False
+
+    entries = iter_json_list(response["Body"], response.get("ContentType"))
+    watermarks = {}
+
+    def merge() -> Iterator[dict]:
+        for entry in merge_team_history(entries, copilot_teams, new_history):
+            if entry["team"]["name"] in new_history:
+                watermarks[entry["team"]["name"]] = get_team_watermark(entry)
+            yield entry
+
+    if not update_s3_list(s3, BUCKET_NAME, TEAMS_HISTORY_OBJECT, merge()):
+        return False
+
+    logger.info(
+        "Team history merged from %s as it was read",
+        TEAMS_HISTORY_OBJECT,
+        extra={"no_teams_updated": len(watermarks)},
+    )
+
+    # The manifest is written last, so it never describes history that was not stored
+    manifest.update(watermarks)
+    return update_s3_object(s3, BUCKET_NAME, TEAMS_HISTORY_MANIFEST, manifest)
+
+
+def get_team_shard_name(team: dict) -> str:
+    """Gets the S3 object name of a team's history shard.
+
+    Args:
+        team (dict): The team, with a `slug` and `name`.
+
+    Returns:
+        str: The S3 object name, using the team's slug, or its name if it has no slug.
+    """
+    return f"{TEAMS_HISTORY_PREFIX}{team.get('slug') or team['name']}.json"
+
+
+def write_team_shards(s3: boto3.client, pending: dict, index: dict) -> tuple[bool, int]:
+    """Writes the shards of teams whose history has changed, and updates their index entries.
+
+    Args:
+        s3 (boto3.client): An S3 client.
+        pending (dict): The history of each team to write, keyed by team name.
+        index (dict): The shard index, which is updated in place.
+
+    Returns:
+        tuple[bool, int]: True if every changed shard was written, and the number written.
+    """
+    changed = {}
+    for team_name, entry in pending.items():
+        watermark = get_team_watermark(entry)
+        if index.get(team_name, {}).get("hash") != watermark["hash"]:
+            changed[team_name] = (get_team_shard_name(entry["team"]), watermark)
+
+    # The changed shards are written concurrently
+    written = update_s3_objects(
+        s3,
+        BUCKET_NAME,
+        {object_name: pending[team_name] for team_name, (object_name, _) in changed.items()},
+    )
+
+    for team_name, (object_name, watermark) in changed.items():
+        if written[object_name]:
+            index[team_name] = {"object": object_name, **watermark}
+
+    return all(written.values()), sum(written.values())
@@ -0,0 +1,288 @@
+"""Clients and credentials reused across warm Lambda invocations.
+
+Lambda keeps a container's module state between invocations. The boto3 session and clients,
+the GitHub App's private key and the installation token are kept here, so a warm invocation
+can skip creating clients, reading the secret and minting a token. The token is replaced
+shortly before it expires, or straight away if GitHub rejects it.
+
+boto3 and github_api_toolkit are slow to import, so they are imported the first time a client or
+token is needed rather than when the module is loaded.
+"""
+
+from __future__ import annotations
+
+import importlib
+import logging
+import threading
+from datetime import UTC, datetime, timedelta
+from http import HTTPStatus
+from typing import TYPE_CHECKING, Any, Optional
+
+from requests import Response
+
+from src.http_pool import PooledHTTPAdapter, mount_adapter
+from src.rate_limit import get_response
+
+if TYPE_CHECKING:
+    import boto3
+    from requests.adapters import BaseAdapter
+
+logger = logging.getLogger()
+
+# Installation tokens are replaced this long before they expire
+TOKEN_EXPIRY_MARGIN = timedelta(minutes=5)
+
+# How long an installation token lasts, if GitHub does not say
+TOKEN_LIFETIME = timedelta(hours=1)
+
+_cache: dict = {}
+_lock = threading.RLock()
+
+
+def clear_cache() -> None:
+    """Forgets every cached client and credential, so the next invocation starts cold."""
+    with _lock:
+        _cache.clear()
+
+
+def is_warm() -> bool:
+    """Checks whether an earlier invocation in this container has already created the clients.
+
+    Returns:
+        bool: True if the boto3 session is cached.
+    """
+    with _lock:
+        return "session" in _cache
+
+
+def get_session() -> boto3.Session:
+    """Gets the boto3 session, creating it on the first invocation.
+
+    Returns:
+        boto3.Session: The session.
+    """
+    with _lock:
+        if "session" not in _cache:
+            _cache["session"] = importlib.import_module("boto3").Session()
+        return _cache["session"]
+
+
+def get_client(service_name: str, **kwargs: Any) -> boto3.client:
+    """Gets a boto3 client, creating it the first time it is needed.
+
+    Args:
+        service_name (str): The AWS service, such as "s3".
+        **kwargs (Any): Passed through to Session.client, such as `region_name`.
+
+    Returns:
+        boto3.client: The client.
+    """
+    key = ("client", service_name, tuple(sorted(kwargs.items())))
+    with _lock:
+        if key not in _cache:
+            _cache[key] = get_session().client(service_name, **kwargs)
+        return _cache[key]
+
+
+def get_github_adapter(pool_size: int, timeout: tuple[float, float]) -> PooledHTTPAdapter:
+    """Gets the connection pool for GitHub API requests, creating it on the first invocation.
+
+    The pool is kept between invocations, so a warm invocation can reuse its open connections.
+
+    Args:
+        pool_size (int): The maximum number of connections kept open.
+        timeout (tuple[float, float]): The connect and read timeouts, in seconds.
+
+    Returns:
+        PooledHTTPAdapter: The adapter holding the pool.
+    """
+    key = ("github_adapter", pool_size, timeout)
+    with _lock:
+        if key not in _cache:
+            _cache[key] = PooledHTTPAdapter(pool_size, timeout)
+        adapter: PooledHTTPAdapter = _cache[key]
+        return adapter
+
+
+def get_secret(secret_name: Optional[str], region_name: Optional[str]) -> str:
+    """Gets a secret from AWS Secrets Manager, reading it the first time it is needed.
+
+    Args:
+        secret_name (Optional[str]): The name of the secret.
+        region_name (Optional[str]): The region of the secret.
+
+    Returns:
+        str: The secret string.
+    """
+    key = ("secret", secret_name, region_name)
+    with _lock:
+        if key not in _cache:
+            secret_manager = get_client("secretsmanager", region_name=region_name)
+            _cache[key] = secret_manager.get_secret_value(SecretId=secret_name)["SecretString"]
+        secret: str = _cache[key]
+        return secret
+
+
+def get_token_expiry(access_token: tuple, now: datetime) -> datetime:
+    """Gets when an installation token expires.
+
+    Args:
+        access_token (tuple): The token as returned by get_token_as_installation, followed by its
+            `expires_at` time if GitHub returned one.
+        now (datetime): When the token was minted.
+
+    Returns:
+        datetime: The expiry time, or `TOKEN_LIFETIME` from now if it is not known.
+    """
+    if len(access_token) > 1 and isinstance(access_token[1], str):
+        try:
+            return datetime.fromisoformat(access_token[1].replace("Z", "+00:00"))
+        except ValueError:
+            pass
+    return now + TOKEN_LIFETIME
+
+
+def get_installation_token(
+    org: Optional[str], secret: str, client_id: Optional[str], refresh: bool = False
+) -> tuple | str:
+    """Gets a GitHub App installation token, minting a new one if it is about to expire.
+
+    Args:
+        org (Optional[str]): The GitHub organisation.
+        secret (str): The GitHub App's private key.
+        client_id (Optional[str]): The GitHub App's client ID.
+        refresh (bool): Mint a new token even if the cached one has not expired.
+
+    Returns:
+        tuple | str: The token as returned by get_token_as_installation, or its error message.
+    """
+    key = ("token", org, client_id)
+    now = datetime.now(UTC)
+
+    with _lock:
+        cached = _cache.get(key)
+        if cached and not refresh and cached["expires_at"] - TOKEN_EXPIRY_MARGIN > now:
+            cached_token: tuple = cached["access_token"]
+            return cached_token
+
+        get_token_as_installation = importlib.import_module(
+            "github_api_toolkit"
+        ).get_token_as_installation
+        access_token: tuple | str = get_token_as_installation(org, secret, client_id)
+        if isinstance(access_token, str):
+            _cache.pop(key, None)
+            return access_token
+
+        _cache[key] = {
+            "access_token": access_token,
+            "expires_at": get_token_expiry(access_token, now),
+        }
+        return access_token
+
+
+class TokenRefreshingInterface:  # pylint: disable=too-many-instance-attributes
+    """Sends requests through a github_interface, replacing its token if GitHub rejects it.
+
+    When a request gets 401 Unauthorized, a new installation token is minted, the
+    github_interface is replaced and the request is sent once more. Any attribute other than
+    `get` is passed through to the current github_interface.
+
+    If an adapter is given, it is mounted on the session of every github_interface created, so
+    requests made with a refreshed token keep using the same connections.
+    """
+
+    def __init__(
+        self,
+        org: Optional[str],
+        secret: str,
+        client_id: Optional[str],
+        token: str,
+        adapter: Optional[BaseAdapter] = None,
+    ) -> None:
+        """Creates a TokenRefreshingInterface.
+
+        Args:
+            org (Optional[str]): The GitHub organisation.
+            secret (str): The GitHub App's private key.
+            client_id (Optional[str]): The GitHub App's client ID.
+            token (str): The installation token to start with.
+            adapter (Optional[BaseAdapter]): The transport adapter to send requests through.
+        """
+        self.org = org
+        self.secret = secret
+        self.client_id = client_id
+        self.token = token
+        self.adapter = adapter
+        self.gh = self.create_interface(token)
+        self.no_token_refreshes = 0
+        self._lock = threading.Lock()
+
+    def __getattr__(self, name: str) -> Any:
+        """Passes any other attribute through to the current github_interface."""
+        if name == "gh":
+            raise AttributeError(name)
+        return getattr(self.gh, name)
+
+    def create_interface(self, token: str) -> Any:
+        """Creates a github_interface, mounting the adapter on its session.
+
+        Args:
+            token (str): The installation token.
+
+        Returns:
+            Any: The github_interface.
+        """
+        gh = importlib.import_module("github_api_toolkit").github_interface(token)
+        if self.adapter is not None:
+            mount_adapter(gh, self.adapter)
+        return gh
+
+    def get(self, url: str, *args: Any, **kwargs: Any) -> Response | Exception:
+        """Sends a GET request, refreshing the token and retrying once if it is rejected.
+
+        Args:
+            url (str): The API endpoint to request.
+            *args (Any): Passed through to github_interface.get.
+            **kwargs (Any): Passed through to github_interface.get.
+
+        Returns:
+            Response | Exception: The value returned by github_interface.get.
+        """
+        token, gh = self.token, self.gh
+        result: Response | Exception = gh.get(url, *args, **kwargs)
+
+        response = get_response(result)
+        if response is None or response.status_code != HTTPStatus.UNAUTHORIZED:
+            return result
+
+        if not self.refresh(token):
+            return result
+
+        result = self.gh.get(url, *args, **kwargs)
+        return result
+
+    def refresh(self, rejected_token: Optional[str] = None) -> bool:
+        """Replaces the installation token, unless another request already has.
+
+        Args:
+            rejected_token (Optional[str]): The token GitHub rejected.
+
+        Returns:
+            bool: True if there is a new token to retry with.
+        """
+        with self._lock:
+            if rejected_token is not None and rejected_token != self.token:
+                return True
+
+            access_token = get_installation_token(
+                self.org, self.secret, self.client_id, refresh=True
+            )
+            if isinstance(access_token, str):
+                logger.error("Error refreshing access token: %s", access_token)
+                return False
+
+            logger.info("Access token refreshed after it was rejected")
+            self.token = access_token[0]
+            self.gh = self.create_interface(self.token)
+            self.no_token_refreshes += 1
+            return True
@@ -50,9 +50,10 @@ data "aws_iam_policy_document" "lambda_s3_policy" {
     effect = "Allow"
 
     actions = [
-      "s3:ListAllMyBuckets", # Allows listing all buckets in the account
-      "s3:GetObject",        # Allows reading objects in buckets
-      "s3:PutObject",        # Allows writing objects to buckets
+      "s3:ListAllMyBuckets",      # Allows listing all buckets in the account
+      "s3:GetObject",             # Allows reading objects in buckets
+      "s3:PutObject",             # Allows writing objects to buckets
+      "s3:AbortMultipartUpload",  # Allows cleaning up the parts of a failed multipart upload
       "s3:ListBucket"
     ]
 
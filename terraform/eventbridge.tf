@@ -18,7 +18,7 @@ module "eventbridge" {
       {
         name  = "${var.lambda_name}-function-cron"
         arn   = aws_lambda_function.lambda_function.arn
-        input = jsonencode({})
+        input = var.fanout_shards > 1 ? jsonencode({ mode = "coordinator" }) : jsonencode({})
       }
     ]
   }
@@ -53,6 +53,8 @@ resource "aws_lambda_function" "lambda_function" {
       GITHUB_APP_CLIENT_ID = var.github_app_client_id
       AWS_SECRET_NAME      = var.aws_secret_name
       AWS_ACCOUNT_NAME     = var.env_name
+      GITHUB_MAX_WORKERS   = var.github_max_workers
+      FANOUT_SHARDS        = var.fanout_shards
     }
   }
 }
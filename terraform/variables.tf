@@ -71,6 +71,18 @@ variable "github_app_client_id" {
   type        = string
 }
 
+variable "github_max_workers" {
+  description = "Maximum number of concurrent GitHub API requests when probing teams"
+  type        = number
+  default     = 10
+}
+
+variable "fanout_shards" {
+  description = "Number of worker invocations to split the teams across. 0 or 1 processes every team in a single invocation"
+  type        = number
+  default     = 0
+}
+
 variable "region" {
   description = "AWS region"
   type        = string
@@ -0,0 +1 @@
+"""Benchmark of the lambda handler against a synthetic organisation, run entirely locally."""
@@ -0,0 +1,7 @@
+"""Runs the benchmark from the command line, with `python -m tests.benchmark`."""
+
+import sys
+
+from tests.benchmark.harness import main
+
+sys.exit(main())
@@ -0,0 +1,701 @@
+"""Benchmark harness running the lambda handler against a synthetic organisation.
+
+The handler runs unchanged, but its GitHub requests are redirected to a local HTTP server
+serving a generated organisation, and its S3 client is replaced by an in-memory stand-in. The
+organisation's size, the share of teams with Copilot metrics, the days of history and the size
+of each day's metrics are configurable, as are the server's latency and rate limit.
+
+The handler runs in a separate process, so its peak RSS is not inflated by the server or the
+generated data. The process is kept between runs, so the first run starts from an empty bucket
+and each later run is a warm invocation reading what the previous one stored.
+
+Run `python -m tests.benchmark --help` for the options.
+"""
+
+from __future__ import annotations
+
+import argparse
+import hashlib
+import importlib
+import json
+import logging
+import multiprocessing
+import os
+import random
+import re
+import resource
+import sys
+import threading
+import time
+from concurrent.futures import ProcessPoolExecutor
+from dataclasses import asdict, dataclass
+from datetime import UTC, date, datetime, timedelta
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from io import BytesIO
+from typing import Any, Optional
+from unittest.mock import patch
+from urllib.parse import parse_qs, urlparse
+
+from botocore.exceptions import ClientError
+
+from src.http_pool import PooledHTTPAdapter
+
+# Organisation served by the local GitHub server
+ORG = "benchmark-org"
+
+# Teams per page of the teams endpoint, as requested by the handler
+TEAMS_PER_PAGE = 100
+
+# Environment of the handler process. Settings the benchmark compares can be overridden
+HANDLER_ENV = {
+    "GITHUB_ORG": ORG,
+    "GITHUB_APP_CLIENT_ID": "benchmark",
+    "AWS_ACCOUNT_NAME": "benchmark",
+    "AWS_SECRET_NAME": "benchmark-secret",
+    "AWS_DEFAULT_REGION": "eu-west-1",
+}
+
+
+@dataclass
+class OrgSpec:
+    """The shape of a synthetic organisation.
+
+    Attributes:
+        teams (int): The number of teams.
+        qualifying_ratio (float): The share of teams with Copilot metrics, from 0 to 1.
+        days (int): The days of metrics history of the organisation and each qualifying team.
+        day_bytes (int): The approximate size of each day's metrics, in bytes of JSON.
+        seed (int): Seeds the generator, so the same spec always gives the same organisation.
+    """
+
+    teams: int = 200
+    qualifying_ratio: float = 0.3
+    days: int = 28
+    day_bytes: int = 2000
+    seed: int = 0
+
+
+class SyntheticOrg:
+    """A generated organisation, with its teams and their Copilot metrics."""
+
+    def __init__(self, spec: OrgSpec, today: Optional[date] = None) -> None:
+        """Generates an organisation.
+
+        Args:
+            spec (OrgSpec): The shape of the organisation.
+            today (Optional[date]): The day the metrics run up to, exclusive. Defaults to today.
+        """
+        rng = random.Random(spec.seed)  # noqa: S311
+        today = today or datetime.now(UTC).date()
+
+        self.spec = spec
+        self.dates = [
+            (today - timedelta(days=offset)).isoformat() for offset in range(spec.days, 0, -1)
+        ]
+        self.teams = [
+            {
+                "id": number,
+                "name": f"team-{number:05d}",
+                "slug": f"team-{number:05d}",
+                "description": "",
+                "html_url": f"https://github.com/orgs/{ORG}/teams/team-{number:05d}",
+            }
+            for number in range(spec.teams)
+        ]
+        self.qualifying = {
+            team["name"] for team in self.teams if rng.random() < spec.qualifying_ratio
+        }
+        self.org_metrics = [self.make_day(rng, day) for day in self.dates]
+        self.team_metrics = {
+            team["name"]: [self.make_day(rng, day) for day in self.dates]
+            for team in self.teams
+            if team["name"] in self.qualifying
+        }
+
+    def make_day(self, rng: random.Random, day: str) -> dict:
+        """Generates one day of metrics, padded with editors to roughly `day_bytes`.
+
+        Args:
+            rng (random.Random): The generator.
+            day (str): The date, as `YYYY-MM-DD`.
+
+        Returns:
+            dict: The day's metrics, in the shape of the GitHub Copilot metrics API.
+        """
+        active = rng.randint(1, 500)
+        record: dict = {
+            "date": day,
+            "total_active_users": active,
+            "total_engaged_users": rng.randint(0, active),
+            "copilot_ide_code_completions": {"total_engaged_users": active, "editors": []},
+        }
+        editors = record["copilot_ide_code_completions"]["editors"]
+        size = len(json.dumps(record))
+        while size < self.spec.day_bytes:
+            editor = {
+                "name": f"editor-{len(editors)}",
+                "total_engaged_users": rng.randint(0, active),
+                "models": [
+                    {
+                        "name": "default",
+                        "is_custom_model": False,
+                        "languages": [
+                            {
+                                "name": f"language-{language}",
+                                "total_code_suggestions": rng.randint(0, 10000),
+                                "total_code_acceptances": rng.randint(0, 5000),
+                            }
+                            for language in range(4)
+                        ],
+                    }
+                ],
+            }
+            editors.append(editor)
+            size += len(json.dumps(editor)) + 2
+        return record
+
+    def get_teams_page(self, page: int) -> tuple[list, int]:
+        """Gets one page of the organisation's teams.
+
+        Args:
+            page (int): The page number, from 1.
+
+        Returns:
+            tuple[list, int]: The teams on the page, and the number of the last page.
+        """
+        last_page = max(1, -(-len(self.teams) // TEAMS_PER_PAGE))
+        start = (page - 1) * TEAMS_PER_PAGE
+        return self.teams[start : start + TEAMS_PER_PAGE], last_page
+
+
+class RateLimit:
+    """A fixed window rate limit, shared by every request to the server."""
+
+    def __init__(self, limit: Optional[int], window: float) -> None:
+        """Creates a RateLimit.
+
+        Args:
+            limit (Optional[int]): The requests allowed per window, or None for no limit.
+            window (float): The length of the window, in seconds.
+        """
+        self.limit = limit
+        self.window = window
+        self.reset_at = time.time() + window
+        self.remaining = limit
+        self._lock = threading.Lock()
+
+    def take(self) -> tuple[bool, dict]:
+        """Counts a request against the limit.
+
+        Returns:
+            tuple[bool, dict]: Whether the request is allowed, and its rate limit headers.
+        """
+        if self.limit is None:
+            return True, {"X-RateLimit-Limit": "5000", "X-RateLimit-Remaining": "5000"}
+
+        with self._lock:
+            now = time.time()
+            if now >= self.reset_at:
+                self.reset_at = now + self.window
+                self.remaining = self.limit
+            allowed = self.remaining > 0
+            if allowed:
+                self.remaining -= 1
+            headers = {
+                "X-RateLimit-Limit": str(self.limit),
+                "X-RateLimit-Remaining": str(self.remaining),
+                # GitHub rounds the reset time down to the whole second
+                "X-RateLimit-Reset": str(int(self.reset_at)),
+            }
+        return allowed, headers
+
+
+class FakeGitHubServer(ThreadingHTTPServer):
+    """A local HTTP server answering the GitHub API requests the handler makes.
+
+    Responses carry an ETag, and requests with a matching `If-None-Match` get 304 Not Modified,
+    as from GitHub. Every request is delayed by `latency` seconds, and once the rate limit is
+    used up requests get 403 until it resets.
+    """
+
+    daemon_threads = True
+
+    def __init__(
+        self, org: SyntheticOrg, latency: float = 0.0, rate_limit: Optional[RateLimit] = None
+    ) -> None:
+        """Creates a FakeGitHubServer on a free local port.
+
+        Args:
+            org (SyntheticOrg): The organisation to serve.
+            latency (float): The delay before each response, in seconds.
+            rate_limit (Optional[RateLimit]): The rate limit. Defaults to no limit.
+        """
+        super().__init__(("127.0.0.1", 0), FakeGitHubHandler)
+        self.org = org
+        self.latency = latency
+        self.rate_limit = rate_limit or RateLimit(None, 3600)
+        self.counters: dict[str, int] = {}
+        self.endpoints: dict[str, int] = {}
+        self._lock = threading.Lock()
+        self._thread: Optional[threading.Thread] = None
+
+    @property
+    def url(self) -> str:
+        """The base URL of the server."""
+        return f"http://127.0.0.1:{self.server_address[1]}"
+
+    def __enter__(self) -> FakeGitHubServer:
+        """Starts serving on a background thread."""
+        self._thread = threading.Thread(target=self.serve_forever, daemon=True)
+        self._thread.start()
+        return self
+
+    def __exit__(self, *args: Any) -> None:
+        """Stops serving and closes the socket."""
+        self.shutdown()
+        self.server_close()
+
+    def count(self, endpoint: str, status: int, body_bytes: int) -> None:
+        """Records a response.
+
+        Args:
+            endpoint (str): The endpoint, with the team name replaced.
+            status (int): The status code.
+            body_bytes (int): The size of the body.
+        """
+        with self._lock:
+            self.endpoints[endpoint] = self.endpoints.get(endpoint, 0) + 1
+            for name, amount in (
+                ("github_requests", 1),
+                ("github_bytes", body_bytes),
+                ("github_not_modified", int(status == 304)),
+                ("github_rate_limited", int(status == 403)),
+            ):
+                self.counters[name] = self.counters.get(name, 0) + amount
+
+    def take_stats(self) -> dict:
+        """Gets the responses recorded since the last call, and starts counting again.
+
+        Returns:
+            dict: The counters, and the number of requests to each endpoint.
+        """
+        with self._lock:
+            stats = {
+                "github_requests": 0,
+                "github_bytes": 0,
+                "github_not_modified": 0,
+                "github_rate_limited": 0,
+                **self.counters,
+                "github_endpoints": dict(sorted(self.endpoints.items())),
+            }
+            self.counters, self.endpoints = {}, {}
+        return stats
+
+
+class FakeGitHubHandler(BaseHTTPRequestHandler):
+    """Answers one request to the FakeGitHubServer."""
+
+    protocol_version = "HTTP/1.1"
+    server: FakeGitHubServer
+
+    def do_GET(self) -> None:
+        """Answers a GET request."""
+        url = urlparse(self.path)
+        query = {name: values[0] for name, values in parse_qs(url.query).items()}
+        endpoint = re.sub(r"/team/[^/]+/", "/team/{team}/", url.path)
+
+        if self.server.latency:
+            time.sleep(self.server.latency)
+
+        allowed, headers = self.server.rate_limit.take()
+        if not allowed:
+            self.respond(endpoint, 403, {"message": "API rate limit exceeded"}, headers)
+            return
+
+        status, data, extra_headers = self.route(url.path, query)
+        self.respond(endpoint, status, data, {**headers, **extra_headers})
+
+    def route(self, path: str, query: dict) -> tuple[int, Any, dict]:
+        """Gets the response to a request.
+
+        Args:
+            path (str): The path of the request.
+            query (dict): The query parameters.
+
+        Returns:
+            tuple[int, Any, dict]: The status code, the data and any extra headers.
+        """
+        org = self.server.org
+        parts = path.strip("/").split("/")
+
+        if parts == ["orgs", ORG, "teams"]:
+            teams, last_page = org.get_teams_page(int(query.get("page", 1)))
+            link = f'<{self.server.url}/orgs/{ORG}/teams?per_page=100&page={last_page}>; rel="last"'
+            return 200, teams, {"Link": link} if last_page > 1 else {}
+
+        if parts == ["orgs", ORG, "copilot", "metrics"]:
+            return 200, self.since(org.org_metrics, query), {}
+
+        if (
+            len(parts) == 6
+            and parts[:3] == ["orgs", ORG, "team"]
+            and parts[4:]
+            == [
+                "copilot",
+                "metrics",
+            ]
+        ):
+            if parts[3] not in {team["name"] for team in org.teams}:
+                return 404, {"message": "Not Found"}, {}
+            return 200, self.since(org.team_metrics.get(parts[3], []), query), {}
+
+        return 404, {"message": "Not Found"}, {}
+
+    @staticmethod
+    def since(days: list, query: dict) -> list:
+        """Filters metrics to the days from the `since` query parameter.
+
+        Args:
+            days (list): The days of metrics.
+            query (dict): The query parameters.
+
+        Returns:
+            list: The days on or after `since`, or every day without it.
+        """
+        since = query.get("since", "")[:10]
+        return [day for day in days if day["date"] >= since]
+
+    def respond(self, endpoint: str, status: int, data: Any, headers: dict) -> None:
+        """Sends a JSON response, or 304 if the client already has it.
+
+        Args:
+            endpoint (str): The endpoint, for the server's counters.
+            status (int): The status code.
+            data (Any): The data to send as JSON.
+            headers (dict): Extra headers.
+        """
+        body = json.dumps(data).encode()
+        etag = f'"{hashlib.sha256(body).hexdigest()[:32]}"'
+        if status == 200 and self.headers.get("If-None-Match") == etag:
+            status, body = 304, b""
+
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(body)))
+        if status in (200, 304):
+            self.send_header("ETag", etag)
+        for name, value in headers.items():
+            self.send_header(name, value)
+        self.end_headers()
+        self.wfile.write(body)
+        self.server.count(endpoint, status, len(body))
+
+    def log_message(self, *args: Any) -> None:
+        """Keeps the server quiet."""
+
+
+class LocalGitHubAdapter(PooledHTTPAdapter):
+    """The handler's connection pool, with requests for the GitHub API sent to a local server."""
+
+    def __init__(self, base_url: str, pool_size: int, timeout: tuple[float, float]) -> None:
+        """Creates a LocalGitHubAdapter.
+
+        Args:
+            base_url (str): The URL of the local server.
+            pool_size (int): The maximum number of connections kept open.
+            timeout (tuple[float, float]): The connect and read timeouts, in seconds.
+        """
+        self.base_url = base_url
+        super().__init__(pool_size, timeout)
+
+    def send(self, request: Any, *args: Any, **kwargs: Any) -> Any:
+        """Sends a request, to the local server if it is for the GitHub API."""
+        request.url = request.url.replace("https://api.github.com", self.base_url, 1)
+        return super().send(request, *args, **kwargs)
+
+
+class FakeS3Client:
+    """An in-memory S3 client, counting the requests made and the bytes read and written."""
+
+    def __init__(self) -> None:
+        """Creates an empty bucket."""
+        self.objects: dict[str, dict] = {}
+        self.counters: dict[str, int] = {}
+        self._lock = threading.Lock()
+
+    def add(self, name: str, amount: int = 1) -> None:
+        """Adds to a counter.
+
+        Args:
+            name (str): The name of the counter.
+            amount (int): The amount to add.
+        """
+        with self._lock:
+            self.counters[name] = self.counters.get(name, 0) + amount
+
+    def take_stats(self) -> dict:
+        """Gets the counters recorded since the last call, and starts counting again.
+
+        Returns:
+            dict: The requests made and the bytes read and written.
+        """
+        with self._lock:
+            stats = {"s3_requests": 0, "s3_bytes_read": 0, "s3_bytes_written": 0, **self.counters}
+            self.counters = {}
+        stats["s3_bytes_stored"] = sum(len(stored["Body"]) for stored in self.objects.values())
+        return stats
+
+    def not_found(self, operation_name: str, code: str) -> Exception:
+        """Creates the error S3 returns for a missing object."""
+        return ClientError(
+            error_response={"Error": {"Code": code, "Message": "Not Found"}},
+            operation_name=operation_name,
+        )
+
+    def get_object(self, Bucket: str, Key: str, **kwargs: Any) -> dict:
+        """Reads an object."""
+        self.add("s3_requests")
+        stored = self.objects.get(Key)
+        if stored is None:
+            raise self.not_found("GetObject", "NoSuchKey")
+        self.add("s3_bytes_read", len(stored["Body"]))
+        return {**stored, "Body": BytesIO(stored["Body"]), "ContentLength": len(stored["Body"])}
+
+    def head_object(self, Bucket: str, Key: str, **kwargs: Any) -> dict:
+        """Reads an object's metadata."""
+        self.add("s3_requests")
+        stored = self.objects.get(Key)
+        if stored is None:
+            raise self.not_found("HeadObject", "404")
+        return {name: value for name, value in stored.items() if name != "Body"}
+
+    def put_object(self, Bucket: str, Key: str, Body: bytes, **kwargs: Any) -> dict:
+        """Writes an object."""
+        self.add("s3_requests")
+        self.add("s3_bytes_written", len(Body))
+        etag = f'"{hashlib.md5(Body).hexdigest()}"'  # noqa: S324
+        self.objects[Key] = {
+            "Body": bytes(Body),
+            "ETag": etag,
+            "ContentType": kwargs.get("ContentType", "binary/octet-stream"),
+            "Metadata": kwargs.get("Metadata", {}),
+            **(
+                {"ContentEncoding": kwargs["ContentEncoding"]}
+                if "ContentEncoding" in kwargs
+                else {}
+            ),
+        }
+        return {"ETag": etag}
+
+    def upload_fileobj(
+        self,
+        Fileobj: Any,
+        Bucket: str,
+        Key: str,
+        ExtraArgs: Optional[dict] = None,
+        **kwargs: Any,
+    ) -> None:
+        """Writes an object from a file, as a multipart upload would."""
+        self.put_object(Bucket, Key, Fileobj.read(), **(ExtraArgs or {}))
+
+
+# State of the handler process, kept between runs
+_state: dict[str, Any] = {}
+
+
+def run_handler(base_url: str, env: dict) -> dict:
+    """Runs the handler once, in the handler process.
+
+    Args:
+        base_url (str): The URL of the local GitHub server.
+        env (dict): The environment to import the handler with, on the first run.
+
+    Returns:
+        dict: The wall time, the handler's result, the S3 counters and the peak RSS so far.
+    """
+    if not _state:
+        os.environ.update(env)
+        # The handler's logs would drown out the report, and its result says if a run failed
+        logging.disable(logging.CRITICAL)
+        _state["s3"] = FakeS3Client()
+
+    lambda_main = importlib.import_module("src.main")
+    s3 = _state["s3"]
+
+    def get_github_adapter(pool_size: int, timeout: tuple[float, float]) -> LocalGitHubAdapter:
+        # Kept between runs, as the handler's own pool is kept between warm invocations
+        if "adapter" not in _state:
+            _state["adapter"] = LocalGitHubAdapter(base_url, pool_size, timeout)
+        return _state["adapter"]
+
+    with (
+        patch("src.main.get_client", return_value=s3),
+        patch("src.main.get_secret", return_value="benchmark-key"),
+        patch(
+            "github_api_toolkit.get_token_as_installation",
+            return_value=("benchmark-token", "2999-01-01T00:00:00Z"),
+        ),
+        patch("src.main.get_github_adapter", get_github_adapter),
+    ):
+        started_at = time.perf_counter()
+        result = lambda_main.handler({}, None)
+        wall_seconds = time.perf_counter() - started_at
+
+    return {
+        "result": result,
+        "wall_seconds": round(wall_seconds, 3),
+        **s3.take_stats(),
+        # ru_maxrss is in kilobytes on Linux
+        "peak_rss_mb": round(resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024, 1),
+    }
+
+
+def run_benchmark(
+    spec: OrgSpec,
+    runs: int = 2,
+    latency: float = 0.0,
+    rate_limit: Optional[RateLimit] = None,
+    env: Optional[dict] = None,
+) -> dict:
+    """Benchmarks the handler against a synthetic organisation.
+
+    Args:
+        spec (OrgSpec): The shape of the organisation.
+        runs (int): The number of runs. The first starts from an empty bucket, and each later
+            run reads what the previous one stored.
+        latency (float): The delay before each GitHub response, in seconds.
+        rate_limit (Optional[RateLimit]): The GitHub rate limit. Defaults to no limit.
+        env (Optional[dict]): Environment variables for the handler, such as its settings.
+
+    Returns:
+        dict: The spec and, for each run, its wall time, GitHub requests and bytes, S3 requests
+            and bytes, and the handler process's peak RSS.
+    """
+    org = SyntheticOrg(spec)
+    handler_env = {**HANDLER_ENV, **(env or {})}
+    report: dict = {
+        "spec": asdict(spec),
+        "qualifying_teams": len(org.qualifying),
+        "latency": latency,
+        "runs": [],
+    }
+
+    context = multiprocessing.get_context("spawn")
+    with (
+        FakeGitHubServer(org, latency, rate_limit) as server,
+        ProcessPoolExecutor(max_workers=1, mp_context=context) as executor,
+    ):
+        for run in range(runs):
+            stats = executor.submit(run_handler, server.url, handler_env).result()
+            report["runs"].append(
+                {"run": "cold" if run == 0 else f"warm {run}", **stats, **server.take_stats()}
+            )
+
+    return report
+
+
+def format_report(report: dict) -> str:
+    """Formats a benchmark report as a table, one row per run.
+
+    Args:
+        report (dict): The report, as returned by run_benchmark.
+
+    Returns:
+        str: The table.
+    """
+    columns = [
+        ("run", "run"),
+        ("wall_seconds", "wall (s)"),
+        ("github_requests", "requests"),
+        ("github_not_modified", "304s"),
+        ("github_rate_limited", "403s"),
+        ("github_bytes", "downloaded"),
+        ("s3_requests", "s3 requests"),
+        ("s3_bytes_read", "s3 read"),
+        ("s3_bytes_written", "s3 written"),
+        ("peak_rss_mb", "peak rss (MB)"),
+    ]
+    spec = report["spec"]
+    rows = [[heading for _, heading in columns]]
+    rows += [[str(run[key]) for key, _ in columns] for run in report["runs"]]
+    widths = [max(len(row[column]) for row in rows) for column in range(len(columns))]
+
+    lines = [
+        f"{spec['teams']} teams ({report['qualifying_teams']} with metrics), {spec['days']} days "
+        f"of {spec['day_bytes']} bytes, {report['latency'] * 1000:g} ms latency"
+    ]
+    lines += [
+        "  ".join(cell.rjust(width) for cell, width in zip(row, widths, strict=True))
+        for row in rows
+    ]
+    return "\n".join(lines)
+
+
+def check_budgets(report: dict, max_seconds: Optional[float], max_requests: Optional[int]) -> list:
+    """Checks each run of a benchmark against its budgets.
+
+    Args:
+        report (dict): The report, as returned by run_benchmark.
+        max_seconds (Optional[float]): The most wall time a run may take.
+        max_requests (Optional[int]): The most GitHub requests a run may make.
+
+    Returns:
+        list: A message for each budget exceeded, or for each run that did not complete.
+    """
+    failures = []
+    for run in report["runs"]:
+        if run["result"] != "Github Data logging is now complete.":
+            failures.append(f"{run['run']} run did not complete: {run['result']}")
+        if max_seconds is not None and run["wall_seconds"] > max_seconds:
+            failures.append(f"{run['run']} run took {run['wall_seconds']}s, over {max_seconds}s")
+        if max_requests is not None and run["github_requests"] > max_requests:
+            failures.append(
+                f"{run['run']} run made {run['github_requests']} requests, over {max_requests}"
+            )
+    return failures
+
+
+def main(argv: Optional[list] = None) -> int:
+    """Runs a benchmark from the command line, and prints its report.
+
+    Args:
+        argv (Optional[list]): The arguments. Defaults to the command line.
+
+    Returns:
+        int: The exit code, 1 if a budget was exceeded.
+    """
+    parser = argparse.ArgumentParser(prog="python -m tests.benchmark", description=__doc__)
+    parser.add_argument("--teams", type=int, default=OrgSpec.teams)
+    parser.add_argument("--qualifying-ratio", type=float, default=OrgSpec.qualifying_ratio)
+    parser.add_argument("--days", type=int, default=OrgSpec.days)
+    parser.add_argument("--day-bytes", type=int, default=OrgSpec.day_bytes)
+    parser.add_argument("--seed", type=int, default=OrgSpec.seed)
+    parser.add_argument("--runs", type=int, default=2)
+    parser.add_argument("--latency-ms", type=float, default=0.0)
+    parser.add_argument("--rate-limit", type=int, help="GitHub requests allowed per window")
+    parser.add_argument("--rate-limit-window", type=float, default=1.0, help="in seconds")
+    parser.add_argument("--max-seconds", type=float, help="fail if a run takes longer")
+    parser.add_argument("--max-requests", type=int, help="fail if a run makes more requests")
+    parser.add_argument("--json", help="also write the report to this file")
+    parser.add_argument(
+        "--env", action="append", default=[], metavar="NAME=VALUE", help="handler setting"
+    )
+    args = parser.parse_args(argv)
+
+    spec = OrgSpec(args.teams, args.qualifying_ratio, args.days, args.day_bytes, args.seed)
+    rate_limit = (
+        RateLimit(args.rate_limit, args.rate_limit_window) if args.rate_limit is not None else None
+    )
+    env = dict(setting.split("=", 1) for setting in args.env)
+
+    report = run_benchmark(spec, args.runs, args.latency_ms / 1000, rate_limit, env)
+    print(format_report(report))
+
+    if args.json:
+        with open(args.json, "w", encoding="utf-8") as file:
+            json.dump(report, file, indent=2)
+
+    failures = check_budgets(report, args.max_seconds, args.max_requests)
+    for failure in failures:
+        print(failure, file=sys.stderr)
+    return 1 if failures else 0
@@ -0,0 +1,164 @@
+import json
+import os
+
+import pytest
+import requests
+from botocore.exceptions import ClientError
+
+from tests.benchmark.harness import (
+    ORG,
+    FakeGitHubServer,
+    FakeS3Client,
+    OrgSpec,
+    RateLimit,
+    SyntheticOrg,
+    check_budgets,
+    format_report,
+    run_benchmark,
+)
+
+# Wall time each run may take, raised on slow CI runners with BENCHMARK_MAX_SECONDS
+MAX_SECONDS = float(os.getenv("BENCHMARK_MAX_SECONDS", "60"))
+
+COMPLETE = "Github Data logging is now complete."
+
+
+class TestSyntheticOrg:
+    def test_shape(self):
+        org = SyntheticOrg(OrgSpec(teams=250, qualifying_ratio=0.5, days=7, day_bytes=1500))
+
+        assert len(org.teams) == 250
+        assert 75 < len(org.qualifying) < 175
+        assert set(org.team_metrics) == org.qualifying
+        assert [day["date"] for day in org.org_metrics] == org.dates
+        assert len(org.dates) == 7
+        # Each day is padded to roughly the requested size
+        assert all(1500 <= len(json.dumps(day)) < 3000 for day in org.org_metrics)
+        assert org.get_teams_page(3) == (org.teams[200:], 3)
+
+    def test_is_reproducible(self):
+        spec = OrgSpec(teams=50, days=3, day_bytes=200)
+        assert SyntheticOrg(spec).team_metrics == SyntheticOrg(spec).team_metrics
+
+
+class TestFakeGitHubServer:
+    def test_serves_the_org(self):
+        org = SyntheticOrg(OrgSpec(teams=150, qualifying_ratio=1, days=5, day_bytes=100))
+        team = org.teams[0]["name"]
+
+        with FakeGitHubServer(org) as server:
+            teams = requests.get(f"{server.url}/orgs/{ORG}/teams", timeout=5)
+            metrics = requests.get(
+                f"{server.url}/orgs/{ORG}/team/{team}/copilot/metrics",
+                params={"since": org.dates[3]},
+                timeout=5,
+            )
+            unchanged = requests.get(
+                f"{server.url}/orgs/{ORG}/team/{team}/copilot/metrics",
+                params={"since": org.dates[3]},
+                headers={"If-None-Match": metrics.headers["ETag"]},
+                timeout=5,
+            )
+            missing = requests.get(f"{server.url}/orgs/{ORG}/team/x/copilot/metrics", timeout=5)
+            stats = server.take_stats()
+
+        assert len(teams.json()) == 100
+        assert teams.links["last"]["url"].endswith("page=2")
+        assert [day["date"] for day in metrics.json()] == org.dates[3:]
+        assert unchanged.status_code == 304
+        assert missing.status_code == 404
+        assert stats["github_requests"] == 4
+        assert stats["github_not_modified"] == 1
+        assert stats["github_endpoints"]["/orgs/benchmark-org/team/{team}/copilot/metrics"] == 3
+
+    def test_rate_limit(self):
+        org = SyntheticOrg(OrgSpec(teams=1, days=1, day_bytes=10))
+
+        with FakeGitHubServer(org, rate_limit=RateLimit(2, 60)) as server:
+            responses = [
+                requests.get(f"{server.url}/orgs/{ORG}/copilot/metrics", timeout=5)
+                for _ in range(3)
+            ]
+
+        assert [response.status_code for response in responses] == [200, 200, 403]
+        assert responses[1].headers["X-RateLimit-Remaining"] == "0"
+        assert int(responses[2].headers["X-RateLimit-Reset"]) > 0
+
+
+class TestFakeS3Client:
+    def test_round_trip(self):
+        s3 = FakeS3Client()
+
+        s3.put_object(Bucket="b", Key="k", Body=b"data", ContentType="application/json")
+
+        assert s3.get_object(Bucket="b", Key="k")["Body"].read() == b"data"
+        assert s3.head_object(Bucket="b", Key="k")["ContentType"] == "application/json"
+        assert s3.take_stats() == {
+            "s3_requests": 3,
+            "s3_bytes_read": 4,
+            "s3_bytes_written": 4,
+            "s3_bytes_stored": 4,
+        }
+
+    def test_missing_object(self):
+        s3 = FakeS3Client()
+
+        with pytest.raises(ClientError) as error:
+            s3.get_object(Bucket="b", Key="missing")
+        assert error.value.response["Error"]["Code"] == "NoSuchKey"
+
+        with pytest.raises(ClientError) as error:
+            s3.head_object(Bucket="b", Key="missing")
+        assert error.value.response["Error"]["Code"] == "404"
+
+
+class TestReport:
+    def test_check_budgets(self):
+        report = {
+            "runs": [
+                {"run": "cold", "result": COMPLETE, "wall_seconds": 2.0, "github_requests": 10},
+                {
+                    "run": "warm 1",
+                    "result": "Run aborted",
+                    "wall_seconds": 0.5,
+                    "github_requests": 2,
+                },
+            ]
+        }
+
+        assert check_budgets(report, None, None) == ["warm 1 run did not complete: Run aborted"]
+        assert check_budgets(report, 1.0, 5)[:2] == [
+            "cold run took 2.0s, over 1.0s",
+            "cold run made 10 requests, over 5",
+        ]
+
+
+@pytest.mark.benchmark
+class TestBenchmark:
+    def test_runs_stay_within_budget(self):
+        spec = OrgSpec(teams=150, qualifying_ratio=0.3, days=7, day_bytes=500)
+
+        report = run_benchmark(spec, runs=2, latency=0.001)
+
+        cold, warm = report["runs"]
+        pages = 2
+        assert check_budgets(report, MAX_SECONDS, None) == [], format_report(report)
+        # A cold run lists the teams, gets the organisation's usage and probes every team, and
+        # reuses the probed metrics as the team history
+        assert cold["github_requests"] == pages + 1 + spec.teams
+        assert cold["github_rate_limited"] == 0
+        # A warm run skips the teams without metrics, and the rest are not modified
+        assert warm["github_requests"] == pages + 1 + report["qualifying_teams"]
+        assert warm["github_not_modified"] == 1 + report["qualifying_teams"]
+        assert warm["s3_bytes_written"] == 0
+        assert warm["peak_rss_mb"] > 0
+
+    def test_run_waits_out_the_rate_limit(self):
+        spec = OrgSpec(teams=60, qualifying_ratio=0.3, days=3, day_bytes=200)
+
+        report = run_benchmark(spec, runs=1, rate_limit=RateLimit(40, 1.0))
+
+        (cold,) = report["runs"]
+        assert cold["result"] == COMPLETE
+        # Every request is answered once, besides any rejected by the rate limit
+        assert cold["github_requests"] - cold["github_rate_limited"] == 1 + 1 + spec.teams
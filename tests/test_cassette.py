@@ -0,0 +1,335 @@
+import io
+import os
+from unittest.mock import MagicMock, patch
+
+import pytest
+import requests
+from botocore.exceptions import ClientError
+from requests import Response
+
+os.environ["AWS_ACCOUNT_NAME"] = "test"
+os.environ["AWS_SECRET_NAME"] = "test-secret"
+os.environ["AWS_DEFAULT_REGION"] = "eu-west-1"
+
+from src.cassette import (
+    SCRUBBED,
+    Cassette,
+    CassetteAdapter,
+    compare_cassettes,
+    decode_body,
+    encode_body,
+    get_cassette_path,
+    load_cassette,
+    open_cassette,
+    save_cassette,
+)
+from src.main import handler
+from src.warm_start import clear_cache
+from tests.benchmark.harness import (
+    ORG,
+    FakeGitHubServer,
+    FakeS3Client,
+    LocalGitHubAdapter,
+    OrgSpec,
+    SyntheticOrg,
+)
+
+API_URL = "https://api.github.com"
+
+
+def make_adapter(responses):
+    """Creates an adapter mock answering each URL with a status code and body."""
+    adapter = MagicMock()
+
+    def send(request, **kwargs):
+        status, body = responses[request.url]
+        response = Response()
+        response.status_code = status
+        response.headers["Content-Type"] = "application/json"
+        response.headers["X-GitHub-Token-Expiration"] = "never"
+        response._content = body
+        return response
+
+    adapter.send.side_effect = send
+    return adapter
+
+
+def make_session(adapter):
+    session = requests.Session()
+    session.mount("https://", adapter)
+    return session
+
+
+def not_found():
+    return ClientError(
+        error_response={"Error": {"Code": "NoSuchKey", "Message": "Not Found"}},
+        operation_name="GetObject",
+    )
+
+
+class TestBodies:
+    def test_text_and_binary_bodies_round_trip(self):
+        assert encode_body(b'{"a": 1}') == {"text": '{"a": 1}'}
+        assert "base64" in encode_body(b"\x1f\x8b\xff")
+        assert decode_body(encode_body(b"\x1f\x8b\xff")) == b"\x1f\x8b\xff"
+
+
+class TestGitHubCassette:
+    def test_record_and_replay(self):
+        url = f"{API_URL}/orgs/org/teams?page=1"
+        recording = Cassette("record")
+        adapter = make_adapter({url: (200, b'[{"name": "team1"}]')})
+        session = make_session(recording.wrap_adapter(adapter))
+
+        recorded = session.get(url, headers={"Authorization": "token secret"})
+
+        interaction = recording.interactions[0]
+        assert interaction["request"]["url"] == url
+        assert "Authorization" not in interaction["request"]["headers"]
+        assert interaction["response"]["status"] == 200
+        # Headers that can carry credentials are not recorded
+        assert "X-GitHub-Token-Expiration" not in interaction["response"]["headers"]
+
+        replaying = Cassette("replay", recording.interactions)
+        replay_adapter = MagicMock()
+        session = make_session(replaying.wrap_adapter(replay_adapter))
+
+        replayed = session.get(url)
+        missing = session.get(f"{API_URL}/orgs/org/teams?page=2")
+
+        assert replayed.json() == recorded.json() == [{"name": "team1"}]
+        assert missing.status_code == 404
+        assert replaying.no_misses == 1
+        replay_adapter.send.assert_not_called()
+
+    def test_replays_connection_errors(self):
+        url = f"{API_URL}/orgs/org/copilot/metrics"
+        recording = Cassette("record")
+        adapter = MagicMock()
+        adapter.send.side_effect = requests.exceptions.ReadTimeout("timed out")
+
+        with pytest.raises(requests.exceptions.ReadTimeout):
+            make_session(recording.wrap_adapter(adapter)).get(url)
+
+        replaying = Cassette("replay", recording.interactions)
+        with pytest.raises(requests.exceptions.ReadTimeout, match="timed out"):
+            make_session(replaying.wrap_adapter(MagicMock())).get(url)
+
+    @patch("src.cassette.time.sleep")
+    def test_original_timing(self, mock_sleep):
+        url = f"{API_URL}/orgs/org/copilot/metrics"
+        interaction = {
+            "kind": "github",
+            "request": {"method": "GET", "url": url, "headers": {}},
+            "response": {"status": 200, "headers": {}, "body": {"text": "[]"}},
+            "offset": 0,
+            "elapsed": 0.25,
+        }
+
+        make_session(Cassette("replay", [interaction], "original").wrap_adapter(MagicMock())).get(
+            url
+        )
+        mock_sleep.assert_called_once_with(0.25)
+
+    def test_other_attributes_are_passed_through(self):
+        adapter = MagicMock()
+        wrapped = Cassette("record").wrap_adapter(adapter)
+
+        assert isinstance(wrapped, CassetteAdapter)
+        assert wrapped.stats() is adapter.stats.return_value
+        wrapped.close()
+        adapter.close.assert_called_once()
+
+
+class TestS3Cassette:
+    def test_record_and_replay(self):
+        s3 = MagicMock()
+        s3.get_object.return_value = {
+            "Body": io.BytesIO(b"[1, 2]"),
+            "ContentType": "application/json",
+            "ResponseMetadata": {"RetryAttempts": 0},
+        }
+        s3.head_object.side_effect = not_found()
+        s3.put_object.return_value = {"ETag": '"etag"'}
+        recording = Cassette("record")
+        client = recording.wrap_s3(s3)
+
+        assert client.get_object(Bucket="b", Key="data.json")["Body"].read() == b"[1, 2]"
+        with pytest.raises(ClientError):
+            client.head_object(Bucket="b", Key="missing.json")
+        client.put_object(Bucket="b", Key="out.json", Body=b"{}")
+        client.upload_fileobj(Fileobj=io.BytesIO(b"large"), Bucket="b", Key="large.json")
+
+        # The upload is still sent in full
+        assert s3.upload_fileobj.call_args.kwargs["Fileobj"].read() == b"large"
+        writes = [i["request"] for i in recording.interactions if i["request"]["key"] == "out.json"]
+        assert writes[0]["size"] == 2
+        assert "body" not in recording.interactions[2]["response"]
+
+        replay_s3 = MagicMock()
+        client = Cassette("replay", recording.interactions).wrap_s3(replay_s3)
+
+        response = client.get_object(Bucket="b", Key="data.json")
+        assert response["Body"].read() == b"[1, 2]"
+        assert response["ContentType"] == "application/json"
+        with pytest.raises(ClientError) as error:
+            client.head_object(Bucket="b", Key="missing.json")
+        assert error.value.response["Error"]["Code"] == "NoSuchKey"
+        # Writes succeed without being sent, and reads not in the cassette are not found
+        assert client.put_object(Bucket="b", Key="out.json", Body=b"{}")["ETag"]
+        assert client.upload_fileobj(Fileobj=io.BytesIO(b"x"), Bucket="b", Key="x") is None
+        with pytest.raises(ClientError):
+            client.get_object(Bucket="b", Key="other.json")
+        replay_s3.get_object.assert_not_called()
+        replay_s3.put_object.assert_not_called()
+        assert client.meta is replay_s3.meta
+
+
+class TestCassetteFiles:
+    def test_save_and_load(self, tmp_path):
+        path = str(tmp_path / "cassette.json.gz")
+        interactions = [{"kind": "s3", "request": {"operation": "get_object", "key": "a"}}]
+
+        save_cassette(path, interactions)
+
+        assert (tmp_path / "cassette.json.gz").read_bytes()[:2] == b"\x1f\x8b"
+        assert load_cassette(path) == interactions
+
+    def test_load_rejects_other_versions(self, tmp_path):
+        path = tmp_path / "cassette.json"
+        path.write_text('{"version": 99, "interactions": []}')
+
+        with pytest.raises(ValueError, match="Unsupported cassette version"):
+            load_cassette(str(path))
+
+    def test_open_cassette(self, tmp_path):
+        path = str(tmp_path / "cassette.json.gz")
+        save_cassette(path, [])
+
+        assert open_cassette().mode == "off"
+        with patch("src.cassette.CASSETTE_MODE", "record"):
+            assert open_cassette().mode == "record"
+        with (
+            patch("src.cassette.CASSETTE_MODE", "replay"),
+            patch("src.cassette.CASSETTE_PATH", path),
+        ):
+            assert open_cassette().replaying
+
+    def test_each_shard_has_its_own_cassette(self, tmp_path):
+        path = str(tmp_path / "cassette.json.gz")
+        shard_path = str(tmp_path / "cassette-shard-1-of-4.json.gz")
+        save_cassette(
+            shard_path, [{"kind": "s3", "request": {"operation": "get_object", "key": "a"}}]
+        )
+
+        assert get_cassette_path(path, "shard-1-of-4") == shard_path
+        assert get_cassette_path(path) == path
+        # No file is made up when CASSETTE_REPLAY_OUTPUT is not set
+        assert get_cassette_path("", "shard-1-of-4") == ""
+
+        with (
+            patch("src.cassette.CASSETTE_MODE", "record"),
+            patch("src.cassette.CASSETTE_PATH", path),
+        ):
+            assert open_cassette("shard-2-of-4").save("shard-2-of-4").endswith("-2-of-4.json.gz")
+        with (
+            patch("src.cassette.CASSETTE_MODE", "replay"),
+            patch("src.cassette.CASSETTE_PATH", path),
+        ):
+            assert open_cassette("shard-1-of-4")._queues
+
+    def test_credentials_are_not_fetched_when_replaying(self):
+        get_secret = MagicMock()
+
+        assert Cassette("replay").call_live(get_secret, "name", replayed=SCRUBBED) == SCRUBBED
+        assert (
+            Cassette("record").call_live(get_secret, "name", replayed=SCRUBBED)
+            is get_secret.return_value
+        )
+        get_secret.assert_called_once_with("name")
+
+    def test_off_cassette_saves_nothing(self):
+        s3, adapter = MagicMock(), MagicMock()
+        cassette = Cassette()
+
+        assert cassette.wrap_s3(s3) is s3
+        assert cassette.wrap_adapter(adapter) is adapter
+        assert cassette.save() is None
+
+
+class TestCompareCassettes:
+    def test_compare(self):
+        def interaction(key, status=200, size=None):
+            request = {"operation": "get_object", "key": key}
+            if size is not None:
+                request = {"operation": "put_object", "key": key, "size": size}
+            return {"kind": "s3", "request": request, "response": {"status": status}}
+
+        before = [interaction("a"), interaction("b"), interaction("b"), interaction("c", size=1)]
+        after = [
+            interaction("a"),
+            interaction("b", 500),
+            interaction("c", size=2),
+            interaction("d"),
+        ]
+
+        assert compare_cassettes(before, before) == []
+        assert compare_cassettes(before, after) == [
+            "s3 get_object b: response changed",
+            "s3 get_object b (#2): only before",
+            "s3 get_object d: only after",
+            "s3 put_object c: request changed",
+        ]
+
+
+@patch("src.main.org", ORG)
+# One request at a time, so both runs write the validators in the same order
+@patch("src.main.MAX_WORKERS", 1)
+@patch("src.main.MAX_CONCURRENT_PHASES", 1)
+@patch("src.main.get_secret", MagicMock(return_value="pem"))
+@patch("github_api_toolkit.get_token_as_installation", MagicMock(return_value=("token",)))
+class TestHandlerReplay:
+    def run(self, cassette, s3, adapter):
+        with (
+            patch("src.main.open_cassette", return_value=cassette),
+            patch("src.main.get_client", return_value=s3),
+            patch("src.main.get_github_adapter", return_value=adapter),
+        ):
+            return handler({}, None)
+
+    def test_replayed_run_matches_the_recording(self, tmp_path):
+        org = SyntheticOrg(OrgSpec(teams=30, qualifying_ratio=0.5, days=3, day_bytes=200))
+        path = str(tmp_path / "cassette.json.gz")
+        output = str(tmp_path / "replay.json.gz")
+
+        with FakeGitHubServer(org) as server, patch("src.cassette.CASSETTE_PATH", path):
+            adapter = LocalGitHubAdapter(server.url, 5, (5.0, 30.0))
+            assert self.run(Cassette("record"), FakeS3Client(), adapter).endswith("complete.")
+
+        recorded = load_cassette(path)
+        assert {interaction["kind"] for interaction in recorded} == {"github", "s3"}
+
+        # Replayed offline, against an empty bucket and with no server to send requests to
+        replaying = Cassette("replay", recorded)
+        unused_s3 = FakeS3Client()
+        with patch("src.cassette.CASSETTE_REPLAY_OUTPUT", output):
+            result = self.run(replaying, unused_s3, LocalGitHubAdapter("http://127.0.0.1:9", 1, 1))
+
+        assert result == "Github Data logging is now complete."
+        assert replaying.no_misses == 0
+        assert unused_s3.objects == {}
+        assert compare_cassettes(recorded, load_cassette(output)) == []
+
+    def test_cassette_is_saved_if_the_run_ends_early(self, tmp_path):
+        path = str(tmp_path / "cassette.json.gz")
+        clear_cache()
+
+        with (
+            patch("src.cassette.CASSETTE_PATH", path),
+            patch("github_api_toolkit.get_token_as_installation", return_value="Bad credentials"),
+        ):
+            result = self.run(Cassette("record"), FakeS3Client(), MagicMock())
+
+        assert result == "Error getting access token: Bad credentials"
+        # The cassette is written, with no GitHub requests as the token was refused
+        assert all(interaction["kind"] == "s3" for interaction in load_cassette(path))
@@ -0,0 +1,134 @@
+import json
+from unittest.mock import MagicMock, patch
+
+from botocore.exceptions import ClientError
+
+from src.checkpoint import CHECKPOINT_OBJECT, TimeBudget, load_checkpoint, save_checkpoint
+
+
+def make_context(remaining_ms):
+    return MagicMock(get_remaining_time_in_millis=MagicMock(return_value=remaining_ms))
+
+
+class TestTimeBudget:
+    def test_is_spent_once_only_the_reserve_is_left(self):
+        assert not TimeBudget(make_context(61_000), reserve_seconds=60).is_spent()
+        assert TimeBudget(make_context(60_000), reserve_seconds=60).is_spent()
+
+    def test_never_spent_without_a_lambda_context(self):
+        budget = TimeBudget(None, reserve_seconds=60)
+        assert budget.remaining_seconds() is None
+        assert not budget.is_spent()
+
+    def test_defer(self, caplog):
+        budget = TimeBudget(make_context(1000), resume=["team1"])
+        budget.defer("team2")
+        budget.defer("team3")
+
+        assert budget.deferred == ["team2", "team3"]
+        assert budget.stats() == {
+            "no_teams_resumed": 1,
+            "no_teams_deferred": 2,
+            "discovery_resumed": False,
+            "discovery_deferred": False,
+        }
+        # The budget running out is logged once
+        assert len([r for r in caplog.records if r.getMessage().startswith("Time budget")]) == 1
+
+    def test_order_by_staleness(self):
+        budget = TimeBudget(None, resume=["team4", "team2"])
+        teams = [{"name": f"team{i}"} for i in range(1, 6)]
+        watermarks = {
+            "team1": {"latest": "2024-01-03"},
+            "team2": {"latest": "2024-01-03"},
+            "team3": {"latest": "2024-01-01"},
+            "team4": {"latest": "2024-01-02"},
+        }
+
+        ordered = [team["name"] for team in budget.order(teams, watermarks)]
+
+        # Deferred teams first, then teams with no history, then the oldest latest date
+        assert ordered == ["team4", "team2", "team5", "team3", "team1"]
+
+
+class TestCheckpoint:
+    def test_load_checkpoint(self):
+        s3 = MagicMock()
+        s3.get_object.return_value = {
+            "Body": MagicMock(read=MagicMock(return_value=json.dumps({"deferred": ["a"]}).encode()))
+        }
+
+        assert load_checkpoint(s3) == (["a"], None)
+        assert s3.get_object.call_args.kwargs["Key"] == CHECKPOINT_OBJECT
+
+    def test_load_checkpoint_without_one(self):
+        s3 = MagicMock()
+        s3.get_object.side_effect = ClientError(
+            error_response={"Error": {"Code": "NoSuchKey", "Message": "Not Found"}},
+            operation_name="GetObject",
+        )
+
+        assert load_checkpoint(s3) == ([], None)
+
+    @patch("src.checkpoint.update_s3_object")
+    def test_save_checkpoint_stores_deferred_teams(self, mock_update_s3_object):
+        budget = TimeBudget(None)
+        budget.defer("team1")
+
+        assert save_checkpoint(MagicMock(), budget) is mock_update_s3_object.return_value
+        _, _, object_name, checkpoint = mock_update_s3_object.call_args.args
+        assert object_name == CHECKPOINT_OBJECT
+        assert checkpoint["deferred"] == ["team1"]
+
+    def test_load_checkpoint_with_discovery(self):
+        s3 = MagicMock()
+        discovery = {"page": 3, "probed": ["a"], "copilot_teams": [{"name": "b"}]}
+        s3.get_object.return_value = {
+            "Body": MagicMock(
+                read=MagicMock(
+                    return_value=json.dumps({"deferred": [], "discovery": discovery}).encode()
+                )
+            )
+        }
+
+        assert load_checkpoint(s3) == ([], discovery)
+
+    def test_load_checkpoint_ignores_invalid_discovery(self):
+        s3 = MagicMock()
+        s3.get_object.return_value = {
+            "Body": MagicMock(
+                read=MagicMock(return_value=json.dumps({"discovery": {"page": "3"}}).encode())
+            )
+        }
+
+        assert load_checkpoint(s3) == ([], None)
+
+    @patch("src.checkpoint.update_s3_object")
+    def test_save_checkpoint_stores_deferred_discovery(self, mock_update_s3_object):
+        budget = TimeBudget(None)
+        budget.defer_discovery(2, ["a"], [{"name": "b"}])
+
+        assert save_checkpoint(MagicMock(), budget) is mock_update_s3_object.return_value
+        assert mock_update_s3_object.call_args.args[3]["discovery"] == {
+            "page": 2,
+            "probed": ["a"],
+            "copilot_teams": [{"name": "b"}],
+        }
+        assert budget.stats()["discovery_deferred"]
+
+    @patch("src.checkpoint.update_s3_object")
+    def test_save_checkpoint_clears_resumed_discovery(self, mock_update_s3_object):
+        save_checkpoint(MagicMock(), TimeBudget(None, discovery={"page": 2}))
+
+        assert mock_update_s3_object.call_args.args[3]["discovery"] is None
+
+    @patch("src.checkpoint.update_s3_object")
+    def test_save_checkpoint_clears_a_resumed_checkpoint(self, mock_update_s3_object):
+        save_checkpoint(MagicMock(), TimeBudget(None, resume=["team1"]))
+
+        assert mock_update_s3_object.call_args.args[3]["deferred"] == []
+
+    @patch("src.checkpoint.update_s3_object")
+    def test_save_checkpoint_is_skipped_without_deferred_teams(self, mock_update_s3_object):
+        assert save_checkpoint(MagicMock(), TimeBudget(None))
+        mock_update_s3_object.assert_not_called()
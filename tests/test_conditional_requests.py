@@ -0,0 +1,145 @@
+from unittest.mock import MagicMock
+
+from requests import HTTPError, Response
+
+from src.conditional_requests import (
+    ConditionalRequestCache,
+    cache_key,
+    forget_validators,
+    is_not_modified,
+)
+
+
+def make_response(status_code=200, headers=None, content=b""):
+    response = Response()
+    response.status_code = status_code
+    response.headers.update(headers or {})
+    response._content = content
+    return response
+
+
+class TestCacheKey:
+    def test_cache_key_without_params(self):
+        assert cache_key("/orgs/test/copilot/metrics") == "/orgs/test/copilot/metrics"
+        assert cache_key("/orgs/test/copilot/metrics", {}) == "/orgs/test/copilot/metrics"
+
+    def test_cache_key_sorts_params(self):
+        assert (
+            cache_key("/orgs/test/copilot/metrics", {"until": "b", "since": "a"})
+            == "/orgs/test/copilot/metrics?since=a&until=b"
+        )
+
+
+class TestIsNotModified:
+    def test_is_not_modified(self):
+        assert is_not_modified(make_response(304))
+        assert not is_not_modified(make_response(200))
+        assert not is_not_modified(HTTPError("404"))
+
+
+class TestConditionalRequestCache:
+    def test_other_endpoints_are_passed_through(self):
+        gh = MagicMock()
+        cache = ConditionalRequestCache(gh)
+
+        result = cache.get("/orgs/test/teams", params={"page": 1})
+
+        assert result is gh.get.return_value
+        gh.get.assert_called_once_with("/orgs/test/teams", params={"page": 1})
+        gh.session.get.assert_not_called()
+
+    def test_first_request_stores_validators(self):
+        gh = MagicMock()
+        gh.session.get.return_value = make_response(
+            200,
+            {"ETag": '"abc"', "Last-Modified": "Mon, 01 Jan 2024 00:00:00 GMT"},
+            b'[{"date": "2024-01-01"}]',
+        )
+        cache = ConditionalRequestCache(gh)
+
+        response = cache.get("/orgs/test/team/dev/copilot/metrics")
+
+        assert response.status_code == 200
+        gh.session.get.assert_called_once_with(
+            "https://api.github.com/orgs/test/team/dev/copilot/metrics", params=None, headers={}
+        )
+        assert cache.entries == {
+            "/orgs/test/team/dev/copilot/metrics": {
+                "etag": '"abc"',
+                "last_modified": "Mon, 01 Jan 2024 00:00:00 GMT",
+                "has_data": True,
+            }
+        }
+        assert cache.has_data("/orgs/test/team/dev/copilot/metrics")
+
+    def test_known_validators_are_sent(self):
+        gh = MagicMock()
+        gh.session.get.return_value = make_response(304)
+        entries = {
+            "/orgs/test/team/dev/copilot/metrics": {
+                "etag": '"abc"',
+                "last_modified": "Mon, 01 Jan 2024 00:00:00 GMT",
+                "has_data": False,
+            }
+        }
+        cache = ConditionalRequestCache(gh, entries)
+
+        response = cache.get("/orgs/test/team/dev/copilot/metrics")
+
+        assert is_not_modified(response)
+        assert gh.session.get.call_args.kwargs["headers"] == {
+            "If-None-Match": '"abc"',
+            "If-Modified-Since": "Mon, 01 Jan 2024 00:00:00 GMT",
+        }
+        assert not cache.has_data("/orgs/test/team/dev/copilot/metrics")
+        assert cache.stats() == {"no_not_modified_responses": 1, "no_modified_responses": 0}
+
+    def test_empty_payload_has_no_data(self):
+        gh = MagicMock()
+        gh.session.get.return_value = make_response(200, {"ETag": '"e"'}, b"[]")
+        cache = ConditionalRequestCache(gh)
+
+        cache.get("/orgs/test/team/dev/copilot/metrics", params={"since": "2024-01-01"})
+
+        assert not cache.has_data(
+            "/orgs/test/team/dev/copilot/metrics", params={"since": "2024-01-01"}
+        )
+
+    def test_http_errors_are_returned(self):
+        gh = MagicMock()
+        gh.session.get.return_value = make_response(404)
+        cache = ConditionalRequestCache(gh)
+
+        result = cache.get("/orgs/test/team/dev/copilot/metrics")
+
+        assert isinstance(result, HTTPError)
+        assert cache.entries == {}
+
+    def test_unauthorized_is_sent_through_github_interface(self):
+        gh = MagicMock()
+        gh.session.get.return_value = make_response(401)
+        cache = ConditionalRequestCache(gh)
+
+        result = cache.get("/orgs/test/team/dev/copilot/metrics", params={"since": "2024-01-01"})
+
+        # The wrapped github_interface may refresh its token and retry
+        assert result is gh.get.return_value
+        gh.get.assert_called_once_with(
+            "/orgs/test/team/dev/copilot/metrics", params={"since": "2024-01-01"}
+        )
+
+    def test_forget_drops_every_request_to_the_endpoint(self):
+        entries = {
+            "/orgs/test/team/dev/copilot/metrics": {"etag": '"a"'},
+            "/orgs/test/team/dev/copilot/metrics?since=2024-01-01": {"etag": '"b"'},
+            "/orgs/test/team/dev-ops/copilot/metrics": {"etag": '"c"'},
+        }
+        cache = ConditionalRequestCache(MagicMock(), entries)
+
+        forget_validators(cache, "/orgs/test/team/dev/copilot/metrics")
+
+        assert list(cache.entries) == ["/orgs/test/team/dev-ops/copilot/metrics"]
+
+    def test_invalid_entries_are_ignored(self):
+        cache = ConditionalRequestCache(MagicMock(), ["not", "a", "dict"])
+        assert cache.entries == {}
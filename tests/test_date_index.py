@@ -0,0 +1,36 @@
+from src.date_index import DateIndex
+
+
+class TestDateIndex:
+    def test_date_index_latest(self):
+        index = DateIndex([{"date": "2024-01-02"}, {"date": "2024-01-01"}])
+        assert index.latest == "2024-01-02"
+        assert "2024-01-01" in index
+        assert "2024-01-03" not in index
+        assert len(index) == 2
+
+    def test_date_index_empty(self):
+        index = DateIndex([])
+        assert index.latest is None
+        assert len(index) == 0
+
+    def test_upsert_appends_new_dates(self):
+        records = [{"date": "2024-01-01", "usage": 1}]
+        index = DateIndex(records)
+
+        assert index.upsert({"date": "2024-01-02", "usage": 2})
+        assert records == [{"date": "2024-01-01", "usage": 1}, {"date": "2024-01-02", "usage": 2}]
+        assert index.latest == "2024-01-02"
+
+    def test_upsert_replaces_existing_dates(self):
+        records = [{"date": "2024-01-01", "usage": 1}, {"date": "2024-01-02", "usage": 2}]
+        index = DateIndex(records)
+
+        assert not index.upsert({"date": "2024-01-01", "usage": 10})
+        assert records == [{"date": "2024-01-01", "usage": 10}, {"date": "2024-01-02", "usage": 2}]
+        assert index.latest == "2024-01-02"
+
+    def test_upsert_older_date_keeps_latest(self):
+        index = DateIndex([{"date": "2024-01-05"}])
+        index.upsert({"date": "2024-01-01"})
+        assert index.latest == "2024-01-05"
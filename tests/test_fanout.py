@@ -0,0 +1,344 @@
+import io
+import json
+import os
+from concurrent.futures import ThreadPoolExecutor
+from datetime import UTC, datetime
+from unittest.mock import MagicMock, patch
+
+import pytest
+from botocore.exceptions import ClientError
+from requests import Response
+
+os.environ["AWS_ACCOUNT_NAME"] = "test"
+os.environ["AWS_SECRET_NAME"] = "test-secret"
+os.environ["AWS_DEFAULT_REGION"] = "eu-west-1"
+
+from src.cassette import Cassette
+from src.fanout import (
+    get_partial_name,
+    get_shard,
+    handler,
+    invoke_workers,
+    merge_partials,
+    partition_teams,
+)
+from src.main import TEAMS_HISTORY_MANIFEST
+from src.main import handler as main_handler
+from src.negative_cache import NEGATIVE_CACHE_OBJECT
+from src.resilience import RunAbortedError
+
+
+def not_found():
+    return ClientError(
+        error_response={"Error": {"Code": "NoSuchKey", "Message": "Not Found"}},
+        operation_name="GetObject",
+    )
+
+
+def make_fake_s3(objects):
+    """Creates an S3 client mock backed by a dictionary of object names to JSON content."""
+    s3 = MagicMock()
+
+    def get_object(Bucket, Key):
+        if Key not in objects:
+            raise not_found()
+        return {"Body": io.BytesIO(json.dumps(objects[Key]).encode())}
+
+    def put_object(Bucket, Key, Body, **kwargs):
+        objects[Key] = json.loads(Body)
+
+    s3.get_object.side_effect = get_object
+    s3.put_object.side_effect = put_object
+    s3.head_object.side_effect = lambda **kwargs: (_ for _ in ()).throw(not_found())
+    return s3
+
+
+def make_response(data):
+    response = Response()
+    response.status_code = 200
+    response._content = json.dumps(data).encode()
+    return response
+
+
+def make_fake_github(teams, metrics):
+    """Creates a github_interface mock serving one page of teams and each team's metrics."""
+    gh = MagicMock()
+
+    def get(url, params=None):
+        if url.endswith("/teams"):
+            return make_response(teams)
+        if "/team/" in url:
+            return make_response(metrics.get(url.split("/")[4], []))
+        return make_response([])
+
+    gh.get.side_effect = get
+    return gh
+
+
+def make_teams(count):
+    return [{"name": f"team{i}", "slug": f"team-{i}", "url": "unused"} for i in range(count)]
+
+
+class TestPartitioning:
+    def test_get_shard_is_stable(self):
+        team = {"name": "Team A", "slug": "team-a"}
+        assert get_shard(team, 4) == get_shard(dict(team), 4)
+        assert 0 <= get_shard(team, 4) < 4
+        # The name is used for teams without a slug
+        assert get_shard({"name": "team-a"}, 4) == get_shard(team, 4)
+
+    def test_partition_teams(self):
+        teams = make_teams(20)
+
+        partitions = partition_teams(teams, 3)
+
+        assert len(partitions) == 3
+        assert sorted(team["name"] for shard in partitions for team in shard) == sorted(
+            team["name"] for team in teams
+        )
+        for shard, shard_teams in enumerate(partitions):
+            assert all(get_shard(team, 3) == shard for team in shard_teams)
+            # Teams keep their listed order, and only the fields the workers need
+            assert shard_teams == sorted(shard_teams, key=lambda team: int(team["name"][4:]))
+            assert all("url" not in team for team in shard_teams)
+
+
+@patch("src.main.NEGATIVE_CACHE_TTL_DAYS", 21)
+@patch("src.fanout.NEGATIVE_CACHE_TTL_DAYS", 21)
+@patch("src.main.org", "test-org")
+class TestWorkers:
+    def test_run_worker_writes_partial(self):
+        objects = {TEAMS_HISTORY_MANIFEST: {"team1": {"latest": "2024-01-02"}}}
+        s3 = make_fake_s3(objects)
+        metrics = {
+            "team1": [{"date": "2024-01-01"}, {"date": "2024-01-02"}, {"date": "2024-01-03"}],
+            "team2": [{"date": "2024-01-01"}],
+        }
+        gh = make_fake_github([], metrics)
+        event = {
+            "run_id": "run",
+            "shard": 1,
+            "shards": 2,
+            "teams": [{"name": "team1"}, {"name": "team2"}, {"name": "team3"}],
+        }
+
+        with patch("src.fanout.connect", return_value=(s3, gh)):
+            assert handler({"mode": "worker", **event}, None).startswith("Shard 2 of 2 written")
+
+        partial = objects[get_partial_name(1, 2)]
+        assert partial["run_id"] == "run"
+        assert [team["name"] for team in partial["copilot_teams"]] == ["team1", "team2"]
+        # Only the days from each team's stored watermark are passed to the merge
+        assert partial["new_history"] == {
+            "team1": [{"date": "2024-01-02"}, {"date": "2024-01-03"}],
+            "team2": [{"date": "2024-01-01"}],
+        }
+        assert list(partial["negative_cache"]) == ["team3"]
+
+    def test_merge_partials(self):
+        teams = make_teams(3)
+        objects = {
+            "teams_history.json": [{"team": {"name": "team0"}, "data": [{"date": "2024-01-01"}]}],
+            get_partial_name(0, 2): {
+                "run_id": "run",
+                "copilot_teams": [{"name": "team2"}],
+                "new_history": {"team2": [{"date": "2024-01-01"}]},
+                "negative_cache": {},
+            },
+            get_partial_name(1, 2): {
+                "run_id": "run",
+                "copilot_teams": [{"name": "team0"}],
+                "new_history": {"team0": [{"date": "2024-01-01"}, {"date": "2024-01-02"}]},
+                "negative_cache": {"team1": {"expires": "2999-01-01"}},
+            },
+        }
+        s3 = make_fake_s3(objects)
+        gh = MagicMock()
+
+        copilot_teams = merge_partials(s3, gh, teams, 2, "run")
+
+        # Teams are stored in the order the API lists them
+        assert copilot_teams == [{"name": "team0"}, {"name": "team2"}]
+        assert objects["copilot_teams.json"] == copilot_teams
+        assert objects[NEGATIVE_CACHE_OBJECT] == {"team1": {"expires": "2999-01-01"}}
+        history = {entry["team"]["name"]: entry["data"] for entry in objects["teams_history.json"]}
+        assert history == {
+            "team0": [{"date": "2024-01-01"}, {"date": "2024-01-02"}],
+            "team2": [{"date": "2024-01-01"}],
+        }
+        gh.get.assert_not_called()
+
+    def test_merge_partials_with_unfinished_shard(self):
+        objects = {
+            get_partial_name(0, 2): {
+                "run_id": "run",
+                "copilot_teams": [{"name": "team0"}],
+                "new_history": {"team0": [{"date": "2024-01-01"}]},
+                "negative_cache": {},
+            },
+            # Left by an earlier run
+            get_partial_name(1, 2): {
+                "run_id": "earlier",
+                "copilot_teams": [],
+                "new_history": {},
+                "negative_cache": {},
+            },
+        }
+        s3 = make_fake_s3(objects)
+
+        with pytest.raises(RunAbortedError, match="1 of 2 shards did not finish"):
+            merge_partials(s3, MagicMock(), make_teams(2), 2, "run")
+
+        # The finished shard's history is stored, but not the incomplete team lists
+        assert [entry["team"]["name"] for entry in objects["teams_history.json"]] == ["team0"]
+        assert "copilot_teams.json" not in objects
+        assert NEGATIVE_CACHE_OBJECT not in objects
+
+    def test_merge_partials_aborts_if_the_history_is_not_written(self):
+        objects = {
+            get_partial_name(0, 1): {
+                "run_id": "run",
+                "copilot_teams": [{"name": "team0"}],
+                "new_history": {"team0": [{"date": "2024-01-01"}]},
+                "negative_cache": {"team1": {"expires": "2999-01-01"}},
+            },
+        }
+        s3 = make_fake_s3(objects)
+
+        with (
+            patch("src.main.update_team_history", return_value=False),
+            pytest.raises(RunAbortedError, match="Could not write the team history"),
+        ):
+            merge_partials(s3, MagicMock(), make_teams(2), 1, "run")
+
+        # The team lists are left unchanged, as they would describe history that was not stored
+        assert "copilot_teams.json" not in objects
+        assert NEGATIVE_CACHE_OBJECT not in objects
+
+    def test_coordinator_runs_workers_locally(self):
+        objects = {}
+        s3 = make_fake_s3(objects)
+        teams = make_teams(10)
+        metrics = {f"team{i}": [{"date": "2024-01-01"}] for i in range(0, 10, 2)}
+        gh = make_fake_github(teams, metrics)
+
+        # Threads stand in for the process pool, so the workers share the fakes
+        with (
+            patch("src.fanout.connect", return_value=(s3, gh)),
+            patch(
+                "src.fanout.ProcessPoolExecutor",
+                lambda max_workers, mp_context: ThreadPoolExecutor(max_workers),
+            ),
+        ):
+            result = main_handler({"mode": "coordinator", "shards": 3}, None)
+
+        assert result == "Github Data logging is now complete."
+        assert [team["name"] for team in objects["copilot_teams.json"]] == [
+            f"team{i}" for i in range(0, 10, 2)
+        ]
+        assert len(objects["teams_history.json"]) == 5
+        assert sorted(objects[NEGATIVE_CACHE_OBJECT]) == [f"team{i}" for i in range(1, 10, 2)]
+        assert all(get_partial_name(shard, 3) in objects for shard in range(3))
+
+    def test_replayed_coordinator_runs_workers_locally(self):
+        gh = make_fake_github(make_teams(2), {})
+
+        with (
+            patch("src.fanout.open_cassette", return_value=Cassette("replay")),
+            patch("src.fanout.connect", return_value=(make_fake_s3({}), gh)),
+            patch("src.fanout.invoke_workers", return_value=[]) as invoke_workers_mock,
+        ):
+            handler({"mode": "coordinator", "shards": 2}, MagicMock())
+
+        # A replayed run is offline, so its workers are not invoked as Lambda functions
+        assert invoke_workers_mock.call_args.args[3] is True
+
+    def test_worker_saves_the_cassette_of_its_shard(self, tmp_path):
+        event = {"run_id": "run", "shard": 0, "shards": 2, "teams": [{"name": "team1"}]}
+
+        with (
+            patch("src.cassette.CASSETTE_MODE", "record"),
+            patch("src.cassette.CASSETTE_PATH", str(tmp_path / "cassette.json.gz")),
+            patch("src.fanout.connect", return_value=(make_fake_s3({}), make_fake_github([], {}))),
+        ):
+            handler({"mode": "worker", **event}, None)
+
+        assert (tmp_path / "cassette-shard-1-of-2.json.gz").exists()
+
+
+class TestInvokeWorkers:
+    def test_local_worker_errors_are_returned(self):
+        def run(event):
+            if event["shard"]:
+                raise RunAbortedError("Could not write")
+            return "done"
+
+        with (
+            patch("src.fanout.run_worker", run),
+            patch(
+                "src.fanout.ProcessPoolExecutor",
+                lambda max_workers, mp_context: ThreadPoolExecutor(max_workers),
+            ),
+        ):
+            results = invoke_workers(MagicMock(), [{"shard": 0}, {"shard": 1}], None, local=True)
+
+        assert results == ["done", "Could not write"]
+
+    @patch("src.fanout.FANOUT_POLL_SECONDS", 0)
+    def test_lambda_workers(self):
+        lambda_client = MagicMock()
+        lambda_client.invoke.side_effect = [
+            {"StatusCode": 202},
+            {"StatusCode": 202},
+            {"StatusCode": 500},
+        ]
+        context = MagicMock(function_name="copilot-usage-lambda")
+        context.get_remaining_time_in_millis.return_value = 600_000
+        now = datetime.now(UTC)
+        s3 = MagicMock()
+        # The partial of shard 2 is only written on the second poll
+        s3.list_objects_v2.side_effect = [
+            {"Contents": [{"Key": "fanout/shard-0-of-3.json", "LastModified": now}]},
+            {
+                "Contents": [
+                    {"Key": "fanout/shard-0-of-3.json", "LastModified": now},
+                    {"Key": "fanout/shard-1-of-3.json", "LastModified": now},
+                ]
+            },
+        ]
+        events = [{"shard": shard, "shards": 3} for shard in range(3)]
+
+        with patch("src.fanout.get_client", return_value=lambda_client):
+            results = invoke_workers(s3, events, context, local=False)
+
+        assert results[:2] == [
+            "Shard 1 of 3 written to fanout/shard-0-of-3.json",
+            "Shard 2 of 3 written to fanout/shard-1-of-3.json",
+        ]
+        assert results[2].startswith("Shard 3 failed to start")
+        assert s3.list_objects_v2.call_count == 2
+        kwargs = lambda_client.invoke.call_args_list[0].kwargs
+        assert kwargs["FunctionName"] == "copilot-usage-lambda"
+        # Workers are invoked asynchronously, so the coordinator does not wait on each request
+        assert kwargs["InvocationType"] == "Event"
+        assert json.loads(kwargs["Payload"]) == {"mode": "worker", "shard": 0, "shards": 3}
+
+    @patch("src.fanout.FANOUT_POLL_SECONDS", 0)
+    def test_lambda_workers_stop_waiting_once_out_of_time(self):
+        lambda_client = MagicMock()
+        lambda_client.invoke.return_value = {"StatusCode": 202}
+        remaining = iter([600_000])
+        context = MagicMock(function_name="copilot-usage-lambda")
+        context.get_remaining_time_in_millis.side_effect = lambda: next(remaining, 30_000)
+        s3 = MagicMock()
+        # A partial left by an earlier run is not counted
+        stale = datetime(2000, 1, 1, tzinfo=UTC)
+        s3.list_objects_v2.return_value = {
+            "Contents": [{"Key": "fanout/shard-0-of-1.json", "LastModified": stale}]
+        }
+
+        with patch("src.fanout.get_client", return_value=lambda_client):
+            results = invoke_workers(s3, [{"shard": 0, "shards": 1}], context, local=False)
+
+        assert results == ["Shard 1 did not finish in time"]
+        assert s3.list_objects_v2.call_count == 2
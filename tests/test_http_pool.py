@@ -0,0 +1,107 @@
+import socket
+import threading
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from types import SimpleNamespace
+from unittest.mock import MagicMock, patch
+
+import pytest
+import requests
+
+from src.http_pool import PooledHTTPAdapter, mount_adapter
+
+
+class KeepAliveHandler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"
+
+    def do_GET(self):
+        body = b"[]"
+        self.send_response(200)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, *args):
+        pass
+
+
+@pytest.fixture
+def server_url():
+    server = ThreadingHTTPServer(("127.0.0.1", 0), KeepAliveHandler)
+    thread = threading.Thread(target=server.serve_forever, daemon=True)
+    thread.start()
+    yield f"http://127.0.0.1:{server.server_address[1]}"
+    server.shutdown()
+    server.server_close()
+
+
+def make_session(adapter):
+    session = requests.Session()
+    session.mount("http://", adapter)
+    return session
+
+
+class TestPooledHTTPAdapter:
+    def test_pool_configuration(self):
+        adapter = PooledHTTPAdapter(25, (5.0, 30.0))
+        pool_kw = adapter.poolmanager.connection_pool_kw
+
+        assert pool_kw["maxsize"] == 25
+        assert pool_kw["block"] is True
+        assert (socket.SOL_SOCKET, socket.SO_KEEPALIVE, 1) in pool_kw["socket_options"]
+
+    def test_keep_alive_can_be_disabled(self):
+        adapter = PooledHTTPAdapter(5, 10.0, keep_alive=False)
+        assert "socket_options" not in adapter.poolmanager.connection_pool_kw
+
+    @patch("requests.adapters.HTTPAdapter.send")
+    def test_default_timeout(self, mock_send):
+        adapter = PooledHTTPAdapter(5, (5.0, 30.0))
+        request = MagicMock()
+
+        adapter.send(request, timeout=None, stream=False)
+        assert mock_send.call_args.kwargs["timeout"] == (5.0, 30.0)
+
+        # A request's own timeout is kept
+        adapter.send(request, timeout=1.0)
+        assert mock_send.call_args.kwargs["timeout"] == 1.0
+
+    def test_connections_are_reused(self, server_url):
+        adapter = PooledHTTPAdapter(5, 5.0)
+        session = make_session(adapter)
+
+        for _ in range(3):
+            assert session.get(server_url + "/teams").json() == []
+
+        assert adapter.stats() == {
+            "no_github_http_requests": 3,
+            "no_github_connections_opened": 1,
+            "no_github_connections_reused": 2,
+        }
+
+    def test_reset_stats_keeps_connections(self, server_url):
+        adapter = PooledHTTPAdapter(5, 5.0)
+        session = make_session(adapter)
+        session.get(server_url)
+
+        adapter.reset_stats()
+        # Another session, as after a token refresh, shares the open connection
+        make_session(adapter).get(server_url)
+
+        assert adapter.stats() == {
+            "no_github_http_requests": 1,
+            "no_github_connections_opened": 0,
+            "no_github_connections_reused": 1,
+        }
+
+
+class TestMountAdapter:
+    def test_mount_adapter(self):
+        gh = SimpleNamespace(session=requests.Session())
+        adapter = PooledHTTPAdapter(5, 5.0)
+
+        assert mount_adapter(gh, adapter)
+        assert gh.session.get_adapter("https://api.github.com/orgs") is adapter
+
+    def test_interface_without_session(self):
+        assert not mount_adapter(SimpleNamespace(), PooledHTTPAdapter(5, 5.0))
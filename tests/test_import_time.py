@@ -0,0 +1,90 @@
+import os
+import subprocess
+import sys
+from pathlib import Path
+
+import pytest
+
+ROOT = Path(__file__).resolve().parent.parent
+
+# Maximum time importing the handler module may take, in milliseconds
+IMPORT_TIME_BUDGET_MS = float(os.getenv("IMPORT_TIME_BUDGET_MS", "300"))
+
+# The budget is checked against the fastest of several imports, which is the least disturbed
+IMPORT_TIME_RUNS = 3
+
+# Packages that are slow to import, and are only imported when they are first needed
+DEFERRED_MODULES = ["boto3", "botocore.session", "s3transfer", "github_api_toolkit"]
+
+
+def run_python(*args):
+    return subprocess.run(
+        [sys.executable, *args],
+        cwd=ROOT,
+        capture_output=True,
+        text=True,
+        check=True,
+    )
+
+
+def parse_importtime(output):
+    """Returns (self_us, cumulative_us, name, depth) for each line of `-X importtime` output."""
+    imports = []
+    for line in output.splitlines():
+        if not line.startswith("import time:") or "cumulative" in line:
+            continue
+        self_us, cumulative_us, name = line.removeprefix("import time:").split("|")
+        depth = (len(name) - len(name.lstrip())) // 2
+        imports.append((int(self_us), int(cumulative_us), name.strip(), depth))
+    return imports
+
+
+def importtime_report(imports, limit=15):
+    lines = [f"{'cumulative ms':>14} {'self ms':>9}  module"]
+    for self_us, cumulative_us, name, depth in sorted(imports, key=lambda i: -i[1])[:limit]:
+        lines.append(f"{cumulative_us / 1000:>14.1f} {self_us / 1000:>9.1f}  {'  ' * depth}{name}")
+    return "\n".join(lines)
+
+
+@pytest.fixture(scope="module")
+def handler_imports():
+    # The first import writes the bytecode cache, as the container image build does
+    run_python("-c", "import src.main")
+    return parse_importtime(run_python("-X", "importtime", "-c", "import src.main").stderr)
+
+
+def get_cumulative_ms(imports, name):
+    return next(i[1] for i in imports if i[2] == name) / 1000
+
+
+class TestImportTime:
+    @pytest.mark.benchmark
+    def test_import_time_is_within_budget(self, handler_imports):
+        runs = [handler_imports] + [
+            parse_importtime(run_python("-X", "importtime", "-c", "import src.main").stderr)
+            for _ in range(IMPORT_TIME_RUNS - 1)
+        ]
+        fastest = min(runs, key=lambda imports: get_cumulative_ms(imports, "src.main"))
+        report = importtime_report(fastest)
+        print(f"\nImport time of src.main\n{report}")
+
+        total_ms = get_cumulative_ms(fastest, "src.main")
+        assert total_ms <= IMPORT_TIME_BUDGET_MS, (
+            f"Importing src.main took {total_ms:.1f}ms, "
+            f"over the budget of {IMPORT_TIME_BUDGET_MS:.0f}ms\n{report}"
+        )
+
+    def test_heavy_modules_are_deferred(self, handler_imports):
+        imported = {i[2] for i in handler_imports}
+        assert [name for name in DEFERRED_MODULES if name in imported] == []
+
+    def test_parse_importtime(self):
+        output = (
+            "import time: self [us] | cumulative | imported package\n"
+            "import time:       120 |        120 |   json.decoder\n"
+            "import time:       300 |        420 | json\n"
+        )
+        assert parse_importtime(output) == [
+            (120, 120, "json.decoder", 1),
+            (300, 420, "json", 0),
+        ]
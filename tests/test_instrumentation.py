@@ -0,0 +1,179 @@
+import json
+from unittest.mock import MagicMock, patch
+
+import pytest
+from requests import HTTPError, Response
+
+from src import instrumentation
+from src.conditional_requests import ConditionalRequestCache
+from src.instrumentation import (
+    InstrumentedInterface,
+    Recorder,
+    emit,
+    instrument,
+    percentile,
+    start,
+    trace_functions,
+    traced,
+)
+
+
+def make_response(body=b"", status_code=200):
+    response = Response()
+    response.status_code = status_code
+    response._content = body
+    return response
+
+
+@pytest.fixture(autouse=True)
+def no_recording():
+    yield
+    instrumentation._current.clear()
+
+
+class TestRecorder:
+    def test_percentile(self):
+        values = [float(value) for value in range(1, 101)]
+        assert percentile(values, 0.5) == 50
+        assert percentile(values, 0.95) == 95
+        assert percentile([3.0], 0.95) == 3
+
+    def test_summary(self):
+        recorder = Recorder()
+        for milliseconds in [10, 20, 30, 40]:
+            recorder.observe("github:/orgs/{org}/teams", milliseconds / 1000)
+        recorder.add("github_requests", 4)
+
+        assert recorder.summary() == {
+            "timings_ms": {
+                "github:/orgs/{org}/teams": {"count": 4, "p50": 20.0, "p95": 40.0, "max": 40.0}
+            },
+            "counters": {"github_requests": 4},
+        }
+
+    def test_to_emf(self):
+        recorder = Recorder()
+        recorder.observe("phase:teams", 0.5)
+        recorder.add("github_downloaded_bytes", 100)
+
+        emf = recorder.to_emf(recorder.summary())
+
+        assert emf["phase:teams.p95"] == 500.0
+        assert emf["github_downloaded_bytes"] == 100
+        metrics = emf["_aws"]["CloudWatchMetrics"][0]["Metrics"]
+        assert {"Name": "phase:teams.max", "Unit": "Milliseconds"} in metrics
+        assert {"Name": "github_downloaded_bytes", "Unit": "Bytes"} in metrics
+
+    @patch("src.instrumentation.INSTRUMENTATION", "emf")
+    def test_emit_prints_emf(self, capsys):
+        start().add("github_requests")
+
+        summary = emit()
+
+        assert summary["counters"] == {"github_requests": 1}
+        assert json.loads(capsys.readouterr().out)["github_requests"] == 1
+
+    def test_emit_without_a_run(self, capsys):
+        assert emit() == {}
+        assert capsys.readouterr().out == ""
+
+
+class TestTracing:
+    def test_traced_records_each_call(self):
+        @traced
+        def add(a, b):
+            return a + b
+
+        @traced(name="json:encode")
+        def encode():
+            return "{}"
+
+        recorder = start()
+        assert add(1, 2) == 3
+        assert add(2, 2) == 4
+        encode()
+
+        assert len(recorder.timings["function:add"]) == 2
+        assert len(recorder.timings["json:encode"]) == 1
+        assert add.__name__ == "add"
+
+    def test_traced_outside_a_run(self):
+        @traced
+        def double(a):
+            return a * 2
+
+        assert double(2) == 4
+
+    @patch("src.instrumentation.ENABLED", False)
+    def test_nothing_is_wrapped_when_off(self):
+        def func():
+            return 1
+
+        namespace = {"func": func}
+        trace_functions(namespace, __name__)
+
+        assert traced(func) is func
+        assert namespace["func"] is func
+        assert start() is None
+
+        gh = MagicMock()
+        assert instrument(gh) is gh
+
+    def test_trace_functions_skips_imported_functions(self):
+        def local():
+            return 1
+
+        namespace = {"local": local, "percentile": percentile, "value": 1}
+        trace_functions(namespace, __name__)
+
+        assert namespace["local"] is not local
+        assert namespace["percentile"] is percentile
+        assert namespace["value"] == 1
+
+
+class TestInstrumentedInterface:
+    def test_requests_are_timed_by_endpoint(self):
+        gh = MagicMock()
+        results = [
+            make_response(b"[1, 2]"),
+            make_response(b"[]"),
+            HTTPError(response=make_response(b"error", 502)),
+        ]
+        # github_interface returns HTTP errors rather than raising them
+        gh.get.side_effect = lambda *args, **kwargs: results.pop(0)
+        recorder = Recorder()
+        interface = InstrumentedInterface(gh, recorder)
+
+        interface.get("/orgs/org/team/a/copilot/metrics")
+        interface.get("/orgs/org/team/b/copilot/metrics", params={"since": "x"})
+        interface.get("/orgs/org/teams")
+
+        assert len(recorder.timings["github:/orgs/org/team/{team}/copilot/metrics"]) == 2
+        assert len(recorder.timings["github:/orgs/org/teams"]) == 1
+        assert recorder.counters == {"github_requests": 3, "github_downloaded_bytes": 13}
+        gh.get.assert_any_call("/orgs/org/team/b/copilot/metrics", params={"since": "x"})
+        assert interface.has_data is gh.has_data
+
+    def test_conditional_requests_are_timed_by_endpoint(self):
+        gh = MagicMock()
+        responses = [make_response(b"[1, 2]"), make_response(status_code=304)]
+        gh.session.get.side_effect = lambda *args, **kwargs: responses.pop(0)
+        recorder = start()
+        # The cache sends metrics requests through the session, around the instrumented interface
+        cache = ConditionalRequestCache(instrument(gh))
+
+        cache.get("/orgs/org/team/a/copilot/metrics")
+        cache.get("/orgs/org/team/a/copilot/metrics")
+
+        assert len(recorder.timings["github:/orgs/org/team/{team}/copilot/metrics"]) == 2
+        assert recorder.counters == {"github_requests": 2, "github_downloaded_bytes": 6}
+        gh.get.assert_not_called()
+
+    def test_instrument_wraps_during_a_run(self):
+        gh = MagicMock()
+        recorder = start()
+
+        interface = instrument(gh)
+
+        assert isinstance(interface, InstrumentedInterface)
+        assert interface.recorder is recorder
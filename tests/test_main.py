@@ -1,24 +1,100 @@
+import gzip
+import hashlib
+import io
 import json
 import os
-from unittest.mock import MagicMock, call, patch
+import threading
+import time
+from datetime import UTC, datetime
+from unittest.mock import ANY, MagicMock, call, patch
 
+import pytest
 from botocore.exceptions import ClientError
-from requests import Response
+from requests import HTTPError, Response
 
 os.environ["AWS_ACCOUNT_NAME"] = "test"
 os.environ["AWS_SECRET_NAME"] = "test-secret"
 os.environ["AWS_DEFAULT_REGION"] = "eu-west-1"
 
+from src.checkpoint import CHECKPOINT_OBJECT, TimeBudget
+from src.conditional_requests import ConditionalRequestCache
+from src.historic_usage import (
+    HISTORIC_USAGE_MANIFEST,
+    group_by_partition,
+    migrate_historic_usage,
+    read_historic_usage,
+)
 from src.main import (
     BUCKET_NAME,
+    ETAG_CACHE_OBJECT,
+    TEAMS_HISTORY_INDEX,
+    TEAMS_HISTORY_MANIFEST,
+    NEGATIVE_CACHE_OBJECT,
     create_dictionary,
+    filter_team_history,
     get_and_update_copilot_teams,
     get_and_update_historic_usage,
     get_copilot_team_date,
+    get_last_page,
+    get_new_team_history,
+    get_prefetch_object_names,
+    get_s3_object,
     get_team_history,
+    get_team_watermark,
     handler,
+    is_without_copilot_data,
+    iter_team_pages,
+    mark_without_copilot_data,
+    plan_team_history,
+    probe_team_metrics,
+    update_sharded_team_history,
+    update_team_history,
     update_s3_object,
 )
+from src.records import Record
+from src.resilience import RunAbortedError
+from src.serialisation import get_content_hash
+from src.team_history import get_team_shard_name
+from src.warm_start import clear_cache
+
+
+@pytest.fixture(autouse=True)
+def cold_start():
+    # Each test starts without the clients and credentials kept between invocations
+    clear_cache()
+    yield
+    clear_cache()
+
+
+def server_error(operation_name="GetObject"):
+    return ClientError(
+        error_response={"Error": {"Code": "InternalError", "Message": "Internal Error"}},
+        operation_name=operation_name,
+    )
+
+
+def make_fake_s3(objects):
+    """Creates an S3 client mock backed by a dictionary of object names to JSON content."""
+    s3 = MagicMock()
+
+    def get_object(Bucket, Key):
+        if Key not in objects:
+            raise ClientError(
+                error_response={"Error": {"Code": "NoSuchKey", "Message": "Not Found"}},
+                operation_name="GetObject",
+            )
+        return {"Body": io.BytesIO(json.dumps(objects[Key]).encode())}
+
+    def put_object(Bucket, Key, Body, **kwargs):
+        objects[Key] = json.loads(Body)
+
+    def list_objects_v2(Bucket, Prefix):
+        return {"Contents": [{"Key": key} for key in objects if key.startswith(Prefix)]}
+
+    s3.get_object.side_effect = get_object
+    s3.put_object.side_effect = put_object
+    s3.list_objects_v2.side_effect = list_objects_v2
+    return s3
 
 
 class TestUpdateS3Object:
@@ -40,6 +116,74 @@ class TestUpdateS3Object:
 
         assert any("Successfully updated" in record.getMessage() for record in caplog.records)
 
+    @patch("src.s3_objects.S3_COMPRESSION", "gzip")
+    @patch("src.s3_objects.S3_JSON_STYLE", "compact")
+    def test_update_s3_object_compressed(self):
+        s3_client = MagicMock()
+
+        assert update_s3_object(s3_client, "test-bucket", "test.json", {"foo": "bar"})
+
+        _, kwargs = s3_client.put_object.call_args
+        assert gzip.decompress(kwargs["Body"]) == b'{"foo":"bar"}'
+        assert kwargs["ContentType"] == "application/json"
+        assert kwargs["ContentEncoding"] == "gzip"
+
+    def test_update_s3_object_skips_unchanged(self, caplog):
+        s3_client = MagicMock()
+        body = b'{\n    "foo": "bar"\n}'
+        s3_client.head_object.return_value = {
+            "Metadata": {"content-sha256": hashlib.sha256(body).hexdigest()}
+        }
+        caplog.set_level("INFO")
+
+        assert update_s3_object(s3_client, "test-bucket", "test.json", {"foo": "bar"})
+
+        s3_client.put_object.assert_not_called()
+        skipped = [r for r in caplog.records if "Skipped updating" in r.getMessage()]
+        assert skipped[0].bytes_skipped == len(body)
+
+    def test_update_s3_object_compares_legacy_etag(self):
+        s3_client = MagicMock()
+        body = b'{\n    "foo": "bar"\n}'
+        s3_client.head_object.return_value = {
+            "ETag": f'"{hashlib.md5(body).hexdigest()}"',
+            "Metadata": {},
+        }
+
+        assert update_s3_object(s3_client, "test-bucket", "test.json", {"foo": "bar"})
+        s3_client.put_object.assert_not_called()
+
+    def test_update_s3_object_writes_changed(self, caplog):
+        s3_client = MagicMock()
+        s3_client.head_object.return_value = {"Metadata": {"content-sha256": "old"}}
+        caplog.set_level("INFO")
+
+        assert update_s3_object(s3_client, "test-bucket", "test.json", {"foo": "bar"})
+
+        _, kwargs = s3_client.put_object.call_args
+        assert kwargs["Metadata"] == {"content-sha256": hashlib.sha256(kwargs["Body"]).hexdigest()}
+        updated = [r for r in caplog.records if "Successfully updated" in r.getMessage()]
+        assert updated[0].bytes_written == len(kwargs["Body"])
+
+    def test_update_s3_object_writes_missing(self):
+        s3_client = MagicMock()
+        s3_client.head_object.side_effect = ClientError(
+            error_response={"Error": {"Code": "404", "Message": "Not Found"}},
+            operation_name="HeadObject",
+        )
+
+        assert update_s3_object(s3_client, "test-bucket", "test.json", {"foo": "bar"})
+        s3_client.put_object.assert_called_once()
+
+    @patch("src.s3_objects.SKIP_UNCHANGED_WRITES", False)
+    def test_update_s3_object_always_writes_when_disabled(self):
+        s3_client = MagicMock()
+
+        assert update_s3_object(s3_client, "test-bucket", "test.json", {"foo": "bar"})
+
+        s3_client.head_object.assert_not_called()
+        s3_client.put_object.assert_called_once()
+
     def test_update_s3_object_failure(self, caplog):
         s3_client = MagicMock()
         s3_client.put_object.side_effect = ClientError(
@@ -57,13 +201,15 @@ class TestUpdateS3Object:
 
 
 class TestGetAndUpdateCopilotTeams:
+    @patch("src.main.NEGATIVE_CACHE_TTL_DAYS", 0)
     @patch("src.main.update_s3_object")
     def test_get_and_update_copilot_teams_single_page(self, mock_update_s3_object):
-        s3 = MagicMock()
+        s3 = make_fake_s3({})
         gh = MagicMock()
         # Mock response for first page
         mock_response = MagicMock()
         mock_response.links = {}  # No 'last' link, so only one page
+        mock_response.json.return_value = [{"name": "team1"}]
         gh.get.return_value = mock_response
 
         # Patch get_copilot_team_date to return a list of teams
@@ -72,20 +218,29 @@ class TestGetAndUpdateCopilotTeams:
         ) as mock_get_team_date:
             result = get_and_update_copilot_teams(s3, gh)
             assert result == [{"name": "team1"}]
-            mock_get_team_date.assert_called_once_with(gh, 1)
+            mock_get_team_date.assert_called_once_with(
+                gh,
+                1,
+                team_metrics=None,
+                teams=mock_response.json.return_value,
+                negative_cache=None,
+                previous_teams={},
+            )
             mock_update_s3_object.assert_called_once()
             args, kwargs = mock_update_s3_object.call_args
             assert args[1].endswith("copilot-usage-dashboard")
             assert args[2] == "copilot_teams.json"
             assert args[3] == [{"name": "team1"}]
 
+    @patch("src.main.NEGATIVE_CACHE_TTL_DAYS", 0)
     @patch("src.main.update_s3_object")
     def test_get_and_update_copilot_teams_multiple_pages(self, mock_update_s3_object):
-        s3 = MagicMock()
+        s3 = make_fake_s3({})
         gh = MagicMock()
         # Mock response with 'last' link for 3 pages
         mock_response = MagicMock()
         mock_response.links = {"last": {"url": "https://api.github.com/orgs/test/teams?page=3"}}
+        mock_response.json.return_value = [{"name": "team"}]
         gh.get.return_value = mock_response
 
         # Patch get_copilot_team_date to return different teams per page
@@ -96,20 +251,26 @@ class TestGetAndUpdateCopilotTeams:
             result = get_and_update_copilot_teams(s3, gh)
             assert result == [{"name": "team1"}, {"name": "team2"}, {"name": "team3"}]
             assert mock_get_team_date.call_count == 3
+            assert [c.args[1] for c in mock_get_team_date.call_args_list] == [1, 2, 3]
+            # Page 1 is only requested once, then pages 2 and 3
+            assert gh.get.call_count == 3
             mock_update_s3_object.assert_called_once()
 
+    @patch("src.main.NEGATIVE_CACHE_TTL_DAYS", 0)
     @patch("src.main.update_s3_object")
     def test_get_and_update_copilot_teams_no_teams(self, mock_update_s3_object):
-        s3 = MagicMock()
+        s3 = make_fake_s3({})
         gh = MagicMock()
         mock_response = MagicMock()
         mock_response.links = {}
+        mock_response.json.return_value = []
         gh.get.return_value = mock_response
 
         with patch("src.main.get_copilot_team_date", return_value=[]) as mock_get_team_date:
             result = get_and_update_copilot_teams(s3, gh)
             assert result == []
-            mock_get_team_date.assert_called_once_with(gh, 1)
+            # An empty page has no teams to probe
+            mock_get_team_date.assert_not_called()
             mock_update_s3_object.assert_called_once()
             args, kwargs = mock_update_s3_object.call_args
             assert args[1].endswith("copilot-usage-dashboard")
@@ -117,6 +278,333 @@ class TestGetAndUpdateCopilotTeams:
             assert args[3] == []
 
 
+class TestDiscoveryBudget:
+    @staticmethod
+    def make_github(pages):
+        def get(url, params=None):
+            response = MagicMock(spec=Response)
+            if url.endswith("/teams"):
+                page = (params or {}).get("page", 1)
+                response.links = {
+                    "last": {"url": f"https://api.github.com/orgs/test-org/teams?page={len(pages)}"}
+                }
+                response.json.return_value = pages[page - 1]
+            else:
+                response.json.return_value = [{"date": "2024-01-01"}]
+            return response
+
+        gh = MagicMock()
+        gh.get.side_effect = get
+        return gh
+
+    @patch("src.main.org", "test-org")
+    @patch("src.main.MAX_WORKERS", 1)
+    @patch("src.main.NEGATIVE_CACHE_TTL_DAYS", 0)
+    @patch("src.main.update_s3_object")
+    def test_discovery_is_deferred_once_out_of_time(self, mock_update_s3_object):
+        gh = self.make_github([[{"name": "team1"}, {"name": "team2"}], [{"name": "team3"}]])
+        remaining = iter([120_000])
+        context = MagicMock()
+        context.get_remaining_time_in_millis.side_effect = lambda: next(remaining, 30_000)
+        budget = TimeBudget(context, reserve_seconds=60)
+
+        result = get_and_update_copilot_teams(make_fake_s3({}), gh, budget=budget)
+
+        assert [team["name"] for team in result] == ["team1"]
+        metrics_urls = [c.args[0] for c in gh.get.call_args_list if "copilot" in c.args[0]]
+        assert metrics_urls == ["/orgs/test-org/team/team1/copilot/metrics"]
+        # Where discovery stopped is kept for the checkpoint, and the stored teams are kept
+        assert budget.discovery == {"page": 1, "probed": ["team1"], "copilot_teams": result}
+        mock_update_s3_object.assert_not_called()
+
+    @patch("src.main.org", "test-org")
+    @patch("src.main.MAX_WORKERS", 1)
+    @patch("src.main.NEGATIVE_CACHE_TTL_DAYS", 0)
+    @patch("src.main.update_s3_object")
+    def test_discovery_resumes_from_the_checkpoint(self, mock_update_s3_object):
+        gh = self.make_github([[{"name": "team1"}], [{"name": "team2"}, {"name": "team3"}]])
+        found = {"name": "team1", "slug": "", "description": "", "url": ""}
+        budget = TimeBudget(
+            None, discovery={"page": 2, "probed": ["team2"], "copilot_teams": [found]}
+        )
+
+        result = get_and_update_copilot_teams(make_fake_s3({}), gh, budget=budget)
+
+        assert [team["name"] for team in result] == ["team1", "team3"]
+        assert [c.args[0] for c in gh.get.call_args_list[1:]] == [
+            "/orgs/test-org/teams",
+            "/orgs/test-org/team/team3/copilot/metrics",
+        ]
+        assert budget.discovery is None
+        assert mock_update_s3_object.call_args.args[2:] == ("copilot_teams.json", result)
+
+    @patch("src.main.org", "test-org")
+    def test_iter_team_pages_from_first_page(self):
+        gh = MagicMock()
+        first_response = MagicMock()
+        first_response.links = {
+            "last": {"url": "https://api.github.com/orgs/test-org/teams?per_page=100&page=3"}
+        }
+        gh.get.return_value.json.return_value = [{"name": "team"}]
+
+        assert [page for page, _ in iter_team_pages(gh, first_response, first_page=3)] == [3]
+        gh.get.assert_called_once_with("/orgs/test-org/teams", params={"per_page": 100, "page": 3})
+        first_response.json.assert_not_called()
+
+
+class TestGetLastPage:
+    def test_get_last_page_from_link(self):
+        response = MagicMock()
+        response.links = {"last": {"url": "https://api.github.com/orgs/test/teams?page=7"}}
+        assert get_last_page(response) == 7
+
+    def test_get_last_page_with_trailing_params(self):
+        response = MagicMock()
+        response.links = {
+            "last": {"url": "https://api.github.com/orgs/test/teams?page=12&per_page=100"}
+        }
+        assert get_last_page(response) == 12
+
+    def test_get_last_page_no_link(self):
+        response = MagicMock()
+        response.links = {}
+        assert get_last_page(response) == 1
+
+    def test_get_last_page_no_page_param(self):
+        response = MagicMock()
+        response.links = {"last": {"url": "https://api.github.com/orgs/test/teams?per_page=100"}}
+        assert get_last_page(response) == 1
+
+
+class TestIterTeamPages:
+    @patch("src.main.org", "test-org")
+    def test_iter_team_pages_reuses_first_response(self):
+        gh = MagicMock()
+        first_response = MagicMock()
+        first_response.links = {}
+        first_response.json.return_value = [{"name": "team1"}]
+
+        result = list(iter_team_pages(gh, first_response))
+        assert result == [(1, [{"name": "team1"}])]
+        gh.get.assert_not_called()
+
+    @patch("src.main.org", "test-org")
+    def test_iter_team_pages_yields_pages_in_order(self):
+        gh = MagicMock()
+        first_response = MagicMock()
+        first_response.links = {
+            "last": {"url": "https://api.github.com/orgs/test-org/teams?per_page=100&page=4"}
+        }
+        first_response.json.return_value = [{"name": "team1"}]
+
+        def get_page(url, params):
+            # Earlier pages are slower, so they arrive out of order
+            time.sleep(0.01 * (5 - params["page"]))
+            page_response = MagicMock()
+            page_response.json.return_value = [{"name": f"team{params['page']}"}]
+            return page_response
+
+        gh.get.side_effect = get_page
+
+        result = list(iter_team_pages(gh, first_response, max_workers=3))
+        assert result == [(page, [{"name": f"team{page}"}]) for page in range(1, 5)]
+        assert sorted(c.kwargs["params"]["page"] for c in gh.get.call_args_list) == [2, 3, 4]
+
+
+class TestNegativeCache:
+    @patch("src.negative_cache.NEGATIVE_CACHE_TTL_DAYS", 20)
+    def test_mark_without_copilot_data_staggers_expiry(self):
+        negative_cache = {}
+        now = datetime(2024, 1, 1, tzinfo=UTC)
+
+        for i in range(50):
+            mark_without_copilot_data(negative_cache, f"team{i}", now)
+
+        expiries = {entry["expires"] for entry in negative_cache.values()}
+        assert all(entry["checked"] == "2024-01-01" for entry in negative_cache.values())
+        # Between half the TTL and the full TTL, spread over several days
+        assert min(expiries) >= "2024-01-11"
+        assert max(expiries) <= "2024-01-21"
+        assert len(expiries) > 1
+
+    def test_is_without_copilot_data(self):
+        now = datetime(2024, 1, 10, tzinfo=UTC)
+        negative_cache = {
+            "fresh": {"checked": "2024-01-01", "expires": "2024-01-20"},
+            "expired": {"checked": "2023-12-01", "expires": "2024-01-10"},
+        }
+        assert is_without_copilot_data(negative_cache, "fresh", now)
+        assert not is_without_copilot_data(negative_cache, "expired", now)
+        assert not is_without_copilot_data(negative_cache, "unknown", now)
+        assert not is_without_copilot_data(None, "fresh", now)
+
+    @patch("src.main.org", "test-org")
+    @patch("src.main.MAX_WORKERS", 1)
+    def test_get_copilot_team_date_skips_cached_teams(self):
+        gh = MagicMock()
+        with_data = MagicMock(spec=Response)
+        with_data.json.return_value = [{"date": "2024-01-01"}]
+        without_data = MagicMock(spec=Response)
+        without_data.json.return_value = []
+        gh.get.side_effect = [with_data, without_data, "not_a_response"]
+
+        negative_cache = {
+            "cached": {"checked": "2000-01-01", "expires": "9999-01-01"},
+            "qualified": {"checked": "2000-01-01", "expires": "2000-01-02"},
+        }
+        teams = [
+            {"name": "cached"},
+            {"name": "qualified"},
+            {"name": "empty"},
+            {"name": "missing"},
+        ]
+
+        result = get_copilot_team_date(gh, 1, teams=teams, negative_cache=negative_cache)
+
+        assert [team["name"] for team in result] == ["qualified"]
+        assert gh.get.call_count == 3
+        assert "/orgs/test-org/team/cached/copilot/metrics" not in [
+            c.args[0] for c in gh.get.call_args_list
+        ]
+        # Only an empty response shows the team has no data, not a failed request
+        assert sorted(negative_cache) == ["cached", "empty"]
+
+    @patch("src.main.org", "test-org")
+    @patch("src.main.MAX_WORKERS", 1)
+    def test_get_copilot_team_date_does_not_cache_transient_failures(self):
+        gh = MagicMock()
+        bad_gateway = Response()
+        bad_gateway.status_code = 502
+        gh.get.return_value = HTTPError(response=bad_gateway)
+
+        negative_cache = {}
+        result = get_copilot_team_date(
+            gh, 1, teams=[{"name": "flaky"}], negative_cache=negative_cache
+        )
+
+        # The team is probed again on the next run, rather than skipped for weeks
+        assert result == []
+        assert negative_cache == {}
+
+    @pytest.mark.parametrize("status_code", [401, 403, 404])
+    @patch("src.main.org", "test-org")
+    @patch("src.main.MAX_WORKERS", 1)
+    def test_get_copilot_team_date_does_not_cache_refused_requests(self, status_code):
+        gh = MagicMock()
+        refused = Response()
+        refused.status_code = status_code
+        gh.get.return_value = HTTPError(response=refused)
+        previous = {"name": "licensed", "slug": "licensed", "description": "", "url": ""}
+
+        negative_cache = {}
+        result = get_copilot_team_date(
+            gh,
+            1,
+            teams=[{"name": "licensed"}],
+            negative_cache=negative_cache,
+            previous_teams={"licensed": previous},
+        )
+
+        # A failed token refresh or an exhausted rate limit does not show the team has no data
+        assert result == [previous]
+        assert negative_cache == {}
+
+    @patch("src.main.org", "test-org")
+    @patch("src.main.MAX_WORKERS", 1)
+    def test_get_copilot_team_date_keeps_previous_entry_on_transient_failure(self):
+        gh = MagicMock()
+        bad_gateway = Response()
+        bad_gateway.status_code = 502
+        gh.get.return_value = HTTPError(response=bad_gateway)
+        previous = {"name": "flaky", "slug": "flaky", "description": "", "url": ""}
+
+        result = get_copilot_team_date(
+            gh,
+            1,
+            teams=[{"name": "flaky"}, {"name": "new"}],
+            previous_teams={"flaky": previous},
+        )
+
+        # Only the team found by the last run keeps its entry
+        assert result == [previous]
+
+    @patch("src.main.NEGATIVE_CACHE_TTL_DAYS", 0)
+    @patch("src.main.update_s3_object")
+    def test_get_and_update_copilot_teams_reads_previous_teams(self, mock_update_s3_object):
+        previous = {"name": "team1", "slug": "team1", "description": "", "url": ""}
+        s3 = make_fake_s3({"copilot_teams.json": [previous]})
+        gh = MagicMock()
+        gh.get.return_value.links = {}
+        gh.get.return_value.json.return_value = [{"name": "team1"}]
+
+        with patch("src.main.get_copilot_team_date", return_value=[]) as mock_get_team_date:
+            get_and_update_copilot_teams(s3, gh)
+
+        assert mock_get_team_date.call_args.kwargs["previous_teams"] == {"team1": previous}
+
+    @patch("src.main.NEGATIVE_CACHE_TTL_DAYS", 21)
+    @patch("src.main.get_s3_object")
+    @patch("src.main.update_s3_object")
+    def test_get_and_update_copilot_teams_stores_negative_cache(
+        self, mock_update_s3_object, mock_get_s3_object
+    ):
+        s3 = MagicMock()
+        gh = MagicMock()
+        gh.get.return_value.links = {}
+        gh.get.return_value.json.return_value = [{"name": "team1"}]
+        mock_get_s3_object.return_value = {
+            "kept": {"checked": "2000-01-01", "expires": "9999-01-01"},
+            "expired": {"checked": "2000-01-01", "expires": "2000-01-02"},
+        }
+
+        with patch("src.main.get_copilot_team_date", return_value=[]) as mock_get_team_date:
+            get_and_update_copilot_teams(s3, gh)
+
+        negative_cache = mock_get_team_date.call_args.kwargs["negative_cache"]
+        assert "kept" in negative_cache
+        mock_get_s3_object.assert_any_call(s3, BUCKET_NAME, NEGATIVE_CACHE_OBJECT, {})
+        mock_update_s3_object.assert_called_with(
+            s3,
+            BUCKET_NAME,
+            NEGATIVE_CACHE_OBJECT,
+            {"kept": {"checked": "2000-01-01", "expires": "9999-01-01"}},
+        )
+
+
+class TestGetS3Object:
+    def test_get_s3_object_success(self):
+        s3_client = MagicMock()
+        s3_client.get_object.return_value = {
+            "Body": MagicMock(read=MagicMock(return_value=b'{"foo": "bar"}'))
+        }
+        assert get_s3_object(s3_client, "bucket", "test.json") == {"foo": "bar"}
+        s3_client.get_object.assert_called_once_with(Bucket="bucket", Key="test.json")
+
+    def test_get_s3_object_compressed(self):
+        s3_client = MagicMock()
+        s3_client.get_object.return_value = {
+            "Body": MagicMock(read=MagicMock(return_value=gzip.compress(b'{"foo": "bar"}'))),
+            "ContentEncoding": "gzip",
+        }
+        assert get_s3_object(s3_client, "bucket", "test.json") == {"foo": "bar"}
+
+    def test_get_s3_object_client_error(self, caplog):
+        s3_client = MagicMock()
+        s3_client.get_object.side_effect = ClientError(
+            error_response={"Error": {"Code": "404", "Message": "Not Found"}},
+            operation_name="GetObject",
+        )
+        assert get_s3_object(s3_client, "bucket", "test.json", {}) == {}
+        assert any("Error getting test.json" in record.getMessage() for record in caplog.records)
+
+    def test_get_s3_object_invalid_json(self):
+        s3_client = MagicMock()
+        s3_client.get_object.return_value = {
+            "Body": MagicMock(read=MagicMock(return_value=b"not json"))
+        }
+        assert get_s3_object(s3_client, "bucket", "test.json", []) == []
+
+
 class TestGetTeamHistory:
     def setup_method(self):
         self.org_patch = patch("src.main.org", "test-org")
@@ -138,6 +626,18 @@ class TestGetTeamHistory:
         )
         assert result == [{"date": "2024-01-01", "usage": 5}]
 
+    def test_get_team_history_decodes_compact_records(self):
+        gh = MagicMock()
+        response = Response()
+        response.status_code = 200
+        response._content = b'[{"date": "2024-01-01", "usage": 5}]'
+        gh.get.return_value = response
+
+        (day,) = get_team_history(gh, "dev-team")
+
+        assert isinstance(day, Record)
+        assert day == {"date": "2024-01-01", "usage": 5}
+
     def test_get_team_history_unexpected_response_type(self, caplog):
         gh = MagicMock()
         gh.get.return_value = "not_a_response"
@@ -149,6 +649,14 @@ class TestGetTeamHistory:
                 "Unexpected response type" in record.getMessage() for record in caplog.records
             )
 
+    def test_get_team_history_not_modified(self):
+        gh = MagicMock()
+        not_modified = Response()
+        not_modified.status_code = 304
+        gh.get.return_value = not_modified
+
+        assert get_team_history(gh, "dev-team", {"since": "2024-01-01"}) == []
+
     def test_get_team_history_with_no_query_params(self):
         gh = MagicMock()
         mock_response = MagicMock(spec=Response)
@@ -161,9 +669,9 @@ class TestGetTeamHistory:
 
 
 class TestHandler:
-    @patch("src.main.boto3.Session")
-    @patch("src.main.github_api_toolkit.get_token_as_installation")
-    @patch("src.main.github_api_toolkit.github_interface")
+    @patch("boto3.Session")
+    @patch("github_api_toolkit.get_token_as_installation")
+    @patch("github_api_toolkit.github_interface")
     @patch("src.main.get_and_update_historic_usage")
     @patch("src.main.get_and_update_copilot_teams")
     @patch("src.main.create_dictionary")
@@ -191,7 +699,12 @@ class TestHandler:
         mock_gh = MagicMock()
         mock_github_interface.return_value = mock_gh
 
-        mock_get_and_update_historic_usage.return_value = (["usage1", "usage2"], ["2024-01-01"])
+        mock_get_and_update_historic_usage.return_value = (
+            ["usage1", "usage2"],
+            ["2024-01-01"],
+            True,
+            2,
+        )
         mock_get_and_update_copilot_teams.return_value = [{"name": "team1"}]
         mock_create_dictionary.return_value = [
             {"team": {"name": "team1"}, "data": [{"date": "2024-01-01"}]}
@@ -207,6 +720,8 @@ class TestHandler:
             )
         }
 
+        caplog.set_level("INFO")
+
         result = handler({}, MagicMock())
         assert result == "Github Data logging is now complete."
         mock_boto3_session.assert_called_once()
@@ -218,12 +733,70 @@ class TestHandler:
         mock_get_and_update_historic_usage.assert_called_once()
         mock_get_and_update_copilot_teams.assert_called_once()
         mock_create_dictionary.assert_called_once()
-        mock_update_s3_object.assert_called_with(
-            mock_s3, BUCKET_NAME, "teams_history.json", mock_create_dictionary.return_value
+        mock_update_s3_object.assert_any_call(
+            ANY, BUCKET_NAME, "teams_history.json", mock_create_dictionary.return_value
+        )
+        # Objects are read and written through the prefetching and resilient wrappers of the S3 client
+        assert mock_update_s3_object.call_args.args[0].s3_client.s3_client is mock_s3
+        # Each phase is timed
+        complete = [r for r in caplog.records if r.getMessage() == "Process complete"]
+        assert (complete[0].no_dates_before, complete[0].no_dates_after) == (1, 2)
+        assert set(complete[0].phase_seconds) == {
+            "historic_usage",
+            "copilot_teams",
+            "team_history",
+            "etag_cache",
+            "checkpoint",
+        }
+        # The phases are instrumented
+        summary = next(r for r in caplog.records if r.getMessage() == "Instrumentation summary")
+        assert {"phase:copilot_teams", "phase:team_history"} <= set(
+            summary.instrumentation["timings_ms"]
         )
+        # The conditional request validators are stored after the team history
+        assert mock_update_s3_object.call_args.args[2] == ETAG_CACHE_OBJECT
+
+    @patch("boto3.Session")
+    @patch("github_api_toolkit.get_token_as_installation")
+    @patch("github_api_toolkit.github_interface")
+    @patch("src.main.get_and_update_historic_usage")
+    @patch("src.main.get_and_update_copilot_teams")
+    @patch("src.main.update_team_history")
+    @patch("src.main.update_s3_object")
+    def test_handler_warm_start_reuses_clients_and_credentials(
+        self,
+        mock_update_s3_object,
+        mock_update_team_history,
+        mock_get_and_update_copilot_teams,
+        mock_get_and_update_historic_usage,
+        mock_github_interface,
+        mock_get_token_as_installation,
+        mock_boto3_session,
+    ):
+        mock_s3 = MagicMock()
+        mock_secret_manager = MagicMock()
+        mock_session = MagicMock()
+        mock_session.client.side_effect = [mock_s3, mock_secret_manager]
+        mock_boto3_session.return_value = mock_session
+        mock_secret_manager.get_secret_value.return_value = {"SecretString": "pem-content"}
+        mock_get_token_as_installation.return_value = ("token",)
+        mock_get_and_update_historic_usage.return_value = ([], [], True, 0)
+        mock_get_and_update_copilot_teams.return_value = []
+        mock_update_team_history.return_value = True
+        mock_s3.get_object.return_value = {"Body": MagicMock(read=MagicMock(return_value=b"{}"))}
 
-    @patch("src.main.boto3.Session")
-    @patch("src.main.github_api_toolkit.get_token_as_installation")
+        handler({}, MagicMock())
+        handler({}, MagicMock())
+
+        mock_boto3_session.assert_called_once()
+        assert mock_session.client.call_count == 2
+        mock_secret_manager.get_secret_value.assert_called_once()
+        mock_get_token_as_installation.assert_called_once()
+        # The S3 client is reused, but objects are prefetched again on each invocation
+        assert mock_update_s3_object.call_args.args[0].s3_client.s3_client is mock_s3
+
+    @patch("boto3.Session")
+    @patch("github_api_toolkit.get_token_as_installation")
     def test_handler_access_token_error(
         self, mock_get_token_as_installation, mock_boto3_session, caplog
     ):
@@ -239,9 +812,44 @@ class TestHandler:
         assert result.startswith("Error getting access token:")
         assert any("Error getting access token" in record.getMessage() for record in caplog.records)
 
-    @patch("src.main.boto3.Session")
-    @patch("src.main.github_api_toolkit.get_token_as_installation")
-    @patch("src.main.github_api_toolkit.github_interface")
+    @patch("boto3.Session")
+    @patch("github_api_toolkit.get_token_as_installation")
+    @patch("github_api_toolkit.github_interface")
+    @patch("src.main.get_and_update_historic_usage")
+    @patch("src.main.get_and_update_copilot_teams")
+    @patch("src.main.update_team_history", return_value=True)
+    @patch("src.main.update_s3_object")
+    def test_handler_keeps_etag_cache_if_historic_write_fails(
+        self,
+        mock_update_s3_object,
+        _mock_update_team_history,
+        mock_get_and_update_copilot_teams,
+        mock_get_and_update_historic_usage,
+        _mock_github_interface,
+        mock_get_token_as_installation,
+        mock_boto3_session,
+    ):
+        mock_s3 = MagicMock()
+        mock_s3.get_object.side_effect = ClientError(
+            error_response={"Error": {"Code": "NoSuchKey", "Message": "Not Found"}},
+            operation_name="GetObject",
+        )
+        mock_session = MagicMock()
+        mock_session.client.side_effect = [mock_s3, MagicMock()]
+        mock_boto3_session.return_value = mock_session
+        mock_get_token_as_installation.return_value = ("token",)
+        mock_get_and_update_copilot_teams.return_value = [{"name": "team1"}]
+
+        # The new days were not stored, so the next run must not be told they are unchanged
+        mock_get_and_update_historic_usage.return_value = (["usage1"], ["2024-01-01"], False, 1)
+
+        assert handler({}, MagicMock()) == "Github Data logging is now complete."
+        written = [c.args[2] for c in mock_update_s3_object.call_args_list]
+        assert ETAG_CACHE_OBJECT not in written
+
+    @patch("boto3.Session")
+    @patch("github_api_toolkit.get_token_as_installation")
+    @patch("github_api_toolkit.github_interface")
     @patch("src.main.get_and_update_historic_usage")
     @patch("src.main.get_and_update_copilot_teams")
     @patch("src.main.create_dictionary")
@@ -268,7 +876,7 @@ class TestHandler:
         mock_gh = MagicMock()
         mock_github_interface.return_value = mock_gh
 
-        mock_get_and_update_historic_usage.return_value = (["usage1"], ["2024-01-01"])
+        mock_get_and_update_historic_usage.return_value = (["usage1"], ["2024-01-01"], True, 1)
         mock_get_and_update_copilot_teams.return_value = [{"name": "team1"}]
         mock_create_dictionary.return_value = [
             {"team": {"name": "team1"}, "data": [{"date": "2024-01-01"}]}
@@ -286,9 +894,111 @@ class TestHandler:
             "Error retrieving existing team history" in record.getMessage()
             for record in caplog.records
         )
-        mock_update_s3_object.assert_called_with(
-            mock_s3, BUCKET_NAME, "teams_history.json", mock_create_dictionary.return_value
+        mock_update_s3_object.assert_any_call(
+            ANY, BUCKET_NAME, "teams_history.json", mock_create_dictionary.return_value
         )
+        # Objects are read and written through the prefetching and resilient wrappers of the S3 client
+        assert mock_update_s3_object.call_args.args[0].s3_client.s3_client is mock_s3
+        # The conditional request validators are stored after the team history
+        assert mock_update_s3_object.call_args.args[2] == ETAG_CACHE_OBJECT
+
+    @patch("boto3.Session")
+    @patch("github_api_toolkit.get_token_as_installation")
+    @patch("github_api_toolkit.github_interface")
+    @patch("src.main.get_and_update_historic_usage")
+    @patch("src.main.get_and_update_copilot_teams")
+    @patch("src.main.create_dictionary")
+    @patch("src.main.update_s3_object")
+    def test_handler_keeps_etag_cache_when_history_write_fails(
+        self,
+        mock_update_s3_object,
+        mock_create_dictionary,
+        mock_get_and_update_copilot_teams,
+        mock_get_and_update_historic_usage,
+        mock_github_interface,
+        mock_get_token_as_installation,
+        mock_boto3_session,
+    ):
+        mock_s3 = MagicMock()
+        mock_secret_manager = MagicMock()
+        mock_session = MagicMock()
+        mock_session.client.side_effect = [mock_s3, mock_secret_manager]
+        mock_boto3_session.return_value = mock_session
+
+        mock_secret_manager.get_secret_value.return_value = {"SecretString": "pem-content"}
+        mock_get_token_as_installation.return_value = ("token",)
+        mock_get_and_update_historic_usage.return_value = ([], [], True, 0)
+        mock_get_and_update_copilot_teams.return_value = []
+        mock_create_dictionary.return_value = []
+        mock_s3.get_object.return_value = {"Body": MagicMock(read=MagicMock(return_value=b"[]"))}
+        mock_update_s3_object.return_value = False
+
+        handler({}, MagicMock())
+
+        written = [c.args[2] for c in mock_update_s3_object.call_args_list]
+        assert written == ["teams_history.json"]
+
+    @patch("boto3.Session")
+    @patch("github_api_toolkit.get_token_as_installation")
+    @patch("github_api_toolkit.github_interface")
+    @patch("src.main.get_and_update_historic_usage")
+    @patch("src.main.get_and_update_copilot_teams")
+    @patch("src.main.update_team_history")
+    @patch("src.main.update_s3_object")
+    def test_handler_aborts_cleanly(
+        self,
+        mock_update_s3_object,
+        mock_update_team_history,
+        mock_get_and_update_copilot_teams,
+        mock_get_and_update_historic_usage,
+        mock_github_interface,
+        mock_get_token_as_installation,
+        mock_boto3_session,
+        caplog,
+    ):
+        mock_session = MagicMock()
+        mock_boto3_session.return_value = mock_session
+        mock_session.client.return_value.get_secret_value.return_value = {"SecretString": "pem"}
+        mock_session.client.return_value.get_object.return_value = {
+            "Body": MagicMock(read=MagicMock(return_value=b"{}"))
+        }
+        mock_get_token_as_installation.return_value = ("token",)
+        mock_get_and_update_historic_usage.side_effect = RunAbortedError("GitHub failed")
+        mock_get_and_update_copilot_teams.return_value = []
+        mock_update_team_history.return_value = True
+
+        result = handler({}, MagicMock())
+
+        assert result == "Run aborted: GitHub failed"
+        # The conditional request validators are not stored for a run that did not finish
+        assert ETAG_CACHE_OBJECT not in [c.args[2] for c in mock_update_s3_object.call_args_list]
+        aborted = next(r for r in caplog.records if r.getMessage().startswith("Run aborted"))
+        assert aborted.no_github_retries == 0
+        assert aborted.s3_circuit_open is False
+
+    @patch("src.main.NEGATIVE_CACHE_TTL_DAYS", 21)
+    @patch("src.main.CONDITIONAL_REQUESTS", True)
+    def test_get_prefetch_object_names(self):
+        assert get_prefetch_object_names() == [
+            "historic_usage_data.json",
+            TEAMS_HISTORY_MANIFEST,
+            ETAG_CACHE_OBJECT,
+            NEGATIVE_CACHE_OBJECT,
+            "copilot_teams.json",
+            CHECKPOINT_OBJECT,
+        ]
+
+    @patch("src.main.NEGATIVE_CACHE_TTL_DAYS", 0)
+    @patch("src.main.CONDITIONAL_REQUESTS", False)
+    @patch("src.main.TEAMS_HISTORY_LAYOUT", "sharded")
+    @patch("src.main.HISTORIC_USAGE_LAYOUT", "monthly")
+    def test_get_prefetch_object_names_partitioned(self):
+        assert get_prefetch_object_names() == [
+            HISTORIC_USAGE_MANIFEST,
+            TEAMS_HISTORY_INDEX,
+            "copilot_teams.json",
+            CHECKPOINT_OBJECT,
+        ]
 
 
 class TestGetCopilotTeamDate:
@@ -317,26 +1027,76 @@ class TestGetCopilotTeamDate:
         gh.get.assert_any_call("/orgs/test-org/team/team2/copilot/metrics")
 
     @patch("src.main.org", "test-org")
-    def test_get_copilot_team_date_unexpected_usage_response(self, caplog):
+    def test_get_copilot_team_date_with_prefetched_teams(self):
+        gh = MagicMock()
+        gh.get.return_value = MagicMock(spec=Response)
+
+        result = get_copilot_team_date(gh, 2, teams=[{"name": "team1", "slug": "slug1"}])
+        assert [team["name"] for team in result] == ["team1"]
+        gh.get.assert_called_once_with("/orgs/test-org/team/team1/copilot/metrics")
+
+    @patch("src.main.org", "test-org")
+    @patch("src.main.MAX_WORKERS", 1)
+    def test_get_copilot_team_date_keeps_team_metrics(self):
         gh = MagicMock()
         teams_response = MagicMock()
         teams_response.json.return_value = [
             {"name": "team1", "slug": "slug1", "description": "desc1", "html_url": "url1"},
+            {"name": "team2", "slug": "slug2", "description": "desc2", "html_url": "url2"},
         ]
-        gh.get.side_effect = [
-            teams_response,
-            "not_a_response",  # usage_data for team1
-        ]
+        team1_usage = MagicMock(spec=Response)
+        team1_usage.json.return_value = [{"date": "2024-01-01"}]
+        team2_usage = MagicMock(spec=Response)
+        team2_usage.json.return_value = []
+        gh.get.side_effect = [teams_response, team1_usage, team2_usage]
 
-        with caplog.at_level("ERROR"):
-            result = get_copilot_team_date(gh, 1)
-            assert result == []
+        team_metrics = {}
+        result = get_copilot_team_date(gh, 1, team_metrics=team_metrics)
+        assert [team["name"] for team in result] == ["team1"]
+        assert team_metrics == {"team1": [{"date": "2024-01-01"}]}
 
     @patch("src.main.org", "test-org")
-    def test_get_copilot_team_date_empty_teams(self):
+    @patch("src.main.MAX_WORKERS", 1)
+    def test_get_copilot_team_date_not_modified(self):
         gh = MagicMock()
-        teams_response = MagicMock()
-        teams_response.json.return_value = []
+        not_modified = Response()
+        not_modified.status_code = 304
+        gh.get.return_value = not_modified
+        gh.has_data.side_effect = [True, False]
+
+        team_metrics = {}
+        result = get_copilot_team_date(
+            gh,
+            1,
+            team_metrics=team_metrics,
+            teams=[{"name": "team1"}, {"name": "team2"}],
+        )
+        assert [team["name"] for team in result] == ["team1"]
+        # The unchanged payload is never decoded
+        assert team_metrics == {"team1": None}
+        gh.has_data.assert_any_call("/orgs/test-org/team/team1/copilot/metrics")
+
+    @patch("src.main.org", "test-org")
+    def test_get_copilot_team_date_unexpected_usage_response(self, caplog):
+        gh = MagicMock()
+        teams_response = MagicMock()
+        teams_response.json.return_value = [
+            {"name": "team1", "slug": "slug1", "description": "desc1", "html_url": "url1"},
+        ]
+        gh.get.side_effect = [
+            teams_response,
+            "not_a_response",  # usage_data for team1
+        ]
+
+        with caplog.at_level("ERROR"):
+            result = get_copilot_team_date(gh, 1)
+            assert result == []
+
+    @patch("src.main.org", "test-org")
+    def test_get_copilot_team_date_empty_teams(self):
+        gh = MagicMock()
+        teams_response = MagicMock()
+        teams_response.json.return_value = []
         gh.get.return_value = teams_response
 
         result = get_copilot_team_date(gh, 1)
@@ -344,6 +1104,59 @@ class TestGetCopilotTeamDate:
         gh.get.assert_called_once_with("/orgs/test-org/teams", params={"per_page": 100, "page": 1})
 
 
+class TestProbeTeamMetrics:
+    @patch("src.main.org", "test-org")
+    def test_probe_team_metrics_preserves_order(self):
+        gh = MagicMock()
+        teams = [{"name": f"team{i}"} for i in range(6)]
+
+        def slow_get(url):
+            # Later teams return first, so ordering must come from submission order
+            index = int(url.split("/")[4].replace("team", ""))
+            time.sleep(0.01 * (6 - index))
+            return url
+
+        gh.get.side_effect = slow_get
+
+        result = probe_team_metrics(gh, teams, max_workers=4)
+        assert result == [f"/orgs/test-org/team/team{i}/copilot/metrics" for i in range(6)]
+
+    @patch("src.main.org", "test-org")
+    def test_probe_team_metrics_bounds_requests_in_flight(self):
+        gh = MagicMock()
+        teams = [{"name": f"team{i}"} for i in range(12)]
+        lock = threading.Lock()
+        in_flight = {"current": 0, "peak": 0}
+
+        def counting_get(url):
+            with lock:
+                in_flight["current"] += 1
+                in_flight["peak"] = max(in_flight["peak"], in_flight["current"])
+            time.sleep(0.01)
+            with lock:
+                in_flight["current"] -= 1
+            return url
+
+        gh.get.side_effect = counting_get
+
+        probe_team_metrics(gh, teams, max_workers=3)
+        assert 1 < in_flight["peak"] <= 3
+        assert gh.get.call_count == 12
+
+    @patch("src.main.org", "test-org")
+    @patch("src.main.MAX_WORKERS", 1)
+    def test_probe_team_metrics_sequential_by_default_setting(self):
+        gh = MagicMock()
+        gh.get.side_effect = ["r1", "r2"]
+
+        result = probe_team_metrics(gh, [{"name": "team1"}, {"name": "team2"}])
+        assert result == ["r1", "r2"]
+        assert gh.get.call_args_list == [
+            call("/orgs/test-org/team/team1/copilot/metrics"),
+            call("/orgs/test-org/team/team2/copilot/metrics"),
+        ]
+
+
 class TestGetAndUpdateHistoricUsage:
     def setup_method(self):
         self.org_patch = patch("src.main.org", "test-org")
@@ -370,12 +1183,13 @@ class TestGetAndUpdateHistoricUsage:
             )
         }
 
-        result, dates_added = get_and_update_historic_usage(s3, gh)
+        result, dates_added, written, _ = get_and_update_historic_usage(s3, gh)
         assert result == [
             {"date": "2024-01-01", "usage": 10},
             {"date": "2024-01-02", "usage": 20},
         ]
         assert dates_added == ["2024-01-02"]
+        assert written
         s3.get_object.assert_called_once()
         s3.put_object.assert_called_once()
         args, kwargs = s3.put_object.call_args
@@ -383,6 +1197,21 @@ class TestGetAndUpdateHistoricUsage:
         assert kwargs["Key"] == "historic_usage_data.json"
         assert json.loads(kwargs["Body"].decode("utf-8")) == result
 
+    def test_get_and_update_historic_usage_write_failure(self):
+        s3 = MagicMock()
+        gh = MagicMock()
+        gh.get.return_value.json.return_value = [{"date": "2024-01-01", "usage": 10}]
+        s3.get_object.return_value = {"Body": io.BytesIO(b"[]")}
+        s3.put_object.side_effect = ClientError(
+            error_response={"Error": {"Code": "500", "Message": "Internal Error"}},
+            operation_name="PutObject",
+        )
+
+        _, dates_added, written, _ = get_and_update_historic_usage(s3, gh)
+
+        assert dates_added == ["2024-01-01"]
+        assert not written
+
     def test_get_and_update_historic_usage_no_existing_data(self, caplog):
         s3 = MagicMock()
         gh = MagicMock()
@@ -395,7 +1224,7 @@ class TestGetAndUpdateHistoricUsage:
             operation_name="GetObject",
         )
 
-        result, dates_added = get_and_update_historic_usage(s3, gh)
+        result, dates_added, *_ = get_and_update_historic_usage(s3, gh)
         assert result == [{"date": "2024-01-01", "usage": 10}]
         assert dates_added == ["2024-01-01"]
         s3.put_object.assert_called_once()
@@ -404,6 +1233,47 @@ class TestGetAndUpdateHistoricUsage:
             for record in caplog.records
         )
 
+    def test_get_and_update_historic_usage_upserts_existing_dates(self):
+        s3 = MagicMock()
+        gh = MagicMock()
+        gh.get.return_value.json.return_value = [
+            {"date": "2024-01-02", "usage": 25},
+            {"date": "2024-01-03", "usage": 30},
+        ]
+
+        existing_usage = [{"date": "2024-01-01", "usage": 10}, {"date": "2024-01-02", "usage": 20}]
+        s3.get_object.return_value = {
+            "Body": MagicMock(
+                read=MagicMock(return_value=json.dumps(existing_usage).encode("utf-8"))
+            )
+        }
+
+        result, dates_added, *_ = get_and_update_historic_usage(s3, gh)
+        assert result == [
+            {"date": "2024-01-01", "usage": 10},
+            {"date": "2024-01-02", "usage": 25},
+            {"date": "2024-01-03", "usage": 30},
+        ]
+        assert dates_added == ["2024-01-03"]
+
+    def test_get_and_update_historic_usage_not_modified(self):
+        s3 = MagicMock()
+        gh = MagicMock()
+        not_modified = Response()
+        not_modified.status_code = 304
+        gh.get.return_value = not_modified
+
+        existing_usage = [{"date": "2024-01-01", "usage": 10}]
+        s3.get_object.return_value = {
+            "Body": MagicMock(
+                read=MagicMock(return_value=json.dumps(existing_usage).encode("utf-8"))
+            )
+        }
+
+        result, dates_added, *_ = get_and_update_historic_usage(s3, gh)
+        assert result == existing_usage
+        assert dates_added == []
+
     def test_get_and_update_historic_usage_no_new_dates(self):
         s3 = MagicMock()
         gh = MagicMock()
@@ -418,11 +1288,184 @@ class TestGetAndUpdateHistoricUsage:
             )
         }
 
-        result, dates_added = get_and_update_historic_usage(s3, gh)
+        result, dates_added, *_ = get_and_update_historic_usage(s3, gh)
         assert result == [{"date": "2024-01-01", "usage": 10}]
         assert dates_added == []
         s3.put_object.assert_called_once()
 
+    def test_get_and_update_historic_usage_unreadable_history(self):
+        s3 = MagicMock()
+        gh = MagicMock()
+        gh.get.return_value.json.return_value = [{"date": "2024-01-01", "usage": 10}]
+        s3.get_object.side_effect = server_error()
+
+        # Starting from an empty list would overwrite the stored history
+        with pytest.raises(RunAbortedError, match="Could not read historic_usage_data.json"):
+            get_and_update_historic_usage(s3, gh)
+        s3.put_object.assert_not_called()
+
+
+class TestPartitionedHistoricUsage:
+    def setup_method(self):
+        self.org_patch = patch("src.main.org", "test-org")
+        self.org_patch.start()
+        self.layout_patch = patch("src.main.HISTORIC_USAGE_LAYOUT", "monthly")
+        self.layout_patch.start()
+
+    def teardown_method(self):
+        self.org_patch.stop()
+        self.layout_patch.stop()
+
+    def test_group_by_partition(self):
+        assert group_by_partition(
+            [{"date": "2024-01-31"}, {"date": "2024-02-01"}, {"date": "2024-01-30"}]
+        ) == {
+            "2024-01": [{"date": "2024-01-31"}, {"date": "2024-01-30"}],
+            "2024-02": [{"date": "2024-02-01"}],
+        }
+
+    def test_migrate_historic_usage(self):
+        objects = {
+            "historic_usage_data.json": [
+                {"date": "2024-01-30", "usage": 1},
+                {"date": "2024-02-01", "usage": 2},
+            ],
+            # Left by an interrupted migration
+            "historic_usage/2023-12.json": [{"date": "2023-12-31", "usage": 0}],
+        }
+        s3 = make_fake_s3(objects)
+
+        manifest = migrate_historic_usage(s3)
+
+        assert manifest == {
+            "partitions": {
+                "2023-12": {"no_days": 1, "latest": "2023-12-31"},
+                "2024-01": {"no_days": 1, "latest": "2024-01-30"},
+                "2024-02": {"no_days": 1, "latest": "2024-02-01"},
+            }
+        }
+        assert objects[HISTORIC_USAGE_MANIFEST] == manifest
+        assert objects["historic_usage/2024-01.json"] == [{"date": "2024-01-30", "usage": 1}]
+
+    def test_migrate_historic_usage_aborts_if_legacy_object_is_unreadable(self):
+        s3 = MagicMock()
+        s3.get_object.return_value = {"Body": io.BytesIO(b"[{not json")}
+
+        with pytest.raises(RunAbortedError, match="Could not decode historic_usage_data.json"):
+            migrate_historic_usage(s3)
+
+        # Nothing is written, so the legacy days are migrated once the object can be read
+        s3.put_object.assert_not_called()
+
+    def test_migrate_historic_usage_aborts_if_a_partition_is_not_written(self):
+        objects = {
+            "historic_usage_data.json": [
+                {"date": "2024-01-30", "usage": 1},
+                {"date": "2024-02-01", "usage": 2},
+            ]
+        }
+        s3 = make_fake_s3(objects)
+        put_object = s3.put_object.side_effect
+
+        def failing_put_object(Bucket, Key, Body, **kwargs):
+            if Key == "historic_usage/2024-02.json":
+                raise server_error("PutObject")
+            return put_object(Bucket, Key, Body, **kwargs)
+
+        s3.put_object.side_effect = failing_put_object
+
+        with pytest.raises(RunAbortedError, match="historic_usage/2024-02.json"):
+            migrate_historic_usage(s3)
+
+        # Without a manifest, the next run migrates the missing partition again
+        assert "historic_usage/2024-01.json" in objects
+        assert HISTORIC_USAGE_MANIFEST not in objects
+
+    def test_migrate_historic_usage_without_legacy_object(self):
+        objects = {}
+
+        manifest = migrate_historic_usage(make_fake_s3(objects))
+
+        assert manifest == {"partitions": {}}
+        assert objects[HISTORIC_USAGE_MANIFEST] == manifest
+
+    def test_only_touched_partitions_are_read_and_written(self):
+        objects = {
+            HISTORIC_USAGE_MANIFEST: {
+                "partitions": {
+                    "2023-12": {"no_days": 1, "latest": "2023-12-31"},
+                    "2024-01": {"no_days": 1, "latest": "2024-01-30"},
+                }
+            },
+            "historic_usage/2023-12.json": [{"date": "2023-12-31", "usage": 0}],
+            "historic_usage/2024-01.json": [{"date": "2024-01-30", "usage": 1}],
+        }
+        s3 = make_fake_s3(objects)
+        gh = MagicMock()
+        gh.get.return_value.json.return_value = [
+            {"date": "2024-01-30", "usage": 1},
+            {"date": "2024-01-31", "usage": 3},
+            {"date": "2024-02-01", "usage": 4},
+        ]
+
+        result, dates_added, written, no_days = get_and_update_historic_usage(s3, gh)
+
+        assert dates_added == ["2024-01-31", "2024-02-01"]
+        assert [day["date"] for day in result] == ["2024-01-30", "2024-01-31", "2024-02-01"]
+        assert written
+        # The untouched partitions are counted from the manifest
+        assert no_days == 4
+        read = {c.kwargs["Key"] for c in s3.get_object.call_args_list}
+        written = {c.kwargs["Key"] for c in s3.put_object.call_args_list}
+        assert "historic_usage/2023-12.json" not in read | written
+        assert written == {
+            "historic_usage/2024-01.json",
+            "historic_usage/2024-02.json",
+            HISTORIC_USAGE_MANIFEST,
+        }
+        assert objects[HISTORIC_USAGE_MANIFEST]["partitions"]["2024-02"] == {
+            "no_days": 1,
+            "latest": "2024-02-01",
+        }
+
+    def test_unreadable_partition_is_not_overwritten(self):
+        objects = {
+            HISTORIC_USAGE_MANIFEST: {
+                "partitions": {"2024-01": {"no_days": 1, "latest": "2024-01-30"}}
+            },
+        }
+        s3 = make_fake_s3(objects)
+        gh = MagicMock()
+        gh.get.return_value.json.return_value = [{"date": "2024-01-31", "usage": 3}]
+
+        result, dates_added, written, _ = get_and_update_historic_usage(s3, gh)
+
+        assert result == []
+        assert dates_added == []
+        assert not written
+        assert "historic_usage/2024-01.json" not in objects
+
+    def test_read_historic_usage_reassembles_partitions(self):
+        objects = {
+            HISTORIC_USAGE_MANIFEST: {
+                "partitions": {
+                    "2024-02": {"no_days": 1, "latest": "2024-02-01"},
+                    "2024-01": {"no_days": 2, "latest": "2024-01-31"},
+                }
+            },
+            "historic_usage/2024-01.json": [{"date": "2024-01-31"}, {"date": "2024-01-30"}],
+            "historic_usage/2024-02.json": [{"date": "2024-02-01"}],
+        }
+        assert read_historic_usage(make_fake_s3(objects)) == [
+            {"date": "2024-01-30"},
+            {"date": "2024-01-31"},
+            {"date": "2024-02-01"},
+        ]
+
+    def test_read_historic_usage_single_object(self):
+        objects = {"historic_usage_data.json": [{"date": "2024-01-01"}]}
+        assert read_historic_usage(make_fake_s3(objects)) == [{"date": "2024-01-01"}]
+
 
 class TestCreateDictionary:
     def setup_method(self):
@@ -478,6 +1521,29 @@ class TestCreateDictionary:
             assert args[1] == "team1"
             assert args[2] == {"since": "2024-01-01"}
 
+    def test_create_dictionary_replaces_boundary_day(self):
+        gh = MagicMock()
+        copilot_teams = [{"name": "team1"}]
+        existing_team_history = [
+            {
+                "team": {"name": "team1"},
+                "data": [{"date": "2024-01-01", "usage": 5}, {"date": "2024-01-02", "usage": 1}],
+            }
+        ]
+
+        # The inclusive `since` returns the last known day again
+        with patch(
+            "src.main.get_team_history",
+            return_value=[{"date": "2024-01-02", "usage": 7}, {"date": "2024-01-03", "usage": 9}],
+        ) as mock_get_team_history:
+            result = create_dictionary(gh, copilot_teams, existing_team_history)
+            assert result[0]["data"] == [
+                {"date": "2024-01-01", "usage": 5},
+                {"date": "2024-01-02", "usage": 7},
+                {"date": "2024-01-03", "usage": 9},
+            ]
+            assert mock_get_team_history.call_args.args[2] == {"since": "2024-01-02"}
+
     def test_create_dictionary_skips_team_with_no_name(self, caplog):
         gh = MagicMock()
         copilot_teams = [{"slug": "slug1"}]  # No 'name'
@@ -491,6 +1557,48 @@ class TestCreateDictionary:
                 "Skipping team with no name" in record.getMessage() for record in caplog.records
             )
 
+    def test_create_dictionary_reuses_team_metrics(self):
+        gh = MagicMock()
+        copilot_teams = [{"name": "team1"}, {"name": "team2"}]
+        existing_team_history = [
+            {"team": {"name": "team1"}, "data": [{"date": "2024-01-01", "usage": 5}]}
+        ]
+        team_metrics = {
+            "team1": [
+                {"date": "2023-12-31", "usage": 1},
+                {"date": "2024-01-02", "usage": 10},
+            ]
+        }
+
+        with patch(
+            "src.main.get_team_history", return_value=[{"date": "2024-01-03", "usage": 3}]
+        ) as mock_get_team_history:
+            result = create_dictionary(gh, copilot_teams, existing_team_history, team_metrics)
+            assert result[0]["data"] == [
+                {"date": "2024-01-01", "usage": 5},
+                {"date": "2024-01-02", "usage": 10},
+            ]
+            assert result[1]["data"] == [{"date": "2024-01-03", "usage": 3}]
+            # Only the team without a discovery payload is requested again
+            mock_get_team_history.assert_called_once_with(gh, "team2", {})
+
+    def test_create_dictionary_skips_unchanged_teams(self):
+        gh = MagicMock()
+        copilot_teams = [{"name": "team1"}, {"name": "team2"}]
+        existing_team_history = [
+            {"team": {"name": "team1"}, "data": [{"date": "2024-01-01", "usage": 5}]}
+        ]
+        # Both teams are unchanged, but team2 has no stored history to fall back on
+        team_metrics = {"team1": None, "team2": None}
+
+        with patch(
+            "src.main.get_team_history", return_value=[{"date": "2024-01-02", "usage": 1}]
+        ) as mock_get_team_history:
+            result = create_dictionary(gh, copilot_teams, existing_team_history, team_metrics)
+            assert result[0]["data"] == [{"date": "2024-01-01", "usage": 5}]
+            assert result[1]["data"] == [{"date": "2024-01-02", "usage": 1}]
+            mock_get_team_history.assert_called_once_with(gh, "team2", {})
+
     def test_create_dictionary_no_new_history(self, caplog):
         gh = MagicMock()
         copilot_teams = [{"name": "team1"}]
@@ -501,3 +1609,376 @@ class TestCreateDictionary:
             result = create_dictionary(gh, copilot_teams, existing_team_history)
             assert result == []
             assert mock_get_team_history.call_count == 1
+
+    def test_create_dictionary_defers_teams_once_out_of_time(self):
+        gh = MagicMock()
+        existing = {"team": {"name": "team2"}, "data": [{"date": "2024-01-01"}]}
+        context = MagicMock()
+        context.get_remaining_time_in_millis.side_effect = [120_000, 30_000, 30_000]
+        budget = TimeBudget(context, reserve_seconds=60)
+
+        with patch(
+            "src.main.get_team_history", return_value=[{"date": "2024-01-02"}]
+        ) as mock_get_team_history:
+            result = create_dictionary(
+                gh, [{"name": "team1"}, {"name": "team2"}], [existing], None, budget
+            )
+
+        # The deferred team keeps its existing history
+        assert {entry["team"]["name"]: entry["data"] for entry in result} == {
+            "team1": [{"date": "2024-01-02"}],
+            "team2": [{"date": "2024-01-01"}],
+        }
+        assert mock_get_team_history.call_count == 1
+        assert budget.deferred == ["team2"]
+
+    @patch("src.main.org", "test-org")
+    @patch("src.main.MAX_WORKERS", 1)
+    def test_deferred_team_is_refreshed_by_the_next_run(self):
+        url = "/orgs/test-org/team/team2/copilot/metrics"
+        validators = {"etag": '"abc"', "last_modified": None, "has_data": True}
+        etag_cache = ConditionalRequestCache(
+            MagicMock(), {url: dict(validators), f"{url}?since=2024-01-01": dict(validators)}
+        )
+        context = MagicMock()
+        context.get_remaining_time_in_millis.return_value = 30_000
+        budget = TimeBudget(context, reserve_seconds=60)
+
+        assert get_new_team_history(etag_cache, "team2", "2024-01-01", {}, budget) is None
+
+        # The validators saved by this run no longer describe the deferred team
+        assert budget.deferred == ["team2"]
+        assert etag_cache.entries == {}
+
+        gh = MagicMock()
+        gh.session.get.return_value = Response()
+        gh.session.get.return_value.status_code = 200
+        gh.session.get.return_value._content = b'[{"date": "2024-01-01"}, {"date": "2024-01-02"}]'
+        next_run = ConditionalRequestCache(gh, etag_cache.entries)
+        team_metrics: dict = {}
+
+        get_copilot_team_date(next_run, 1, team_metrics=team_metrics, teams=[{"name": "team2"}])
+
+        # The next run requests the team's metrics in full, rather than being told they are
+        # unchanged
+        assert gh.session.get.call_args.kwargs["headers"] == {}
+        new_days = get_new_team_history(next_run, "team2", "2024-01-01", team_metrics)
+        # The last known day is returned again, followed by the day the deferred run missed
+        assert [day["date"] for day in new_days] == ["2024-01-01", "2024-01-02"]
+
+
+class TestFilterTeamHistory:
+    def test_filter_team_history_without_since(self):
+        usage = [{"date": "2024-01-01"}, {"date": "2024-01-02"}]
+        result = filter_team_history(usage)
+        assert result == usage
+        assert result is not usage
+
+    def test_filter_team_history_since_is_inclusive(self):
+        usage = [{"date": "2024-01-01"}, {"date": "2024-01-02"}, {"date": "2024-01-03"}]
+        assert filter_team_history(usage, "2024-01-02") == [
+            {"date": "2024-01-02"},
+            {"date": "2024-01-03"},
+        ]
+
+
+class TestShardedTeamHistory:
+    def setup_method(self):
+        self.org_patch = patch("src.main.org", "test-org")
+        self.org_patch.start()
+
+    def teardown_method(self):
+        self.org_patch.stop()
+
+    def test_get_content_hash_ignores_key_order(self):
+        assert get_content_hash({"a": 1, "b": [1, 2]}) == get_content_hash({"b": [1, 2], "a": 1})
+        assert get_content_hash({"a": 1}) != get_content_hash({"a": 2})
+
+    def test_get_team_shard_name(self):
+        assert get_team_shard_name({"name": "Team 1", "slug": "team-1"}) == (
+            "teams_history/team-1.json"
+        )
+        assert get_team_shard_name({"name": "team1"}) == "teams_history/team1.json"
+
+    def test_migrates_single_object(self):
+        objects = {
+            "teams_history.json": [
+                {"team": {"name": "team1", "slug": "team1"}, "data": [{"date": "2024-01-01"}]},
+                {"team": {"name": "team2", "slug": "team2"}, "data": [{"date": "2024-01-01"}]},
+            ]
+        }
+        s3 = make_fake_s3(objects)
+        gh = MagicMock()
+        team_metrics = {"team1": [{"date": "2024-01-01"}, {"date": "2024-01-02"}]}
+
+        result = update_sharded_team_history(
+            s3, gh, [{"name": "team1", "slug": "team1"}], team_metrics
+        )
+
+        assert result
+        assert objects["teams_history/team1.json"]["data"] == [
+            {"date": "2024-01-01"},
+            {"date": "2024-01-02"},
+        ]
+        # Teams without Copilot data this run are still migrated
+        assert objects["teams_history/team2.json"]["data"] == [{"date": "2024-01-01"}]
+        assert objects[TEAMS_HISTORY_INDEX]["team1"] == {
+            "object": "teams_history/team1.json",
+            "no_days": 2,
+            "latest": "2024-01-02",
+            "hash": get_content_hash(objects["teams_history/team1.json"]),
+        }
+
+    def test_only_changed_shards_are_written(self):
+        team1 = {"team": {"name": "team1", "slug": "team1"}, "data": [{"date": "2024-01-01"}]}
+        team2 = {"team": {"name": "team2", "slug": "team2"}, "data": [{"date": "2024-01-01"}]}
+        objects = {
+            "teams_history/team1.json": team1,
+            "teams_history/team2.json": team2,
+            TEAMS_HISTORY_INDEX: {
+                "team1": {
+                    "object": "teams_history/team1.json",
+                    "no_days": 1,
+                    "latest": "2024-01-01",
+                    "hash": get_content_hash(team1),
+                },
+                "team2": {
+                    "object": "teams_history/team2.json",
+                    "no_days": 1,
+                    "latest": "2024-01-01",
+                    "hash": get_content_hash(team2),
+                },
+            },
+        }
+        s3 = make_fake_s3(objects)
+        gh = MagicMock()
+        team_metrics = {
+            "team1": [{"date": "2024-01-01"}],
+            "team2": [{"date": "2024-01-01"}, {"date": "2024-01-02"}],
+        }
+
+        result = update_sharded_team_history(
+            s3,
+            gh,
+            [{"name": "team1", "slug": "team1"}, {"name": "team2", "slug": "team2"}],
+            team_metrics,
+        )
+
+        assert result
+        written = [c.kwargs["Key"] for c in s3.put_object.call_args_list]
+        assert written == ["teams_history/team2.json", TEAMS_HISTORY_INDEX]
+        assert objects[TEAMS_HISTORY_INDEX]["team2"]["latest"] == "2024-01-02"
+
+    def test_nothing_written_when_unchanged(self):
+        team1 = {"team": {"name": "team1", "slug": "team1"}, "data": [{"date": "2024-01-01"}]}
+        objects = {
+            "teams_history/team1.json": team1,
+            TEAMS_HISTORY_INDEX: {
+                "team1": {
+                    "object": "teams_history/team1.json",
+                    "no_days": 1,
+                    "latest": "2024-01-01",
+                    "hash": get_content_hash(team1),
+                }
+            },
+        }
+        s3 = make_fake_s3(objects)
+
+        assert update_sharded_team_history(
+            s3, MagicMock(), [{"name": "team1", "slug": "team1"}], {"team1": None}
+        )
+        s3.put_object.assert_not_called()
+        # Planned from the index, so the shard is not read
+        read = [c.kwargs["Key"] for c in s3.get_object.call_args_list]
+        assert read == [TEAMS_HISTORY_INDEX]
+
+    @patch("src.main.org", "test-org")
+    def test_unreadable_shard_is_skipped(self):
+        objects = {
+            TEAMS_HISTORY_INDEX: {
+                "team1": {
+                    "object": "teams_history/team1.json",
+                    "no_days": 1,
+                    "latest": "2024-01-01",
+                    "hash": "abc",
+                }
+            },
+        }
+        s3 = make_fake_s3(objects)
+
+        gh = MagicMock()
+
+        update_sharded_team_history(
+            s3, gh, [{"name": "team1", "slug": "team1"}], {"team1": [{"date": "x"}]}
+        )
+        assert "teams_history/team1.json" not in objects
+        # The next run requests the team's metrics in full, as its new days were not stored
+        gh.forget.assert_called_once_with("/orgs/test-org/team/team1/copilot/metrics")
+
+    @patch("src.main.TEAMS_HISTORY_LAYOUT", "sharded")
+    @patch("boto3.Session")
+    @patch("github_api_toolkit.get_token_as_installation")
+    @patch("github_api_toolkit.github_interface")
+    @patch("src.main.get_and_update_historic_usage")
+    @patch("src.main.get_and_update_copilot_teams")
+    @patch("src.main.update_sharded_team_history")
+    @patch("src.main.update_s3_object")
+    def test_handler_uses_sharded_layout(
+        self,
+        mock_update_s3_object,
+        mock_update_sharded_team_history,
+        mock_get_and_update_copilot_teams,
+        mock_get_and_update_historic_usage,
+        mock_github_interface,
+        mock_get_token_as_installation,
+        mock_boto3_session,
+    ):
+        mock_s3 = MagicMock()
+        mock_secret_manager = MagicMock()
+        mock_session = MagicMock()
+        mock_session.client.side_effect = [mock_s3, mock_secret_manager]
+        mock_boto3_session.return_value = mock_session
+        mock_secret_manager.get_secret_value.return_value = {"SecretString": "pem-content"}
+        mock_get_token_as_installation.return_value = ("token",)
+        mock_get_and_update_historic_usage.return_value = ([], [], True, 0)
+        mock_get_and_update_copilot_teams.return_value = [{"name": "team1"}]
+        mock_s3.get_object.return_value = {"Body": MagicMock(read=MagicMock(return_value=b"{}"))}
+        mock_update_sharded_team_history.return_value = True
+
+        handler({}, MagicMock())
+
+        mock_update_sharded_team_history.assert_called_once()
+        written = [c.args[2] for c in mock_update_s3_object.call_args_list]
+        assert "teams_history.json" not in written
+
+
+class TestTeamHistoryManifest:
+    def test_get_team_watermark(self):
+        entry = {
+            "team": {"name": "team1"},
+            "data": [{"date": "2024-01-02"}, {"date": "2024-01-01"}],
+        }
+        assert get_team_watermark(entry) == {
+            "no_days": 2,
+            "latest": "2024-01-02",
+            "hash": get_content_hash(entry),
+        }
+
+    def test_plan_team_history(self):
+        gh = MagicMock()
+        watermarks = {"team1": {"latest": "2024-01-02"}, "team2": {"latest": "2024-01-02"}}
+        team_metrics = {
+            "team1": [{"date": "2024-01-01"}, {"date": "2024-01-02"}, {"date": "2024-01-03"}],
+            "team2": None,
+        }
+
+        new_history = plan_team_history(
+            gh, [{"name": "team1"}, {"name": "team2"}], watermarks, team_metrics
+        )
+
+        assert new_history == {"team1": [{"date": "2024-01-02"}, {"date": "2024-01-03"}]}
+        gh.get.assert_not_called()
+
+    @patch("src.main.org", "test-org")
+    def test_plan_team_history_refreshes_stalest_teams_first(self):
+        gh = MagicMock()
+        gh.get.return_value = MagicMock(spec=Response)
+        gh.get.return_value.json.return_value = [{"date": "2024-01-03"}]
+        watermarks = {"team1": {"latest": "2024-01-02"}, "team2": {"latest": "2024-01-01"}}
+        context = MagicMock()
+        context.get_remaining_time_in_millis.side_effect = [120_000, 30_000, 30_000]
+        budget = TimeBudget(context, reserve_seconds=60)
+
+        new_history = plan_team_history(
+            gh, [{"name": "team1"}, {"name": "team2"}], watermarks, {}, budget
+        )
+
+        assert new_history == {"team2": [{"date": "2024-01-03"}]}
+        gh.get.assert_called_once_with(
+            "/orgs/test-org/team/team2/copilot/metrics", params={"since": "2024-01-01"}
+        )
+        assert budget.deferred == ["team1"]
+
+    def test_builds_manifest_without_one(self):
+        objects = {
+            "teams_history.json": [{"team": {"name": "team1"}, "data": [{"date": "2024-01-01"}]}]
+        }
+        s3 = make_fake_s3(objects)
+        team_metrics = {"team1": [{"date": "2024-01-01"}, {"date": "2024-01-02"}]}
+
+        assert update_team_history(s3, MagicMock(), [{"name": "team1"}], team_metrics)
+
+        written = [c.kwargs["Key"] for c in s3.put_object.call_args_list]
+        assert written == ["teams_history.json", TEAMS_HISTORY_MANIFEST]
+        assert objects[TEAMS_HISTORY_MANIFEST] == {
+            "team1": get_team_watermark(objects["teams_history.json"][0])
+        }
+        assert objects[TEAMS_HISTORY_MANIFEST]["team1"]["latest"] == "2024-01-02"
+
+    def test_history_not_read_without_new_days(self):
+        team1 = {"team": {"name": "team1"}, "data": [{"date": "2024-01-01"}]}
+        objects = {
+            "teams_history.json": [team1],
+            TEAMS_HISTORY_MANIFEST: {"team1": get_team_watermark(team1)},
+        }
+        s3 = make_fake_s3(objects)
+
+        assert update_team_history(s3, MagicMock(), [{"name": "team1"}], {"team1": None})
+
+        read = [c.kwargs["Key"] for c in s3.get_object.call_args_list]
+        assert read == [TEAMS_HISTORY_MANIFEST]
+        s3.put_object.assert_not_called()
+
+    def test_only_teams_with_new_days_are_updated(self):
+        team1 = {"team": {"name": "team1"}, "data": [{"date": "2024-01-01"}]}
+        team2 = {"team": {"name": "team2"}, "data": [{"date": "2024-01-01"}]}
+        manifest = {"team1": get_team_watermark(team1), "team2": get_team_watermark(team2)}
+        objects = {"teams_history.json": [team1, team2], TEAMS_HISTORY_MANIFEST: manifest}
+        s3 = make_fake_s3(objects)
+        team_metrics = {"team1": None, "team2": [{"date": "2024-01-01"}, {"date": "2024-01-02"}]}
+
+        assert update_team_history(
+            s3, MagicMock(), [{"name": "team1"}, {"name": "team2"}], team_metrics
+        )
+
+        assert objects["teams_history.json"][0] == team1
+        assert objects["teams_history.json"][1]["data"] == [
+            {"date": "2024-01-01"},
+            {"date": "2024-01-02"},
+        ]
+        assert objects[TEAMS_HISTORY_MANIFEST]["team1"] == manifest["team1"]
+        assert objects[TEAMS_HISTORY_MANIFEST]["team2"]["latest"] == "2024-01-02"
+
+    def test_unreadable_history_is_not_overwritten(self):
+        objects = {TEAMS_HISTORY_MANIFEST: {"team1": {"no_days": 1, "latest": "2024-01-01"}}}
+        s3 = make_fake_s3(objects)
+        team_metrics = {"team1": [{"date": "2024-01-02"}]}
+
+        assert not update_team_history(s3, MagicMock(), [{"name": "team1"}], team_metrics)
+        s3.put_object.assert_not_called()
+
+    def test_unreadable_history_without_manifest_is_not_overwritten(self):
+        s3 = make_fake_s3({})
+        get_missing_object = s3.get_object.side_effect
+
+        def get_object(Bucket, Key):
+            if Key == "teams_history.json":
+                raise server_error()
+            return get_missing_object(Bucket, Key)
+
+        s3.get_object.side_effect = get_object
+        team_metrics = {"team1": [{"date": "2024-01-02"}]}
+
+        assert not update_team_history(s3, MagicMock(), [{"name": "team1"}], team_metrics)
+        s3.put_object.assert_not_called()
+
+    @patch("src.main.update_s3_object")
+    def test_manifest_not_written_when_history_write_fails(self, mock_update_s3_object):
+        s3 = make_fake_s3({})
+        mock_update_s3_object.return_value = False
+        team_metrics = {"team1": [{"date": "2024-01-01"}]}
+
+        assert not update_team_history(s3, MagicMock(), [{"name": "team1"}], team_metrics)
+
+        written = [c.args[2] for c in mock_update_s3_object.call_args_list]
+        assert written == ["teams_history.json"]
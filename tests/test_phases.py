@@ -0,0 +1,86 @@
+import threading
+import time
+
+import pytest
+
+from src.phases import PhaseGraph
+
+
+class TestPhaseGraph:
+    def test_results_feed_dependent_phases(self):
+        graph = PhaseGraph()
+        graph.add("a", lambda: 2)
+        graph.add("b", lambda: 3)
+        graph.add("product", lambda a, b: a * b, ["a", "b"])
+        graph.add("total", lambda a, product: a + product, ["a", "product"])
+
+        assert graph.run() == {"a": 2, "b": 3, "product": 6, "total": 8}
+        assert set(graph.timings) == {"a", "b", "product", "total"}
+
+    def test_independent_phases_run_concurrently(self):
+        barrier = threading.Barrier(2, timeout=1)
+
+        def phase():
+            # Only returns if the other phase is running at the same time
+            barrier.wait()
+            return True
+
+        graph = PhaseGraph()
+        graph.add("a", phase)
+        graph.add("b", phase)
+
+        assert graph.run() == {"a": True, "b": True}
+
+    def test_dependent_phase_waits(self):
+        order = []
+
+        def slow():
+            time.sleep(0.02)
+            order.append("slow")
+
+        graph = PhaseGraph()
+        graph.add("slow", slow)
+        graph.add("fast", lambda: order.append("fast"))
+        graph.add("after", lambda _: order.append("after"), ["slow"])
+
+        graph.run()
+
+        assert order.index("after") > order.index("slow")
+
+    def test_one_worker_runs_in_order_added(self):
+        order = []
+        graph = PhaseGraph()
+        for name in ["a", "b", "c"]:
+            graph.add(name, lambda name=name: order.append(name))
+
+        graph.run(max_workers=1)
+
+        assert order == ["a", "b", "c"]
+
+    def test_failure_stops_dependent_phases(self):
+        ran = []
+
+        def fail():
+            raise RuntimeError("boom")
+
+        graph = PhaseGraph()
+        graph.add("fail", fail)
+        graph.add("independent", lambda: ran.append("independent"))
+        graph.add("dependent", lambda _: ran.append("dependent"), ["fail"])
+
+        with pytest.raises(RuntimeError, match="boom"):
+            graph.run(max_workers=1)
+
+        assert "dependent" not in ran
+        assert "fail" in graph.timings
+
+    def test_add_rejects_unknown_dependencies(self):
+        graph = PhaseGraph()
+        with pytest.raises(ValueError, match="unknown phases: missing"):
+            graph.add("a", lambda _: None, ["missing"])
+
+    def test_add_rejects_duplicate_names(self):
+        graph = PhaseGraph()
+        graph.add("a", lambda: None)
+        with pytest.raises(ValueError, match="already been added"):
+            graph.add("a", lambda: None)
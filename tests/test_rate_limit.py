@@ -0,0 +1,207 @@
+import threading
+import time
+from unittest.mock import MagicMock, patch
+
+from requests import HTTPError, Response
+
+from src.rate_limit import RateLimitScheduler, get_int_header, get_response
+
+
+def make_response(status_code=200, headers=None):
+    response = Response()
+    response.status_code = status_code
+    response.headers.update(headers or {})
+    return response
+
+
+def returns(*results):
+    # side_effect raises exception instances, but github_interface returns them
+    results = iter(results)
+    return lambda *args, **kwargs: next(results)
+
+
+class FakeTime:
+    def __init__(self, now=1000.0):
+        self.now = now
+        self.sleeps = []
+
+    def time(self):
+        return self.now
+
+    def sleep(self, seconds):
+        self.sleeps.append(seconds)
+        self.now += seconds
+
+
+class TestGetResponse:
+    def test_get_response_from_response(self):
+        response = make_response()
+        assert get_response(response) is response
+
+    def test_get_response_from_http_error(self):
+        response = make_response(403)
+        assert get_response(HTTPError(response=response)) is response
+
+    def test_get_response_from_other_exception(self):
+        assert get_response(ValueError("boom")) is None
+
+
+class TestGetIntHeader:
+    def test_get_int_header(self):
+        response = make_response(headers={"X-RateLimit-Remaining": "42"})
+        assert get_int_header(response, "X-RateLimit-Remaining") == 42
+
+    def test_get_int_header_missing_or_invalid(self):
+        response = make_response(headers={"Retry-After": "soon"})
+        assert get_int_header(response, "Retry-After") is None
+        assert get_int_header(response, "X-RateLimit-Reset") is None
+
+
+class TestRateLimitScheduler:
+    def test_get_passes_through_arguments(self):
+        gh = MagicMock()
+        response = make_response()
+        gh.get.return_value = response
+
+        scheduler = RateLimitScheduler(gh)
+        result = scheduler.get("/orgs/test/teams", params={"page": 2})
+
+        assert result is response
+        gh.get.assert_called_once_with("/orgs/test/teams", params={"page": 2})
+        assert scheduler.requests_made == 1
+
+    def test_other_attributes_are_passed_through(self):
+        gh = MagicMock()
+        scheduler = RateLimitScheduler(gh)
+        assert scheduler.session is gh.session
+
+    @patch("src.rate_limit.time", new_callable=FakeTime)
+    def test_retry_after_pauses_and_retries(self, clock):
+        gh = MagicMock()
+        limited = HTTPError(response=make_response(429, {"Retry-After": "30"}))
+        success = make_response(200, {"X-RateLimit-Remaining": "4000"})
+        gh.get.side_effect = returns(limited, success)
+
+        scheduler = RateLimitScheduler(gh, max_concurrency=8)
+        result = scheduler.get("/orgs/test/teams")
+
+        assert result is success
+        assert gh.get.call_count == 2
+        assert clock.sleeps == [30]
+        assert scheduler.throttled_seconds == 30
+        assert scheduler.rate_limited_responses == 1
+        # Halved on the rate limit, then increased by one on the successful response
+        assert scheduler.concurrency == 5
+
+    @patch("src.rate_limit.time", new_callable=FakeTime)
+    def test_exhausted_budget_pauses_until_reset(self, clock):
+        gh = MagicMock()
+        limited = HTTPError(
+            response=make_response(403, {"X-RateLimit-Remaining": "0", "X-RateLimit-Reset": "1060"})
+        )
+        success = make_response(200, {"X-RateLimit-Remaining": "5000"})
+        gh.get.side_effect = returns(limited, success)
+
+        scheduler = RateLimitScheduler(gh)
+        result = scheduler.get("/orgs/test/teams")
+
+        assert result is success
+        assert clock.sleeps == [61.0]
+        assert scheduler.remaining == 5000
+
+    @patch("src.rate_limit.time", new_callable=FakeTime)
+    def test_gives_up_after_max_retries(self, clock):
+        gh = MagicMock()
+        limited = HTTPError(response=make_response(429, {"Retry-After": "1"}))
+        gh.get.return_value = limited
+
+        scheduler = RateLimitScheduler(gh, max_retries=2)
+        result = scheduler.get("/orgs/test/teams")
+
+        assert result is limited
+        assert gh.get.call_count == 3
+        assert clock.sleeps == [1, 1]
+
+    def test_forbidden_without_rate_limit_is_not_retried(self):
+        gh = MagicMock()
+        forbidden = HTTPError(response=make_response(403, {"X-RateLimit-Remaining": "4000"}))
+        gh.get.return_value = forbidden
+
+        scheduler = RateLimitScheduler(gh)
+        assert scheduler.get("/orgs/test/teams") is forbidden
+        assert gh.get.call_count == 1
+
+    def test_low_remaining_scales_concurrency_down(self):
+        gh = MagicMock()
+        gh.get.return_value = make_response(200, {"X-RateLimit-Remaining": "10"})
+
+        scheduler = RateLimitScheduler(gh, max_concurrency=8, low_remaining=100)
+        scheduler.get("/orgs/test/teams")
+        assert scheduler.concurrency == 4
+        scheduler.get("/orgs/test/teams")
+        scheduler.get("/orgs/test/teams")
+        scheduler.get("/orgs/test/teams")
+        assert scheduler.concurrency == 1
+
+    def test_successful_responses_scale_concurrency_up(self):
+        gh = MagicMock()
+        gh.get.return_value = make_response(200, {"X-RateLimit-Remaining": "4000"})
+
+        scheduler = RateLimitScheduler(gh, max_concurrency=4)
+        scheduler.concurrency = 1
+        for _ in range(5):
+            scheduler.get("/orgs/test/teams")
+        assert scheduler.concurrency == 4
+
+    def test_requests_in_flight_are_bounded(self):
+        lock = threading.Lock()
+        in_flight = {"current": 0, "peak": 0}
+
+        def counting_get(url):
+            with lock:
+                in_flight["current"] += 1
+                in_flight["peak"] = max(in_flight["peak"], in_flight["current"])
+            time.sleep(0.01)
+            with lock:
+                in_flight["current"] -= 1
+            return make_response()
+
+        gh = MagicMock()
+        gh.get.side_effect = counting_get
+        scheduler = RateLimitScheduler(gh, max_concurrency=2)
+
+        threads = [
+            threading.Thread(target=scheduler.get, args=("/orgs/test/teams",)) for _ in range(8)
+        ]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+
+        assert in_flight["peak"] <= 2
+        assert scheduler.requests_made == 8
+
+    @patch("src.rate_limit.time", new_callable=FakeTime)
+    def test_stats(self, clock):
+        gh = MagicMock()
+
+        def get(url):
+            clock.now += 2
+            return make_response(200, {"X-RateLimit-Remaining": "4998"})
+
+        gh.get.side_effect = get
+        scheduler = RateLimitScheduler(gh)
+        scheduler.get("/orgs/test/teams")
+        scheduler.get("/orgs/test/teams")
+
+        assert scheduler.stats() == {
+            "no_github_requests": 2,
+            "github_request_rate": 0.5,
+            "github_throttled_seconds": 0.0,
+            "github_rate_limited_responses": 0,
+            "github_rate_limit_remaining": 4998,
+        }
+
+    def test_stats_before_any_request(self):
+        scheduler = RateLimitScheduler(MagicMock())
+        assert scheduler.stats()["github_request_rate"] == 0.0
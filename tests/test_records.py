@@ -0,0 +1,121 @@
+import json
+import tracemalloc
+from unittest.mock import patch
+
+import pytest
+
+from src.records import Record, compact_pairs, encode_record, get_object_pairs_hook
+from src.serialisation import encode_json, get_content_hash
+
+
+def make_day(date, editors=3):
+    return {
+        "date": date,
+        "total_active_users": 12,
+        "copilot_ide_code_completions": {
+            "total_engaged_users": 10,
+            "editors": [
+                {
+                    "name": f"editor-{editor}",
+                    "models": [
+                        {
+                            "name": "default",
+                            "is_custom_model": False,
+                            "custom_model_training_date": None,
+                            "languages": [
+                                {"name": "python", "total_code_suggestions": 1234 + editor},
+                                {"name": "go", "total_code_acceptances": 0.5},
+                            ],
+                        }
+                    ],
+                }
+                for editor in range(editors)
+            ],
+        },
+    }
+
+
+DAYS = [make_day(f"2024-01-{day:02d}") for day in range(1, 29)]
+
+
+def loads(text):
+    return json.loads(text, object_pairs_hook=compact_pairs)
+
+
+class TestRecord:
+    def test_round_trips_losslessly(self):
+        text = json.dumps(DAYS, indent=4)
+
+        days = loads(text)
+
+        assert isinstance(days[0], Record)
+        assert json.dumps(days, indent=4, default=encode_record) == text
+        assert days == DAYS
+
+    def test_reads_like_a_dict(self):
+        (day,) = loads(json.dumps([DAYS[0]]))
+
+        assert day["date"] == "2024-01-01"
+        assert day.get("missing") is None
+        assert "copilot_ide_code_completions" in day
+        assert list(day) == list(DAYS[0])
+        assert {**day}["total_active_users"] == 12
+        assert repr(day).startswith("Record({'date': '2024-01-01'")
+        with pytest.raises(KeyError):
+            day["missing"]
+        with pytest.raises(TypeError):
+            day["date"] = "2024-01-02"
+
+    def test_keys_and_strings_are_shared(self):
+        first, second = loads(json.dumps(DAYS[:2]))
+
+        assert first._positions is second._positions
+        first_model = first["copilot_ide_code_completions"]["editors"][0]["models"][0]
+        second_model = second["copilot_ide_code_completions"]["editors"][0]["models"][0]
+        assert first_model["name"] is second_model["name"]
+
+    def test_repeated_keys_keep_the_last_value(self):
+        text = '{"a": 1, "b": 2, "a": 3}'
+
+        assert loads(text) == json.loads(text) == {"a": 3, "b": 2}
+        assert json.dumps(loads(text), default=encode_record) == json.dumps(json.loads(text))
+
+    def test_lists_can_be_updated(self):
+        (entry,) = loads(json.dumps([{"team": {"name": "team1"}, "data": []}]))
+
+        entry["data"].append(DAYS[0])
+
+        assert json.loads(json.dumps(entry, default=encode_record))["data"] == [DAYS[0]]
+
+    def test_other_objects_are_not_encoded(self):
+        with pytest.raises(TypeError, match="set is not JSON serializable"):
+            json.dumps({1, 2}, default=encode_record)
+
+    def test_uses_less_memory(self):
+        text = json.dumps([make_day(f"2024-01-{day:02d}", editors=20) for day in range(1, 29)])
+
+        def measure(object_pairs_hook):
+            tracemalloc.start()
+            data = json.loads(text, object_pairs_hook=object_pairs_hook)
+            size, _ = tracemalloc.get_traced_memory()
+            tracemalloc.stop()
+            del data
+            return size
+
+        # The first decode stores the keys and interns the strings, which later decodes share
+        measure(compact_pairs)
+        assert measure(compact_pairs) < 0.7 * measure(None)
+
+    def test_object_pairs_hook(self):
+        assert get_object_pairs_hook() is compact_pairs
+        with patch("src.records.COMPACT_RECORDS", False):
+            assert get_object_pairs_hook() is None
+
+
+class TestSerialisation:
+    @pytest.mark.parametrize("style", ["indent", "compact", "ndjson"])
+    def test_records_are_stored_as_dicts(self, style):
+        records = loads(json.dumps(DAYS))
+
+        assert encode_json(records, style, "gzip") == encode_json(DAYS, style, "gzip")
+        assert get_content_hash(records) == get_content_hash(DAYS)
@@ -0,0 +1,177 @@
+from unittest.mock import MagicMock, patch
+
+import pytest
+from requests import ConnectionError as RequestsConnectionError
+from requests import HTTPError, Response
+
+from src.resilience import (
+    CircuitBreaker,
+    CircuitOpenError,
+    RetryingInterface,
+    RunAbortedError,
+    get_backoff_delay,
+    get_endpoint,
+    is_retryable,
+)
+
+
+def make_response(status_code=200):
+    response = Response()
+    response.status_code = status_code
+    return response
+
+
+def make_error(status_code):
+    return HTTPError(response=make_response(status_code))
+
+
+def make_interface(gh, threshold=5):
+    return RetryingInterface(gh, CircuitBreaker("GitHub", threshold))
+
+
+class TestIsRetryable:
+    @pytest.mark.parametrize("status_code", [500, 502, 503, 504])
+    def test_server_errors(self, status_code):
+        assert is_retryable(make_error(status_code))
+        assert is_retryable(make_response(status_code))
+
+    @pytest.mark.parametrize("status_code", [200, 304, 403, 404, 422, 429])
+    def test_other_responses(self, status_code):
+        assert not is_retryable(make_error(status_code))
+
+    def test_connection_errors(self):
+        assert is_retryable(RequestsConnectionError("reset"))
+        assert not is_retryable("not_a_response")
+
+
+class TestBackoff:
+    def test_delay_is_within_the_exponential_bound(self):
+        for attempt, bound in [(1, 0.5), (2, 1.0), (3, 2.0), (10, 4.0)]:
+            for _ in range(20):
+                assert 0 <= get_backoff_delay(attempt, 0.5, 4.0) <= bound
+
+    def test_get_endpoint(self):
+        assert get_endpoint("/orgs/org/team/a/copilot/metrics") == (
+            "/orgs/org/team/{team}/copilot/metrics"
+        )
+        assert get_endpoint("/orgs/org/teams?page=2") == "/orgs/org/teams"
+        assert get_endpoint("/orgs/org/copilot/metrics") == "/orgs/org/copilot/metrics"
+
+
+class TestCircuitBreaker:
+    def test_opens_after_consecutive_failures(self):
+        breaker = CircuitBreaker("S3", threshold=2)
+        breaker.record_failure("a")
+        breaker.record_success()
+        breaker.record_failure("b")
+        breaker.check()
+
+        breaker.record_failure("c")
+
+        assert breaker.is_open
+        assert breaker.no_failures == 3
+        with pytest.raises(CircuitOpenError, match="S3 failed 2 times in a row"):
+            breaker.check()
+
+    def test_circuit_open_error_aborts_the_run(self):
+        assert issubclass(CircuitOpenError, RunAbortedError)
+
+
+@patch("src.resilience.time.sleep")
+class TestRetryingInterface:
+    def test_transient_failure_is_retried(self, mock_sleep, caplog):
+        gh = MagicMock()
+        ok = make_response(200)
+        results = [make_error(502), ok]
+        gh.get.side_effect = lambda *args, **kwargs: results.pop(0)
+
+        interface = make_interface(gh)
+        result = interface.get("/orgs/org/team/a/copilot/metrics", params={"since": "x"})
+
+        assert result is ok
+        assert gh.get.call_count == 2
+        gh.get.assert_called_with("/orgs/org/team/a/copilot/metrics", params={"since": "x"})
+        mock_sleep.assert_called_once()
+        assert interface.stats() == {
+            "no_github_retries": 1,
+            "github_retries_by_endpoint": {"/orgs/org/team/{team}/copilot/metrics": 1},
+            "no_github_failures": 0,
+            "github_circuit_open": False,
+        }
+        retry = next(r for r in caplog.records if r.getMessage().startswith("Retrying"))
+        assert retry.status_code == 502
+        assert retry.attempt == 1
+
+    @patch("src.resilience.RETRY_MAX_ATTEMPTS", 3)
+    def test_failure_is_returned_after_max_attempts(self, mock_sleep):
+        gh = MagicMock()
+        error = make_error(503)
+        gh.get.return_value = error
+
+        interface = make_interface(gh)
+
+        assert interface.get("/orgs/org/teams") is error
+        assert gh.get.call_count == 3
+        assert interface.breaker.no_failures == 1
+
+    @patch("src.resilience.RETRY_MAX_ATTEMPTS", 2)
+    def test_raised_connection_error_is_retried_then_raised(self, mock_sleep):
+        gh = MagicMock()
+        gh.get.side_effect = RequestsConnectionError("reset")
+
+        interface = make_interface(gh)
+
+        with pytest.raises(RequestsConnectionError):
+            interface.get("/orgs/org/teams")
+        assert gh.get.call_count == 2
+
+    @pytest.mark.parametrize("status_code", [403, 404, 429])
+    def test_other_errors_are_not_retried(self, mock_sleep, status_code):
+        gh = MagicMock()
+        error = make_error(status_code)
+        gh.get.return_value = error
+
+        interface = make_interface(gh)
+
+        assert interface.get("/orgs/org/team/a/copilot/metrics") is error
+        assert gh.get.call_count == 1
+        assert interface.breaker.no_failures == 0
+
+    @patch("src.resilience.RETRY_MAX_ATTEMPTS", 3)
+    @patch("src.resilience.RETRY_BUDGET_PER_ENDPOINT", 3)
+    def test_retry_budget_is_per_endpoint(self, mock_sleep):
+        gh = MagicMock()
+        gh.get.return_value = make_error(502)
+
+        interface = make_interface(gh)
+        interface.get("/orgs/org/team/a/copilot/metrics")
+        interface.get("/orgs/org/team/b/copilot/metrics")
+        interface.get("/orgs/org/teams")
+
+        # Teams a and b share the metrics budget, and the team listing has its own
+        assert interface.retries == {
+            "/orgs/org/team/{team}/copilot/metrics": 3,
+            "/orgs/org/teams": 2,
+        }
+        assert gh.get.call_count == 3 + 2 + 3
+
+    @patch("src.resilience.RETRY_MAX_ATTEMPTS", 1)
+    def test_circuit_opens_and_stops_requests(self, mock_sleep):
+        gh = MagicMock()
+        gh.get.return_value = make_error(502)
+
+        interface = make_interface(gh, threshold=2)
+        interface.get("/orgs/org/teams")
+
+        with pytest.raises(CircuitOpenError):
+            interface.get("/orgs/org/teams")
+        with pytest.raises(CircuitOpenError):
+            interface.get("/orgs/org/copilot/metrics")
+
+        assert gh.get.call_count == 2
+        assert interface.stats()["github_circuit_open"]
+
+    def test_attributes_are_passed_through(self, mock_sleep):
+        gh = MagicMock()
+        interface = make_interface(gh)
+        assert interface.has_data is gh.has_data
@@ -0,0 +1,303 @@
+import hashlib
+import json
+import threading
+import time
+from unittest.mock import MagicMock, patch
+
+import pytest
+from boto3.exceptions import S3UploadFailedError
+from botocore.exceptions import ClientError
+
+from src.resilience import CircuitBreaker, CircuitOpenError, RunAbortedError
+from src.s3_objects import (
+    PrefetchingS3Client,
+    ResilientS3Client,
+    get_s3_object,
+    get_s3_objects,
+    update_s3_list,
+    update_s3_object,
+    update_s3_objects,
+)
+
+
+def make_body(data):
+    return MagicMock(read=MagicMock(return_value=json.dumps(data).encode()))
+
+
+def not_found(operation_name="GetObject"):
+    return ClientError(
+        error_response={"Error": {"Code": "NoSuchKey", "Message": "Not Found"}},
+        operation_name=operation_name,
+    )
+
+
+def server_error(operation_name="GetObject", retries=0):
+    return ClientError(
+        error_response={
+            "Error": {"Code": "InternalError", "Message": "Internal Error"},
+            "ResponseMetadata": {"RetryAttempts": retries},
+        },
+        operation_name=operation_name,
+    )
+
+
+class TestPrefetchingS3Client:
+    def test_prefetched_response_is_used_once(self):
+        s3 = MagicMock()
+        s3.get_object.return_value = {"Body": make_body({"foo": "bar"}), "ContentType": "x"}
+
+        client = PrefetchingS3Client(s3, "bucket", ["a.json"])
+        response = client.get_object(Bucket="bucket", Key="a.json")
+
+        assert json.loads(response["Body"].read()) == {"foo": "bar"}
+        assert response["ContentType"] == "x"
+        assert s3.get_object.call_count == 1
+
+        # Later reads go to S3
+        client.get_object(Bucket="bucket", Key="a.json")
+        assert s3.get_object.call_count == 2
+        assert client.stats() == {"no_s3_prefetched": 1, "no_s3_prefetch_hits": 1}
+
+    def test_prefetch_error_is_raised_on_read(self):
+        s3 = MagicMock()
+        s3.get_object.side_effect = not_found()
+
+        client = PrefetchingS3Client(s3, "bucket", ["a.json"])
+
+        with pytest.raises(ClientError):
+            client.get_object(Bucket="bucket", Key="a.json")
+
+    def test_write_discards_prefetched_response(self):
+        s3 = MagicMock()
+        s3.get_object.return_value = {"Body": make_body({"version": 1})}
+
+        client = PrefetchingS3Client(s3, "bucket", ["a.json"])
+        client.put_object(Bucket="bucket", Key="a.json", Body=b"{}")
+
+        s3.get_object.return_value = {"Body": make_body({"version": 2})}
+        response = client.get_object(Bucket="bucket", Key="a.json")
+
+        assert json.loads(response["Body"].read()) == {"version": 2}
+        s3.put_object.assert_called_once_with(Bucket="bucket", Key="a.json", Body=b"{}")
+        assert client.stats()["no_s3_prefetch_hits"] == 0
+
+    def test_other_objects_and_attributes_are_passed_through(self):
+        s3 = MagicMock()
+        client = PrefetchingS3Client(s3, "bucket", [])
+
+        client.get_object(Bucket="other-bucket", Key="a.json")
+        s3.get_object.assert_called_once_with(Bucket="other-bucket", Key="a.json")
+        assert client.head_object is s3.head_object
+
+    def test_reads_overlap(self):
+        lock = threading.Lock()
+        in_flight = {"current": 0, "peak": 0}
+
+        def get_object(Bucket, Key):
+            with lock:
+                in_flight["current"] += 1
+                in_flight["peak"] = max(in_flight["peak"], in_flight["current"])
+            time.sleep(0.02)
+            with lock:
+                in_flight["current"] -= 1
+            return {"Body": make_body(Key)}
+
+        s3 = MagicMock()
+        s3.get_object.side_effect = get_object
+        names = ["a.json", "b.json", "c.json"]
+
+        client = PrefetchingS3Client(s3, "bucket", names, max_workers=3)
+        for name in names:
+            assert json.loads(client.get_object(Bucket="bucket", Key=name)["Body"].read()) == name
+
+        assert in_flight["peak"] > 1
+
+
+class TestGetS3Objects:
+    def test_get_s3_objects(self):
+        s3 = MagicMock()
+
+        def get_object(Bucket, Key):
+            if Key == "missing.json":
+                raise not_found()
+            return {"Body": make_body({"name": Key})}
+
+        s3.get_object.side_effect = get_object
+
+        result = get_s3_objects(s3, "bucket", ["a.json", "missing.json", "b.json"], [])
+
+        assert result == {
+            "a.json": {"name": "a.json"},
+            "missing.json": [],
+            "b.json": {"name": "b.json"},
+        }
+
+    def test_defaults_are_not_shared(self):
+        s3 = MagicMock()
+        s3.get_object.side_effect = not_found()
+
+        result = get_s3_objects(s3, "bucket", ["a.json", "b.json"], [])
+        result["a.json"].append(1)
+
+        assert result["b.json"] == []
+
+
+class TestResilientS3Client:
+    def test_retries_are_counted(self, caplog):
+        s3 = MagicMock()
+        s3.get_object.return_value = {"Body": b"", "ResponseMetadata": {"RetryAttempts": 2}}
+
+        client = ResilientS3Client(s3, CircuitBreaker("S3"))
+        response = client.get_object(Bucket="bucket", Key="a.json")
+
+        assert response is s3.get_object.return_value
+        s3.get_object.assert_called_once_with(Bucket="bucket", Key="a.json")
+        assert client.stats() == {"no_s3_retries": 2, "no_s3_failures": 0, "s3_circuit_open": False}
+        retry = next(r for r in caplog.records if r.getMessage() == "S3 get_object was retried")
+        assert retry.retries == 2
+
+    def test_missing_objects_are_not_failures(self):
+        s3 = MagicMock()
+        s3.head_object.side_effect = not_found("HeadObject")
+
+        client = ResilientS3Client(s3, CircuitBreaker("S3", threshold=1))
+        with pytest.raises(ClientError):
+            client.head_object(Bucket="bucket", Key="a.json")
+
+        assert not client.breaker.is_open
+
+    def test_circuit_opens_after_failures(self):
+        s3 = MagicMock()
+        s3.put_object.side_effect = server_error("PutObject", retries=4)
+
+        client = ResilientS3Client(s3, CircuitBreaker("S3", threshold=2))
+        for _ in range(2):
+            with pytest.raises(ClientError):
+                client.put_object(Bucket="bucket", Key="a.json", Body=b"{}")
+
+        with pytest.raises(CircuitOpenError):
+            client.get_object(Bucket="bucket", Key="a.json")
+
+        s3.get_object.assert_not_called()
+        assert client.stats() == {"no_s3_retries": 8, "no_s3_failures": 2, "s3_circuit_open": True}
+
+    def test_other_attributes_are_passed_through(self):
+        s3 = MagicMock()
+        client = ResilientS3Client(s3, CircuitBreaker("S3"))
+        assert client.meta is s3.meta
+
+
+class TestGetS3Object:
+    def test_missing_object_uses_default(self):
+        s3 = MagicMock()
+        s3.get_object.side_effect = not_found()
+        assert get_s3_object(s3, "bucket", "a.json", []) == []
+
+    def test_unreadable_object_aborts_the_run(self):
+        s3 = MagicMock()
+        s3.get_object.side_effect = server_error()
+
+        with pytest.raises(RunAbortedError, match="Could not read a.json"):
+            get_s3_object(s3, "bucket", "a.json", [])
+
+
+class TestUpdateS3Objects:
+    def test_update_s3_objects(self):
+        s3 = MagicMock()
+        s3.head_object.side_effect = not_found("HeadObject")
+
+        def put_object(Bucket, Key, Body, **kwargs):
+            if Key == "fail.json":
+                raise not_found("PutObject")
+
+        s3.put_object.side_effect = put_object
+
+        result = update_s3_objects(s3, "bucket", {"a.json": [1], "fail.json": [2], "b.json": [3]})
+
+        assert result == {"a.json": True, "fail.json": False, "b.json": True}
+        assert sorted(c.kwargs["Key"] for c in s3.put_object.call_args_list) == [
+            "a.json",
+            "b.json",
+            "fail.json",
+        ]
+
+
+class TestMultipartUpload:
+    @patch("src.s3_objects.MULTIPART_THRESHOLD", 16)
+    def test_large_bodies_are_uploaded_in_parts(self):
+        s3 = MagicMock()
+        s3.head_object.side_effect = not_found("HeadObject")
+
+        assert update_s3_object(s3, "bucket", "large.json", {"data": "x" * 32})
+
+        s3.put_object.assert_not_called()
+        kwargs = s3.upload_fileobj.call_args.kwargs
+        assert json.loads(kwargs["Fileobj"].read()) == {"data": "x" * 32}
+        assert kwargs["Key"] == "large.json"
+        assert kwargs["ExtraArgs"]["ContentType"] == "application/json"
+        assert "content-sha256" in kwargs["ExtraArgs"]["Metadata"]
+        assert kwargs["Config"].multipart_threshold == 16
+
+    @patch("src.s3_objects.MULTIPART_THRESHOLD", 16)
+    def test_failed_multipart_upload(self):
+        s3 = MagicMock()
+        s3.head_object.side_effect = not_found("HeadObject")
+        s3.upload_fileobj.side_effect = S3UploadFailedError("failed")
+
+        assert not update_s3_object(s3, "bucket", "large.json", {"data": "x" * 32})
+
+    def test_small_bodies_are_put(self):
+        s3 = MagicMock()
+        s3.head_object.side_effect = not_found("HeadObject")
+
+        assert update_s3_object(s3, "bucket", "small.json", {"foo": "bar"})
+
+        s3.put_object.assert_called_once()
+        s3.upload_fileobj.assert_not_called()
+
+
+class TestUpdateS3List:
+    def test_writes_the_same_body_as_update_s3_object(self):
+        s3 = MagicMock()
+        s3.head_object.side_effect = not_found("HeadObject")
+        data = [{"team": {"name": "team1"}, "data": [{"date": "2024-01-01"}]}]
+
+        assert update_s3_list(s3, "bucket", "list.json", iter(data))
+        assert update_s3_object(s3, "bucket", "object.json", data)
+
+        streamed, encoded = (c.kwargs for c in s3.put_object.call_args_list)
+        assert streamed["Key"] == "list.json"
+        assert streamed["Body"] == encoded["Body"]
+        assert streamed["Metadata"] == encoded["Metadata"]
+        assert streamed["ContentType"] == "application/json"
+
+    def test_unchanged_list_is_not_written(self, caplog):
+        caplog.set_level("INFO")
+        body = json.dumps([1, 2], indent=4).encode()
+        s3 = MagicMock()
+        s3.head_object.return_value = {"ETag": f'"{hashlib.md5(body).hexdigest()}"'}
+
+        assert update_s3_list(s3, "bucket", "list.json", [1, 2])
+
+        s3.put_object.assert_not_called()
+        record = next(r for r in caplog.records if "unchanged" in r.getMessage())
+        assert record.bytes_skipped == len(body)
+
+    @patch("src.s3_objects.MULTIPART_THRESHOLD", 16)
+    def test_large_lists_are_uploaded_in_parts(self):
+        s3 = MagicMock()
+        s3.head_object.side_effect = not_found("HeadObject")
+        uploaded = []
+        s3.upload_fileobj.side_effect = lambda Fileobj, **kwargs: uploaded.append(Fileobj.read())
+
+        assert update_s3_list(s3, "bucket", "large.json", ["x" * 32, "y"])
+
+        s3.put_object.assert_not_called()
+        assert json.loads(uploaded[0]) == ["x" * 32, "y"]
+
+    def test_failed_write(self):
+        s3 = MagicMock()
+        s3.head_object.side_effect = not_found("HeadObject")
+        s3.put_object.side_effect = server_error("PutObject")
+
+        assert not update_s3_list(s3, "bucket", "list.json", [1])
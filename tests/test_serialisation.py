@@ -0,0 +1,219 @@
+import gzip
+import hashlib
+import io
+import json
+from unittest.mock import MagicMock, patch
+
+import pytest
+
+from src.serialisation import (
+    GZIP_MAGIC,
+    JSON_CONTENT_TYPE,
+    NDJSON_CONTENT_TYPE,
+    ZSTD_MAGIC,
+    JsonListWriter,
+    decode_json,
+    decode_s3_response,
+    encode_json,
+    iter_json_list,
+)
+
+USAGE_DATA = [
+    {"date": "2024-01-01", "total_active_users": 3},
+    {"date": "2024-01-02", "total_active_users": 4},
+]
+
+
+class TestEncodeJson:
+    def test_indent_is_the_original_format(self):
+        body, metadata = encode_json({"foo": "bar"})
+        assert body == b'{\n    "foo": "bar"\n}'
+        assert metadata == {"ContentType": JSON_CONTENT_TYPE}
+
+    def test_compact(self):
+        body, _ = encode_json({"foo": [1, 2]}, style="compact")
+        assert body == b'{"foo":[1,2]}'
+
+    def test_ndjson(self):
+        body, metadata = encode_json(USAGE_DATA, style="ndjson")
+        assert body.splitlines() == [
+            b'{"date":"2024-01-01","total_active_users":3}',
+            b'{"date":"2024-01-02","total_active_users":4}',
+        ]
+        assert metadata == {"ContentType": NDJSON_CONTENT_TYPE}
+
+    def test_ndjson_falls_back_to_compact_for_objects(self):
+        body, metadata = encode_json({"foo": "bar"}, style="ndjson")
+        assert body == b'{"foo":"bar"}'
+        assert metadata == {"ContentType": JSON_CONTENT_TYPE}
+
+    def test_gzip(self):
+        body, metadata = encode_json(USAGE_DATA, compression="gzip")
+        assert body.startswith(GZIP_MAGIC)
+        assert metadata["ContentEncoding"] == "gzip"
+        assert json.loads(gzip.decompress(body)) == USAGE_DATA
+
+    def test_gzip_is_deterministic(self):
+        assert encode_json(USAGE_DATA, compression="gzip") == encode_json(
+            USAGE_DATA, compression="gzip"
+        )
+
+    @patch("src.serialisation.zstandard", None)
+    def test_zstd_falls_back_to_gzip(self, caplog):
+        body, metadata = encode_json(USAGE_DATA, compression="zstd")
+        assert body.startswith(GZIP_MAGIC)
+        assert metadata["ContentEncoding"] == "gzip"
+        assert any("zstandard is not installed" in record.getMessage() for record in caplog.records)
+
+    def test_zstd(self):
+        zstandard = MagicMock()
+        zstandard.ZstdCompressor.return_value.compress.return_value = ZSTD_MAGIC + b"data"
+
+        with patch("src.serialisation.zstandard", zstandard):
+            body, metadata = encode_json(USAGE_DATA, style="compact", compression="zstd")
+
+        assert body == ZSTD_MAGIC + b"data"
+        assert metadata["ContentEncoding"] == "zstd"
+        zstandard.ZstdCompressor.return_value.compress.assert_called_once_with(
+            json.dumps(USAGE_DATA, separators=(",", ":")).encode("utf-8")
+        )
+
+
+class TestDecodeJson:
+    @pytest.mark.parametrize("style", ["indent", "compact", "ndjson"])
+    @pytest.mark.parametrize("compression", ["none", "gzip"])
+    def test_round_trip(self, style, compression):
+        body, metadata = encode_json(USAGE_DATA, style, compression)
+        assert decode_json(body, metadata["ContentType"]) == USAGE_DATA
+
+    def test_legacy_object_without_content_type(self):
+        assert decode_json(json.dumps(USAGE_DATA, indent=4).encode("utf-8")) == USAGE_DATA
+
+    def test_zstd(self):
+        zstandard = MagicMock()
+        decompressobj = zstandard.ZstdDecompressor.return_value.decompressobj.return_value
+        decompressobj.decompress.return_value = b'{"foo": "bar"}'
+
+        with patch("src.serialisation.zstandard", zstandard):
+            assert decode_json(ZSTD_MAGIC + b"data") == {"foo": "bar"}
+
+    @patch("src.serialisation.zstandard", None)
+    def test_zstd_without_zstandard(self):
+        with pytest.raises(ValueError, match="zstandard is not installed"):
+            decode_json(ZSTD_MAGIC + b"data")
+
+    def test_decode_s3_response(self):
+        body, metadata = encode_json(USAGE_DATA, "ndjson", "gzip")
+        response = {"Body": MagicMock(read=MagicMock(return_value=body)), **metadata}
+        assert decode_s3_response(response) == USAGE_DATA
+
+
+TEAM_HISTORY = [
+    {"team": {"name": f"team{i}", "slug": "é"}, "data": USAGE_DATA, "score": i * 1.5}
+    for i in range(20)
+] + [1, -2.5e10, "text", None, True, [], {}]
+
+
+class TestIterJsonList:
+    @pytest.mark.parametrize("style", ["indent", "compact", "ndjson"])
+    @pytest.mark.parametrize("compression", ["none", "gzip"])
+    @pytest.mark.parametrize("chunk_size", [1, 7, 1024])
+    def test_round_trip(self, style, compression, chunk_size):
+        body, metadata = encode_json(TEAM_HISTORY, style, compression)
+
+        items = iter_json_list(io.BytesIO(body), metadata["ContentType"], chunk_size)
+
+        assert list(items) == TEAM_HISTORY
+
+    def test_items_are_yielded_as_they_are_read(self):
+        body, _ = encode_json(TEAM_HISTORY)
+        stream = io.BytesIO(body)
+
+        items = iter_json_list(stream, chunk_size=64)
+
+        assert next(items) == TEAM_HISTORY[0]
+        assert stream.tell() < len(body) / 4
+
+    @pytest.mark.parametrize("body", [b"[]", b"  [ ]\n", b""])
+    def test_empty_list(self, body):
+        content_type = NDJSON_CONTENT_TYPE if not body else JSON_CONTENT_TYPE
+        assert list(iter_json_list(io.BytesIO(body), content_type)) == []
+
+    @pytest.mark.parametrize(
+        ("body", "error"),
+        [
+            (b'{"foo": "bar"}', "Expected a JSON list"),
+            (b"[1, 2", "Expected ',' or ']'"),
+            (b"[1 2]", "Expected ',' or ']'"),
+            (b"[1] 2", "Extra data"),
+            (b'[{"foo": ', "Expecting value"),
+            (b'["\xc3', "Unterminated string"),
+        ],
+    )
+    def test_invalid_lists(self, body, error):
+        with pytest.raises(ValueError, match=error):
+            list(iter_json_list(io.BytesIO(body), chunk_size=2))
+
+    def test_zstd(self):
+        zstandard = MagicMock()
+        decompressobj = zstandard.ZstdDecompressor.return_value.decompressobj.return_value
+        decompressobj.decompress.side_effect = lambda chunk: chunk.replace(ZSTD_MAGIC, b"")
+        decompressobj.flush.return_value = b""
+
+        with patch("src.serialisation.zstandard", zstandard):
+            items = iter_json_list(io.BytesIO(ZSTD_MAGIC + b"[1, 2]"), chunk_size=2)
+            assert list(items) == [1, 2]
+
+    @patch("src.serialisation.zstandard", None)
+    def test_zstd_without_zstandard(self):
+        with pytest.raises(ValueError, match="zstandard is not installed"):
+            list(iter_json_list(io.BytesIO(ZSTD_MAGIC + b"data")))
+
+
+class TestJsonListWriter:
+    @pytest.mark.parametrize("style", ["indent", "compact", "ndjson"])
+    @pytest.mark.parametrize("compression", ["none", "gzip"])
+    @pytest.mark.parametrize("data", [TEAM_HISTORY, USAGE_DATA[:1], []])
+    def test_matches_encode_json(self, style, compression, data):
+        expected, metadata = encode_json(data, style, compression)
+
+        with JsonListWriter(style, compression, max_memory=64) as writer:
+            for item in data:
+                writer.write(item)
+            body = writer.close().read()
+
+            assert body == expected
+            assert writer.metadata == metadata
+            assert writer.size == len(expected)
+            assert writer.digests() == (
+                hashlib.sha256(expected).hexdigest(),
+                hashlib.md5(expected, usedforsecurity=False).hexdigest(),
+            )
+
+    def test_body_moves_to_disk(self):
+        with JsonListWriter(max_memory=64) as writer:
+            for item in TEAM_HISTORY:
+                writer.write(item)
+
+            assert writer.body._rolled
+            assert json.load(writer.close()) == TEAM_HISTORY
+
+    def test_zstd(self):
+        zstandard = MagicMock()
+        compressobj = zstandard.ZstdCompressor.return_value.compressobj.return_value
+        compressobj.compress.side_effect = lambda data: data
+        compressobj.flush.return_value = b""
+
+        with (
+            patch("src.serialisation.zstandard", zstandard),
+            JsonListWriter("compact", "zstd") as writer,
+        ):
+            writer.write(1)
+            assert writer.close().read() == b"[1]"
+            assert writer.metadata["ContentEncoding"] == "zstd"
+
+    @patch("src.serialisation.zstandard", None)
+    def test_zstd_falls_back_to_gzip(self):
+        with JsonListWriter("compact", "zstd") as writer:
+            assert gzip.decompress(writer.close().read()) == b"[]"
+            assert writer.metadata["ContentEncoding"] == "gzip"
@@ -0,0 +1,125 @@
+import gzip
+import io
+import json
+from unittest.mock import MagicMock, patch
+
+from botocore.exceptions import ClientError
+
+from src.team_history import (
+    TEAMS_HISTORY_MANIFEST,
+    TEAMS_HISTORY_OBJECT,
+    get_team_watermark,
+    merge_team_history,
+    stream_team_history,
+)
+
+
+def server_error(operation_name="GetObject"):
+    return ClientError(
+        error_response={"Error": {"Code": "InternalError", "Message": "Internal Error"}},
+        operation_name=operation_name,
+    )
+
+
+def make_fake_s3(bodies):
+    """Creates an S3 client mock backed by a dictionary of object names to raw bodies."""
+    s3 = MagicMock()
+
+    def get_object(Bucket, Key):
+        return {"Body": io.BytesIO(bodies[Key]), "ContentType": "application/json"}
+
+    def put_object(Bucket, Key, Body, **kwargs):
+        bodies[Key] = Body
+
+    s3.get_object.side_effect = get_object
+    s3.put_object.side_effect = put_object
+    s3.head_object.side_effect = server_error("HeadObject")
+    return s3
+
+
+def make_entry(name, *dates):
+    return {"team": {"name": name}, "data": [{"date": date, "value": 0} for date in dates]}
+
+
+class TestMergeTeamHistory:
+    def test_merge(self):
+        entries = [
+            make_entry("team1", "2024-01-01", "2024-01-02"),
+            make_entry("team2", "2024-01-01"),
+        ]
+        new_history = {
+            # The last known day is returned again, with updated values
+            "team1": [{"date": "2024-01-02", "value": 1}, {"date": "2024-01-03", "value": 1}],
+            "team3": [{"date": "2024-01-03", "value": 1}],
+        }
+        copilot_teams = [{"name": "team3", "slug": "team-3"}, {"name": "team1"}]
+
+        merged = list(merge_team_history(iter(entries), copilot_teams, new_history))
+
+        assert [entry["team"]["name"] for entry in merged] == ["team1", "team2", "team3"]
+        assert merged[0]["data"] == [
+            {"date": "2024-01-01", "value": 0},
+            {"date": "2024-01-02", "value": 1},
+            {"date": "2024-01-03", "value": 1},
+        ]
+        assert merged[1] == make_entry("team2", "2024-01-01")
+        assert merged[2] == {"team": copilot_teams[0], "data": new_history["team3"]}
+
+    def test_days_before_the_stored_history_are_not_merged(self):
+        entries = [make_entry("team1", "2024-01-05")]
+        new_history = {"team1": [{"date": "2024-01-01"}, {"date": "2024-01-06"}]}
+
+        (merged,) = merge_team_history(entries, [], new_history)
+
+        assert [day["date"] for day in merged["data"]] == ["2024-01-05", "2024-01-06"]
+
+    def test_entries_are_merged_one_at_a_time(self):
+        read = []
+
+        def entries():
+            for name in ("team1", "team2"):
+                read.append(name)
+                yield make_entry(name, "2024-01-01")
+
+        merged = merge_team_history(entries(), [], {})
+
+        assert next(merged)["team"]["name"] == "team1"
+        assert read == ["team1"]
+
+
+class TestStreamTeamHistory:
+    def test_merges_as_it_reads(self):
+        team1, team2 = make_entry("team1", "2024-01-01"), make_entry("team2", "2024-01-01")
+        manifest = {"team1": get_team_watermark(team1), "team2": get_team_watermark(team2)}
+        bodies = {TEAMS_HISTORY_OBJECT: gzip.compress(json.dumps([team1, team2]).encode())}
+        s3 = make_fake_s3(bodies)
+        new_history = {"team2": [{"date": "2024-01-02", "value": 1}]}
+
+        assert stream_team_history(s3, [{"name": "team2"}], new_history, manifest)
+
+        history = json.loads(bodies[TEAMS_HISTORY_OBJECT])
+        assert history[0] == team1
+        assert [day["date"] for day in history[1]["data"]] == ["2024-01-01", "2024-01-02"]
+        stored_manifest = json.loads(bodies[TEAMS_HISTORY_MANIFEST])
+        assert stored_manifest["team1"] == manifest["team1"]
+        assert stored_manifest["team2"] == get_team_watermark(history[1])
+
+    def test_unreadable_history_is_not_overwritten(self):
+        s3 = MagicMock()
+        s3.get_object.side_effect = server_error()
+
+        assert not stream_team_history(s3, [], {"team1": [{"date": "2024-01-01"}]}, {})
+        s3.put_object.assert_not_called()
+
+    @patch("src.team_history.update_s3_object")
+    @patch("src.team_history.update_s3_list", return_value=False)
+    def test_manifest_not_written_when_history_write_fails(
+        self, mock_update_s3_list, mock_update_s3_object
+    ):
+        s3 = make_fake_s3({TEAMS_HISTORY_OBJECT: b"[]"})
+        manifest = {}
+
+        assert not stream_team_history(s3, [], {"team1": [{"date": "2024-01-01"}]}, manifest)
+
+        mock_update_s3_object.assert_not_called()
+        assert manifest == {}
@@ -0,0 +1,176 @@
+from datetime import UTC, datetime, timedelta
+from unittest.mock import MagicMock, patch
+
+import pytest
+from requests import HTTPError, Response
+
+from src.warm_start import (
+    TOKEN_LIFETIME,
+    TokenRefreshingInterface,
+    clear_cache,
+    get_client,
+    get_github_adapter,
+    get_installation_token,
+    get_secret,
+    get_token_expiry,
+    is_warm,
+)
+
+
+def make_response(status_code=200):
+    response = Response()
+    response.status_code = status_code
+    return response
+
+
+@pytest.fixture(autouse=True)
+def cold_start():
+    clear_cache()
+    yield
+    clear_cache()
+
+
+class TestClients:
+    @patch("boto3.Session")
+    def test_clients_are_reused(self, mock_session):
+        assert not is_warm()
+
+        s3 = get_client("s3")
+        assert get_client("s3") is s3
+        get_client("secretsmanager", region_name="eu-west-2")
+
+        assert is_warm()
+        mock_session.assert_called_once()
+        assert mock_session.return_value.client.call_count == 2
+
+    @patch("boto3.Session")
+    def test_secret_is_reused(self, mock_session):
+        secret_manager = mock_session.return_value.client.return_value
+        secret_manager.get_secret_value.return_value = {"SecretString": "pem"}
+
+        assert get_secret("secret", "eu-west-2") == "pem"
+        assert get_secret("secret", "eu-west-2") == "pem"
+
+        secret_manager.get_secret_value.assert_called_once_with(SecretId="secret")
+        mock_session.return_value.client.assert_called_once_with(
+            "secretsmanager", region_name="eu-west-2"
+        )
+
+    def test_github_adapter_is_reused(self):
+        adapter = get_github_adapter(10, (5.0, 30.0))
+
+        assert get_github_adapter(10, (5.0, 30.0)) is adapter
+        assert get_github_adapter(20, (5.0, 30.0)) is not adapter
+
+
+class TestInstallationToken:
+    def test_get_token_expiry(self):
+        now = datetime(2024, 1, 1, 12, tzinfo=UTC)
+        assert get_token_expiry(("token", "2024-01-01T13:00:00Z"), now) == datetime(
+            2024, 1, 1, 13, tzinfo=UTC
+        )
+        assert get_token_expiry(("token",), now) == now + TOKEN_LIFETIME
+        assert get_token_expiry(("token", "soon"), now) == now + TOKEN_LIFETIME
+
+    @patch("github_api_toolkit.get_token_as_installation")
+    def test_token_is_reused_until_shortly_before_expiry(self, mock_get_token):
+        expires_at = datetime.now(UTC) + timedelta(minutes=30)
+        mock_get_token.return_value = ("token", expires_at.isoformat())
+
+        assert get_installation_token("org", "pem", "client")[0] == "token"
+        assert get_installation_token("org", "pem", "client")[0] == "token"
+        mock_get_token.assert_called_once_with("org", "pem", "client")
+
+    @patch("github_api_toolkit.get_token_as_installation")
+    def test_expiring_token_is_replaced(self, mock_get_token):
+        expires_at = datetime.now(UTC) + timedelta(minutes=2)
+        mock_get_token.return_value = ("token", expires_at.isoformat())
+
+        get_installation_token("org", "pem", "client")
+        get_installation_token("org", "pem", "client")
+
+        assert mock_get_token.call_count == 2
+
+    @patch("github_api_toolkit.get_token_as_installation")
+    def test_refresh_mints_a_new_token(self, mock_get_token):
+        mock_get_token.side_effect = [("old",), ("new",)]
+
+        get_installation_token("org", "pem", "client")
+        assert get_installation_token("org", "pem", "client", refresh=True) == ("new",)
+
+    @patch("github_api_toolkit.get_token_as_installation")
+    def test_errors_are_not_cached(self, mock_get_token):
+        mock_get_token.side_effect = ["error", ("token",)]
+
+        assert get_installation_token("org", "pem", "client") == "error"
+        assert get_installation_token("org", "pem", "client") == ("token",)
+
+
+class TestTokenRefreshingInterface:
+    @patch("github_api_toolkit.get_token_as_installation")
+    @patch("github_api_toolkit.github_interface")
+    def test_unauthorized_refreshes_token_and_retries(self, mock_interface, mock_get_token):
+        old, new = MagicMock(), MagicMock()
+        mock_interface.side_effect = [old, new]
+        old.get.return_value = HTTPError(response=make_response(401))
+        new.get.return_value = make_response(200)
+        mock_get_token.return_value = ("new-token",)
+
+        gh = TokenRefreshingInterface("org", "pem", "client", "old-token")
+        result = gh.get("/orgs/org/teams", params={"page": 1})
+
+        assert result is new.get.return_value
+        new.get.assert_called_once_with("/orgs/org/teams", params={"page": 1})
+        mock_interface.assert_called_with("new-token")
+        assert gh.token == "new-token"
+        assert gh.no_token_refreshes == 1
+        assert gh.session is new.session
+
+    @patch("github_api_toolkit.get_token_as_installation")
+    @patch("github_api_toolkit.github_interface")
+    def test_token_is_only_refreshed_once(self, mock_interface, mock_get_token):
+        mock_get_token.return_value = ("new-token",)
+
+        gh = TokenRefreshingInterface("org", "pem", "client", "old-token")
+        assert gh.refresh("old-token")
+        # Another request rejected with the old token retries with the new one
+        assert gh.refresh("old-token")
+
+        mock_get_token.assert_called_once()
+        assert gh.no_token_refreshes == 1
+
+    @patch("github_api_toolkit.get_token_as_installation")
+    @patch("github_api_toolkit.github_interface")
+    def test_failed_refresh_returns_original_error(self, mock_interface, mock_get_token):
+        unauthorized = HTTPError(response=make_response(401))
+        mock_interface.return_value.get.return_value = unauthorized
+        mock_get_token.return_value = "error"
+
+        gh = TokenRefreshingInterface("org", "pem", "client", "old-token")
+
+        assert gh.get("/orgs/org/teams") is unauthorized
+        assert mock_interface.return_value.get.call_count == 1
+
+    @patch("github_api_toolkit.github_interface")
+    def test_other_errors_are_returned(self, mock_interface):
+        forbidden = HTTPError(response=make_response(403))
+        mock_interface.return_value.get.return_value = forbidden
+
+        gh = TokenRefreshingInterface("org", "pem", "client", "token")
+
+        assert gh.get("/orgs/org/teams") is forbidden
+        assert gh.no_token_refreshes == 0
+
+    @patch("github_api_toolkit.get_token_as_installation")
+    @patch("github_api_toolkit.github_interface")
+    def test_adapter_is_mounted_on_every_interface(self, mock_interface, mock_get_token):
+        old, new = MagicMock(), MagicMock()
+        mock_interface.side_effect = [old, new]
+        mock_get_token.return_value = ("new-token",)
+        adapter = MagicMock()
+
+        gh = TokenRefreshingInterface("org", "pem", "client", "old-token", adapter)
+        gh.refresh("old-token")
+
+        old.session.mount.assert_called_once_with("https://", adapter)
+        new.session.mount.assert_called_once_with("https://", adapter)